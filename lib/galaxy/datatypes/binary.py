@@ -2,7 +2,6 @@
 from __future__ import print_function
 
 import binascii
-import gzip
 import logging
 import os
 import shutil
@@ -27,12 +26,29 @@ from galaxy.datatypes.data import (
     get_file_peek,
 )
 from galaxy.datatypes.metadata import DictParameter, ListParameter, MetadataElement, MetadataParameter
+from galaxy.datatypes.sniff import open_for_sniffing
+from galaxy.datatypes.util.line_counts import decompression_threads
 from galaxy.util import nice_size, sqlite
 from galaxy.util.checkers import is_bz2, is_gzip
 from . import data, dataproviders
 
 log = logging.getLogger(__name__)
 
+# Alignments read to check that a BAM file declared coordinate-sorted is sorted
+BAM_ORDER_SAMPLE_SIZE = 10000
+# Before 0.16, pysam.index() requires the file to index as first argument
+PYSAM_INDEX_INPUT_FIRST = tuple(int(part) for part in pysam.__version__.split(".")[:2]) < (0, 16)
+
+
+def _pysam_index_args(file_name, index_name, threads):
+    """Arguments of pysam.index() indexing ``file_name`` into ``index_name`` with ``threads`` threads."""
+    options = ['-@', str(threads)]
+    if PYSAM_INDEX_INPUT_FIRST:
+        # samtools' (GNU) getopt still parses the options after the files
+        return [file_name, index_name] + options
+    return options + [file_name, index_name]
+
+
 # Currently these supported binary data types must be manually set on upload
 
 
@@ -90,10 +106,11 @@ class Idat(Binary):
     file_ext = "idat"
     edam_format = "format_2058"
     edam_data = "data_2603"
+    sniff_magic = (b'IDAT',)
 
     def sniff(self, filename):
         try:
-            header = open(filename, 'rb').read(4)
+            header = open_for_sniffing(filename).read(4)
             if header == b'IDAT':
                 return True
             return False
@@ -129,7 +146,7 @@ class Cel(Binary):
         >>> Cel().sniff(fname)
         False
         """
-        with open(filename, 'rb') as handle:
+        with open_for_sniffing(filename) as handle:
             header_bytes = handle.read(8)
         found_cel_4 = False
         found_cel_3 = False
@@ -262,6 +279,8 @@ class BamNative(CompressedArchive):
     edam_data = "data_0863"
     file_ext = "unsorted.bam"
     sort_flag = None
+    # BGZF is a gzip variant
+    sniff_magic = (b'\x1f\x8b',)
 
     MetadataElement(name="bam_version", default=None, desc="BAM Version", param=MetadataParameter, readonly=True, visible=False, optional=True, no_value=None)
     MetadataElement(name="sort_order", default=None, desc="Sort Order", param=MetadataParameter, readonly=True, visible=False, optional=True, no_value=None)
@@ -294,7 +313,7 @@ class BamNative(CompressedArchive):
         # BAM is compressed in the BGZF format, and must not be uncompressed in Galaxy.
         # The first 4 bytes of any bam file is 'BAM\1', and the file is binary.
         try:
-            header = gzip.open(filename).read(4)
+            header = open_for_sniffing(filename, "gzip").read(4)
             if header == b'BAM\1':
                 return True
             return False
@@ -339,6 +358,17 @@ class BamNative(CompressedArchive):
         file_paths.append(dataset.metadata.bam_index.file_name)
         return zip(file_paths, rel_paths)
 
+    def threads(self):
+        """
+        Threads to groom and index BAM files with: the slots of the job
+        running the code (GALAXY_SLOTS), at most the ``max_threads`` of the
+        datatype if set.
+        """
+        threads = decompression_threads()
+        if self.max_threads > 0:
+            threads = min(threads, self.max_threads)
+        return threads
+
     def groom_dataset_content(self, file_name):
         """
         Ensures that the BAM file contents are coordinate-sorted.  This function is called
@@ -354,11 +384,10 @@ class BamNative(CompressedArchive):
         tmp_dir = tempfile.mkdtemp()
         tmp_sorted_dataset_file_name_prefix = os.path.join(tmp_dir, 'sorted')
         sorted_file_name = "%s.bam" % tmp_sorted_dataset_file_name_prefix
-        slots = os.environ.get('GALAXY_SLOTS', 1)
         sort_args = []
         if self.sort_flag:
             sort_args = [self.sort_flag]
-        sort_args.extend(["-@%s" % slots, file_name, '-T', tmp_sorted_dataset_file_name_prefix, '-O', 'BAM', '-o', sorted_file_name])
+        sort_args.extend(["-@%s" % self.threads(), file_name, '-T', tmp_sorted_dataset_file_name_prefix, '-O', 'BAM', '-o', sorted_file_name])
         try:
             pysam.sort(*sort_args)
         except Exception:
@@ -453,6 +482,8 @@ class Bam(BamNative):
         """
         Check if file_name is a coordinate-sorted BAM file
         """
+        if self._declared_and_sampled_coordinate_sorted(file_name):
+            return False
         # The best way to ensure that BAM files are coordinate-sorted and indexable
         # is to actually index them.
         index_name = tempfile.NamedTemporaryFile(prefix="bam_index").name
@@ -460,7 +491,7 @@ class Bam(BamNative):
             # If pysam fails to index a file it will write to stderr,
             # and this causes the set_meta script to fail. So instead
             # we start another process and discard stderr.
-            cmd = ['python', '-c', "import pysam; pysam.index('%s', '%s')" % (file_name, index_name)]
+            cmd = [sys.executable, '-c', "import sys, pysam; pysam.index(*sys.argv[1:])"] + _pysam_index_args(file_name, index_name, self.threads())
             with open(os.devnull, 'w') as devnull:
                 subprocess.check_call(cmd, stderr=devnull, shell=False)
             needs_sorting = False
@@ -472,13 +503,51 @@ class Bam(BamNative):
             pass
         return needs_sorting
 
+    def _declared_and_sampled_coordinate_sorted(self, file_name, sample_size=BAM_ORDER_SAMPLE_SIZE):
+        """
+        Check that the header of file_name declares it coordinate-sorted and
+        that its first ``sample_size`` alignments are, which spares indexing
+        the whole file.
+        """
+        try:
+            with pysam.AlignmentFile(file_name, mode='rb', threads=self.threads()) as bam_file:
+                if bam_file.header.get('HD', {}).get('SO') != 'coordinate':
+                    return False
+                previous = None
+                for i, alignment in enumerate(bam_file):
+                    if i >= sample_size:
+                        break
+                    # Unmapped reads without a reference come last
+                    key = (alignment.reference_id if alignment.reference_id >= 0 else float('inf'), alignment.reference_start)
+                    if previous is not None and key < previous:
+                        return False
+                    previous = key
+                return True
+        except Exception:
+            return False
+
+    def _valid_index(self, file_name, index_file_name):
+        """
+        Check if index_file_name is an up-to-date index of file_name, e.g.
+        uploaded with it, that can be kept rather than indexing file_name again.
+        """
+        try:
+            if os.path.getsize(index_file_name) == 0 or os.path.getmtime(index_file_name) < os.path.getmtime(file_name):
+                return False
+            with pysam.AlignmentFile(file_name, mode='rb', index_filename=index_file_name) as bam_file:
+                return bam_file.check_index() and len(bam_file.get_index_statistics()) == bam_file.nreferences
+        except Exception:
+            return False
+
     def set_meta(self, dataset, overwrite=True, **kwd):
         # These metadata values are not accessible by users, always overwrite
         super(Bam, self).set_meta(dataset=dataset, overwrite=overwrite, **kwd)
         index_file = dataset.metadata.bam_index
         if not index_file:
             index_file = dataset.metadata.spec['bam_index'].param.new_file(dataset=dataset)
-        pysam.index(dataset.file_name, index_file.file_name)
+        elif self._valid_index(dataset.file_name, index_file.file_name):
+            return
+        pysam.index(*_pysam_index_args(dataset.file_name, index_file.file_name, self.threads()))
         dataset.metadata.bam_index = index_file
 
     def sniff(self, file_name):
@@ -624,6 +693,7 @@ class CRAM(Binary):
     file_ext = "cram"
     edam_format = "format_3462"
     edam_data = "format_0863"
+    sniff_magic = (b'CRAM',)
 
     MetadataElement(name="cram_version", default=None, desc="CRAM Version", param=MetadataParameter, readonly=True, visible=False, optional=False, no_value=None)
     MetadataElement(name="cram_index", desc="CRAM Index File", param=metadata.FileParameter, file_ext="crai", readonly=True, no_value=None, visible=False, optional=True)
@@ -649,7 +719,7 @@ class CRAM(Binary):
 
     def set_index_file(self, dataset, index_file):
         try:
-            pysam.index(dataset.file_name, index_file.file_name)
+            pysam.index(*_pysam_index_args(dataset.file_name, index_file.file_name, decompression_threads()))
             return True
         except Exception as exc:
             log.warning('%s, set_index_file Exception: %s', self, exc)
@@ -665,7 +735,7 @@ class CRAM(Binary):
 
     def sniff(self, filename):
         try:
-            header = open(filename, 'rb').read(4)
+            header = open_for_sniffing(filename).read(4)
             if header == b"CRAM":
                 return True
             return False
@@ -676,6 +746,8 @@ class CRAM(Binary):
 class BaseBcf(CompressedArchive):
     edam_format = "format_3020"
     edam_data = "data_3498"
+    # BGZF is a gzip variant
+    sniff_magic = (b'\x1f\x8b',)
 
 
 class Bcf(BaseBcf):
@@ -690,7 +762,7 @@ class Bcf(BaseBcf):
     def sniff(self, filename):
         # BCF is compressed in the BGZF format, and must not be uncompressed in Galaxy.
         try:
-            header = gzip.open(filename).read(3)
+            header = open_for_sniffing(filename, "gzip").read(3)
             # The first 3 bytes of any BCF file are 'BCF', and the file is binary.
             if header == b'BCF':
                 return True
@@ -733,10 +805,11 @@ class BcfUncompressed(BaseBcf):
     False
     """
     file_ext = "bcf_uncompressed"
+    sniff_magic = (b'BCF',)
 
     def sniff(self, filename):
         try:
-            header = open(filename, mode='rb').read(3)
+            header = open_for_sniffing(filename).read(3)
             # The first 3 bytes of any BCF file are 'BCF', and the file is binary.
             if header == b'BCF':
                 return True
@@ -758,6 +831,7 @@ class H5(Binary):
     False
     """
     file_ext = "h5"
+    sniff_magic = (binascii.unhexlify("894844460d0a1a0a"),)
     edam_format = "format_3590"
 
     def __init__(self, **kwd):
@@ -767,7 +841,7 @@ class H5(Binary):
     def sniff(self, filename):
         # The first 8 bytes of any hdf5 file are 0x894844460d0a1a0a
         try:
-            header = open(filename, 'rb').read(8)
+            header = open_for_sniffing(filename).read(8)
             if header == self._magic:
                 return True
             return False
@@ -921,7 +995,7 @@ class GmxBinary(Binary):
     def sniff(self, filename):
         # The first 4 bytes of any GROMACS binary file containing the magic number
         try:
-            header = open(filename, 'rb').read(struct.calcsize('>1i'))
+            header = open_for_sniffing(filename).read(struct.calcsize('>1i'))
             if struct.unpack('>1i', header)[0] == self.magic_number:
                 return True
             return False
@@ -1228,12 +1302,13 @@ class Sff(Binary):
     edam_format = "format_3284"
     edam_data = "data_0924"
     file_ext = "sff"
+    sniff_magic = (b'.sff',)
 
     def sniff(self, filename):
         # The first 4 bytes of any sff file is '.sff', and the file is binary. For details
         # about the format, see http://www.ncbi.nlm.nih.gov/Traces/trace.cgi?cmd=show&f=formats&m=doc&s=format
         try:
-            header = open(filename, 'rb').read(4)
+            header = open_for_sniffing(filename).read(4)
             if header == b'.sff':
                 return True
             return False
@@ -1266,6 +1341,7 @@ class BigWig(Binary):
     file_ext = "bigwig"
     track_type = "LineTrack"
     data_sources = {"data_standalone": "bigwig"}
+    sniff_magic = (struct.pack("I", 0x888FFC26),)
 
     def __init__(self, **kwd):
         Binary.__init__(self, **kwd)
@@ -1277,7 +1353,7 @@ class BigWig(Binary):
 
     def sniff(self, filename):
         try:
-            magic = self._unpack("I", open(filename, 'rb'))
+            magic = self._unpack("I", open_for_sniffing(filename))
             return magic[0] == self._magic
         except Exception:
             return False
@@ -1303,6 +1379,7 @@ class BigBed(BigWig):
     edam_data = "data_3002"
     file_ext = "bigbed"
     data_sources = {"data_standalone": "bigbed"}
+    sniff_magic = (struct.pack("I", 0x8789F2EB),)
 
     def __init__(self, **kwd):
         Binary.__init__(self, **kwd)
@@ -1315,13 +1392,14 @@ class TwoBit(Binary):
     edam_format = "format_3009"
     edam_data = "data_0848"
     file_ext = "twobit"
+    sniff_magic = (struct.pack(">L", TWOBIT_MAGIC_NUMBER), struct.pack(">L", TWOBIT_MAGIC_NUMBER_SWAP))
 
     def sniff(self, filename):
         try:
             # All twobit files start with a 16-byte header. If the file is smaller than 16 bytes, it's obviously not a valid twobit file.
             if os.path.getsize(filename) < 16:
                 return False
-            header = open(filename, 'rb').read(TWOBIT_MAGIC_SIZE)
+            header = open_for_sniffing(filename).read(TWOBIT_MAGIC_SIZE)
             magic = struct.unpack(">L", header)[0]
             if magic == TWOBIT_MAGIC_NUMBER or magic == TWOBIT_MAGIC_NUMBER_SWAP:
                 return True
@@ -1350,6 +1428,7 @@ class SQlite(Binary):
     MetadataElement(name="table_row_count", default={}, param=DictParameter, desc="Database Table Row Count", readonly=True, visible=True, no_value={})
     file_ext = "sqlite"
     edam_format = "format_3621"
+    sniff_magic = (b'SQLite format 3\0',)
 
     def init_meta(self, dataset, copy_from=None):
         Binary.init_meta(self, dataset, copy_from=copy_from)
@@ -1388,7 +1467,7 @@ class SQlite(Binary):
         # The first 16 bytes of any SQLite3 database file is 'SQLite format 3\0', and the file is binary. For details
         # about the format, see http://www.sqlite.org/fileformat.html
         try:
-            header = open(filename, 'rb').read(16)
+            header = open_for_sniffing(filename).read(16)
             if header == b'SQLite format 3\0':
                 return True
             return False
@@ -1764,6 +1843,9 @@ class ExcelXls(Binary):
     """Class describing an Excel (xls) file"""
     file_ext = "excel.xls"
     edam_format = "format_3468"
+    # OLE2 compound documents (Excel 5 and later) and the BIFF records
+    # starting older workbooks, checking this avoids running `file`
+    sniff_magic = (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', b'\x09\x00', b'\x09\x02', b'\x09\x04', b'\x09\x08')
 
     def sniff(self, filename):
         mime_type = subprocess.check_output(['file', '--mime-type', filename])
@@ -1797,7 +1879,7 @@ class Sra(Binary):
         For details about the format, see http://www.ncbi.nlm.nih.gov/books/n/helpsra/SRA_Overview_BK/#SRA_Overview_BK.4_SRA_Data_Structure
         """
         try:
-            header = open(filename, 'rb').read(8)
+            header = open_for_sniffing(filename).read(8)
             if header == b'NCBI.sra':
                 return True
             else:
@@ -1827,11 +1909,11 @@ class RData(Binary):
     def sniff(self, filename):
         rdata_header = b'RDX2\nX\n'
         try:
-            header = open(filename, 'rb').read(7)
+            header = open_for_sniffing(filename).read(7)
             if header == rdata_header:
                 return True
 
-            header = gzip.open(filename).read(7)
+            header = open_for_sniffing(filename, "gzip").read(7)
             if header == rdata_header:
                 return True
         except Exception:
@@ -1843,7 +1925,7 @@ class OxliBinary(Binary):
     @staticmethod
     def _sniff(filename, oxlitype):
         try:
-            with open(filename, 'rb') as fileobj:
+            with open_for_sniffing(filename) as fileobj:
                 header = fileobj.read(4)
                 if header == b'OXLI':
                     fileobj.read(1)  # skip the version number
@@ -2222,7 +2304,7 @@ class NetCDF(Binary):
 
     def sniff(self, filename):
         try:
-            with open(filename, 'rb') as f:
+            with open_for_sniffing(filename) as f:
                 header = f.read(3)
             if header == b'CDF':
                 return True
@@ -2254,7 +2336,7 @@ class Dcd(Binary):
         # Match the keyword 'CORD' at position 4 or 8 - intsize dependent
         # Not checking for endianness
         try:
-            with open(filename, 'rb') as header:
+            with open_for_sniffing(filename) as header:
                 intsize = 4
                 header.seek(intsize)
                 if header.read(intsize) == self._magic_number:
@@ -2305,7 +2387,7 @@ class Vel(Binary):
         # Match the keyword 'VELD' at position 4 or 8 - intsize dependent
         # Not checking for endianness
         try:
-            with open(filename, 'rb') as header:
+            with open_for_sniffing(filename) as header:
                 intsize = 4
                 header.seek(intsize)
                 if header.read(intsize) == self._magic_number:
@@ -2346,6 +2428,7 @@ class DAA(Binary):
     False
     """
     file_ext = "daa"
+    sniff_magic = (binascii.unhexlify("6be33e6d47530e3c"),)
 
     def __init__(self, **kwd):
         Binary.__init__(self, **kwd)
@@ -2353,7 +2436,7 @@ class DAA(Binary):
 
     def sniff(self, filename):
         # The first 8 bytes of any daa file are 0x3c0e53476d3ee36b
-        with open(filename, 'rb') as f:
+        with open_for_sniffing(filename) as f:
             return f.read(8) == self._magic
 
 
@@ -2369,6 +2452,7 @@ class RMA6(Binary):
     False
     """
     file_ext = "rma6"
+    sniff_magic = (binascii.unhexlify("000003f600000006"),)
 
     def __init__(self, **kwd):
         Binary.__init__(self, **kwd)
@@ -2376,7 +2460,7 @@ class RMA6(Binary):
 
     def sniff(self, filename):
         # The first 8 bytes of any daa file are 0x3c0e53476d3ee36b
-        with open(filename, 'rb') as f:
+        with open_for_sniffing(filename) as f:
             return f.read(8) == self._magic
 
 
@@ -2392,6 +2476,7 @@ class DMND(Binary):
     False
     """
     file_ext = "dmnd"
+    sniff_magic = (binascii.unhexlify("6d18ee15a4f84a02"),)
 
     def __init__(self, **kwd):
         Binary.__init__(self, **kwd)
@@ -2399,7 +2484,7 @@ class DMND(Binary):
 
     def sniff(self, filename):
         # The first 8 bytes of any dmnd file are 0x24af8a415ee186d
-        with open(filename, 'rb') as f:
+        with open_for_sniffing(filename) as f:
             return f.read(8) == self._magic
 
 
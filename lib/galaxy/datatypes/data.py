@@ -18,6 +18,7 @@ from markupsafe import escape
 from galaxy import util
 from galaxy.datatypes.metadata import MetadataElement  # import directly to maintain ease of use in Datatype class definitions
 from galaxy.datatypes.sniff import build_sniff_from_prefix
+from galaxy.datatypes.util import line_counts
 from galaxy.util import (
     compression_utils,
     FILENAME_VALID_CHARS,
@@ -125,6 +126,11 @@ class Data(object):
     # The dataset contains binary data --> do not space_to_tab or convert newlines, etc.
     # Allow binary file uploads of this type when True.
     is_binary = True
+    # Leading bytes of the files sniff() can possibly accept, as stored (i.e.
+    # before any decompression). Files not starting with any of them are
+    # not sniffed against this datatype. Applies to the subclasses, which
+    # must override it if their sniff() does not build on this one.
+    sniff_magic = None
     # Allow user to change between this datatype and others. If False, this datatype
     # cannot be changed from or into.
     allow_datatype_change = True
@@ -134,6 +140,8 @@ class Data(object):
     primary_file_name = 'index'
     # A per datatype setting (inherited): max file size (in bytes) for setting optional metadata
     _max_optional_metadata_filesize = None
+    # A per datatype setting (inherited): max threads for grooming, indexing... a dataset
+    _max_threads = None
 
     # Trackster track type.
     track_type = None
@@ -210,6 +218,21 @@ class Data(object):
 
     max_optional_metadata_filesize = property(get_max_optional_metadata_filesize, set_max_optional_metadata_filesize)
 
+    def set_max_threads(self, max_value):
+        try:
+            max_value = int(max_value)
+        except (TypeError, ValueError):
+            return
+        self.__class__._max_threads = max_value
+
+    def get_max_threads(self):
+        rval = self.__class__._max_threads
+        if rval is None:
+            return -1
+        return rval
+
+    max_threads = property(get_max_threads, set_max_threads)
+
     def set_peek(self, dataset, is_multi_byte=False):
         """
         Set the peek and blurb text
@@ -820,9 +843,9 @@ class Text(Data):
         Perform a rough estimate by extrapolating number of lines from a small read.
         """
         sample_size = 1048576
-        with open(dataset.file_name) as dataset_fh:
+        with open(dataset.file_name, 'rb') as dataset_fh:
             dataset_read = dataset_fh.read(sample_size)
-        sample_lines = dataset_read.count('\n')
+        sample_lines = line_counts.count_newlines(dataset_read)
         est_lines = int(sample_lines * (float(dataset.get_size()) / float(sample_size)))
         return est_lines
 
@@ -831,19 +854,15 @@ class Text(Data):
         Count the number of lines of data in dataset,
         skipping all blank lines and comments.
         """
-        data_lines = 0
-        with compression_utils.get_fileobj(dataset.file_name) as in_file:
-            # FIXME: Potential encoding issue can prevent the ability to iterate over lines
-            # causing set_meta process to fail otherwise OK jobs. A better solution than
-            # a silent try/except is desirable.
-            try:
-                for line in in_file:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        data_lines += 1
-            except Exception:
-                pass
-        return data_lines
+        counter = line_counts.DataLineCounter()
+        # FIXME: Potential encoding issue can prevent the ability to count lines
+        # causing set_meta process to fail otherwise OK jobs. A better solution than
+        # a silent try/except is desirable.
+        try:
+            line_counts.count(dataset.file_name, counter)
+        except Exception:
+            pass
+        return counter.data_lines
 
     def set_peek(self, dataset, line_count=None, is_multi_byte=False, WIDTH=256, skipchars=None, line_wrap=True):
         """
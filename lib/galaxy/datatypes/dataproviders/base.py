@@ -127,6 +127,18 @@ class DataProvider(six.Iterator):
     def readlines(self):
         return [line for line in self]
 
+    # record indexes
+    def record_index(self, key):
+        """
+        Return the sparse index of the records (the valid data of a
+        provider using this one as its source) keyed with `key`, or `None`
+        if this provider cannot seek to the data of those records.
+
+        Meant to be overridden by sources that can (see
+        `dataset.DatasetDataProvider`).
+        """
+        return None
+
     # iterator interface
     def __iter__(self):
         # it's generators all the way up, Timmy
@@ -201,6 +213,19 @@ class FilteredDataProvider(DataProvider):
                 self.num_data_returned += 1
                 yield datum
 
+    def record_index_key(self):
+        """
+        Return a JSON serializable description of what `filter` considers
+        valid data: providers counting their valid data the same way share
+        the same record index. `None` when it cannot be described (e.g. when
+        using a `filter_fn`).
+
+        Meant to be extended by providers adding their own filtering.
+        """
+        if self.filter_fn:
+            return None
+        return {'class': self.__class__.__name__}
+
     # TODO: may want to squash this into DataProvider
     def filter(self, datum):
         """
@@ -253,32 +278,46 @@ class LimitedOffsetDataProvider(FilteredDataProvider):
         Iterate over the source until `num_valid_data_read` is greater than
         `offset`, begin providing datat, and stop when `num_data_returned`
         is greater than `offset`.
+
+        If the source keeps a record index of the valid data of this
+        provider, the source is first moved to the closest indexed datum
+        before `offset` (`num_data_read` then only counts the data read from
+        there) and the index is extended with the data read.
         """
         if self.limit is not None and self.limit <= 0:
             return
 
-        parent_gen = super(LimitedOffsetDataProvider, self).__iter__()
-        for datum in parent_gen:
-            self.num_data_returned -= 1
-
-            if self.num_valid_data_read > self.offset:
-                self.num_data_returned += 1
-                yield datum
+        record_index = self._record_index()
+        if record_index is not None and self.offset:
+            record, position = record_index.closest_record(self.offset)
+            if position is not None:
+                self.source.seek(position)
+                self.num_valid_data_read = record
 
-            if self.limit is not None and self.num_data_returned >= self.limit:
-                break
-
-    # TODO: skipping lines is inefficient - somehow cache file position/line_num pair and allow provider
-    #   to seek to a pos/line and then begin providing lines
-    # the important catch here is that we need to have accurate pos/line pairs
-    #   in order to preserve the functionality of limit and offset
-    # if file_seek and len( file_seek ) == 2:
-    #    seek_pos, new_line_num = file_seek
-    #    self.seek_and_set_curr_line( seek_pos, new_line_num )
-
-    # def seek_and_set_curr_line( self, file_seek, new_curr_line_num ):
-    #    self.seek( file_seek, os.SEEK_SET )
-    #    self.curr_line_num = new_curr_line_num
+        parent_gen = super(LimitedOffsetDataProvider, self).__iter__()
+        try:
+            for datum in parent_gen:
+                self.num_data_returned -= 1
+                if record_index is not None:
+                    record_index.add(self.num_valid_data_read - 1, self.source.line_offset)
+
+                if self.num_valid_data_read > self.offset:
+                    self.num_data_returned += 1
+                    yield datum
+
+                if self.limit is not None and self.num_data_returned >= self.limit:
+                    break
+        finally:
+            if record_index is not None and record_index.modified:
+                self.source.save_record_index(record_index)
+
+    def _record_index(self):
+        # sources that are not data providers (e.g. files) keep no index
+        source_record_index = getattr(self.source, 'record_index', None)
+        key = self.record_index_key()
+        if source_record_index is None or key is None:
+            return None
+        return source_record_index(key)
 
 
 class MultiSourceDataProvider(DataProvider):
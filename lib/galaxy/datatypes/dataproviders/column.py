@@ -109,11 +109,25 @@ class ColumnarDataProvider(line.RegexLineDataProvider):
 
         filters = filters or []
         self.column_filters = []
+        self.column_filter_params = []
         for filter_ in filters:
             parsed = self.parse_filter(filter_)
             # TODO: might be better to error on bad filter/None here
             if callable(parsed):
                 self.column_filters.append(parsed)
+                self.column_filter_params.append(filter_)
+        # custom parsers change the values given to the column filters
+        self.has_custom_parsers = bool(parsers)
+
+    def record_index_key(self):
+        key = super(ColumnarDataProvider, self).record_index_key()
+        if key is not None and self.column_filters:
+            if self.has_custom_parsers:
+                return None
+            key.update(filters=self.column_filter_params, indeces=self.selected_column_indeces,
+                       column_types=self.column_types, parse_columns=bool(self.parsers),
+                       deliminator=self.deliminator)
+        return key
 
     def parse_filter(self, filter_param_str):
         split = filter_param_str.split('-', 2)
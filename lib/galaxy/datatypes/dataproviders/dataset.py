@@ -5,15 +5,22 @@ Dataproviders that use either:
     - or provide data in some way relevant to bioinformatic data
         (e.g. parsing genomic regions from their source)
 """
+import json
 import logging
+import os
 import sys
 
+import six
 from bx import (
     seq as bx_seq,
     wiggle as bx_wig
 )
 
-from galaxy.util import sqlite
+from galaxy.datatypes.util import chunks
+from galaxy.util import (
+    sqlite,
+    unicodify
+)
 from . import (
     base,
     column,
@@ -30,6 +37,62 @@ change SamtoolsDataProvider to use pysam
 
 log = logging.getLogger(__name__)
 
+# sidecar file (in the dataset's extra files) of the record indexes of the dataset
+RECORD_INDEX_FILENAME = '__record_index__.json'
+RECORD_INDEX_VERSION = 1
+# records between two entries of a record index
+RECORD_INDEX_INTERVAL = 10000
+# record indexes kept per dataset (one per way of filtering its lines), the oldest are dropped
+MAX_RECORD_INDEXES = 16
+
+
+class RecordIndex(object):
+    """
+    Sparse index of the records (the valid data) a provider reads from the
+    lines of a dataset: the offsets of the lines of every `interval`-th
+    record, so that the provider can seek close to the record to start
+    providing from instead of reading and filtering every line before it.
+
+    The index is keyed with the provider's `record_index_key`, as what is a
+    valid datum depends on how the provider filters the lines.
+
+    >>> index = RecordIndex('key', interval=10)
+    >>> index.closest_record(25)
+    (0, None)
+    >>> for record in range(30):
+    ...     index.add(record, record * 100)
+    >>> index.offsets, index.modified
+    ([0, 1000, 2000], True)
+    >>> index.closest_record(25), index.closest_record(9), index.closest_record(1000)
+    ((20, 2000), (0, 0), (20, 2000))
+    """
+
+    def __init__(self, key, interval=RECORD_INDEX_INTERVAL, offsets=None):
+        self.key = key
+        self.interval = interval
+        self.offsets = offsets or []
+        # has the index been extended since it was loaded
+        self.modified = False
+
+    def closest_record(self, record):
+        """
+        Return the closest indexed record at or before `record` (0 based) and
+        the offset of its line, or `(0, None)` if no record is indexed.
+        """
+        entry = min(record // self.interval, len(self.offsets) - 1)
+        if entry < 0:
+            return 0, None
+        return entry * self.interval, self.offsets[entry]
+
+    def add(self, record, offset):
+        """
+        Index `record` (0 based) whose line starts at `offset` if it is the
+        next record to index.
+        """
+        if record == len(self.offsets) * self.interval:
+            self.offsets.append(offset)
+            self.modified = True
+
 
 # ----------------------------------------------------------------------------- base for using a Glx dataset
 class DatasetDataProvider(base.DataProvider):
@@ -53,6 +116,65 @@ class DatasetDataProvider(base.DataProvider):
         # this dataset file is obviously the source
         # TODO: this might be a good place to interface with the object_store...
         super(DatasetDataProvider, self).__init__(open(dataset.file_name, 'rb'))
+        # offset in the file of the line last provided
+        self.line_offset = None
+
+    def __iter__(self):
+        with self:
+            offset = self.source.tell()
+            for source_line in self.source:
+                self.line_offset = offset
+                offset += len(source_line)
+                yield unicodify(source_line) if six.PY3 else source_line
+
+    # record indexes
+    def _record_index_path(self):
+        extra_files_path = getattr(self.dataset, 'extra_files_path', None)
+        if not extra_files_path:
+            return None
+        return os.path.join(extra_files_path, RECORD_INDEX_FILENAME)
+
+    def _file_stamp(self):
+        # the indexes are dropped once the dataset's file changes
+        stat = os.stat(self.dataset.file_name)
+        return [stat.st_size, stat.st_mtime]
+
+    def _load_record_indexes(self):
+        index_path = self._record_index_path()
+        indexes = index_path and chunks.load_index(index_path)
+        if (not indexes or indexes.get('version') != RECORD_INDEX_VERSION or
+                indexes.get('stamp') != self._file_stamp()):
+            return []
+        return indexes.get('indexes', [])
+
+    def record_index(self, key):
+        """
+        Return the index keyed with `key` of the records read from this
+        dataset, saved in its extra files, or an empty index if there is none
+        or the dataset has changed since.
+        """
+        key = json.dumps(key, sort_keys=True)
+        for indexed_key, interval, offsets in self._load_record_indexes():
+            if indexed_key == key:
+                return RecordIndex(key, interval=interval, offsets=offsets)
+        return RecordIndex(key, interval=RECORD_INDEX_INTERVAL)
+
+    def save_record_index(self, record_index):
+        """
+        Save `record_index` with the other indexes of this dataset, dropping
+        the oldest ones.
+        """
+        indexes = [index for index in self._load_record_indexes() if index[0] != record_index.key]
+        indexes.append([record_index.key, record_index.interval, record_index.offsets])
+        if hasattr(self.dataset, 'dataset'):
+            self.dataset.dataset.create_extra_files_path()
+        index_path = self._record_index_path()
+        if index_path:
+            chunks.save_index(index_path, {
+                'version': RECORD_INDEX_VERSION,
+                'stamp': self._file_stamp(),
+                'indexes': indexes[-MAX_RECORD_INDEXES:],
+            })
 
     # TODO: this is a bit of a mess
     @classmethod
@@ -59,6 +59,13 @@ class FilteredLineDataProvider(base.LimitedOffsetDataProvider):
         self.provide_blank = provide_blank
         self.comment_char = comment_char
 
+    def record_index_key(self):
+        key = super(FilteredLineDataProvider, self).record_index_key()
+        if key is not None:
+            key.update(strip_lines=self.strip_lines, strip_newlines=self.strip_newlines,
+                       provide_blank=self.provide_blank, comment_char=self.comment_char)
+        return key
+
     def filter(self, line):
         """
         Determines whether to provide line or not.
@@ -113,6 +120,12 @@ class RegexLineDataProvider(FilteredLineDataProvider):
         self.invert = invert
         # NOTE: no support for flags
 
+    def record_index_key(self):
+        key = super(RegexLineDataProvider, self).record_index_key()
+        if key is not None:
+            key.update(regex_list=self.regex_list, invert=self.invert)
+        return key
+
     def filter(self, line):
         # NOTE: filter_fn will occur BEFORE any matching
         line = super(RegexLineDataProvider, self).filter(line)
@@ -6,6 +6,7 @@ import zipfile
 
 from six.moves.urllib.parse import quote_plus
 
+from galaxy.datatypes.sniff import open_for_sniffing
 from galaxy.datatypes.text import Html as HtmlFromText
 from galaxy.util import nice_size
 from galaxy.util.image_util import check_image_type
@@ -155,10 +156,11 @@ class Rast(Image):
 class Pdf(Image):
     edam_format = "format_3508"
     file_ext = "pdf"
+    sniff_magic = (b"%PDF",)
 
     def sniff(self, filename):
         """Determine if the file is in pdf format."""
-        with open(filename, 'rb') as fh:
+        with open_for_sniffing(filename) as fh:
             return fh.read(4) == b"%PDF"
 
 
@@ -28,6 +28,7 @@ from . import (
     xml
 )
 from .display_applications.application import DisplayApplication
+from .sniff import SniffPlan
 
 
 class ConfigurationError(Exception):
@@ -51,6 +52,7 @@ class Registry(object):
         self.available_tracks = []
         self.set_external_metadata_tool = None
         self.sniff_order = []
+        self._sniff_plan = None
         self.upload_file_formats = []
         # Datatype elements defined in local datatypes_conf.xml that contain display applications.
         self.display_app_containers = []
@@ -288,6 +290,8 @@ class Registry(object):
                                     self.upload_file_formats.append(extension)
                                 # Max file size cut off for setting optional metadata.
                                 self.datatypes_by_extension[extension].max_optional_metadata_filesize = elem.get('max_optional_metadata_filesize', None)
+                                # Max threads to groom and index datasets with, the job's slots otherwise.
+                                self.datatypes_by_extension[extension].max_threads = elem.get('max_threads', None)
                                 for converter in elem.findall('converter'):
                                     # Build the list of datatype converters which will later be loaded into the calling app's toolbox.
                                     converter_config = converter.get('file', None)
@@ -398,6 +402,7 @@ class Registry(object):
                     self.sniff_order.append(datatype)
 
         append_to_sniff_order()
+        self._sniff_plan = SniffPlan(self.sniff_order)
 
     def _load_build_sites(self, root):
 
@@ -936,6 +941,17 @@ class Registry(object):
             rval['auto'] = rval['txt']
         return rval
 
+    @property
+    def sniff_plan(self):
+        """
+        The sniff order compiled for dispatch, see :class:`galaxy.datatypes.sniff.SniffPlan`.
+        Recompiled if the sniff order changed (e.g. sniffers of an installed
+        Tool Shed repository were loaded).
+        """
+        if self._sniff_plan is None or self._sniff_plan.sniff_order != self.sniff_order:
+            self._sniff_plan = SniffPlan(self.sniff_order)
+        return self._sniff_plan
+
     @property
     def edam_formats(self):
         """
@@ -7,12 +7,15 @@ import codecs
 import gzip
 import io
 import logging
+import mmap
 import os
 import re
 import shutil
 import sys
 import tempfile
+import threading
 import zipfile
+from contextlib import contextmanager
 
 from six import (
     PY3,
@@ -23,6 +26,10 @@ from six.moves import filter
 from six.moves.urllib.request import urlopen
 
 from galaxy import util
+from galaxy.datatypes.util.upload_pipeline import (
+    PosixLines,
+    SpacesToTabs,
+)
 from galaxy.util import compression_utils
 from galaxy.util.checkers import (
     check_binary,
@@ -41,6 +48,10 @@ else:
 log = logging.getLogger(__name__)
 
 SNIFF_PREFIX_BYTES = int(os.environ.get("GALAXY_SNIFF_PREFIX_BYTES", None) or 2 ** 20)
+# Decompressed data shared by the readers of a FilePrefix is decoded in chunks of this size
+SHARED_STREAM_CHUNK_BYTES = 2 ** 16
+# At most this much of the decompressed data is kept in memory, past it the data is streamed again
+SHARED_STREAM_MAX_BYTES = max(SNIFF_PREFIX_BYTES, 2 ** 24)
 
 
 def get_test_fname(fname):
@@ -432,7 +443,10 @@ def guess_ext(fname, sniff_order, is_binary=False):
     >>> guess_ext(fname, sniff_order)  # This test case is ensuring doesn't throw exception, actual value could change if non-utf encoding handling improves.
     'data'
     """
-    file_prefix = FilePrefix(fname)
+    if not isinstance(fname, FilePrefix):
+        with FilePrefix(fname) as file_prefix:
+            return guess_ext(file_prefix, sniff_order, is_binary=is_binary)
+    file_prefix = fname
     file_ext = run_sniffers_raw(file_prefix, sniff_order, is_binary)
 
     # Ugly hack for tsv vs tabular sniffing, we want to prefer tabular
@@ -458,48 +472,106 @@ def guess_ext(fname, sniff_order, is_binary=False):
 
 def run_sniffers_raw(filename_or_file_prefix, sniff_order, is_binary=False):
     """Run through sniffers specified by sniff_order, return None of None match.
+
+    ``sniff_order`` is either a list of datatypes or a :class:`SniffPlan`
+    built from one (e.g. ``Registry.sniff_plan``), which avoids compiling
+    the plan on every call.
     """
+    if not isinstance(sniff_order, SniffPlan):
+        sniff_order = SniffPlan(sniff_order)
     if isinstance(filename_or_file_prefix, FilePrefix):
-        fname = filename_or_file_prefix.filename
-        file_prefix = filename_or_file_prefix
-    else:
-        fname = filename_or_file_prefix
-        file_prefix = FilePrefix(filename_or_file_prefix)
+        return sniff_order.run(filename_or_file_prefix, is_binary=is_binary)
+    with FilePrefix(filename_or_file_prefix) as file_prefix:
+        return sniff_order.run(file_prefix, is_binary=is_binary)
+
+
+class SniffPlan(object):
+    """
+    A sniff order compiled for dispatch.
+
+    The datatypes that can be sniffed for a file are selected once per
+    compression format of the file and binary flag instead of testing every
+    datatype for every file. Datatypes declaring the leading bytes of the
+    files they accept (``sniff_magic``) are grouped by them, a group is
+    skipped as a whole if the file starts differently. The remaining
+    datatypes are sniffed in the original order, so the first matching
+    datatype is the same as when running through the sniff order.
+    """
 
-    file_ext = None
-    for datatype in sniff_order:
+    def __init__(self, sniff_order):
+        self.sniff_order = list(sniff_order)
+        self._candidates = {}
+        self.magic_length = max([len(magic) for datatype in self.sniff_order for magic in getattr(datatype, "sniff_magic", None) or ()] or [0])
+
+    def __iter__(self):
+        return iter(self.sniff_order)
+
+    def __len__(self):
+        return len(self.sniff_order)
+
+    def candidates(self, compressed_format, is_binary=False):
         """
-        Some classes may not have a sniff function, which is ok.  In fact,
-        Binary, Data, Tabular and Text are examples of classes that should never
-        have a sniff function. Since these classes are default classes, they contain
-        few rules to filter out data of other formats, so they should be called
-        from this function after all other datatypes in sniff_order have not been
-        successfully discovered.
+        Return the ``(datatype, sniff_prefix, sniff_magic)`` tuples of the
+        datatypes that can match a file compressed with ``compressed_format``
+        (None if uncompressed), ``sniff_prefix`` telling whether the datatype
+        sniffs a :class:`FilePrefix` instead of a file name.
         """
-        try:
-            if hasattr(datatype, "sniff_prefix"):
-                datatype_compressed = getattr(datatype, "compressed", False)
-                if datatype_compressed and not file_prefix.compressed_format:
+        key = (compressed_format, is_binary)
+        if key not in self._candidates:
+            candidates = []
+            for datatype in self.sniff_order:
+                # Some classes may not have a sniff function, which is ok. In fact,
+                # Binary, Data, Tabular and Text are examples of classes that should never
+                # have a sniff function. Since these classes are default classes, they contain
+                # few rules to filter out data of other formats, so they should be called
+                # after all other datatypes in sniff_order have not been successfully discovered.
+                sniff_prefix = hasattr(datatype, "sniff_prefix")
+                if sniff_prefix:
+                    datatype_compressed = getattr(datatype, "compressed", False)
+                    if bool(datatype_compressed) != bool(compressed_format):
+                        continue
+                    if compressed_format:
+                        # Compare the compressed format detected to the expected one,
+                        # compressed datatypes not defining one cannot be sniffed.
+                        datatype_compressed_format = getattr(datatype, "compressed_format", _MISSING)
+                        if datatype_compressed_format is _MISSING:
+                            continue
+                        if datatype_compressed_format and datatype_compressed_format != compressed_format:
+                            continue
+                elif is_binary and not datatype.is_binary:
                     continue
-                if not datatype_compressed and file_prefix.compressed_format:
+                sniff_magic = getattr(datatype, "sniff_magic", None)
+                candidates.append((datatype, sniff_prefix, tuple(sniff_magic) if sniff_magic else None))
+            self._candidates[key] = candidates
+        return self._candidates[key]
+
+    def run(self, file_prefix, is_binary=False):
+        """Return the extension of the first datatype matching ``file_prefix``, None if none does."""
+        fname = file_prefix.filename
+        leading_bytes = None
+        magic_matches = {}
+        for datatype, sniff_prefix, sniff_magic in self.candidates(file_prefix.compressed_format, is_binary):
+            if sniff_magic:
+                if sniff_magic not in magic_matches:
+                    if leading_bytes is None:
+                        leading_bytes = file_prefix.raw_file().read(self.magic_length)
+                    magic_matches[sniff_magic] = leading_bytes.startswith(sniff_magic)
+                if not magic_matches[sniff_magic]:
                     continue
-                if file_prefix.compressed_format and getattr(datatype, "compressed_format"):
-                    # In this case go a step further and compare the compressed format detected
-                    # to the expected.
-                    if file_prefix.compressed_format != datatype.compressed_format:
-                        continue
-                if datatype.sniff_prefix(file_prefix):
-                    file_ext = datatype.file_ext
-                    break
-            elif is_binary and not datatype.is_binary:
-                continue
-            elif datatype.sniff(fname):
-                file_ext = datatype.file_ext
-                break
-        except Exception:
-            pass
+            try:
+                if sniff_prefix:
+                    if datatype.sniff_prefix(file_prefix):
+                        return datatype.file_ext
+                else:
+                    with _sniffing_file(file_prefix):
+                        if datatype.sniff(fname):
+                            return datatype.file_ext
+            except Exception:
+                pass
+        return None
+
 
-    return file_ext
+_MISSING = object()
 
 
 def zip_single_fileobj(path):
@@ -509,32 +581,166 @@ def zip_single_fileobj(path):
             return z.open(name)
 
 
+class _SharedBytes(object):
+    """
+    Bytes of a file shared by the readers of a :class:`FilePrefix`, either
+    the memory-mapped file itself or the output of a decompressor, which is
+    decoded (once) only as far as it is read.
+
+    Only the first ``limit`` bytes of the decompressed data are kept, past
+    them the data is read through the decompressor keeping its last chunk,
+    which is restarted (with ``reopen``) to read data before that chunk.
+    """
+
+    def __init__(self, data=None, source=None, reopen=None, limit=SHARED_STREAM_MAX_BYTES):
+        self.data = data if data is not None else bytearray()
+        self.source = source
+        self._reopen = reopen
+        self._limit = limit
+        # Offset of the next byte of the source, the last chunk read past the
+        # kept data and the size of the data once the source is exhausted
+        self._offset = len(self.data)
+        self._tail = b""
+        self._tail_start = self._offset
+        self._size = len(self.data) if source is None else None
+        # Furthest offset read so far
+        self.high_water = 0
+
+    def _read_source(self, length=0):
+        chunk = self.source.read(max(SHARED_STREAM_CHUNK_BYTES, length))
+        if not chunk:
+            self.source.close()
+            self.source = None
+            self._size = self._offset
+        self._offset += len(chunk)
+        return chunk
+
+    def ensure(self, end=None):
+        """Keep the first ``end`` bytes (``limit`` if None) if there are that many, up to ``limit``."""
+        end = self._limit if end is None else min(end, self._limit)
+        while self.source is not None and self._offset == len(self.data) and len(self.data) < end:
+            chunk = self._read_source(end - len(self.data))
+            kept = self._limit - len(self.data)
+            self.data.extend(chunk[:kept])
+            if len(chunk) > kept:
+                self._tail = chunk[kept:]
+                self._tail_start = self._offset - len(self._tail)
+
+    def _stream(self, start, end):
+        """Read bytes past the kept data through the decompressor."""
+        if start < self._tail_start:
+            self.source = self._reopen()
+            self._offset = 0
+            self._tail = b""
+            self._tail_start = 0
+        chunks = []
+        position = start
+        while end is None or position < end:
+            tail_end = self._tail_start + len(self._tail)
+            if position < tail_end:
+                chunk = self._tail[position - self._tail_start:None if end is None else end - self._tail_start]
+                chunks.append(chunk)
+                position += len(chunk)
+            elif self.source is None:
+                break
+            else:
+                self._tail = self._read_source(0 if end is None else end - position)
+                self._tail_start = self._offset - len(self._tail)
+        return b"".join(chunks)
+
+    def read(self, start, end=None):
+        self.ensure(end)
+        kept = len(self.data)
+        chunk = bytes(self.data[start:end]) if start < kept else b""
+        if self._size != kept and (end is None or end > kept):
+            chunk += self._stream(max(start, kept), end)
+        self.high_water = max(self.high_water, start + len(chunk))
+        return chunk
+
+    def __len__(self):
+        """Size of the data, decompressing to the end without keeping it if not known yet."""
+        self.ensure()
+        while self._size is None:
+            self._tail = self._read_source()
+            self._tail_start = self._offset - len(self._tail)
+        return self._size
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class _SharedBytesReader(io.RawIOBase):
+    """A binary file object with its own position over :class:`_SharedBytes`."""
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._shared.read(self._position, self._position + len(b))
+        b[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._shared)
+        if offset < 0:
+            raise IOError("Negative seek position %d" % offset)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+
+def _map_file(filename):
+    with open(filename, "rb") as f:
+        try:
+            if os.fstat(f.fileno()).st_size:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # Not a regular file (e.g. a pipe), read it instead
+            return f.read()
+        return b""
+
+
 class FilePrefix(object):
+    """
+    The beginning of a file to sniff, decompressed if the file is compressed
+    with gzip, bz2 or zip.
+
+    The file is memory-mapped and decompressed lazily and only once, sniffers
+    needing more than the prefix get file objects sharing the mapping and the
+    decompressed stream (see :func:`open_for_sniffing`).
+    """
 
     def __init__(self, filename):
         non_utf8_error = None
-        compressed_format = None
-        contents_header_bytes = None
         contents_header = None  # First MAX_BYTES of the file.
-        truncated = False
-        # A future direction to optimize sniffing even more for sniffers at the top of the list
-        # is to lazy load contents_header based on what interface is requested. For instance instead
-        # of returning a StringIO directly in string_io() return an object that reads the contents and
-        # populates contents_header while providing a StringIO-like interface until the file is read
-        # but then would fallback to native string_io()
+        self.filename = filename
+        self._raw = _SharedBytes(_map_file(filename))
+        compressed_format, self._contents = self._open_contents()
+        contents_header_bytes = self._contents.read(0, SNIFF_PREFIX_BYTES)
+        truncated = len(contents_header_bytes) == SNIFF_PREFIX_BYTES
         try:
-            compressed_format, f = compression_utils.get_fileobj_raw(filename, "rb")
-            try:
-                contents_header_bytes = f.read(SNIFF_PREFIX_BYTES)
-                truncated = len(contents_header_bytes) == SNIFF_PREFIX_BYTES
-                contents_header = contents_header_bytes.decode("utf-8")
-            finally:
-                f.close()
+            contents_header = contents_header_bytes.decode("utf-8")
         except UnicodeDecodeError as e:
             non_utf8_error = e
 
         self.truncated = truncated
-        self.filename = filename
         self.non_utf8_error = non_utf8_error
         self.binary = non_utf8_error is not None  # obviously wrong
         self.compressed_format = compressed_format
@@ -542,12 +748,60 @@ class FilePrefix(object):
         self.contents_header_bytes = contents_header_bytes
         self._file_size = None
 
+    def _open_contents(self):
+        """Detect the compression of the file as ``compression_utils.get_fileobj_raw`` does."""
+        magic = self._raw.read(0, 3)
+        if magic.startswith(util.gzip_magic):
+            try:
+                # Only files starting with valid gzip data are decompressed
+                gzip.GzipFile(fileobj=self.raw_file(), mode="rb").read(4)
+                return "gzip", self._decompressed(lambda: gzip.GzipFile(fileobj=self.raw_file(), mode="rb"))
+            except Exception:
+                pass
+        if magic == util.bz2_magic:
+            # Only bz2 on Python 3 reads from file objects
+            return "bz2", self._decompressed(lambda: bz2.BZ2File(self.raw_file() if PY3 else self.filename, "rb"))
+        if zipfile.is_zipfile(self.raw_file()):
+            zip_file = zipfile.ZipFile(self.raw_file())
+            # The first file in the zip file
+            name = zip_file.namelist()[0]
+            return "zip", self._decompressed(lambda: zip_file.open(name))
+        return None, self._raw
+
+    def _decompressed(self, open_source):
+        return _SharedBytes(source=open_source(), reopen=open_source)
+
     @property
     def file_size(self):
         if self._file_size is None:
             self._file_size = os.path.getsize(self.filename)
         return self._file_size
 
+    @property
+    def bytes_read(self):
+        """How far the file has been read through this prefix."""
+        return self._raw.high_water
+
+    def close(self):
+        """Release the mapping of the file and the decompressor, the file objects returned can no longer be read."""
+        if self._contents is not self._raw:
+            self._contents.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def raw_file(self):
+        """A binary file object over the file as stored."""
+        return _SharedBytesReader(self._raw)
+
+    def contents_file(self):
+        """A binary file object over the decompressed content of the file (the file itself if not compressed)."""
+        return _SharedBytesReader(self._contents)
+
     def string_io(self):
         if self.non_utf8_error is not None:
             raise self.non_utf8_error
@@ -576,11 +830,51 @@ class FilePrefix(object):
         return query_str in self.contents_header
 
 
+_sniffing = threading.local()
+
+
+@contextmanager
+def _sniffing_file(file_prefix):
+    """Let :func:`open_for_sniffing` use ``file_prefix`` while sniffing its file."""
+    previous = getattr(_sniffing, "file_prefix", None)
+    _sniffing.file_prefix = file_prefix
+    try:
+        yield
+    finally:
+        _sniffing.file_prefix = previous
+
+
+def open_for_sniffing(filename, compressed_format=None):
+    """
+    Open ``filename`` for reading in binary mode from a ``sniff()`` method,
+    decompressed if ``compressed_format`` is given. While the file is being
+    sniffed (in :meth:`SniffPlan.run`), the returned file object reads from
+    the :class:`FilePrefix` of the file instead of reading (and decompressing)
+    the file again.
+    """
+    file_prefix = getattr(_sniffing, "file_prefix", None)
+    if file_prefix is not None and file_prefix.filename == filename:
+        if compressed_format is None:
+            return file_prefix.raw_file()
+        if compressed_format == file_prefix.compressed_format:
+            return file_prefix.contents_file()
+    if compressed_format == "gzip":
+        return gzip.open(filename, "rb")
+    elif compressed_format == "bz2":
+        return bz2.BZ2File(filename, "rb")
+    elif compressed_format is None:
+        return open(filename, "rb")
+    raise ValueError("Cannot decompress %s files" % compressed_format)
+
+
 def build_sniff_from_prefix(klass):
     # Build and attach a sniff function to this class (klass) from the sniff_prefix function
     # expected to be defined for the class.
     def auto_sniff(self, filename):
-        file_prefix = FilePrefix(filename)
+        with FilePrefix(filename) as file_prefix:
+            return _auto_sniff(self, file_prefix)
+
+    def _auto_sniff(self, file_prefix):
         datatype_compressed = getattr(self, "compressed", False)
         if file_prefix.compressed_format and not datatype_compressed:
             return False
@@ -697,7 +991,14 @@ def handle_uploaded_dataset_file_internal(
         uploaded_file_ext=None,
         convert_to_posix_lines=None,
         convert_spaces_to_tabs=None,
+        pipeline=None,
 ):
+    """
+    Decompress, convert and sniff an uploaded file. If an
+    :class:`galaxy.datatypes.util.upload_pipeline.UploadPipeline` is given,
+    the content of text files is converted (or just read) through it, so that
+    its stages see the whole file in the same single pass.
+    """
     is_valid, ext, converted_path, compressed_type = handle_compressed_file(
         filename,
         datatypes_registry,
@@ -718,28 +1019,39 @@ def handle_uploaded_dataset_file_internal(
         is_binary = check_binary(converted_path)
         guessed_ext = ext
         if ext in AUTO_DETECT_EXTENSIONS:
-            guessed_ext = guess_ext(converted_path, sniff_order=datatypes_registry.sniff_order, is_binary=is_binary)
+            guessed_ext = guess_ext(converted_path, sniff_order=datatypes_registry.sniff_plan, is_binary=is_binary)
             guessed_datatype = datatypes_registry.get_datatype_by_extension(guessed_ext)
             if not is_binary and guessed_datatype.is_binary:
                 # It's possible to have a datatype that is binary but not within the first 1024 bytes,
                 # so check_binary might return a false negative. This is for instance true for PDF files
                 is_binary = True
 
+        # The pipeline reads the file as uploaded unless it was decompressed
+        # (in place or not)
+        pipeline_source = not in_place and converted_path == filename
         if not is_binary and (convert_to_posix_lines or convert_spaces_to_tabs):
             # Convert universal line endings to Posix line endings, spaces to tabs (if desired)
-            if convert_spaces_to_tabs:
-                convert_fxn = convert_newlines_sep2tabs
+            if pipeline is not None:
+                transforms = [PosixLines()]
+                if convert_spaces_to_tabs:
+                    transforms.append(SpacesToTabs())
+                _converted_path = pipeline.run(converted_path, transforms=transforms, source=pipeline_source, in_place=in_place, tmp_dir=tmp_dir, tmp_prefix=tmp_prefix)
             else:
-                convert_fxn = convert_newlines
-            line_count, _converted_path = convert_fxn(converted_path, in_place=in_place, tmp_dir=tmp_dir, tmp_prefix=tmp_prefix)
+                if convert_spaces_to_tabs:
+                    convert_fxn = convert_newlines_sep2tabs
+                else:
+                    convert_fxn = convert_newlines
+                line_count, _converted_path = convert_fxn(converted_path, in_place=in_place, tmp_dir=tmp_dir, tmp_prefix=tmp_prefix)
             if not in_place:
                 if converted_path and filename != converted_path:
                     os.unlink(converted_path)
                 converted_path = _converted_path
             if ext in AUTO_DETECT_EXTENSIONS:
-                ext = guess_ext(converted_path, sniff_order=datatypes_registry.sniff_order, is_binary=is_binary)
+                ext = guess_ext(converted_path, sniff_order=datatypes_registry.sniff_plan, is_binary=is_binary)
         else:
             ext = guessed_ext
+            if pipeline is not None and not is_binary:
+                pipeline.run(converted_path, source=pipeline_source)
 
         if not is_binary and check_content and check_html(converted_path):
             raise InappropriateDatasetContentError('The uploaded file contains invalid HTML content')
@@ -15,6 +15,7 @@ import sys
 import tempfile
 from json import dumps
 
+import numpy
 import pysam
 from markupsafe import escape
 
@@ -27,6 +28,7 @@ from galaxy.datatypes.sniff import (
     iter_headers,
     validate_tabular,
 )
+from galaxy.datatypes.util import chunks
 from galaxy.util import compression_utils
 from . import dataproviders
 
@@ -35,6 +37,142 @@ if sys.version_info > (3,):
 
 log = logging.getLogger(__name__)
 
+# Name of the line index of a tabular dataset in its extra files
+LINE_INDEX_FILENAME = '__line_index__.json'
+# Characters of a tabular dataset read at once when setting its metadata
+SET_META_BLOCK_SIZE = 2 ** 22
+# Column types, in the order in which they are tried for a value, a column
+# gets the last type found for any of its values
+COLUMN_TYPE_ORDER = ['int', 'float', 'list', 'str']
+_NO_COLUMN_TYPE = -1
+_STR_COLUMN_TYPE = COLUMN_TYPE_ORDER.index('str')
+_UNKNOWN_COLUMN_TYPE = len(COLUMN_TYPE_ORDER)
+# Longer digit strings are left to int(), which may limit their length
+_MAX_FAST_INT_DIGITS = 4000
+# Values guessed one by one remembered while setting metadata
+_MAX_GUESSED_VALUES = 100000
+
+
+def _guess_column_type(column_text):
+    """
+    Return the index in COLUMN_TYPE_ORDER of the type of a single value,
+    -1 for an empty value.
+
+    >>> [_guess_column_type(v) for v in ['1', '-1.5', 'NA', '1e5', '1,2', 'a', '']]
+    [0, 1, 1, 1, 2, 3, -1]
+    """
+    try:
+        int(column_text)
+        return 0
+    except ValueError:
+        pass
+    try:
+        float(column_text)
+        return 1
+    except ValueError:
+        if column_text.strip().lower() == 'na':
+            return 1  # na is special cased to be a float
+    if "," in column_text:
+        return 2
+    if column_text != "":
+        return 3
+    return _NO_COLUMN_TYPE
+
+
+def _guess_column_types(data, column_types, guessed):
+    """
+    Refine ``column_types``, an array of indices in COLUMN_TYPE_ORDER (-1
+    for columns without values so far), with ``data``: utf-8 encoded tab
+    separated lines, each ending with a newline. Return the refined array,
+    extended if the lines have more columns.
+
+    The type of most values is derived from counts of their characters,
+    computed for all the values at once. Other values (e.g. 'inf' or ' 1')
+    are guessed one by one, unless their column is already of type 'str',
+    and are remembered in the ``guessed`` dictionary.
+
+    >>> types = _guess_column_types(b'1\\t2.5\\t\\n-3\\t1,2\\t1e-5\\n', numpy.zeros(0, dtype=numpy.int8), {})
+    >>> [COLUMN_TYPE_ORDER[t] for t in types]
+    ['int', 'list', 'float']
+    """
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    # Every value ends with a tab or a newline
+    ends = numpy.flatnonzero((buf == 9) | (buf == 10))
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    lower = buf | 32
+
+    def cumulative(mask):
+        counts = numpy.zeros(len(buf) + 1, dtype=numpy.int32)
+        numpy.cumsum(mask, out=counts[1:])
+        return counts
+
+    digit_counts = cumulative((buf >= 48) & (buf <= 57))
+    dot_counts = cumulative(buf == 46)
+    e_counts = cumulative(lower == 101)
+
+    def number(starts, ends):
+        """Whether the values between starts and ends are integers and decimal numbers int() and float() accept."""
+        signed = (ends > starts) & ((buf[starts] == 45) | (buf[starts] == 43))
+        starts = starts + signed
+        lengths = ends - starts
+        digits = digit_counts[ends] - digit_counts[starts]
+        dots = dot_counts[ends] - dot_counts[starts]
+        return (lengths > 0) & (digits == lengths), (digits > 0) & (dots == 1) & (digits == lengths - 1)
+
+    is_int, is_float = number(starts, ends)
+    is_int &= lengths <= _MAX_FAST_INT_DIGITS
+    # Numbers with an exponent
+    e_positions = numpy.flatnonzero(lower == 101)
+    with_e = numpy.flatnonzero((e_counts[ends] - e_counts[starts]) == 1)
+    e_at = e_positions[numpy.searchsorted(e_positions, starts[with_e])]
+    mantissa_int, mantissa_float = number(starts[with_e], e_at)
+    exponent_int, _ = number(e_at + 1, ends[with_e])
+    is_float[with_e[(mantissa_int | mantissa_float) & exponent_int]] = True
+    # na is special cased to be a float
+    is_na = numpy.flatnonzero(lengths == 2)
+    is_float[is_na[(lower[starts[is_na]] == 110) & (lower[starts[is_na] + 1] == 97)]] = True
+
+    value_types = numpy.full(len(ends), _UNKNOWN_COLUMN_TYPE, dtype=numpy.int8)
+    value_types[is_float] = 1
+    value_types[is_int] = 0
+    # Neither int() nor float() accept a comma
+    comma_counts = cumulative(buf == 44)
+    value_types[comma_counts[ends] > comma_counts[starts]] = 2
+    value_types[lengths == 0] = _NO_COLUMN_TYPE
+
+    # Column of each value: its index minus the index of the first value of its line
+    line_ends = buf[ends] == 10
+    lines = numpy.cumsum(line_ends) - line_ends
+    first_values = numpy.zeros(lines[-1] + 1, dtype=ends.dtype)
+    first_values[1:] = numpy.flatnonzero(line_ends)[:-1] + 1
+    columns = numpy.arange(len(ends)) - first_values[lines]
+
+    n_columns = max(len(column_types), columns.max() + 1)
+    refined = numpy.full(n_columns, _NO_COLUMN_TYPE, dtype=numpy.int8)
+    refined[:len(column_types)] = column_types
+    for column_type in range(len(COLUMN_TYPE_ORDER)):
+        found = numpy.bincount(columns[value_types == column_type], minlength=n_columns) > 0
+        refined[found] = numpy.maximum(refined[found], column_type)
+
+    unknown = numpy.flatnonzero((value_types == _UNKNOWN_COLUMN_TYPE) & (refined[columns] < _STR_COLUMN_TYPE))
+    if len(unknown):
+        refined = refined.tolist()
+        for column, start, end in zip(columns[unknown].tolist(), starts[unknown].tolist(), ends[unknown].tolist()):
+            if refined[column] == _STR_COLUMN_TYPE:
+                continue
+            column_text = data[start:end].decode('utf-8')
+            column_type = guessed.get(column_text)
+            if column_type is None:
+                if len(guessed) >= _MAX_GUESSED_VALUES:
+                    guessed.clear()
+                column_type = guessed[column_text] = _guess_column_type(column_text)
+            refined[column] = max(refined[column], column_type)
+        refined = numpy.array(refined, dtype=numpy.int8)
+    return refined
+
 
 @dataproviders.decorators.has_dataproviders
 class TabularData(data.Text):
@@ -69,23 +207,53 @@ class TabularData(data.Text):
         except Exception:
             return False
 
-    def get_chunk(self, trans, dataset, offset=0, ck_size=None):
-        with compression_utils.get_fileobj(dataset.file_name) as f:
+    def get_chunk(self, trans, dataset, offset=0, ck_size=None, line=None):
+        """
+        Return the lines of dataset starting at ``offset`` (in the decompressed
+        content), or at line ``line`` (0 based) if given, and the offset of the
+        next chunk.
+        """
+        if line is not None and line < 0:
+            raise ValueError("Invalid line %d, must not be negative" % line)
+        with compression_utils.get_fileobj(dataset.file_name, 'rb') as f:
+            if line is not None:
+                offset = self._line_offset(dataset, f, line)
             f.seek(offset)
-            ck_data = f.read(ck_size or trans.app.config.display_chunk_size)
-            if ck_data and ck_data[-1] != '\n':
-                cursor = f.read(1)
-                while cursor and cursor != '\n':
-                    ck_data += cursor
-                    cursor = f.read(1)
-            last_read = f.tell()
-        return dumps({'ck_data': util.unicodify(ck_data),
-                      'offset': last_read})
-
-    def display_data(self, trans, dataset, preview=False, filename=None, to_ext=None, offset=None, ck_size=None, **kwd):
+            ck_data = chunks.read_chunk(f, ck_size or trans.app.config.display_chunk_size)
+        rval = {'ck_data': util.unicodify(ck_data.replace(b'\r\n', b'\n')),
+                'offset': offset + len(ck_data)}
+        if line is not None:
+            rval['line'] = line
+        return dumps(rval)
+
+    def _line_offset(self, dataset, f, line):
+        """
+        Find the offset of ``line`` with the line index of dataset, saved in its
+        extra files and only extended as far as needed.
+        """
+        size = dataset.get_size()
+        try:
+            mtime = os.path.getmtime(dataset.file_name)
+        except OSError:
+            mtime = None
+        index_path = None
+        if dataset.extra_files_path:
+            index_path = os.path.join(dataset.extra_files_path, LINE_INDEX_FILENAME)
+        line_index = (index_path and chunks.LineIndex.load(index_path, size, mtime)) or chunks.LineIndex(size, mtime=mtime)
+        entries = len(line_index.offsets)
+        offset = line_index.line_offset(f, line)
+        if len(line_index.offsets) != entries:
+            if not index_path and hasattr(dataset, 'dataset'):
+                dataset.dataset.create_extra_files_path()
+                index_path = os.path.join(dataset.extra_files_path, LINE_INDEX_FILENAME)
+            if index_path:
+                line_index.save(index_path)
+        return offset
+
+    def display_data(self, trans, dataset, preview=False, filename=None, to_ext=None, offset=None, ck_size=None, line=None, **kwd):
         preview = util.string_as_bool(preview)
-        if offset is not None:
-            return self.get_chunk(trans, dataset, offset, ck_size)
+        if offset is not None or line is not None:
+            return self.get_chunk(trans, dataset, offset or 0, ck_size, line=line)
         elif to_ext or not preview:
             to_ext = to_ext or dataset.extension
             return self._serve_raw(trans, dataset, to_ext, **kwd)
@@ -276,122 +444,85 @@ class Tabular(TabularData):
         requested_skip = skip
         if skip is None:
             skip = 0
-        column_type_set_order = ['int', 'float', 'list', 'str']  # Order to set column types in
-        default_column_type = column_type_set_order[-1]  # Default column type is lowest in list
-        column_type_compare_order = list(column_type_set_order)  # Order to compare column types
-        column_type_compare_order.reverse()
-
-        def type_overrules_type(column_type1, column_type2):
-            if column_type1 is None or column_type1 == column_type2:
-                return False
-            if column_type2 is None:
-                return True
-            for column_type in column_type_compare_order:
-                if column_type1 == column_type:
-                    return True
-                if column_type2 == column_type:
-                    return False
-            # neither column type was found in our ordered list, this cannot happen
-            raise ValueError("Tried to compare unknown column types: %s and %s" % (column_type1, column_type2))
-
-        def is_int(column_text):
-            try:
-                int(column_text)
-                return True
-            except ValueError:
-                return False
-
-        def is_float(column_text):
-            try:
-                float(column_text)
-                return True
-            except ValueError:
-                if column_text.strip().lower() == 'na':
-                    return True  # na is special cased to be a float
-                return False
-
-        def is_list(column_text):
-            return "," in column_text
-
-        def is_str(column_text):
-            # anything, except an empty string, is True
-            if column_text == "":
-                return False
-            return True
-        is_column_type = {}  # Dict to store column type string to checking function
-        for column_type in column_type_set_order:
-            is_column_type[column_type] = locals()["is_%s" % (column_type)]
-
-        def guess_column_type(column_text):
-            for column_type in column_type_set_order:
-                if is_column_type[column_type](column_text):
-                    return column_type
-            return None
         data_lines = 0
         comment_lines = 0
-        column_types = []
-        first_line_column_types = [default_column_type]  # default value is one column of type str
+        # Indices in COLUMN_TYPE_ORDER, -1 while a column has no value
+        column_types = numpy.zeros(0, dtype=numpy.int8)
+        first_line_column_types = [_STR_COLUMN_TYPE]  # default value is one column of type str
+        guessed = {}
         if dataset.has_data():
             # NOTE: if skip > num_check_lines, we won't detect any metadata, and will use default
             with compression_utils.get_fileobj(dataset.file_name) as dataset_fh:
                 i = 0
-                while True:
-                    line = dataset_fh.readline()
-                    if not line:
-                        break
-                    line = line.rstrip('\r\n')
-                    if i < skip or not line or line.startswith('#'):
-                        # We'll call blank lines comments
-                        comment_lines += 1
+                remainder = ''
+                finished = False
+                while not finished:
+                    # Lines are read by blocks, their values are typed together
+                    block = dataset_fh.read(SET_META_BLOCK_SIZE)
+                    if block:
+                        lines = (remainder + block).split('\n')
+                        remainder = lines.pop()
                     else:
-                        data_lines += 1
-                        if max_guess_type_data_lines is None or data_lines <= max_guess_type_data_lines:
-                            fields = line.split('\t')
-                            for field_count, field in enumerate(fields):
-                                if field_count >= len(column_types):  # found a previously unknown column, we append None
-                                    column_types.append(None)
-                                column_type = guess_column_type(field)
-                                if type_overrules_type(column_type, column_types[field_count]):
-                                    column_types[field_count] = column_type
-                        if i == 0 and requested_skip is None:
-                            # This is our first line, people seem to like to upload files that have a header line, but do not
-                            # start with '#' (i.e. all column types would then most likely be detected as str).  We will assume
-                            # that the first line is always a header (this was previous behavior - it was always skipped).  When
-                            # the requested skip is None, we only use the data from the first line if we have no other data for
-                            # a column.  This is far from perfect, as
-                            # 1,2,3	1.1	2.2	qwerty
-                            # 0	0		1,2,3
-                            # will be detected as
-                            # "column_types": ["int", "int", "float", "list"]
-                            # instead of
-                            # "column_types": ["list", "float", "float", "str"]  *** would seem to be the 'Truth' by manual
-                            # observation that the first line should be included as data.  The old method would have detected as
-                            # "column_types": ["int", "int", "str", "list"]
-                            first_line_column_types = column_types
-                            column_types = [None for col in first_line_column_types]
-                    if max_data_lines is not None and data_lines >= max_data_lines:
-                        if dataset_fh.tell() != dataset.get_size():
-                            data_lines = None  # Clear optional data_lines metadata value
-                            comment_lines = None  # Clear optional comment_lines metadata value; additional comment lines could appear below this point
-                        break
-                    i += 1
+                        lines = [remainder] if remainder else []
+                        remainder = ''
+                        finished = True
+                    to_guess = []
+                    for line_index, line in enumerate(lines):
+                        if i < skip or not line or line.startswith('#'):
+                            # We'll call blank lines comments
+                            comment_lines += 1
+                        else:
+                            data_lines += 1
+                            if max_guess_type_data_lines is None or data_lines <= max_guess_type_data_lines:
+                                to_guess.append(line)
+                            if i == 0 and requested_skip is None:
+                                # This is our first line, people seem to like to upload files that have a header line, but do not
+                                # start with '#' (i.e. all column types would then most likely be detected as str).  We will assume
+                                # that the first line is always a header (this was previous behavior - it was always skipped).  When
+                                # the requested skip is None, we only use the data from the first line if we have no other data for
+                                # a column.  This is far from perfect, as
+                                # 1,2,3	1.1	2.2	qwerty
+                                # 0	0		1,2,3
+                                # will be detected as
+                                # "column_types": ["int", "int", "float", "list"]
+                                # instead of
+                                # "column_types": ["list", "float", "float", "str"]  *** would seem to be the 'Truth' by manual
+                                # observation that the first line should be included as data.  The old method would have detected as
+                                # "column_types": ["int", "int", "str", "list"]
+                                if to_guess:
+                                    column_types = _guess_column_types((line + '\n').encode('utf-8'), column_types, guessed)
+                                    to_guess = []
+                                first_line_column_types = column_types.tolist()
+                                column_types = numpy.full(len(first_line_column_types), _NO_COLUMN_TYPE, dtype=numpy.int8)
+                        if max_data_lines is not None and data_lines >= max_data_lines:
+                            # Whether the file has been read entirely, the file handle is only at the end of this line
+                            # when no text read after it is left
+                            if line_index < len(lines) - 1 or remainder or dataset_fh.tell() != dataset.get_size():
+                                data_lines = None  # Clear optional data_lines metadata value
+                                comment_lines = None  # Clear optional comment_lines metadata value; additional comment lines could appear below this point
+                            finished = True
+                            break
+                        i += 1
+                    if to_guess:
+                        column_types = _guess_column_types(('\n'.join(to_guess) + '\n').encode('utf-8'), column_types, guessed)
 
+        column_types = column_types.tolist()
         # we error on the larger number of columns
         # first we pad our column_types by using data from first line
         if len(first_line_column_types) > len(column_types):
             for column_type in first_line_column_types[len(column_types):]:
                 column_types.append(column_type)
-        # Now we fill any unknown (None) column_types with data from first line
+        # Now we fill any unknown column_types with data from first line
         for i in range(len(column_types)):
-            if column_types[i] is None:
-                if len(first_line_column_types) <= i or first_line_column_types[i] is None:
-                    column_types[i] = default_column_type
+            if column_types[i] == _NO_COLUMN_TYPE:
+                if len(first_line_column_types) <= i or first_line_column_types[i] == _NO_COLUMN_TYPE:
+                    column_types[i] = _STR_COLUMN_TYPE
                 else:
                     column_types[i] = first_line_column_types[i]
         # Set the discovered metadata values for the dataset
         dataset.metadata.data_lines = data_lines
         dataset.metadata.comment_lines = comment_lines
-        dataset.metadata.column_types = column_types
+        dataset.metadata.column_types = [COLUMN_TYPE_ORDER[column_type] for column_type in column_types]
         dataset.metadata.columns = len(column_types)
         dataset.metadata.delimiter = '\t'
 
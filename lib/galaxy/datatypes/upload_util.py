@@ -1,6 +1,12 @@
 import os
 
-from galaxy.datatypes import sniff
+import six
+
+from galaxy.datatypes import (
+    data,
+    sequence,
+    sniff,
+)
 from galaxy.util.checkers import (
     check_binary,
     is_single_file_zip,
@@ -25,6 +31,7 @@ def handle_upload(
     auto_decompress,
     convert_to_posix_lines,
     convert_spaces_to_tabs,
+    pipeline=None,
 ):
     stdout = None
     converted_path = None
@@ -52,11 +59,12 @@ def handle_upload(
                 uploaded_file_ext=os.path.splitext(name)[1].lower().lstrip('.'),
                 convert_to_posix_lines=convert_to_posix_lines,
                 convert_spaces_to_tabs=convert_spaces_to_tabs,
+                pipeline=pipeline,
             )
         except sniff.InappropriateDatasetContentError as exc:
             raise UploadProblemException(exc)
     elif requested_ext == 'auto':
-        ext = sniff.guess_ext(path, registry.sniff_order, is_binary=is_binary)
+        ext = sniff.guess_ext(path, registry.sniff_plan, is_binary=is_binary)
     else:
         ext = requested_ext
 
@@ -88,3 +96,25 @@ def handle_upload(
         stdout = 'ZIP file contained more than one file, only the first file was added to Galaxy.'
 
     return stdout, ext, datatype, is_binary, converted_path
+
+
+def counted_metadata(datatype, line_counts, path):
+    """
+    Return the metadata set_meta() would set on the dataset ``path`` of
+    ``datatype`` if it only counts lines or sequences, from the counts of the
+    :class:`galaxy.datatypes.util.upload_pipeline.LineCounts` stage the
+    dataset went through when uploaded. Return None if set_meta() sets more
+    metadata or the lines could not be counted.
+    """
+    if line_counts.error is not None:
+        return None
+    set_meta = six.get_unbound_function(type(datatype).set_meta)
+    if set_meta is six.get_unbound_function(data.Text.set_meta):
+        return {"data_lines": line_counts.text.data_lines}
+    if set_meta is six.get_unbound_function(sequence.Sequence.set_meta):
+        return {"data_lines": line_counts.fasta.data_lines, "sequences": line_counts.fasta.sequences}
+    if set_meta is six.get_unbound_function(sequence.BaseFastq.set_meta):
+        if datatype.max_optional_metadata_filesize >= 0 and os.path.getsize(path) > datatype.max_optional_metadata_filesize:
+            return None
+        return {"data_lines": line_counts.fastq.data_lines, "sequences": line_counts.fastq.sequences}
+    return None
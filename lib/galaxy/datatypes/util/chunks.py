@@ -0,0 +1,201 @@
+"""
+Read (possibly compressed) text datasets by chunks of whole lines, and find
+the offsets of their lines with a sparse index of line numbers.
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+
+import numpy
+
+log = logging.getLogger(__name__)
+
+# Bytes read ahead at once to complete the last line of a chunk
+PAGE_SIZE = 2 ** 16
+# Bytes between two entries of a line index
+LINE_INDEX_INTERVAL = 2 ** 20
+LINE_INDEX_VERSION = 1
+
+
+def read_chunk(fh, size, page_size=PAGE_SIZE):
+    """
+    Read about ``size`` bytes of whole lines from the binary file object
+    ``fh``: the chunk is cut after its last newline, unless it holds part of
+    a single line, which is then read to its end by pages of ``page_size``
+    bytes. The next chunk starts ``len(chunk)`` bytes further, the position
+    of ``fh`` is left past the chunk (seeking back in a compressed file
+    would decompress it again from its start).
+
+    >>> from io import BytesIO
+    >>> read_chunk(BytesIO(b'a\\tb\\nc\\td\\ne'), 6) == b'a\\tb\\n'
+    True
+    >>> read_chunk(BytesIO(b'c\\td\\ne'), 6) == b'c\\td\\ne'
+    True
+    >>> read_chunk(BytesIO(b'a\\tb\\nc'), 2, page_size=1) == b'a\\tb\\n'
+    True
+    """
+    chunk = fh.read(size)
+    if len(chunk) < size or chunk.endswith(b"\n"):
+        # The end of the file or of a line
+        return chunk
+    end = chunk.rfind(b"\n")
+    if end != -1:
+        return chunk[:end + 1]
+    pages = [chunk]
+    while True:
+        page = fh.read(page_size)
+        end = page.find(b"\n")
+        if end != -1:
+            pages.append(page[:end + 1])
+            break
+        pages.append(page)
+        if len(page) < page_size:
+            break
+    return b"".join(pages)
+
+
+class LineIndex(object):
+    """
+    Sparse index of the lines of a (possibly compressed) text file: the
+    offsets (in the decompressed content) of the first line starting after
+    every ``interval`` bytes and their line numbers.
+
+    The index is built as far as needed to find a line, so that reading the
+    file from its start is only needed once, it can then be saved and loaded
+    with the file. Finding the offset of a line, or the line of an offset,
+    then only reads the file from the closest entry of the index.
+
+    >>> from io import BytesIO
+    >>> fh = BytesIO(''.join('line %d\\n' % i for i in range(100)).encode())
+    >>> index = LineIndex(size=len(fh.getvalue()), interval=64)
+    >>> index.line_offset(fh, 42) == fh.getvalue().index(b'line 42\\n')
+    True
+    >>> index.line_number(fh, fh.getvalue().index(b'line 57\\n'))
+    57
+    >>> index.line_offset(fh, 1000) == len(fh.getvalue())
+    True
+    >>> index.complete, index.lines
+    (True, 100)
+    """
+
+    def __init__(self, size, interval=LINE_INDEX_INTERVAL, offsets=None, line_numbers=None, complete=False, mtime=None):
+        # Size and modification time of the indexed file, to tell whether the index is still valid
+        self.size = size
+        self.mtime = mtime
+        self.interval = interval
+        self.offsets = offsets or [0]
+        self.line_numbers = line_numbers or [0]
+        self.complete = complete
+
+    @property
+    def lines(self):
+        """Number of lines of the file, None until the index is complete."""
+        return self.line_numbers[-1] if self.complete else None
+
+    def _extend(self, fh, to_line=None, to_offset=None):
+        """Index the file from the last entry up to ``to_line`` or ``to_offset``, to its end if both are None."""
+        position = self.offsets[-1]
+        line_number = self.line_numbers[-1]
+        fh.seek(position)
+        while (to_line is None or self.line_numbers[-1] <= to_line) and (to_offset is None or self.offsets[-1] <= to_offset):
+            block = fh.read(self.interval)
+            if not block:
+                if position > self.offsets[-1]:
+                    # The last line, without newline
+                    self.offsets.append(position)
+                    self.line_numbers.append(line_number + 1)
+                self.complete = True
+                break
+            newlines = numpy.flatnonzero(numpy.frombuffer(block, dtype=numpy.uint8) == 10)
+            if len(newlines):
+                line_number += len(newlines)
+                self.offsets.append(position + int(newlines[-1]) + 1)
+                self.line_numbers.append(line_number)
+            position += len(block)
+
+    def _closest_entry(self, entries, value):
+        return bisect.bisect_right(entries, value) - 1
+
+    def line_offset(self, fh, line_number):
+        """Offset of the start of line ``line_number`` (0 based) of ``fh``, the end of the file if it has fewer lines."""
+        if line_number < 0:
+            raise ValueError("Invalid line number %d" % line_number)
+        if not self.complete and self.line_numbers[-1] <= line_number:
+            self._extend(fh, to_line=line_number)
+        entry = self._closest_entry(self.line_numbers, line_number)
+        offset = self.offsets[entry]
+        lines_to_skip = line_number - self.line_numbers[entry]
+        fh.seek(offset)
+        while lines_to_skip:
+            block = fh.read(self.interval)
+            if not block:
+                break
+            newlines = numpy.flatnonzero(numpy.frombuffer(block, dtype=numpy.uint8) == 10)
+            if len(newlines) >= lines_to_skip:
+                return offset + int(newlines[lines_to_skip - 1]) + 1
+            lines_to_skip -= len(newlines)
+            offset += len(block)
+        return offset
+
+    def line_number(self, fh, offset):
+        """Number (0 based) of the line of ``fh`` including ``offset``."""
+        if not self.complete and self.offsets[-1] <= offset:
+            self._extend(fh, to_offset=offset)
+        entry = self._closest_entry(self.offsets, offset)
+        fh.seek(self.offsets[entry])
+        return self.line_numbers[entry] + fh.read(offset - self.offsets[entry]).count(b"\n")
+
+    def to_dict(self):
+        return {
+            "version": LINE_INDEX_VERSION,
+            "size": self.size,
+            "mtime": self.mtime,
+            "interval": self.interval,
+            "offsets": self.offsets,
+            "line_numbers": self.line_numbers,
+            "complete": self.complete,
+        }
+
+    def save(self, path):
+        """Write the index to ``path``, failing silently (the index is only a cache)."""
+        save_index(path, self.to_dict())
+
+    @classmethod
+    def load(cls, path, size, mtime=None):
+        """
+        Read the index of a file of ``size`` bytes last modified at ``mtime``
+        from ``path``, None if missing or out of date.
+        """
+        index = load_index(path)
+        if index is None or index.get("version") != LINE_INDEX_VERSION or index.get("size") != size or index.get("mtime") != mtime:
+            return None
+        return cls(size, interval=index["interval"], offsets=index["offsets"], line_numbers=index["line_numbers"], complete=index["complete"], mtime=mtime)
+
+
+def load_index(path):
+    """Read the dictionary written by :func:`save_index` to ``path``, None if missing or unreadable."""
+    try:
+        with open(path) as fh:
+            index = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+    return index if isinstance(index, dict) else None
+
+
+def save_index(path, index):
+    """
+    Write the dictionary ``index`` as JSON to ``path``, replacing the file
+    at once so that readers never see part of it, and failing silently (an
+    index is only a cache).
+    """
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as fh:
+            json.dump(index, fh)
+        os.rename(fh.name, path)
+    except (IOError, OSError):
+        log.debug("Could not save index %s", path, exc_info=True)
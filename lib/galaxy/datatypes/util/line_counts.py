@@ -0,0 +1,313 @@
+"""
+Count the lines and sequence records of (possibly compressed) text datasets
+by blocks of bytes instead of reading them line by line.
+
+Datatypes only need the first character of each line (once stripped of
+whitespace) to tell data lines from comment or blank lines and to find
+record headers, :func:`iter_first_characters` provides it for all the lines
+of a block at once and the counters below keep track of the counts.
+"""
+import codecs
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from galaxy.util import compression_utils
+
+# Bytes read (and decompressed) at once
+BLOCK_SIZE = 2 ** 20
+# First character of blank lines and of lines starting with a non-ASCII character
+BLANK = -1
+NON_ASCII = 128
+
+_BGZF_HEADER = struct.Struct("<4sBBBBBBHBBHH")
+_BGZF_HEADER_SIZE = _BGZF_HEADER.size
+# First bytes of lines str.strip() may remove, decoded to find their first character
+_MAY_BE_STRIPPED = numpy.zeros(256, dtype=bool)
+_MAY_BE_STRIPPED[[9, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+_MAY_BE_STRIPPED[128:] = True
+
+
+def decompression_threads():
+    """Threads to decompress BGZF files with, the slots of the job running the code if any."""
+    try:
+        return max(int(os.environ.get("GALAXY_SLOTS", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def iter_blocks(filename, block_size=BLOCK_SIZE, threads=1):
+    """
+    Yield the content of ``filename``, decompressed if compressed with gzip,
+    bz2 or zip, by blocks of bytes. BGZF files are decompressed by
+    ``threads`` threads.
+    """
+    if threads > 1 and _is_bgzf(filename):
+        for block in _iter_bgzf_blocks(filename, block_size, threads):
+            yield block
+        return
+    with compression_utils.get_fileobj(filename, "rb") as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def _bgzf_member_size(header):
+    """Size of the BGZF block starting with ``header``, None if it is not a BGZF block."""
+    if len(header) < _BGZF_HEADER_SIZE:
+        return None
+    magic, _, _, _, _, _, _, xlen, si1, si2, slen, bsize = _BGZF_HEADER.unpack(header[:_BGZF_HEADER_SIZE])
+    if magic != b"\x1f\x8b\x08\x04" or xlen < 6 or (si1, si2, slen) != (66, 67, 2):
+        return None
+    return bsize + 1
+
+
+def _is_bgzf(filename):
+    with open(filename, "rb") as fh:
+        return _bgzf_member_size(fh.read(_BGZF_HEADER_SIZE)) is not None
+
+
+def _bgzf_chunks(fh, chunk_size):
+    """Yield consecutive BGZF blocks of ``fh`` by chunks of about ``chunk_size`` compressed bytes."""
+    chunk = []
+    chunk_length = 0
+    while True:
+        header = fh.read(_BGZF_HEADER_SIZE)
+        if not header:
+            break
+        size = _bgzf_member_size(header)
+        if size is None:
+            # Not BGZF after all, the rest is decompressed as a whole
+            chunk.append(header + fh.read())
+            break
+        chunk.append(header + fh.read(size - _BGZF_HEADER_SIZE))
+        chunk_length += size
+        if chunk_length >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+            chunk_length = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _inflate(data):
+    """Decompress concatenated gzip members."""
+    decompressed = []
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressed.append(decompressor.decompress(data))
+        decompressed.append(decompressor.flush())
+        data = decompressor.unused_data
+    return b"".join(decompressed)
+
+
+def _iter_bgzf_blocks(filename, block_size, threads):
+    # BGZF blocks hold at most 64KB, blocks of compressed data of about
+    # block_size / 4 give decompressed blocks of about block_size
+    with open(filename, "rb") as fh, ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for chunk in _bgzf_chunks(fh, max(block_size // 4, 1)):
+            pending.append(executor.submit(_inflate, chunk))
+            if len(pending) > 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _first_character(line):
+    text = line.decode("utf-8", "ignore").strip()
+    if not text:
+        return BLANK
+    code = ord(text[0])
+    return code if code < NON_ASCII else NON_ASCII
+
+
+def _first_characters(lines):
+    """First characters of ``lines``, complete lines ending with a newline."""
+    buf = numpy.frombuffer(lines, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(buf == 10)
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    first_bytes = buf[starts]
+    first_characters = first_bytes.astype(numpy.int16)
+    first_characters[starts == ends] = BLANK
+    for index in numpy.flatnonzero(_MAY_BE_STRIPPED[first_bytes]).tolist():
+        first_characters[index] = _first_character(lines[starts[index]:ends[index]])
+    return first_characters
+
+
+def iter_first_characters(filename, block_size=BLOCK_SIZE, threads=1):
+    """
+    Yield, by blocks of lines of ``filename`` (decompressed if compressed),
+    arrays of the first character of each line once stripped of whitespace:
+    its code if ASCII, NON_ASCII otherwise, and BLANK for blank lines.
+
+    Lines end with '\\n', '\\r\\n' or '\\r' and the content must be utf-8, as
+    when reading the file in text mode: a UnicodeDecodeError is raised
+    otherwise.
+    """
+    first_characters = FirstCharacters()
+    for block in iter_blocks(filename, block_size, threads):
+        block_first_characters = first_characters.update(block)
+        if block_first_characters is not None:
+            yield block_first_characters
+    last_first_characters = first_characters.finish()
+    if last_first_characters is not None:
+        yield last_first_characters
+
+
+class FirstCharacters(object):
+    """
+    The first characters of the lines of a file fed by consecutive blocks of
+    bytes, as yielded by :func:`iter_first_characters`: :meth:`update` returns
+    those of the lines completed by a block (None if none is), :meth:`finish`
+    those of the lines left once the whole file was fed.
+
+    >>> first_characters = FirstCharacters()
+    >>> first_characters.update(b'>a\\r') is None
+    True
+    >>> first_characters.update(b'\\n  \\nAC').tolist() == [ord('>'), BLANK]
+    True
+    >>> first_characters.finish().tolist() == [ord('A')]
+    True
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        # Start of the line continuing in the next block while its first
+        # character is unknown, and this character once known
+        self._line_start = None
+        self._line_first_character = BLANK
+        self._pending_cr = False
+
+    def update(self, block):
+        self._decoder.decode(block)
+        return self._concatenate(self._first_characters(block))
+
+    def finish(self):
+        self._decoder.decode(b"", final=True)
+        block = b"\n" if self._pending_cr else b""
+        self._pending_cr = False
+        first_characters = self._first_characters(block)
+        if self._line_start is not None:
+            # Last line without newline
+            first_characters.append(numpy.array([self._line_first_character], dtype=numpy.int16))
+            self._line_start = None
+        return self._concatenate(first_characters)
+
+    def _concatenate(self, first_characters):
+        return numpy.concatenate(first_characters) if first_characters else None
+
+    def _first_characters(self, block):
+        if self._pending_cr:
+            block = b"\r" + block
+            self._pending_cr = False
+        if b"\r" in block:
+            if block.endswith(b"\r"):
+                # Maybe followed by '\n'
+                block = block[:-1]
+                self._pending_cr = True
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        first_characters = []
+        if self._line_start is not None:
+            end = block.find(b"\n")
+            if self._line_first_character == BLANK:
+                self._line_start += block if end == -1 else block[:end]
+                self._line_first_character = _first_character(self._line_start)
+                if self._line_first_character != BLANK:
+                    self._line_start = b""
+            if end == -1:
+                return first_characters
+            first_characters.append(numpy.array([self._line_first_character], dtype=numpy.int16))
+            self._line_start = None
+            block = block[end + 1:]
+        last_end = block.rfind(b"\n")
+        if last_end != -1:
+            first_characters.append(_first_characters(block[:last_end + 1]))
+        if last_end + 1 < len(block):
+            self._line_start = block[last_end + 1:]
+            self._line_first_character = _first_character(self._line_start)
+            if self._line_first_character != BLANK:
+                self._line_start = b""
+        return first_characters
+
+
+class DataLineCounter(object):
+    """Count lines neither blank nor comments."""
+
+    def __init__(self, comment="#"):
+        self.comment = ord(comment)
+        self.data_lines = 0
+
+    def update(self, first_characters):
+        self.data_lines += int(numpy.count_nonzero((first_characters != BLANK) & (first_characters != self.comment)))
+
+
+class FastaCounter(object):
+    """Count lines other than comments and the '>' headers of sequences."""
+
+    def __init__(self):
+        self.data_lines = 0
+        self.sequences = 0
+
+    def update(self, first_characters):
+        self.data_lines += int(numpy.count_nonzero(first_characters != ord("#")))
+        self.sequences += int(numpy.count_nonzero(first_characters == ord(">")))
+
+
+class FastqCounter(object):
+    """
+    Count the lines after the leading comments and the records of FASTQ
+    files: a line starting with '@' at least 3 lines after the previous
+    record started starts a new record.
+    """
+
+    def __init__(self):
+        self.data_lines = 0
+        self._sequences = 0
+        self._last_record_line = 0
+
+    def update(self, first_characters):
+        if not self.data_lines:
+            data = numpy.flatnonzero(first_characters != ord("#"))
+            if not len(data):
+                return
+            first_characters = first_characters[data[0]:]
+        for line in (numpy.flatnonzero(first_characters == ord("@")) + self.data_lines).tolist():
+            if line - self._last_record_line >= 3:
+                self._sequences += 1
+                self._last_record_line = line
+        self.data_lines += len(first_characters)
+
+    @property
+    def sequences(self):
+        # The last record
+        if self.data_lines - self._last_record_line >= 4:
+            return self._sequences + 1
+        return self._sequences
+
+
+def count(filename, counter, threads=None):
+    """Update ``counter`` with all the lines of ``filename`` and return it."""
+    if threads is None:
+        threads = decompression_threads()
+    for first_characters in iter_first_characters(filename, threads=threads):
+        counter.update(first_characters)
+    return counter
+
+
+def count_newlines(data):
+    """
+    Count the line breaks of ``data`` ('\\n', '\\r\\n' or '\\r').
+
+    >>> count_newlines(b'a\\nb\\r\\nc\\rd')
+    3
+    """
+    return data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n")
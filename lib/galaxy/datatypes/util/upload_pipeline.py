@@ -0,0 +1,216 @@
+"""
+Read uploaded files once, through a pipeline of stages.
+
+Uploads used to be read again and again: to validate their hashes, to
+convert their line endings (and spaces to tabs), then to count their lines
+and sequences when setting their metadata. An :class:`UploadPipeline` reads
+a file once by blocks, feeds each block to the stages observing the file as
+uploaded (e.g. :class:`Digest`), rewrites it with transforms
+(:class:`PosixLines`, :class:`SpacesToTabs`), feeds the rewritten block to
+the stages observing the file as written (e.g. :class:`LineCounts`) and
+writes the converted file at once.
+"""
+import io
+import os
+import re
+import shutil
+import tempfile
+
+from galaxy.datatypes.util import line_counts
+from galaxy.util.hash_util import HASH_NAME_MAP
+
+# Bytes read at once
+BLOCK_SIZE = 2 ** 20
+
+# Whitespace replaced by tabs, as by sniff.convert_newlines_sep2tabs
+_SPACES = re.compile(br"[^\S\n]+")
+_SPACE_BYTES = b" \t\r\x0b\x0c"
+
+
+class PosixLines(object):
+    """
+    Transform '\\r\\n' and '\\r' line endings to '\\n' and end the last line
+    with a newline, as :func:`galaxy.datatypes.sniff.convert_newlines` does.
+    """
+
+    def __init__(self):
+        self._pending_cr = False
+        self._ends_with_newline = None
+
+    def transform(self, block):
+        if self._pending_cr:
+            block = b"\r" + block
+            self._pending_cr = False
+        if block.endswith(b"\r"):
+            # Maybe followed by '\n'
+            block = block[:-1]
+            self._pending_cr = True
+        block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if block:
+            self._ends_with_newline = block.endswith(b"\n")
+        return block
+
+    def flush(self):
+        if self._pending_cr or self._ends_with_newline is False:
+            self._pending_cr = False
+            self._ends_with_newline = True
+            return b"\n"
+        return b""
+
+
+class SpacesToTabs(object):
+    """
+    Transform runs of whitespace other than newlines to a tab, as
+    :func:`galaxy.datatypes.sniff.convert_newlines_sep2tabs` does. Follows
+    :class:`PosixLines` in a pipeline.
+    """
+
+    def __init__(self):
+        # Whitespace ending the last block, the run may continue in the next one
+        self._pending = b""
+
+    def transform(self, block):
+        block = self._pending + block
+        end = len(block.rstrip(_SPACE_BYTES))
+        self._pending = block[end:]
+        return _SPACES.sub(b"\t", block[:end])
+
+    def flush(self):
+        block = _SPACES.sub(b"\t", self._pending)
+        self._pending = b""
+        return block
+
+
+class Digest(object):
+    """Hash of the file as uploaded, ``hash_function`` is one of ``galaxy.util.hash_util.HASH_NAMES``."""
+    source = True
+
+    def __init__(self, hash_function):
+        self.hash_function = hash_function
+        self._hasher = HASH_NAME_MAP[hash_function]()
+
+    def update(self, block):
+        self._hasher.update(block)
+
+    def finish(self):
+        pass
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+class LineCounts(object):
+    """
+    Count the lines of the file as written, and its data lines and sequences
+    as the Text, Sequence and FASTQ datatypes count them (see
+    :mod:`galaxy.datatypes.util.line_counts`). If the file is not utf-8,
+    counting stops and ``error`` is set.
+    """
+    source = False
+
+    def __init__(self):
+        self.lines = 0
+        self.text = line_counts.DataLineCounter()
+        self.fasta = line_counts.FastaCounter()
+        self.fastq = line_counts.FastqCounter()
+        self.error = None
+        self._first_characters = line_counts.FirstCharacters()
+
+    def update(self, block):
+        if self.error is None:
+            try:
+                self._count(self._first_characters.update(block))
+            except UnicodeDecodeError as e:
+                self.error = e
+
+    def finish(self):
+        if self.error is None:
+            try:
+                self._count(self._first_characters.finish())
+            except UnicodeDecodeError as e:
+                self.error = e
+
+    def _count(self, first_characters):
+        if first_characters is None:
+            return
+        self.lines += len(first_characters)
+        for counter in (self.text, self.fasta, self.fastq):
+            counter.update(first_characters)
+
+
+class UploadPipeline(object):
+    """
+    Read a file once by blocks, feeding them to ``stages``: stages with a
+    true ``source`` attribute observe the file as read, the others the file
+    as written (once transformed). A pipeline reads a single file.
+
+    >>> from galaxy.datatypes.sniff import get_test_fname
+    >>> digest, counts = Digest("MD5"), LineCounts()
+    >>> pipeline = UploadPipeline([digest, counts])
+    >>> pipeline.run(get_test_fname('1.fastqsanger'))
+    >>> (counts.fastq.data_lines, counts.fastq.sequences)
+    (8, 2)
+    >>> import hashlib
+    >>> digest.hexdigest() == hashlib.md5(open(get_test_fname('1.fastqsanger'), 'rb').read()).hexdigest()
+    True
+    """
+
+    def __init__(self, stages=None, block_size=BLOCK_SIZE):
+        self.stages = list(stages or [])
+        self.block_size = block_size
+        # The file read through the pipeline and whether it is the file as
+        # uploaded (not decompressed or converted beforehand)
+        self.path = None
+        self.source = False
+
+    def run(self, path, transforms=None, source=True, in_place=True, tmp_dir=None, tmp_prefix="gxupload"):
+        """
+        Read ``path`` through the pipeline. The stages observing the file as
+        uploaded are only fed if ``source`` is true.
+
+        If ``transforms`` are given, the transformed file is written to a
+        temporary file in ``tmp_dir``, which replaces ``path`` if
+        ``in_place``, its path is returned otherwise. None is returned if the
+        file is transformed in place or not transformed.
+        """
+        assert self.path is None, "An upload pipeline reads a single file"
+        self.path = path
+        self.source = source
+        transforms = transforms or []
+        source_stages = [stage for stage in self.stages if stage.source and source]
+        output_stages = [stage for stage in self.stages if not stage.source]
+        temp_name = None
+        output = None
+        if transforms:
+            fd, temp_name = tempfile.mkstemp(prefix=tmp_prefix, dir=tmp_dir)
+            output = io.open(fd, mode="wb")
+        try:
+            with io.open(path, mode="rb") as fh:
+                while True:
+                    block = fh.read(self.block_size)
+                    final = not block
+                    for stage in source_stages:
+                        stage.update(block)
+                    for transform in transforms:
+                        block = transform.transform(block)
+                        if final:
+                            block += transform.flush()
+                    for stage in output_stages:
+                        stage.update(block)
+                    if output is not None:
+                        output.write(block)
+                    if final:
+                        break
+            for stage in source_stages + output_stages:
+                stage.finish()
+        except Exception:
+            if output is not None:
+                output.close()
+                os.remove(temp_name)
+            raise
+        if output is not None:
+            output.close()
+            if in_place:
+                shutil.move(temp_name, path)
+                return None
+        return temp_name
@@ -38,7 +38,10 @@ from galaxy.job_execution.output_collect import collect_extra_files
 from galaxy.jobs.actions.post import ActionBox
 from galaxy.jobs.mapper import JobMappingException, JobRunnerMapper
 from galaxy.jobs.runners import BaseJobRunner, JobState
-from galaxy.metadata import get_metadata_compute_strategy
+from galaxy.metadata import (
+    cache as metadata_cache,
+    get_metadata_compute_strategy
+)
 from galaxy.objectstore import ObjectStorePopulator
 from galaxy.tool_util.deps import requirements
 from galaxy.tool_util.output_checker import check_output, DETECTED_JOB_STATE
@@ -1270,6 +1273,8 @@ class JobWrapper(HasResourceParameters):
 
             self.sa_session.add(job)
             self.sa_session.flush()
+            self._notify_outputs_changed(job)
+            self.app.job_manager.notify_job_state_changed(job)
         else:
             for dataset_assoc in job.output_datasets:
                 dataset = dataset_assoc.dataset
@@ -1290,6 +1295,13 @@ class JobWrapper(HasResourceParameters):
         delete_files = cleanup_job == 'always' or (cleanup_job == 'onsuccess' and job.state == job.states.DELETED)
         self.cleanup(delete_files=delete_files)
 
+    def _notify_outputs_changed(self, job):
+        """Let the job handler know that the states of this job's outputs have changed, so that jobs waiting on them can
+        be dispatched promptly.
+        """
+        dataset_ids = [dataset_assoc.dataset.dataset.id for dataset_assoc in job.output_datasets + job.output_library_datasets]
+        self.app.job_manager.notify_datasets_changed(dataset_ids)
+
     def pause(self, job=None, message=None):
         if job is None:
             job = self.get_job()
@@ -1324,6 +1336,7 @@ class JobWrapper(HasResourceParameters):
         job.set_state(model.Job.states.RESUBMITTED)
         self.sa_session.add(job)
         self.sa_session.flush()
+        self.app.job_manager.notify_job_state_changed(job)
 
     def change_state(self, state, info=False, flush=True, job=None):
         job_supplied = job is not None
@@ -1360,6 +1373,7 @@ class JobWrapper(HasResourceParameters):
         self.sa_session.add(job)
         if flush:
             self.sa_session.flush()
+        self.app.job_manager.notify_job_state_changed(job)
 
     def get_state(self):
         job = self.get_job()
@@ -1489,6 +1503,8 @@ class JobWrapper(HasResourceParameters):
             # but somewhat trickier (need to recurse up the copied_from tree), for now we'll call set_meta()
             retry_internally = util.asbool(self.get_destination_configuration("retry_metadata_internally", True))
             metadata_set_successfully = self.external_output_metadata.external_metadata_set_successfully(dataset, output_name, self.sa_session, working_directory=self.working_directory)
+            # key of the dataset's metadata in the metadata cache, if set by Galaxy and cached
+            metadata_cache_key = None
             if retry_internally and not metadata_set_successfully:
                 # If Galaxy was expected to sniff type and didn't - do so.
                 if dataset.ext == "_sniff_":
@@ -1496,18 +1512,21 @@ class JobWrapper(HasResourceParameters):
                     dataset.extension = extension
 
                 # call datatype.set_meta directly for the initial set_meta call during dataset creation
-                dataset.datatype.set_meta(dataset, overwrite=False)
+                metadata_cache_key = metadata_cache.set_meta(dataset, self.external_output_metadata.metadata_cache, overwrite=False)
             elif (job.states.ERROR != final_job_state and not metadata_set_successfully):
                 dataset._state = model.Dataset.states.FAILED_METADATA
             else:
                 self.external_output_metadata.load_metadata(dataset, output_name, self.sa_session, working_directory=self.working_directory, remote_metadata_directory=remote_metadata_directory)
             line_count = context.get('line_count', None)
-            try:
-                # Certain datatype's set_peek methods contain a line_count argument
-                dataset.set_peek(line_count=line_count)
-            except TypeError:
-                # ... and others don't
-                dataset.set_peek()
+            if line_count is None and metadata_cache_key:
+                metadata_cache.set_peek(dataset, self.external_output_metadata.metadata_cache, metadata_cache_key)
+            else:
+                try:
+                    # Certain datatype's set_peek methods contain a line_count argument
+                    dataset.set_peek(line_count=line_count)
+                except TypeError:
+                    # ... and others don't
+                    dataset.set_peek()
         else:
             # Handle purged datasets.
             dataset.blurb = "empty"
@@ -1642,6 +1661,7 @@ class JobWrapper(HasResourceParameters):
         # Flush all the dataset and job changes above.  Dataset state changes
         # will now be seen by the user.
         self.sa_session.flush()
+        self._notify_outputs_changed(job)
 
         # The exit code will be null if there is no exit code to be set.
         # This is so that we don't assign an exit code, such as 0, that
@@ -1661,15 +1681,11 @@ class JobWrapper(HasResourceParameters):
                             tool=self.tool, stdout=job.stdout, stderr=job.stderr)
         job.command_line = unicodify(self.command_line)
 
-        collected_bytes = 0
-        # Once datasets are collected, set the total dataset size (includes extra files)
+        # Once datasets are collected, set the total dataset size (includes extra files),
+        # the disk usage of users referencing them is adjusted on flush
         for dataset_assoc in job.output_datasets:
             if not dataset_assoc.dataset.dataset.purged:
                 dataset_assoc.dataset.dataset.set_total_size()
-                collected_bytes += dataset_assoc.dataset.dataset.get_total_size()
-
-        if job.user:
-            job.user.adjust_total_disk_usage(collected_bytes)
 
         # Empirically, we need to update job.user and
         # job.workflow_invocation_step.workflow_invocation in separate
@@ -1690,6 +1706,7 @@ class JobWrapper(HasResourceParameters):
             # If job was composed of tasks, don't attempt to recollect statisitcs
             self._collect_metrics(job, job_metrics_directory)
         self.sa_session.flush()
+        self.app.job_manager.notify_job_state_changed(job)
         if job.state == job.states.ERROR:
             self._report_error()
         cleanup_job = self.cleanup_job
@@ -1826,15 +1843,21 @@ class JobWrapper(HasResourceParameters):
 
     def get_input_fnames(self):
         job = self.get_job()
+        self._locate_input_datasets(job)
         filenames = []
         for da in job.input_datasets + job.input_library_datasets:  # da is JobToInputDatasetAssociation object
             if da.dataset:
                 filenames.extend(self.get_input_dataset_fnames(da.dataset))
         return filenames
 
+    def _locate_input_datasets(self, job):
+        datasets = [da.dataset.dataset for da in job.input_datasets + job.input_library_datasets if da.dataset]
+        self.app.object_store.locate_many([dataset for dataset in datasets if not dataset.external_filename])
+
     def get_input_paths(self, job=None):
         if job is None:
             job = self.get_job()
+        self._locate_input_datasets(job)
         paths = []
         for da in job.input_datasets + job.input_library_datasets:  # da is JobToInputDatasetAssociation object
             if da.dataset:
@@ -2544,5 +2567,11 @@ class NoopQueue(object):
     def put_stop(self, *args):
         return
 
+    def notify_datasets_changed(self, *args):
+        return
+
+    def notify_job_state_changed(self, *args):
+        return
+
     def shutdown(self):
         return
@@ -3,9 +3,11 @@ Galaxy job handler, prepares, runs, tracks, and finishes Galaxy jobs
 """
 import datetime
 import os
+import threading
 import time
 from collections import defaultdict
 
+from boltons.iterutils import chunked
 from six.moves.queue import (
     Empty,
     Queue
@@ -27,6 +29,7 @@ from galaxy.jobs import (
     TaskWrapper
 )
 from galaxy.jobs.mapper import JobNotReadyException
+from galaxy.model import history_summary
 from galaxy.util import unicodify
 from galaxy.util.logging import get_logger
 from galaxy.util.monitors import Monitors
@@ -38,6 +41,8 @@ log = get_logger(__name__)
 # States for running a job. These are NOT the same as data states
 JOB_WAIT, JOB_ERROR, JOB_INPUT_ERROR, JOB_INPUT_DELETED, JOB_READY, JOB_DELETED, JOB_ADMIN_DELETED, JOB_USER_OVER_QUOTA, JOB_USER_OVER_TOTAL_WALLTIME = 'wait', 'error', 'input_error', 'input_deleted', 'ready', 'deleted', 'admin_deleted', 'user_over_quota', 'user_over_total_walltime'
 DEFAULT_JOB_PUT_FAILURE_MESSAGE = 'Unable to run job due to a misconfiguration of the Galaxy job running system.  Please contact a site administrator.'
+# Maximum number of ids bound into a single IN clause (SQLite limits the number of bound parameters)
+MAX_IN_CLAUSE_IDS = 500
 
 
 class JobHandler(object):
@@ -62,6 +67,210 @@ class JobHandler(object):
         self.job_stop_queue.shutdown()
 
 
+def pause_new_jobs(sa_session, messages):
+    """
+    Pause jobs that are still in the ``new`` state, along with their output
+    datasets, using a handful of bulk ``UPDATE ... WHERE id IN (...)``
+    statements rather than loading and flushing each job through the ORM.
+
+    :param sa_session: Session the statements are executed in.
+    :param messages:   Maps the ids of the jobs to pause to the message to set
+                       as the ``info`` of their outputs.
+    :type messages:    dict
+
+    :returns: list of ids of the jobs that were paused
+    """
+    job_table = model.Job.table
+    paused_state = model.Job.states.PAUSED
+    paused_job_ids = []
+    for chunk in chunked(sorted(messages), MAX_IN_CLAUSE_IDS):
+        rows = sa_session.execute(select([job_table.c.id, job_table.c.info])
+                                  .where(and_(job_table.c.id.in_(chunk),
+                                              job_table.c.state == model.Job.states.NEW))).fetchall()
+        if not rows:
+            continue
+        job_ids = [row[0] for row in rows]
+        sa_session.execute(job_table.update()
+                           .where(and_(job_table.c.id.in_(job_ids),
+                                       job_table.c.state == model.Job.states.NEW))
+                           .values(state=paused_state))
+        # Equivalent of the JobStateHistory created by Job.set_state()
+        sa_session.execute(model.JobStateHistory.table.insert(),
+                           [dict(job_id=job_id, state=paused_state, info=info) for job_id, info in rows])
+        for job_to_output_table, association_table, association_id_column in (
+                (model.JobToOutputDatasetAssociation.table, model.HistoryDatasetAssociation.table, 'dataset_id'),
+                (model.JobToOutputLibraryDatasetAssociation.table, model.LibraryDatasetDatasetAssociation.table, 'ldda_id')):
+            outputs = sa_session.execute(select([job_to_output_table.c.job_id, association_table.c.id, association_table.c.dataset_id])
+                                         .where(and_(job_to_output_table.c.job_id.in_(job_ids),
+                                                     job_to_output_table.c[association_id_column] == association_table.c.id))).fetchall()
+            dataset_ids = sorted(set(row[2] for row in outputs))
+            for dataset_ids_chunk in chunked(dataset_ids, MAX_IN_CLAUSE_IDS):
+                sa_session.execute(model.Dataset.table.update()
+                                   .where(model.Dataset.table.c.id.in_(dataset_ids_chunk))
+                                   .values(state=model.Dataset.states.PAUSED))
+            # Bypasses the hooks keeping history summaries current
+            history_summary.mark_stale_for_datasets(sa_session, dataset_ids)
+            association_ids_by_message = defaultdict(list)
+            for job_id, association_id, _ in outputs:
+                association_ids_by_message[messages[job_id]].append(association_id)
+            for message, association_ids in association_ids_by_message.items():
+                for association_ids_chunk in chunked(association_ids, MAX_IN_CLAUSE_IDS):
+                    sa_session.execute(association_table.update()
+                                       .where(association_table.c.id.in_(association_ids_chunk))
+                                       .values(info=message))
+        paused_job_ids.extend(job_ids)
+    return paused_job_ids
+
+
+class JobReadinessTracker(object):
+    """
+    In-memory dependency graph between the new jobs a handler is waiting on
+    and the input datasets that are not yet ready, so that each iteration of
+    the handler queue only needs to examine jobs whose inputs have changed.
+
+    This object is only modified by the handler's monitor thread.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # job id -> set of dataset ids the job is still waiting on
+        self.job_dependencies = {}
+        # dataset id -> set of job ids waiting on the dataset
+        self.dataset_dependents = {}
+        # ids of tracked jobs that are not waiting on any dataset
+        self.ready = set()
+
+    def __contains__(self, job_id):
+        return job_id in self.job_dependencies
+
+    def __len__(self):
+        return len(self.job_dependencies)
+
+    def track(self, job_id, dataset_ids):
+        """Start tracking ``job_id``, which is waiting on ``dataset_ids``."""
+        self.untrack(job_id)
+        dataset_ids = set(dataset_ids)
+        self.job_dependencies[job_id] = dataset_ids
+        for dataset_id in dataset_ids:
+            self.dataset_dependents.setdefault(dataset_id, set()).add(job_id)
+        if not dataset_ids:
+            self.ready.add(job_id)
+
+    def untrack(self, job_id):
+        for dataset_id in self.job_dependencies.pop(job_id, ()):
+            dependents = self.dataset_dependents.get(dataset_id)
+            if dependents is not None:
+                dependents.discard(job_id)
+                if not dependents:
+                    del self.dataset_dependents[dataset_id]
+        self.ready.discard(job_id)
+
+    def sync(self, job_ids):
+        """Stop tracking any job not in ``job_ids`` and return the (sorted) ids in ``job_ids`` that are not tracked yet.
+        """
+        job_ids = set(job_ids)
+        for job_id in [j for j in self.job_dependencies if j not in job_ids]:
+            self.untrack(job_id)
+        return sorted(j for j in job_ids if j not in self.job_dependencies)
+
+    def is_watched(self, dataset_id):
+        return dataset_id in self.dataset_dependents
+
+    @property
+    def watched_dataset_ids(self):
+        return list(self.dataset_dependents)
+
+    def datasets_ready(self, dataset_ids):
+        """Record that ``dataset_ids`` have reached a ready state and return the ids of jobs that became ready."""
+        became_ready = set()
+        for dataset_id in dataset_ids:
+            for job_id in self.dataset_dependents.pop(dataset_id, ()):
+                dependencies = self.job_dependencies[job_id]
+                dependencies.discard(dataset_id)
+                if not dependencies:
+                    self.ready.add(job_id)
+                    became_ready.add(job_id)
+        return became_ready
+
+    @property
+    def ready_job_ids(self):
+        return sorted(self.ready)
+
+
+class JobCounts(object):
+    """
+    Counts of the active (queued, running or resubmitted) jobs per user, per
+    user and destination, and per destination.
+
+    Rather than being rebuilt with GROUP BY queries on every iteration of the
+    handler queue, the counts are adjusted as jobs change state and are
+    periodically reset from the database. Jobs are tracked by id so that
+    repeated or out of order updates for the same job are harmless.
+    Updates may come from any thread.
+    """
+    # Jobs in these states count against a user's total concurrent job limit
+    user_states = (model.Job.states.QUEUED, model.Job.states.RUNNING, model.Job.states.RESUBMITTED)
+    # Jobs in these states count against destination limits
+    destination_states = (model.Job.states.QUEUED, model.Job.states.RUNNING)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__clear()
+
+    def __clear(self):
+        # job id -> (user id, destination id, state)
+        self.__jobs = {}
+        self.__user = defaultdict(int)
+        self.__user_destination = defaultdict(lambda: defaultdict(int))
+        self.__destination = defaultdict(int)
+
+    def __adjust(self, user_id, destination_id, state, delta):
+        if state in self.user_states and user_id is not None:
+            self.__user[user_id] += delta
+        if state in self.destination_states:
+            self.__user_destination[user_id][destination_id] += delta
+            self.__destination[destination_id] += delta
+
+    def __set(self, job_id, user_id, destination_id, state):
+        previous = self.__jobs.pop(job_id, None)
+        if previous is not None:
+            self.__adjust(*previous, delta=-1)
+        if state in self.user_states:
+            self.__jobs[job_id] = (user_id, destination_id, state)
+            self.__adjust(user_id, destination_id, state, 1)
+
+    def update(self, job_id, user_id, destination_id, state):
+        """Record that a job is now in `state`, jobs in any state other than queued, running or resubmitted are no longer
+        counted.
+        """
+        with self.__lock:
+            self.__set(job_id, user_id, destination_id, state)
+
+    def reset(self, rows):
+        """Replace all counts with `rows` of (job id, user id, destination id, state), e.g. from the database."""
+        with self.__lock:
+            self.__clear()
+            for job_id, user_id, destination_id, state in rows:
+                self.__set(job_id, user_id, destination_id, state)
+
+    def __len__(self):
+        return len(self.__jobs)
+
+    def get_user_job_count(self, user_id):
+        with self.__lock:
+            return self.__user.get(user_id, 0)
+
+    def get_user_job_count_per_destination(self, user_id):
+        with self.__lock:
+            return dict((k, v) for k, v in self.__user_destination.get(user_id, {}).items() if v)
+
+    def get_total_job_count_per_destination(self):
+        with self.__lock:
+            return dict((k, v) for k, v in self.__destination.items() if v)
+
+
 class JobHandlerQueue(Monitors):
     """
     Job Handler's Internal Queue, this is what actually implements waiting for
@@ -78,6 +287,9 @@ class JobHandlerQueue(Monitors):
         self.track_jobs_in_database = self.app.config.track_jobs_in_database
 
         # Initialize structures for handling job limits
+        self.job_counts = JobCounts()
+        self.job_count_reconcile_interval = self.app.config.job_handler_count_reconcile_interval
+        self.__last_job_count_reconcile = None
         self.__clear_job_count()
 
         # Keep track of the pid that started the job manager, only it
@@ -89,6 +301,10 @@ class JobHandlerQueue(Monitors):
         self.waiting_jobs = []
         # Contains wrappers of jobs that are limited or ready (so they aren't created unnecessarily/multiple times)
         self.job_wrappers = {}
+        # Tracks the unready inputs of new jobs (only use from monitor thread)
+        self.readiness = JobReadinessTracker()
+        self.readiness_reconcile_interval = self.app.config.job_handler_readiness_reconcile_interval
+        self.__last_readiness_reconcile = None
         name = "JobHandlerQueue.monitor_thread"
         self._init_monitor_thread(name, target=self.__monitor, config=app.config)
         self.__grab_query = None
@@ -291,35 +507,8 @@ class JobHandlerQueue(Monitors):
         if self.track_jobs_in_database:
             # Clear the session so we get fresh states for job and all datasets
             self.sa_session.expunge_all()
-            # Fetch all new jobs
-            hda_not_ready = self.sa_session.query(model.Job.id).enable_eagerloads(False) \
-                .join(model.JobToInputDatasetAssociation) \
-                .join(model.HistoryDatasetAssociation) \
-                .join(model.Dataset) \
-                .filter(and_(model.Job.state == model.Job.states.NEW,
-                             model.Dataset.state.in_(model.Dataset.non_ready_states))).subquery()
-            ldda_not_ready = self.sa_session.query(model.Job.id).enable_eagerloads(False) \
-                .join(model.JobToInputLibraryDatasetAssociation) \
-                .join(model.LibraryDatasetDatasetAssociation) \
-                .join(model.Dataset) \
-                .filter(and_(model.Job.state == model.Job.states.NEW,
-                             model.Dataset.state.in_(model.Dataset.non_ready_states))).subquery()
-            if self.app.config.user_activation_on:
-                jobs_to_check = self.sa_session.query(model.Job).enable_eagerloads(False) \
-                    .outerjoin(model.User) \
-                    .filter(and_((model.Job.state == model.Job.states.NEW),
-                                 or_((model.Job.user_id == null()), (model.User.active == true())),
-                                 (model.Job.handler == self.app.config.server_name),
-                                 ~model.Job.table.c.id.in_(hda_not_ready),
-                                 ~model.Job.table.c.id.in_(ldda_not_ready))) \
-                    .order_by(model.Job.id).all()
-            else:
-                jobs_to_check = self.sa_session.query(model.Job).enable_eagerloads(False) \
-                    .filter(and_((model.Job.state == model.Job.states.NEW),
-                                 (model.Job.handler == self.app.config.server_name),
-                                 ~model.Job.table.c.id.in_(hda_not_ready),
-                                 ~model.Job.table.c.id.in_(ldda_not_ready))) \
-                    .order_by(model.Job.id).all()
+            # Fetch all new jobs whose inputs are ready
+            jobs_to_check = self.__get_ready_new_jobs()
             # Filter jobs with invalid input states
             jobs_to_check = self.__filter_jobs_with_invalid_input_states(jobs_to_check)
             # Fetch all "resubmit" jobs
@@ -351,11 +540,12 @@ class JobHandlerQueue(Monitors):
             # Reassemble resubmit job destination from persisted value
             jw = self.__recover_job_wrapper(job)
             if jw.is_ready_for_resubmission(job):
-                self.increase_running_job_count(job.user_id, jw.job_destination.id)
+                self.increase_running_job_count(job.id, job.user_id, jw.job_destination.id)
                 self.dispatcher.put(jw)
         # Iterate over new and waiting jobs and look for any that are
         # ready to run
         new_waiting_jobs = []
+        jobs_to_pause = {}
         for job in jobs_to_check:
             try:
                 # Check the job's dependencies, requeue if they're not done.
@@ -398,12 +588,7 @@ class JobHandlerQueue(Monitors):
                     else:
                         log.info("(%d) User (%s) is over total walltime limit: job paused" % (job.id, job.user_id))
 
-                    job.set_state(model.Job.states.PAUSED)
-                    for dataset_assoc in job.output_datasets + job.output_library_datasets:
-                        dataset_assoc.dataset.dataset.state = model.Dataset.states.PAUSED
-                        dataset_assoc.dataset.info = "Execution of this dataset's job is paused because you were over your disk quota at the time it was ready to run"
-                        self.sa_session.add(dataset_assoc.dataset.dataset)
-                    self.sa_session.add(job)
+                    jobs_to_pause[job.id] = "Execution of this dataset's job is paused because you were over your disk quota at the time it was ready to run"
                 elif job_state == JOB_ERROR:
                     log.error("(%d) Error checking job readiness" % job.id)
                 else:
@@ -411,6 +596,10 @@ class JobHandlerQueue(Monitors):
                     new_waiting_jobs.append(job.id)
             except Exception:
                 log.exception("failure running job %d", job.id)
+        if jobs_to_pause:
+            # Flush pending changes (e.g. input dataset versions) before the bulk update bypasses the session
+            self.sa_session.flush()
+            pause_new_jobs(self.sa_session, jobs_to_pause)
         # Update the waiting list
         if not self.track_jobs_in_database:
             self.waiting_jobs = new_waiting_jobs
@@ -423,6 +612,73 @@ class JobHandlerQueue(Monitors):
         # Done with the session
         self.sa_session.remove()
 
+    def __get_ready_new_jobs(self):
+        """
+        Returns the new jobs assigned to this handler that have no inputs in a non-ready state.
+
+        Rather than checking the input states of every new job on every iteration, the unready inputs of each new job
+        are recorded once in the readiness tracker and only the states of those datasets are polled afterward. The
+        complete dependency graph is rebuilt from the database every `job_handler_readiness_reconcile_interval`
+        seconds.
+        """
+        now = time.time()
+        if self.__last_readiness_reconcile is None or now - self.__last_readiness_reconcile >= self.readiness_reconcile_interval:
+            log.trace('Reconciling job readiness for %d tracked job(s)', len(self.readiness))
+            self.readiness.clear()
+            self.__last_readiness_reconcile = now
+        new_job_ids = [row[0] for row in self.sa_session.query(model.Job.id).enable_eagerloads(False)
+                       .filter(and_(model.Job.state == model.Job.states.NEW,
+                                    model.Job.handler == self.app.config.server_name))]
+        untracked_job_ids = self.readiness.sync(new_job_ids)
+        if untracked_job_ids:
+            unready_inputs = self.__get_unready_inputs(untracked_job_ids)
+            for job_id in untracked_job_ids:
+                self.readiness.track(job_id, unready_inputs.get(job_id, ()))
+        watched_dataset_ids = self.readiness.watched_dataset_ids
+        for dataset_ids in chunked(watched_dataset_ids, MAX_IN_CLAUSE_IDS):
+            ready_dataset_ids = [row[0] for row in self.sa_session.query(model.Dataset.id).enable_eagerloads(False)
+                                 .filter(and_(model.Dataset.id.in_(dataset_ids),
+                                              ~model.Dataset.state.in_(model.Dataset.non_ready_states)))]
+            self.readiness.datasets_ready(ready_dataset_ids)
+        jobs = []
+        for job_ids in chunked(self.readiness.ready_job_ids, MAX_IN_CLAUSE_IDS):
+            query = self.sa_session.query(model.Job).enable_eagerloads(False)
+            if self.app.config.user_activation_on:
+                query = query.outerjoin(model.User) \
+                    .filter(or_((model.Job.user_id == null()), (model.User.active == true())))
+            jobs.extend(query.filter(and_(model.Job.id.in_(job_ids),
+                                          model.Job.state == model.Job.states.NEW,
+                                          model.Job.handler == self.app.config.server_name))
+                        .order_by(model.Job.id).all())
+        return jobs
+
+    def __get_unready_inputs(self, job_ids):
+        """
+        Returns a dictionary mapping the ids in `job_ids` to the ids of their input datasets that are in a non-ready
+        state. Jobs with no such inputs are not included.
+        """
+        unready_inputs = defaultdict(set)
+        for chunk in chunked(job_ids, MAX_IN_CLAUSE_IDS):
+            for job_to_input, input_association in [(model.JobToInputDatasetAssociation, model.HistoryDatasetAssociation),
+                                                    (model.JobToInputLibraryDatasetAssociation, model.LibraryDatasetDatasetAssociation)]:
+                q = self.sa_session.query(job_to_input.table.c.job_id, model.Dataset.id).enable_eagerloads(False) \
+                    .select_from(job_to_input) \
+                    .join(input_association) \
+                    .join(model.Dataset) \
+                    .filter(and_(job_to_input.table.c.job_id.in_(chunk),
+                                 model.Dataset.state.in_(model.Dataset.non_ready_states)))
+                for job_id, dataset_id in q:
+                    unready_inputs[job_id].add(dataset_id)
+        return unready_inputs
+
+    def notify_datasets_changed(self, dataset_ids):
+        """
+        Called (possibly from another thread) when the state of `dataset_ids` has changed, wakes the monitor thread if
+        any waiting job depends on them so that it is dispatched without waiting for the next iteration.
+        """
+        if any(self.readiness.is_watched(dataset_id) for dataset_id in dataset_ids):
+            self.sleeper.wake()
+
     def __filter_jobs_with_invalid_input_states(self, jobs):
         """
         Takes  list of jobs and filters out jobs whose input datasets are in invalid state and
@@ -468,14 +724,14 @@ class JobHandlerQueue(Monitors):
                 jobs_to_pause[job_id].append("Input dataset '%s' is in error state" % hda_name)
             elif dataset_state != model.Dataset.states.OK:
                 jobs_to_ignore[job_id].append("Input dataset '%s' is in %s state" % (hda_name, dataset_state))
-        for job_id in sorted(jobs_to_pause):
-            pause_message = ", ".join(jobs_to_pause[job_id])
-            pause_message = "%s. To resume this job fix the input dataset(s)." % pause_message
-            job, job_wrapper = self.job_pair_for_id(job_id)
+        if jobs_to_pause:
+            pause_messages = dict((job_id, "%s. To resume this job fix the input dataset(s)." % ", ".join(messages))
+                                  for job_id, messages in jobs_to_pause.items())
             try:
-                job_wrapper.pause(job=job, message=pause_message)
+                for job_id in pause_new_jobs(self.sa_session, pause_messages):
+                    log.debug("Pausing Job '%d', %s", job_id, pause_messages[job_id])
             except Exception:
-                log.exception("(%s) Caught exception while attempting to pause job.", job_id)
+                log.exception("Caught exception while attempting to pause job(s): %s", ', '.join(map(str, sorted(jobs_to_pause))))
         for job_id in sorted(jobs_to_fail):
             fail_message = ", ".join(jobs_to_fail[job_id])
             job, job_wrapper = self.job_pair_for_id(job_id)
@@ -519,7 +775,7 @@ class JobHandlerQueue(Monitors):
 
         if state == JOB_READY:
             # PASS.  increase usage by one job (if caching) so that multiple jobs aren't dispatched on this queue iteration
-            self.increase_running_job_count(job.user_id, job_destination.id)
+            self.increase_running_job_count(job.id, job.user_id, job_destination.id)
             for job_to_input_dataset_association in job.input_datasets:
                 # We record the input dataset version, now that we know the inputs are ready
                 if job_to_input_dataset_association.dataset:
@@ -629,90 +885,74 @@ class JobHandlerQueue(Monitors):
         return None
 
     def __clear_job_count(self):
-        self.user_job_count = None
-        self.user_job_count_per_destination = None
-        self.total_job_count_per_destination = None
+        # Counts of jobs dispatched by this handler in the current iteration, these are added to the counts queried
+        # from the database when not caching job counts.
+        self.user_job_count = {}
+        self.user_job_count_per_destination = {}
+        now = time.time()
+        if self.__last_job_count_reconcile is None or now - self.__last_job_count_reconcile >= self.job_count_reconcile_interval:
+            self.__reconcile_job_counts()
+            self.__last_job_count_reconcile = now
+
+    def __reconcile_job_counts(self):
+        """Reset the incrementally maintained job counts from the database."""
+        result = self.sa_session.execute(select([model.Job.table.c.id,
+                                                 model.Job.table.c.user_id,
+                                                 model.Job.table.c.destination_id,
+                                                 model.Job.table.c.state])
+                                         .where(model.Job.table.c.state.in_(JobCounts.user_states)))
+        self.job_counts.reset(result)
+        log.trace('Reconciled job counts, %d active job(s)', len(self.job_counts))
+
+    def notify_job_state_changed(self, job):
+        """
+        Called (possibly from another thread) when the state of `job` has changed so the job counts used to enforce
+        concurrency limits stay current between reconciliations.
+        """
+        self.job_counts.update(job.id, job.user_id, job.destination_id, job.state)
 
     def get_user_job_count(self, user_id):
-        self.__cache_user_job_count()
+        if self.app.config.cache_user_job_count:
+            return self.job_counts.get_user_job_count(user_id)
         # This could have been incremented by a previous job dispatched on this iteration, even if we're not caching
         rval = self.user_job_count.get(user_id, 0)
-        if not self.app.config.cache_user_job_count:
-            result = self.sa_session.execute(select([func.count(model.Job.table.c.id)])
-                                             .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED,
-                                                         model.Job.states.RUNNING,
-                                                         model.Job.states.RESUBMITTED)),
-                                                         (model.Job.table.c.user_id == user_id))))
-            for row in result:
-                # there should only be one row
-                rval += row[0]
+        result = self.sa_session.execute(select([func.count(model.Job.table.c.id)])
+                                         .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED,
+                                                     model.Job.states.RUNNING,
+                                                     model.Job.states.RESUBMITTED)),
+                                                     (model.Job.table.c.user_id == user_id))))
+        for row in result:
+            # there should only be one row
+            rval += row[0]
         return rval
 
-    def __cache_user_job_count(self):
-        # Cache the job count if necessary
-        if self.user_job_count is None and self.app.config.cache_user_job_count:
-            self.user_job_count = {}
-            query = self.sa_session.execute(select([model.Job.table.c.user_id, func.count(model.Job.table.c.user_id)])
-                                            .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED,
-                                                                                     model.Job.states.RUNNING,
-                                                                                     model.Job.states.RESUBMITTED)),
-                                                        (model.Job.table.c.user_id != null())))
-                                            .group_by(model.Job.table.c.user_id))
-            for row in query:
-                self.user_job_count[row[0]] = row[1]
-        elif self.user_job_count is None:
-            self.user_job_count = {}
-
     def get_user_job_count_per_destination(self, user_id):
-        self.__cache_user_job_count_per_destination()
-        cached = self.user_job_count_per_destination.get(user_id, {})
         if self.app.config.cache_user_job_count:
-            rval = cached
-        else:
-            # The cached count is still used even when we're not caching, it is
-            # incremented when a job is run by this handler to ensure that
-            # multiple jobs can't get past the limits in one iteration of the
-            # queue.
-            rval = {}
-            rval.update(cached)
-            result = self.sa_session.execute(select([model.Job.table.c.destination_id, func.count(model.Job.table.c.destination_id).label('job_count')])
-                                             .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING)), (model.Job.table.c.user_id == user_id)))
-                                             .group_by(model.Job.table.c.destination_id))
-            for row in result:
-                # Add the count from the database to the cached count
-                rval[row['destination_id']] = rval.get(row['destination_id'], 0) + row['job_count']
+            return self.job_counts.get_user_job_count_per_destination(user_id)
+        # The count of jobs dispatched on this iteration is still used even
+        # when we're not caching, to ensure that multiple jobs can't get past
+        # the limits in one iteration of the queue.
+        rval = {}
+        rval.update(self.user_job_count_per_destination.get(user_id, {}))
+        result = self.sa_session.execute(select([model.Job.table.c.destination_id, func.count(model.Job.table.c.destination_id).label('job_count')])
+                                         .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING)), (model.Job.table.c.user_id == user_id)))
+                                         .group_by(model.Job.table.c.destination_id))
+        for row in result:
+            # Add the count from the database to the dispatched count
+            rval[row['destination_id']] = rval.get(row['destination_id'], 0) + row['job_count']
         return rval
 
-    def __cache_user_job_count_per_destination(self):
-        # Cache the job count if necessary
-        if self.user_job_count_per_destination is None and self.app.config.cache_user_job_count:
-            self.user_job_count_per_destination = {}
-            result = self.sa_session.execute(select([model.Job.table.c.user_id, model.Job.table.c.destination_id, func.count(model.Job.table.c.user_id).label('job_count')])
-                                             .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING))))
-                                             .group_by(model.Job.table.c.user_id, model.Job.table.c.destination_id))
-            for row in result:
-                if row['user_id'] not in self.user_job_count_per_destination:
-                    self.user_job_count_per_destination[row['user_id']] = {}
-                self.user_job_count_per_destination[row['user_id']][row['destination_id']] = row['job_count']
-        elif self.user_job_count_per_destination is None:
-            self.user_job_count_per_destination = {}
-
-    def increase_running_job_count(self, user_id, destination_id):
-        if self.app.job_config.limits.registered_user_concurrent_jobs or \
-           self.app.job_config.limits.anonymous_user_concurrent_jobs or \
-           self.app.job_config.limits.destination_user_concurrent_jobs:
-            if self.user_job_count is None:
-                self.user_job_count = {}
-            if self.user_job_count_per_destination is None:
-                self.user_job_count_per_destination = {}
+    def increase_running_job_count(self, job_id, user_id, destination_id):
+        # Dispatched jobs are counted as queued until the runner reports otherwise
+        self.job_counts.update(job_id, user_id, destination_id, model.Job.states.QUEUED)
+        if not self.app.config.cache_user_job_count and (
+                self.app.job_config.limits.registered_user_concurrent_jobs or
+                self.app.job_config.limits.anonymous_user_concurrent_jobs or
+                self.app.job_config.limits.destination_user_concurrent_jobs):
             self.user_job_count[user_id] = self.user_job_count.get(user_id, 0) + 1
             if user_id not in self.user_job_count_per_destination:
                 self.user_job_count_per_destination[user_id] = {}
             self.user_job_count_per_destination[user_id][destination_id] = self.user_job_count_per_destination[user_id].get(destination_id, 0) + 1
-        if self.app.job_config.limits.destination_total_concurrent_jobs:
-            if self.total_job_count_per_destination is None:
-                self.total_job_count_per_destination = {}
-            self.total_job_count_per_destination[destination_id] = self.total_job_count_per_destination.get(destination_id, 0) + 1
 
     def __check_user_jobs(self, job, job_wrapper):
         # TODO: Update output datasets' _state = LIMITED or some such new
@@ -758,22 +998,12 @@ class JobHandlerQueue(Monitors):
             log.warning('Job %s is not associated with a user or session so job concurrency limit cannot be checked.' % job.id)
         return JOB_READY
 
-    def __cache_total_job_count_per_destination(self):
-        # Cache the job count if necessary
-        if self.total_job_count_per_destination is None:
-            self.total_job_count_per_destination = {}
-            result = self.sa_session.execute(select([model.Job.table.c.destination_id, func.count(model.Job.table.c.destination_id).label('job_count')])
-                                             .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING))))
-                                             .group_by(model.Job.table.c.destination_id))
-            for row in result:
-                self.total_job_count_per_destination[row['destination_id']] = row['job_count']
-
     def get_total_job_count_per_destination(self):
-        self.__cache_total_job_count_per_destination()
-        # Always use caching (at worst a job will have to wait one iteration,
-        # and this would be more fair anyway as it ensures FIFO scheduling,
-        # insofar as FIFO would be fair...)
-        return self.total_job_count_per_destination
+        # Always use the incrementally maintained counts (at worst a job will
+        # have to wait until the next reconciliation, and this would be more
+        # fair anyway as it ensures FIFO scheduling, insofar as FIFO would be
+        # fair...)
+        return self.job_counts.get_total_job_count_per_destination()
 
     def __check_destination_jobs(self, job, job_wrapper):
         if self.app.job_config.limits.destination_total_concurrent_jobs:
@@ -922,6 +1152,7 @@ class JobHandlerStopQueue(Monitors):
             job.set_final_state(final_state)
             self.sa_session.add(job)
             self.sa_session.flush()
+            self.app.job_manager.notify_job_state_changed(job)
             if job.job_runner_name is not None:
                 # tell the dispatcher to stop the job
                 job_wrapper = JobWrapper(job, self, use_persisted_destination=True)
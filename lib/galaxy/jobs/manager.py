@@ -92,6 +92,22 @@ class JobManager(object):
         """
         self.job_handler.job_stop_queue.put(job.id, error_msg=message)
 
+    def notify_datasets_changed(self, dataset_ids):
+        """Notify this process's job handler (if any) that the states of the datasets with the given ids have changed.
+
+        :param dataset_ids: ids of the :class:`galaxy.model.Dataset` objects whose state changed.
+        :type dataset_ids:  list of int
+        """
+        self.job_handler.job_queue.notify_datasets_changed(dataset_ids)
+
+    def notify_job_state_changed(self, job):
+        """Notify this process's job handler (if any) that the state of a job has changed.
+
+        :param job: Job whose state changed.
+        :type job:  Instance of :class:`galaxy.model.Job`.
+        """
+        self.job_handler.job_queue.notify_job_state_changed(job)
+
     def shutdown(self):
         self.job_handler.shutdown()
 
@@ -109,6 +125,12 @@ class NoopManager(object):
     def stop(self, *args, **kwargs):
         pass
 
+    def notify_datasets_changed(self, *args, **kwargs):
+        pass
+
+    def notify_job_state_changed(self, *args, **kwargs):
+        pass
+
 
 class NoopHandler(object):
     """
@@ -45,6 +45,8 @@ from .state_handler_factory import build_state_handlers
 log = get_logger(__name__)
 
 STOP_SIGNAL = object()
+# Seconds between checks of a running job's limits (e.g. walltime)
+LIMIT_CHECK_INTERVAL = 20
 
 
 JOB_RUNNER_PARAMETER_UNKNOWN_MESSAGE = "Invalid job runner parameter for this plugin: %s"
@@ -607,6 +609,12 @@ class AsynchronousJobState(JobState):
         self._running = False
         self.check_count = 0
         self.start_time = None
+        # When the monitor thread should next check this job (``None`` means
+        # on its next pass) and the current interval between checks.
+        self.next_check = None
+        self.check_interval = None
+        self._last_limit_check = None
+        self._last_checked_state = None
 
         # job_id is the DRM's job id, not the Galaxy job id
         self.job_id = job_id
@@ -630,14 +638,41 @@ class AsynchronousJobState(JobState):
         if self.start_time is None:
             self.start_time = datetime.datetime.now()
 
+    def check_due(self, now):
+        return self.next_check is None or self.next_check <= now
+
+    def schedule_next_check(self, min_interval, max_interval, backoff, now=None):
+        """
+        Schedule the next check of this job. The interval is reset to
+        ``min_interval`` whenever the job's state changed since the previous
+        check and grows by ``backoff`` (up to ``max_interval``) otherwise, so
+        new and short jobs are checked often while long running jobs are
+        checked less and less.
+        """
+        if now is None:
+            now = time.time()
+        checked_state = (self.old_state, self.running)
+        if self.check_interval is None or checked_state != self._last_checked_state:
+            self.check_interval = min_interval
+        else:
+            self.check_interval = min(max_interval, self.check_interval * backoff)
+        self._last_checked_state = checked_state
+        self.next_check = now + self.check_interval
+
     def check_limits(self, runtime=None):
         limit_state = None
         if self.job_wrapper.has_limits():
             self.check_count += 1
-            if self.running and (self.check_count % 20 == 0):
+            now = time.time()
+            if self._last_limit_check is None:
+                self._last_limit_check = now
+            # Checks are not done at a fixed rate, so check the limits by time
+            # rather than every nth check.
+            if self.running and now - self._last_limit_check >= LIMIT_CHECK_INTERVAL:
                 if runtime is None:
                     runtime = datetime.datetime.now() - (self.start_time or datetime.datetime.now())
                 self.check_count = 0
+                self._last_limit_check = now
                 limit_state = self.job_wrapper.check_limits(runtime=runtime)
         if limit_state is not None:
             # Set up the job for failure, but the runner will do the actual work
@@ -657,6 +692,12 @@ class AsynchronousJobRunner(BaseJobRunner, Monitors):
     thread to monitor the state of asynchronous jobs and submitting those jobs
     to the correct methods (queue, finish, cleanup) at appropriate times..
     """
+    DEFAULT_SPECS = dict(
+        BaseJobRunner.DEFAULT_SPECS,
+        monitor_min_interval=dict(map=float, valid=lambda x: float(x) > 0, default=1.0),
+        monitor_max_interval=dict(map=float, valid=lambda x: float(x) > 0, default=30.0),
+        monitor_backoff=dict(map=float, valid=lambda x: float(x) >= 1, default=1.5),
+    )
 
     def __init__(self, app, nworkers, **kwargs):
         super(AsynchronousJobRunner, self).__init__(app, nworkers, **kwargs)
@@ -693,16 +734,47 @@ class AsynchronousJobRunner(BaseJobRunner, Monitors):
                     self.watched.append(async_job_state)
             except Empty:
                 pass
-            # Iterate over the list of watched jobs and check state
-            try:
-                self.check_watched_items()
-            except Exception:
-                log.exception('Unhandled exception checking active jobs')
-            # Sleep a bit before the next state check
-            time.sleep(1)
+            # Only hand the jobs that are due to check_watched_items, the
+            # others stay in self.watched untouched.
+            now = time.time()
+            due = [ajs for ajs in self.watched if ajs.check_due(now)]
+            if due:
+                # Iterate over the list of due jobs and check state
+                try:
+                    still_watched = self.check_watched_items(due)
+                except Exception:
+                    log.exception('Unhandled exception checking active jobs')
+                    still_watched = due
+                self._schedule_watched_items(still_watched)
+                checked = set(due)
+                self.watched = [ajs for ajs in self.watched if ajs not in checked] + still_watched
+            # Sleep until the next job is due, new jobs wake the monitor up
+            self._monitor_sleep(self._monitor_sleep_interval())
+
+    def _schedule_watched_items(self, watched):
+        now = time.time()
+        for async_job_state in watched:
+            async_job_state.schedule_next_check(
+                self.runner_params['monitor_min_interval'],
+                self.runner_params['monitor_max_interval'],
+                self.runner_params['monitor_backoff'],
+                now=now,
+            )
+
+    def _monitor_sleep_interval(self):
+        if not self.monitor_queue.empty():
+            return 0
+        sleep_interval = self.runner_params['monitor_max_interval']
+        if self.watched:
+            next_check = min(ajs.next_check for ajs in self.watched)
+            sleep_interval = min(sleep_interval, next_check - time.time())
+        return max(sleep_interval, 0)
 
     def monitor_job(self, job_state):
         self.monitor_queue.put(job_state)
+        sleeper = getattr(self, 'sleeper', None)
+        if sleeper is not None:
+            sleeper.wake()
 
     def shutdown(self):
         """Attempts to gracefully shut down the monitor thread"""
@@ -712,20 +784,22 @@ class AsynchronousJobRunner(BaseJobRunner, Monitors):
         self.shutdown_monitor()
         super(AsynchronousJobRunner, self).shutdown()
 
-    def check_watched_items(self):
+    def check_watched_items(self, watched):
         """
-        This method is responsible for iterating over self.watched and handling
-        state changes and updating self.watched with a new list of watched job
-        states. Subclasses can opt to override this directly (as older job runners will
-        initially) or just override check_watched_item and allow the list processing to
-        reuse the logic here.
+        This method is responsible for iterating over ``watched``, the job
+        states in self.watched that are due for a check, and handling state
+        changes. It returns the list of those job states to keep watching, the
+        monitor thread updates self.watched with it. Subclasses can opt to
+        override this directly (as older job runners will initially) or just
+        override check_watched_item and allow the list processing to reuse the
+        logic here.
         """
         new_watched = []
-        for async_job_state in self.watched:
+        for async_job_state in watched:
             new_async_job_state = self.check_watched_item(async_job_state)
             if new_async_job_state:
                 new_watched.append(new_async_job_state)
-        self.watched = new_watched
+        return new_watched
 
     # Subclasses should implement this unless they override check_watched_items all together.
     def check_watched_item(self, job_state):
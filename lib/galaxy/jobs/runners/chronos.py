@@ -142,7 +142,7 @@ class ChronosJobRunner(AsynchronousJobRunner):
                                    job_wrapper=job_wrapper,
                                    job_id=job_name,
                                    job_destination=job_destination)
-        self.monitor_queue.put(ajs)
+        self.monitor_job(ajs)
 
     @handle_exception_call
     def stop_job(self, job_wrapper):
@@ -173,14 +173,14 @@ class ChronosJobRunner(AsynchronousJobRunner):
                 state='running'))
             ajs.old_state = model.Job.states.RUNNING
             ajs.running = True
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
         elif job.state == model.Job.states.QUEUED:
             LOGGER.debug(msg.format(
                 name=job.id, runner=job.job_runner_external_id,
                 state='queued'))
             ajs.old_state = model.Job.states.QUEUED
             ajs.running = False
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
     @handle_exception_call
     def check_watched_item(self, job_state):
@@ -119,7 +119,7 @@ class ShellJobRunner(AsynchronousJobRunner):
         ajs.job_destination = job_destination
 
         # Add to our 'queue' of jobs to monitor
-        self.monitor_queue.put(ajs)
+        self.monitor_job(ajs)
 
     def submit(self, shell, job_interface, job_file, galaxy_id_tag, retry=MAX_SUBMIT_RETRY, timeout=10):
         """
@@ -143,16 +143,16 @@ class ShellJobRunner(AsynchronousJobRunner):
             log.error(stderr)
             return cmd_out.returncode, cmd_out.stdout
 
-    def check_watched_items(self):
+    def check_watched_items(self, watched):
         """
         Called by the monitor thread to look at each watched job and deal
         with state changes.
         """
         new_watched = []
 
-        job_states = self.__get_job_states()
+        job_states = self.__get_job_states(watched)
 
-        for ajs in self.watched:
+        for ajs in watched:
             external_job_id = ajs.job_id
             id_tag = ajs.job_wrapper.get_id_tag()
             old_state = ajs.old_state
@@ -191,8 +191,7 @@ class ShellJobRunner(AsynchronousJobRunner):
                 self.work_queue.put((self.finish_job, ajs))
             else:
                 new_watched.append(ajs)
-        # Replace the watch list with the updated version
-        self.watched = new_watched
+        return new_watched
 
     def __handle_out_of_memory(self, ajs, external_job_id):
         shell_params, job_params = self.parse_destination_params(ajs.job_destination.params)
@@ -204,11 +203,11 @@ class ShellJobRunner(AsynchronousJobRunner):
                 ajs.runner_state = JobState.runner_states.MEMORY_LIMIT_REACHED
                 ajs.fail_message = "Tool failed due to insufficient memory. Try with more memory."
 
-    def __get_job_states(self):
+    def __get_job_states(self, watched):
         job_destinations = {}
         job_states = {}
         # unique the list of destinations
-        for ajs in self.watched:
+        for ajs in watched:
             if ajs.job_destination.id not in job_destinations:
                 job_destinations[ajs.job_destination.id] = dict(job_destination=ajs.job_destination, job_ids=[ajs.job_id])
             else:
@@ -251,9 +250,9 @@ class ShellJobRunner(AsynchronousJobRunner):
             log.debug("(%s/%s) is still in running state, adding to the runner monitor queue" % (job.id, job.job_runner_external_id))
             ajs.old_state = model.Job.states.RUNNING
             ajs.running = True
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
         elif job.state == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in queued state, adding to the runner monitor queue" % (job.id, job.job_runner_external_id))
             ajs.old_state = model.Job.states.QUEUED
             ajs.running = False
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
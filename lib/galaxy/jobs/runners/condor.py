@@ -164,15 +164,15 @@ class CondorJobRunner(AsynchronousJobRunner):
         cjs.job_destination = job_destination
 
         # Add to our 'queue' of jobs to monitor
-        self.monitor_queue.put(cjs)
+        self.monitor_job(cjs)
 
-    def check_watched_items(self):
+    def check_watched_items(self, watched):
         """
         Called by the monitor thread to look at each watched job and deal
         with state changes.
         """
         new_watched = []
-        for cjs in self.watched:
+        for cjs in watched:
             job_id = cjs.job_id
             galaxy_id_tag = cjs.job_wrapper.get_id_tag()
             try:
@@ -218,8 +218,7 @@ class CondorJobRunner(AsynchronousJobRunner):
                 continue
             cjs.runnning = job_running
             new_watched.append(cjs)
-        # Replace the watch list with the updated version
-        self.watched = new_watched
+        return new_watched
 
     def stop_job(self, job_wrapper):
         """Attempts to delete a job from the DRM queue"""
@@ -279,11 +278,11 @@ class CondorJobRunner(AsynchronousJobRunner):
         if job.state == model.Job.states.RUNNING:
             log.debug("(%s/%s) is still in running state, adding to the DRM queue" % (job.id, job.job_runner_external_id))
             cjs.running = True
-            self.monitor_queue.put(cjs)
+            self.monitor_job(cjs)
         elif job.state == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in DRM queued state, adding to the DRM queue" % (job.id, job.job_runner_external_id))
             cjs.running = False
-            self.monitor_queue.put(cjs)
+            self.monitor_job(cjs)
 
     def _stop_container(self, job_wrapper):
         return self._run_container_command(job_wrapper, 'stop')
@@ -18,7 +18,10 @@ from galaxy.jobs.runners import (
     AsynchronousJobRunner,
     AsynchronousJobState
 )
-from galaxy.util import asbool
+from galaxy.util import (
+    asbool,
+    unicodify
+)
 
 drmaa = None
 
@@ -28,6 +31,38 @@ __all__ = ('DRMAAJobRunner',)
 
 RETRY_EXCEPTIONS_LOWER = frozenset(['invalidjobexception', 'internalexception'])
 
+# Native states reported by the drmaa_bulk_status_command, mapped to the name
+# of the corresponding drmaa.JobState. Slurm states are squeue's compact codes
+# (``squeue -h -o '%i %t'``), SGE/Univa states those of ``qstat``. Terminal
+# states are deliberately missing: such jobs are checked with DRMAA (as are
+# jobs not in the output at all) so finished jobs keep being handled as before.
+BULK_STATUS_STATES = {
+    # Slurm
+    'PD': 'QUEUED_ACTIVE',
+    'CF': 'QUEUED_ACTIVE',
+    'RQ': 'QUEUED_ACTIVE',
+    'RF': 'QUEUED_ACTIVE',
+    'RH': 'SYSTEM_ON_HOLD',
+    'RD': 'SYSTEM_ON_HOLD',
+    'R': 'RUNNING',
+    'CG': 'RUNNING',
+    'SI': 'RUNNING',
+    'SO': 'RUNNING',
+    'S': 'SYSTEM_SUSPENDED',
+    'ST': 'USER_SUSPENDED',
+    # SGE/Univa
+    'qw': 'QUEUED_ACTIVE',
+    'hqw': 'USER_ON_HOLD',
+    'hRwq': 'USER_ON_HOLD',
+    'r': 'RUNNING',
+    't': 'RUNNING',
+    'Rr': 'RUNNING',
+    'Rt': 'RUNNING',
+    's': 'USER_SUSPENDED',
+    'ts': 'USER_SUSPENDED',
+    'tS': 'SYSTEM_SUSPENDED',
+}
+
 
 class DRMAAJobRunner(AsynchronousJobRunner):
     """
@@ -41,7 +76,8 @@ class DRMAAJobRunner(AsynchronousJobRunner):
         global drmaa
 
         runner_param_specs = {
-            'drmaa_library_path': dict(map=str, default=os.environ.get('DRMAA_LIBRARY_PATH', None))}
+            'drmaa_library_path': dict(map=str, default=os.environ.get('DRMAA_LIBRARY_PATH', None)),
+            'drmaa_bulk_status_command': dict(map=str, default=None)}
         for retry_exception in RETRY_EXCEPTIONS_LOWER:
             runner_param_specs[retry_exception + '_state'] = dict(map=str, valid=lambda x: x in (model.Job.states.OK, model.Job.states.ERROR), default=model.Job.states.OK)
             runner_param_specs[retry_exception + '_retries'] = dict(map=int, valid=lambda x: int(x) >= 0, default=0)
@@ -92,6 +128,9 @@ class DRMAAJobRunner(AsynchronousJobRunner):
         self.ds = DrmaaSessionFactory().get()
 
         self.userid = None
+        # States of the watched jobs fetched with the bulk status command for
+        # the current monitor cycle
+        self._bulk_job_states = {}
 
         self._init_monitor_thread()
         self._init_worker_threads()
@@ -227,7 +266,7 @@ class DRMAAJobRunner(AsynchronousJobRunner):
         ajs.job_destination = job_destination
 
         # Add to our 'queue' of jobs to monitor
-        self.monitor_queue.put(ajs)
+        self.monitor_job(ajs)
 
     def _complete_terminal_job(self, ajs, drmaa_state, **kwargs):
         """
@@ -273,7 +312,9 @@ class DRMAAJobRunner(AsynchronousJobRunner):
         state = None
         try:
             assert external_job_id not in (None, 'None'), '(%s/%s) Invalid job id' % (galaxy_id_tag, external_job_id)
-            state = self.ds.job_status(external_job_id)
+            state = self._bulk_job_states.get(external_job_id)
+            if state is None:
+                state = self.ds.job_status(external_job_id)
             # Reset exception retries
             for retry_exception in RETRY_EXCEPTIONS_LOWER:
                 setattr(ajs, retry_exception + '_retries', 0)
@@ -311,13 +352,14 @@ class DRMAAJobRunner(AsynchronousJobRunner):
             return None
         return state
 
-    def check_watched_items(self):
+    def check_watched_items(self, watched):
         """
         Called by the monitor thread to look at each watched job and deal
         with state changes.
         """
         new_watched = []
-        for ajs in self.watched:
+        self._bulk_job_states = self._get_bulk_job_states()
+        for ajs in watched:
             external_job_id = ajs.job_id
             galaxy_id_tag = ajs.job_wrapper.get_id_tag()
             old_state = ajs.old_state
@@ -343,8 +385,32 @@ class DRMAAJobRunner(AsynchronousJobRunner):
                 continue
             ajs.old_state = state
             new_watched.append(ajs)
-        # Replace the watch list with the updated version
-        self.watched = new_watched
+        self._bulk_job_states = {}
+        return new_watched
+
+    def _get_bulk_job_states(self):
+        """
+        Get the states of all jobs known to the DRM with a single call of the
+        drmaa_bulk_status_command (if configured) rather than asking DRMAA
+        about each watched job. The command must print one line per job
+        containing the job's id and its state (see BULK_STATUS_STATES).
+        Returns a dict mapping external job ids to DRMAA job states, any job
+        missing from it is checked with DRMAA.
+        """
+        bulk_status_command = self.runner_params['drmaa_bulk_status_command']
+        if not bulk_status_command or not self.watched:
+            return {}
+        command = shlex.split(bulk_status_command)
+        try:
+            p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdoutdata, stderrdata = p.communicate()
+        except Exception:
+            log.exception("Running bulk status command %s failed", command)
+            return {}
+        if p.returncode != 0:
+            log.warning("Bulk status command %s failed (exit code %s), checking jobs one at a time: %s", command, p.returncode, unicodify(stderrdata).strip())
+            return {}
+        return parse_bulk_job_states(unicodify(stdoutdata), self.drmaa_job_states)
 
     def stop_job(self, job_wrapper):
         """Attempts to delete a job from the DRM queue"""
@@ -380,12 +446,12 @@ class DRMAAJobRunner(AsynchronousJobRunner):
             log.debug("(%s/%s) is still in running state, adding to the DRM queue" % (job.id, job.get_job_runner_external_id()))
             ajs.old_state = drmaa.JobState.RUNNING
             ajs.running = True
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
         elif job.get_state() == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in DRM queued state, adding to the DRM queue" % (job.id, job.get_job_runner_external_id()))
             ajs.old_state = drmaa.JobState.QUEUED_ACTIVE
             ajs.running = False
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
     def store_jobtemplate(self, job_wrapper, jt):
         """ Stores the content of a DRMAA JobTemplate object in a file as a JSON string.
@@ -436,3 +502,20 @@ class DRMAAJobRunner(AsynchronousJobRunner):
         if self.restrict_job_name_length:
             job_name = job_name[:self.restrict_job_name_length]
         return job_name
+
+
+def parse_bulk_job_states(output, job_states):
+    """
+    Parse the output of a bulk status command into a dict mapping job ids to
+    states of ``job_states`` (``drmaa.JobState``). Header lines and jobs in
+    states without a mapping in BULK_STATUS_STATES are skipped.
+    """
+    states = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        state_name = BULK_STATUS_STATES.get(fields[1])
+        if state_name is not None:
+            states[fields[0]] = getattr(job_states, state_name)
+    return states
@@ -160,7 +160,7 @@ class GodockerJobRunner(AsynchronousJobRunner):
             log.debug("Starting queue_job for job " + job_id)
             # Create an object of AsynchronousJobState and add it to the monitor queue.
             ajs = AsynchronousJobState(files_dir=job_wrapper.working_directory, job_wrapper=job_wrapper, job_id=job_id, job_destination=job_destination)
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
     def check_watched_item(self, job_state):
         """ Get the job current status from GoDocker
@@ -256,13 +256,13 @@ class GodockerJobRunner(AsynchronousJobRunner):
             log.debug("(%s/%s) is still in running state, adding to the god queue" % (job.id, job.get_job_runner_external_id()))
             ajs.old_state = 'R'
             ajs.running = True
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
         elif job.state == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in god queued state, adding to the god queue" % (job.id, job.get_job_runner_external_id()))
             ajs.old_state = 'Q'
             ajs.running = False
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
     # Helper functions
 
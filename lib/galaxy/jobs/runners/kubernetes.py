@@ -152,7 +152,7 @@ class KubernetesJobRunner(AsynchronousJobRunner):
         ajs.job_id = k8s_job_name
         # store runner information for tracking if Galaxy restarts
         job_wrapper.set_job_destination(job_wrapper.job_destination, k8s_job_name)
-        self.monitor_queue.put(ajs)
+        self.monitor_job(ajs)
 
     def __get_pull_policy(self):
         return pull_policy(self.runner_params)
@@ -566,13 +566,13 @@ class KubernetesJobRunner(AsynchronousJobRunner):
                 job.id, job.job_runner_external_id))
             ajs.old_state = model.Job.states.RUNNING
             ajs.running = True
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
         elif job.state == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in queued state, adding to the runner monitor queue" % (
                 job.id, job.job_runner_external_id))
             ajs.old_state = model.Job.states.QUEUED
             ajs.running = False
-            self.monitor_queue.put(ajs)
+            self.monitor_job(ajs)
 
     def finish_job(self, job_state):
         super(KubernetesJobRunner, self).finish_job(job_state)
@@ -342,17 +342,17 @@ class PBSJobRunner(AsynchronousJobRunner):
         job_state.job_destination = job_destination
 
         # Add to our 'queue' of jobs to monitor
-        self.monitor_queue.put(job_state)
+        self.monitor_job(job_state)
 
-    def check_watched_items(self):
+    def check_watched_items(self, watched):
         """
         Called by the monitor thread to look at each watched job and deal
         with state changes.
         """
         new_watched = []
         # reduce pbs load by batching status queries
-        (failures, statuses) = self.check_all_jobs()
-        for pbs_job_state in self.watched:
+        (failures, statuses) = self.check_all_jobs(watched)
+        for pbs_job_state in watched:
             job_id = pbs_job_state.job_id
             galaxy_job_id = pbs_job_state.job_wrapper.get_id_tag()
             old_state = pbs_job_state.old_state
@@ -414,10 +414,9 @@ class PBSJobRunner(AsynchronousJobRunner):
                 continue
             pbs_job_state.old_state = status.job_state
             new_watched.append(pbs_job_state)
-        # Replace the watch list with the updated version
-        self.watched = new_watched
+        return new_watched
 
-    def check_all_jobs(self):
+    def check_all_jobs(self, watched):
         """
         Returns a list of servers that failed to be contacted and a dict
         of "job_id : status" pairs (where status is a bunchified version
@@ -426,7 +425,7 @@ class PBSJobRunner(AsynchronousJobRunner):
         servers = []
         failures = []
         statuses = {}
-        for pbs_job_state in self.watched:
+        for pbs_job_state in watched:
             pbs_server_name = self.__get_pbs_server(pbs_job_state.job_destination.params)
             if pbs_server_name not in servers:
                 servers.append(pbs_server_name)
@@ -551,9 +550,9 @@ class PBSJobRunner(AsynchronousJobRunner):
             log.debug("(%s/%s) is still in running state, adding to the PBS queue" % (job.id, job.get_job_runner_external_id()))
             pbs_job_state.old_state = 'R'
             pbs_job_state.running = True
-            self.monitor_queue.put(pbs_job_state)
+            self.monitor_job(pbs_job_state)
         elif job.state == model.Job.states.QUEUED:
             log.debug("(%s/%s) is still in PBS queued state, adding to the PBS queue" % (job.id, job.get_job_runner_external_id()))
             pbs_job_state.old_state = 'Q'
             pbs_job_state.running = False
-            self.monitor_queue.put(pbs_job_state)
+            self.monitor_job(pbs_job_state)
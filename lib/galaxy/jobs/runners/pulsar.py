@@ -663,7 +663,7 @@ class PulsarJobRunner(AsynchronousJobRunner):
             log.debug("(Pulsar/%s) is still in running state, adding to the Pulsar queue" % (job.id))
             job_state.old_state = True
             job_state.running = state == model.Job.states.RUNNING
-            self.monitor_queue.put(job_state)
+            self.monitor_job(job_state)
 
     def shutdown(self):
         super(PulsarJobRunner, self).shutdown()
@@ -1,4 +1,6 @@
 import logging
+import socket
+import threading
 import time
 
 import paramiko
@@ -14,7 +16,7 @@ from .local import LocalShell
 log = logging.getLogger(__name__)
 logging.getLogger("paramiko").setLevel(logging.WARNING)  # paramiko logging is very verbose
 
-__all__ = ('RemoteShell', 'SecureShell', 'GlobusSecureShell', 'ParamikoShell')
+__all__ = ('RemoteShell', 'SecureShell', 'GlobusSecureShell', 'ParamikoShell', 'PooledParamikoShell')
 
 
 class RemoteShell(LocalShell):
@@ -97,6 +99,144 @@ class ParamikoShell(object):
         return self.ssh.exec_command(smart_str(cmd), timeout=timeout)
 
 
+class PooledParamikoShell(object):
+    """
+    Like ParamikoShell, but keeps a pool of up to ``pool_size`` SSH
+    connections and runs commands concurrently, multiplexing up to
+    ``max_channels`` of them on each connection as separate SSH channels.
+    Connections are opened when first needed and reopened if they fail, so
+    only the first command(s) pay for the SSH handshake.
+    """
+
+    def __init__(self, username, hostname, password=None, private_key=None, port=22, timeout=60, pool_size=4, max_channels=8, **kwargs):
+        self.username = username
+        self.hostname = hostname
+        self.password = password
+        self.private_key = private_key
+        self.port = int(port) if port else port
+        self.timeout = int(timeout) if timeout else timeout
+        self.pool_size = int(pool_size)
+        self.max_channels = int(max_channels)
+        self.retry_action_executor = RetryActionExecutor(max_retries=100, interval_max=300)
+        # One slot per connection: the paramiko client (None until connected)
+        # and the number of commands running on it.
+        self._connections = [Bunch(ssh=None, active=0) for _ in range(self.pool_size)]
+        self._condition = threading.Condition()
+        self._counters = dict(commands=0, connects=0, failures=0, waits=0)
+
+    def _connect(self):
+        log.info("Attempting establishment of new paramiko SSH connection to %s", self.hostname)
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(hostname=self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    key_filename=self.private_key,
+                    timeout=self.timeout)
+        return ssh
+
+    def _acquire(self):
+        """Pick the least busy connection with a free channel, waiting for one if needed."""
+        with self._condition:
+            while True:
+                available = [c for c in self._connections if c.active < self.max_channels]
+                if available:
+                    # Prefer already open connections to opening a new one
+                    connection = min(available, key=lambda c: (c.ssh is None, c.active))
+                    connection.active += 1
+                    return connection
+                self._counters['waits'] += 1
+                self._condition.wait()
+
+    def _release(self, connection):
+        with self._condition:
+            connection.active -= 1
+            self._condition.notify()
+
+    def _client(self, connection):
+        with self._condition:
+            ssh = connection.ssh
+            if ssh is not None:
+                transport = ssh.get_transport()
+                if transport is not None and transport.is_active():
+                    return ssh
+                connection.ssh = None
+        ssh = self._connect()
+        with self._condition:
+            self._counters['connects'] += 1
+            if connection.ssh is None:
+                connection.ssh = ssh
+                return ssh
+        # Another thread reconnected this slot in the meantime
+        ssh.close()
+        return connection.ssh
+
+    def _discard(self, connection, ssh):
+        with self._condition:
+            self._counters['failures'] += 1
+            if connection.ssh is ssh:
+                connection.ssh = None
+        ssh.close()
+
+    def _open_channel(self, connection):
+        ssh = self._client(connection)
+        try:
+            transport = ssh.get_transport()
+            if transport is None:
+                raise paramiko.SSHException("SSH connection is closed")
+            return transport.open_session(timeout=self.timeout)
+        except paramiko.ChannelException as e:
+            # Refused by the server (e.g. too many sessions), the connection is fine
+            log.error("Opening a channel on %s failed: %s", self.hostname, e)
+            with self._condition:
+                self._counters['failures'] += 1
+            raise
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            log.error("Opening a channel on %s failed, reconnecting: %s", self.hostname, e)
+            self._discard(connection, ssh)
+            raise
+
+    def execute(self, cmd, timeout=60):
+        connection = self._acquire()
+        try:
+            # Only connecting and opening the channel are retried, once the
+            # command is sent it must not run again (e.g. qsub).
+            channel = self.retry_action_executor.execute(lambda: self._open_channel(connection))
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(smart_str(cmd))
+                stdout = channel.makefile('r')
+                stderr = channel.makefile_stderr('r')
+                return_code = channel.recv_exit_status()
+                result = Bunch(stdout=unicodify(stdout.read()), stderr=unicodify(stderr.read()), returncode=return_code)
+            finally:
+                # A failing command only takes its own channel down, not the
+                # connection shared with other commands.
+                channel.close()
+        finally:
+            self._release(connection)
+        with self._condition:
+            self._counters['commands'] += 1
+        return result
+
+    def stats(self):
+        """Return a dict describing the pool, e.g. for logging or monitoring."""
+        with self._condition:
+            stats = dict(self._counters)
+            stats['pool_size'] = self.pool_size
+            stats['open_connections'] = len([c for c in self._connections if c.ssh is not None])
+            stats['active_commands'] = sum(c.active for c in self._connections)
+        return stats
+
+    def close(self):
+        with self._condition:
+            for connection in self._connections:
+                if connection.ssh is not None:
+                    connection.ssh.close()
+                    connection.ssh = None
+
+
 class GlobusSecureShell(SecureShell):
 
     def __init__(self, rsh='gsissh', rcp='gsiscp', **kwargs):
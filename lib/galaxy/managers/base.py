@@ -31,6 +31,7 @@ import re
 
 import routes
 import sqlalchemy
+from boltons.iterutils import chunked
 from six import string_types
 
 from galaxy import exceptions
@@ -674,6 +675,13 @@ class ModelSerializer(HasAModelManager):
             `view` and `keys`: combine both into one list of keys
         """
 
+        all_keys = self._view_and_keys_to_keys(view=view, keys=keys, default_view=default_view)
+        return self.serialize(item, all_keys, **context)
+
+    def _view_and_keys_to_keys(self, view=None, keys=None, default_view=None):
+        """
+        Combine `view` and `keys` into a list of keys as described in `serialize_to_view`.
+        """
         # TODO: default view + view makes no sense outside the API.index context - move default view there
         all_keys = []
         keys = keys or []
@@ -688,8 +696,7 @@ class ModelSerializer(HasAModelManager):
                 all_keys = keys
             elif default_view:
                 all_keys = self._view_to_keys(default_view)
-
-        return self.serialize(item, all_keys, **context)
+        return all_keys
 
     def _view_to_keys(self, view=None):
         """
@@ -704,6 +711,177 @@ class ModelSerializer(HasAModelManager):
         return self.views[view][:]
 
 
+class RowSerializer(object):
+    """
+    Serializes a key of items from the rows of a projection (see
+    `BulkSerializerMixin`).
+
+    `columns` are the labeled columns the key needs, `serializer` is called
+    with a row, the batch of rows and the context. If given, `prefetch` is
+    called once with the batch before, to fetch what `serializer` needs for
+    all of its rows at once (e.g. their tags); its result is stored in the
+    batch's `prefetched` under the key. The values of `encoded_columns`
+    are ids encoded for the whole batch at once, see `RowBatch.encoded_id`.
+    """
+
+    def __init__(self, columns, serializer, prefetch=None, encoded_columns=None):
+        self.columns = columns
+        self.serializer = serializer
+        self.prefetch = prefetch
+        self.encoded_columns = encoded_columns or []
+
+
+class RowBatch(object):
+    """
+    A batch of items serialized at once: their rows by id and what was
+    prefetched for them by key.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.prefetched = {}
+        self.encoded_ids = {}
+
+    def encoded_id(self, id):
+        """Return the encoded `id`, a value of one of the `encoded_columns` of the batch's keys."""
+        return self.encoded_ids[id] if id is not None else None
+
+
+class BulkSerializerMixin(object):
+    """
+    Serialize many items at once, rather than item by item from their (lazily
+    loaded) attributes and relations.
+
+    The keys with a `RowSerializer` in `row_serializers` are serialized from
+    the rows of a single query projecting the columns they need from
+    `bulk_selectable` - batches of `bulk_batch_size` items at a time. Other
+    keys are serialized by `serialize` from the items, loaded at once by
+    `bulk_load_items`.
+    """
+    #: items serialized at once, also the size of the IN clauses selecting them
+    bulk_batch_size = 1000
+
+    def add_row_serializers(self):
+        """
+        Register a map of attribute keys -> `RowSerializer` that will serialize
+        the attribute from the rows of a projection.
+        """
+        self.row_serializers = {}
+
+    def bulk_selectable(self):
+        """
+        Return the table (or join) the columns of the row serializers are
+        selected from and its id column, identifying the items.
+        """
+        raise NotImplementedError('Abstract method')
+
+    def bulk_load_items(self, ids):
+        """
+        Return a map of ids to the items with `ids`, to serialize the keys
+        without row serializers.
+        """
+        raise NotImplementedError('Abstract method')
+
+    def bulk_keys(self, batch, keys, **context):
+        """
+        Return a map of ids to the keys to serialize for each item of `batch`,
+        e.g. to hide information from users not able to access some items.
+        """
+        return dict((item_id, keys) for item_id in batch.rows)
+
+    def bulk_required_columns(self):
+        """
+        Return the labeled columns needed by `bulk_keys`, besides those of the
+        row serializers of the keys.
+        """
+        return []
+
+    def serialize_many(self, ids, view=None, keys=None, default_view=None, **context):
+        """
+        Serialize the items with `ids` to `view` and/or `keys` (as described in
+        `serialize_to_view`), returning a map of ids to the serialized items.
+        Items not found are missing from the map.
+        """
+        all_keys = self._view_and_keys_to_keys(view=view, keys=keys, default_view=default_view)
+        returned = {}
+        for batch_ids in chunked(ids, self.bulk_batch_size):
+            returned.update(self._serialize_batch(batch_ids, all_keys, **context))
+        return returned
+
+    def _serialize_batch(self, ids, keys, **context):
+        selectable, id_column = self.bulk_selectable()
+        keys = [key for key in keys if key in self.serializers or key in self.serializable_keyset]
+        columns = [id_column.label('id')] + self.bulk_required_columns()
+        for key in keys:
+            if key in self.row_serializers:
+                columns.extend(self.row_serializers[key].columns)
+        # columns needed by several keys are selected once
+        unique_columns = {}
+        for column in columns:
+            unique_columns.setdefault(column.key, column)
+        statement = (sqlalchemy.select(list(unique_columns.values()))
+            .select_from(selectable)
+            .where(id_column.in_(ids)))
+        rows = self.app.model.context.execute(statement).fetchall()
+        batch = RowBatch(dict((row.id, row) for row in rows))
+
+        keys_by_id = self.bulk_keys(batch, keys, **context)
+        batch_keys = set()
+        for item_keys in keys_by_id.values():
+            batch_keys.update(item_keys)
+        ids_to_encode = set()
+        for key in batch_keys:
+            row_serializer = self.row_serializers.get(key)
+            if row_serializer is None:
+                continue
+            for column in row_serializer.encoded_columns:
+                ids_to_encode.update(row[column.key] for row in batch.rows.values())
+            if row_serializer.prefetch is not None:
+                batch.prefetched[key] = row_serializer.prefetch(batch, **context)
+        ids_to_encode.discard(None)
+        ids_to_encode = list(ids_to_encode)
+        batch.encoded_ids = dict(zip(ids_to_encode, self.app.security.encode_ids(ids_to_encode)))
+        items = {}
+        if any(key not in self.row_serializers for key in batch_keys):
+            items = self.bulk_load_items(list(batch.rows.keys()))
+
+        returned = {}
+        for item_id, row in batch.rows.items():
+            serialized = {}
+            item_keys = []
+            for key in keys_by_id[item_id]:
+                if key in self.row_serializers:
+                    try:
+                        serialized[key] = self.row_serializers[key].serializer(row, batch, **context)
+                    except SkipAttribute:
+                        pass
+                else:
+                    item_keys.append(key)
+            if item_keys:
+                serialized.update(self.serialize(items[item_id], item_keys, **context))
+            returned[item_id] = serialized
+        return returned
+
+    def row_serializer_for_id(self, column):
+        """Return a `RowSerializer` encoding the id `column`."""
+        return RowSerializer([column], lambda row, batch, **c: batch.encoded_id(row[column.key]), encoded_columns=[column])
+
+    def row_serializer_for_date(self, column):
+        """Return a `RowSerializer` for the date `column`."""
+        def serialize(row, batch, **context):
+            date = row[column.key]
+            return date.isoformat() if date is not None else None
+        return RowSerializer([column], serialize)
+
+    def row_serializer_for_column(self, column):
+        """Return a `RowSerializer` for the value of `column`."""
+        return RowSerializer([column], lambda row, batch, **c: row[column.key])
+
+    def row_serializer_for_constant(self, value):
+        """Return a `RowSerializer` for a key whose value is the same for all items."""
+        return RowSerializer([], lambda row, batch, **c: value)
+
+
 class ModelDeserializer(HasAModelManager):
     """
     An object that converts an incoming serialized dict into values that can be
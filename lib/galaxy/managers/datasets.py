@@ -5,7 +5,9 @@ import glob
 import logging
 import os
 
+from boltons.iterutils import chunked
 from six import string_types
+from sqlalchemy import sql
 
 import galaxy.datatypes.metadata
 from galaxy import (
@@ -24,6 +26,8 @@ from galaxy.util.checkers import check_binary
 
 log = logging.getLogger(__name__)
 
+MAX_IN_CLAUSE_IDS = 1000
+
 
 class DatasetManager(base.ModelManager, secured.AccessibleManagerMixin, deletable.PurgableManagerMixin):
     """
@@ -101,6 +105,26 @@ class DatasetManager(base.ModelManager, secured.AccessibleManagerMixin, deletabl
         roles = user.all_roles_exploiting_cache() if user else []
         return self.app.security_agent.can_access_dataset(roles, dataset)
 
+    def are_accessible(self, dataset_ids, user, **kwargs):
+        """
+        Return a map of `dataset_ids` to whether these datasets are readable/viewable
+        to user, as `is_accessible` would for each but at once.
+        """
+        if self.user_manager.is_admin(user, trans=kwargs.get("trans", None)):
+            return dict((dataset_id, True) for dataset_id in dataset_ids)
+        role_ids = set(model.cached_id(role) for role in user.all_roles_exploiting_cache()) if user else set()
+        # datasets without access roles are public, the user must have all of the others
+        accessible = dict((dataset_id, True) for dataset_id in dataset_ids)
+        table = model.DatasetPermissions.table
+        access_action = self.app.security_agent.permitted_actions.DATASET_ACCESS.action
+        for chunk in chunked(list(dataset_ids), MAX_IN_CLAUSE_IDS):
+            statement = (sql.select([table.c.dataset_id, table.c.role_id])
+                .where(sql.and_(table.c.dataset_id.in_(chunk), table.c.action == access_action)))
+            for dataset_id, role_id in self.session().execute(statement):
+                if role_id not in role_ids:
+                    accessible[dataset_id] = False
+        return accessible
+
     # TODO: implement above for groups
     # TODO: datatypes?
     # .... data, object_store
@@ -363,7 +387,7 @@ class DatasetAssociationManager(base.ModelManager,
             else:
                 path = data.dataset.file_name
                 is_binary = check_binary(path)
-                datatype = sniff.guess_ext(path, trans.app.datatypes_registry.sniff_order, is_binary=is_binary)
+                datatype = sniff.guess_ext(path, trans.app.datatypes_registry.sniff_plan, is_binary=is_binary)
                 trans.app.datatypes_registry.change_datatype(data, datatype)
                 trans.sa_session.flush()
                 self.set_metadata(trans, dataset_assoc)
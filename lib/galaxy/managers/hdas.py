@@ -8,6 +8,12 @@ import gettext
 import logging
 import os
 
+from six import string_types
+from sqlalchemy.orm import (
+    eagerload,
+    undefer
+)
+
 from galaxy import (
     datatypes,
     exceptions,
@@ -15,6 +21,7 @@ from galaxy import (
 )
 from galaxy.managers import (
     annotatable,
+    base,
     datasets,
     secured,
     taggable,
@@ -136,15 +143,10 @@ class HDAManager(datasets.DatasetAssociationManager,
     def purge(self, hda, flush=True):
         """
         Purge this HDA and the dataset underlying it.
+
+        The user's disk usage is decreased on flush (see `galaxy.model.user_disk_usage`).
         """
-        user = hda.history.user or None
-        quota_amount_reduction = 0
-        if user:
-            quota_amount_reduction = hda.quota_amount(user)
         super(HDAManager, self).purge(hda, flush=flush)
-        # decrease the user's space used
-        if quota_amount_reduction:
-            user.adjust_total_disk_usage(-quota_amount_reduction)
         return hda
 
     # .... states
@@ -242,6 +244,7 @@ class HDAManager(datasets.DatasetAssociationManager,
 
 class HDASerializer(  # datasets._UnflattenedMetadataDatasetAssociationSerializer,
         datasets.DatasetAssociationSerializer,
+        base.BulkSerializerMixin,
         taggable.TaggableSerializerMixin,
         annotatable.AnnotatableSerializerMixin):
     model_manager_class = HDAManager
@@ -317,6 +320,7 @@ class HDASerializer(  # datasets._UnflattenedMetadataDatasetAssociationSerialize
             'id', 'name', 'history_id', 'hid', 'history_content_type',
             'state', 'deleted', 'visible'
         ])
+        self.add_row_serializers()
 
     def add_serializers(self):
         super(HDASerializer, self).add_serializers()
@@ -362,6 +366,83 @@ class HDASerializer(  # datasets._UnflattenedMetadataDatasetAssociationSerialize
             'created_from_basename' : lambda i, k, **c: i.created_from_basename,
         })
 
+    def add_row_serializers(self):
+        super(HDASerializer, self).add_row_serializers()
+        hda = model.HistoryDatasetAssociation.table
+        dataset = model.Dataset.table
+        id_column = hda.c.id.label('id')
+        history_id_column = hda.c.history_id.label('history_id')
+        extension = self.row_serializer_for_column(hda.c.extension.label('extension'))
+
+        self.row_serializers.update({
+            'id'            : self.row_serializer_for_id(id_column),
+            'type_id'       : base.RowSerializer([id_column], lambda row, batch, **c: 'dataset-' + batch.encoded_id(row.id),
+                                                 encoded_columns=[id_column]),
+            'model_class'   : self.row_serializer_for_constant('HistoryDatasetAssociation'),
+            'history_content_type': self.row_serializer_for_constant('dataset'),
+            'hda_ldda'      : self.row_serializer_for_constant('hda'),
+            'accessible'    : base.RowSerializer([], lambda row, batch, **c: batch.prefetched['accessible'][row.id]),
+            'history_id'    : self.row_serializer_for_id(history_id_column),
+            'dataset_id'    : self.row_serializer_for_id(hda.c.dataset_id.label('dataset_id')),
+            'hid'           : self.row_serializer_for_column(hda.c.hid.label('hid')),
+            'name'          : self.row_serializer_for_column(hda.c.name.label('name')),
+            # as HistoryDatasetAssociation.state
+            'state'         : base.RowSerializer([hda.c._state.label('hda_state'), dataset.c.state.label('dataset_state')],
+                                                 lambda row, batch, **c: row.hda_state or row.dataset_state),
+            'extension'     : extension,
+            'file_ext'      : extension,
+            'deleted'       : self.row_serializer_for_column(hda.c.deleted.label('deleted')),
+            'purged'        : self.row_serializer_for_column(hda.c.purged.label('purged')),
+            'visible'       : self.row_serializer_for_column(hda.c.visible.label('visible')),
+            'misc_info'     : base.RowSerializer([hda.c.info.label('info')],
+                                                 lambda row, batch, **c: row.info.strip() if isinstance(row.info, string_types) else row.info),
+            'misc_blurb'    : self.row_serializer_for_column(hda.c.blurb.label('blurb')),
+            'validated_state': self.row_serializer_for_column(hda.c.validated_state.label('validated_state')),
+            'validated_state_message': self.row_serializer_for_column(hda.c.validated_state_message.label('validated_state_message')),
+            'tags'          : self.row_serializer_for_tags(model.HistoryDatasetAssociationTagAssociation, 'history_dataset_association_id'),
+            'api_type'      : self.row_serializer_for_constant('file'),
+            'type'          : self.row_serializer_for_constant('file'),
+            'url'           : base.RowSerializer([id_column, history_id_column],
+                                                 lambda row, batch, **c: self.url_for('history_content',
+                                                                                      history_id=batch.encoded_id(row.history_id),
+                                                                                      id=batch.encoded_id(row.id)),
+                                                 encoded_columns=[id_column, history_id_column]),
+            'create_time'   : self.row_serializer_for_date(hda.c.create_time.label('create_time')),
+            'update_time'   : self.row_serializer_for_date(hda.c.update_time.label('update_time')),
+        })
+
+    def bulk_selectable(self):
+        hda = model.HistoryDatasetAssociation.table
+        dataset = model.Dataset.table
+        return hda.join(dataset, hda.c.dataset_id == dataset.c.id), hda.c.id
+
+    def bulk_load_items(self, ids):
+        query = (self.app.model.context.query(model.HistoryDatasetAssociation)
+            .filter(model.HistoryDatasetAssociation.id.in_(ids))
+            .options(undefer('_metadata'))
+            .options(eagerload('dataset.actions'))
+            .options(eagerload('tags'))
+            .options(eagerload('annotations')))
+        return dict((hda.id, hda) for hda in query)
+
+    def bulk_required_columns(self):
+        # to check access and serialize the inaccessible view
+        columns = [model.HistoryDatasetAssociation.table.c.dataset_id.label('dataset_id')]
+        for key in self._view_to_keys('inaccessible'):
+            columns.extend(self.row_serializers[key].columns)
+        return columns
+
+    def bulk_keys(self, batch, keys, user=None, **context):
+        """
+        Override to hide information to users not able to access, as `serialize`.
+        """
+        dataset_ids = set(row.dataset_id for row in batch.rows.values())
+        accessible_datasets = self.hda_manager.dataset_manager.are_accessible(dataset_ids, user, **context)
+        accessible = batch.prefetched['accessible'] = dict((hda_id, accessible_datasets[row.dataset_id])
+                                                           for hda_id, row in batch.rows.items())
+        inaccessible_keys = self._view_to_keys('inaccessible')
+        return dict((hda_id, keys if accessible[hda_id] else inaccessible_keys) for hda_id in batch.rows)
+
     def serialize(self, hda, keys, user=None, **context):
         """
         Override to hide information to users not able to access.
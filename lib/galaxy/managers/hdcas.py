@@ -6,6 +6,8 @@ history.
 """
 import logging
 
+from sqlalchemy.orm import eagerload
+
 from galaxy import model
 from galaxy.managers import (
     annotatable,
@@ -195,6 +197,7 @@ class DCASerializer(base.ModelSerializer):
 
 class HDCASerializer(
         DCASerializer,
+        base.BulkSerializerMixin,
         taggable.TaggableSerializerMixin,
         annotatable.AnnotatableSerializerMixin):
     """
@@ -234,6 +237,7 @@ class HDCASerializer(
             'populated',
             'elements'
         ], include_keys_from='summary')
+        self.add_row_serializers()
 
     def add_serializers(self):
         super(HDCASerializer, self).add_serializers()
@@ -249,9 +253,74 @@ class HDCASerializer(
             'history_content_type'      : lambda *a, **c: self.hdca_manager.model_class.content_type,
             'type_id'                   : self.serialize_type_id,
             'job_source_id'             : self.serialize_id,
+            # the HDCA's own update_time is bumped when its collection changes, see HistoryContentsManager.changed_since_filter
+            'update_time'               : self.serialize_date,
 
             'url'   : lambda i, k, **c: self.url_for('history_content_typed',
                                                      history_id=self.app.security.encode_id(i.history_id),
                                                      id=self.app.security.encode_id(i.id),
                                                      type=self.hdca_manager.model_class.content_type),
         })
+
+    def add_row_serializers(self):
+        super(HDCASerializer, self).add_row_serializers()
+        hdca = model.HistoryDatasetCollectionAssociation.table
+        collection = model.DatasetCollection.table
+        content_type = self.hdca_manager.model_class.content_type
+        id_column = hdca.c.id.label('id')
+        history_id_column = hdca.c.history_id.label('history_id')
+        job_source_columns = [hdca.c.implicit_collection_jobs_id.label('implicit_collection_jobs_id'), hdca.c.job_id.label('job_id')]
+
+        def serialize_job_source_id(row, batch, **context):
+            return batch.encoded_id(row.implicit_collection_jobs_id or row.job_id)
+
+        def serialize_job_source_type(row, batch, **context):
+            # as HistoryDatasetCollectionAssociation.job_source_type
+            if row.implicit_collection_jobs_id:
+                return "ImplicitCollectionJobs"
+            elif row.job_id:
+                return "Job"
+            return None
+
+        self.row_serializers.update({
+            'id'            : self.row_serializer_for_id(id_column),
+            'type_id'       : base.RowSerializer([id_column], lambda row, batch, **c: content_type + '-' + batch.encoded_id(row.id),
+                                                 encoded_columns=[id_column]),
+            'model_class'   : self.row_serializer_for_constant(self.hdca_manager.model_class.__class__.__name__),
+            'type'          : self.row_serializer_for_constant('collection'),
+            'history_content_type': self.row_serializer_for_constant(content_type),
+            'history_id'    : self.row_serializer_for_id(history_id_column),
+            'hid'           : self.row_serializer_for_column(hdca.c.hid.label('hid')),
+            'name'          : self.row_serializer_for_column(hdca.c.name.label('name')),
+            'deleted'       : self.row_serializer_for_column(hdca.c.deleted.label('deleted')),
+            'visible'       : self.row_serializer_for_column(hdca.c.visible.label('visible')),
+            'job_source_id' : base.RowSerializer(job_source_columns, serialize_job_source_id, encoded_columns=job_source_columns),
+            'job_source_type': base.RowSerializer(job_source_columns, serialize_job_source_type),
+            'update_time'   : self.row_serializer_for_date(hdca.c.update_time.label('update_time')),
+            # proxied to the collection
+            'collection_type': self.row_serializer_for_column(collection.c.collection_type.label('collection_type')),
+            'populated_state': self.row_serializer_for_column(collection.c.populated_state.label('populated_state')),
+            'populated_state_message': self.row_serializer_for_column(collection.c.populated_state_message.label('populated_state_message')),
+            'element_count' : self.row_serializer_for_column(collection.c.element_count.label('element_count')),
+            'create_time'   : self.row_serializer_for_date(collection.c.create_time.label('create_time')),
+            'tags'          : self.row_serializer_for_tags(model.HistoryDatasetCollectionTagAssociation, 'history_dataset_collection_id'),
+            'url'           : base.RowSerializer([id_column, history_id_column],
+                                                 lambda row, batch, **c: self.url_for('history_content_typed',
+                                                                                      history_id=batch.encoded_id(row.history_id),
+                                                                                      id=batch.encoded_id(row.id),
+                                                                                      type=content_type),
+                                                 encoded_columns=[id_column, history_id_column]),
+        })
+
+    def bulk_selectable(self):
+        hdca = model.HistoryDatasetCollectionAssociation.table
+        collection = model.DatasetCollection.table
+        return hdca.join(collection, hdca.c.collection_id == collection.c.id), hdca.c.id
+
+    def bulk_load_items(self, ids):
+        query = (self.app.model.context.query(model.HistoryDatasetCollectionAssociation)
+            .filter(model.HistoryDatasetCollectionAssociation.id.in_(ids))
+            .options(eagerload('collection'))
+            .options(eagerload('tags'))
+            .options(eagerload('annotations')))
+        return dict((hdca.id, hdca) for hdca in query)
@@ -8,7 +8,9 @@ import logging
 
 from sqlalchemy import (
     asc,
-    desc
+    desc,
+    func,
+    select
 )
 
 from galaxy import (
@@ -21,6 +23,8 @@ from galaxy.managers import (
     history_contents,
     sharable
 )
+from galaxy.model import history_summary
+from galaxy.util import nice_size
 
 log = logging.getLogger(__name__)
 
@@ -168,6 +172,13 @@ class HistoryManager(sharable.SharableModelManager, deletable.PurgableManagerMix
             .filter(model.Job.state.in_(model.Job.non_ready_states)))
         return jobs
 
+    def summary(self, history):
+        """
+        Return the summary of the contents of this history: their counts by
+        state, visibility and deletion and the size of its unique datasets.
+        """
+        return history_summary.get_summary(self.session(), history, self.app.config.history_summary_reconcile_interval)
+
 
 class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSerializerMixin):
     """
@@ -241,8 +252,8 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
 
         self.serializers.update({
             'model_class'   : lambda *a, **c: 'History',
-            'size'          : lambda i, k, **c: int(i.disk_size),
-            'nice_size'     : lambda i, k, **c: i.disk_nice_size,
+            'size'          : lambda i, k, **c: int(self._summary(i, **c).disk_size),
+            'nice_size'     : lambda i, k, **c: nice_size(self._summary(i, **c).disk_size),
             'state'         : self.serialize_history_state,
 
             'url'           : lambda i, k, **c: self.url_for('history', id=self.app.security.encode_id(i.id)),
@@ -265,6 +276,21 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
             'user_id'       : lambda i, k, **c: self.app.security.encode_id(i.user_id) if i.user_id is not None else None
         })
 
+    def serialize(self, history, keys, **context):
+        """
+        Serialize ``history``, the summary of its contents used by several keys
+        is only read once.
+        """
+        context = dict(context, history_summaries={})
+        return super(HistorySerializer, self).serialize(history, keys, **context)
+
+    def _summary(self, history, history_summaries=None, **context):
+        if history_summaries is None:
+            return self.manager.summary(history)
+        if history.id not in history_summaries:
+            history_summaries[history.id] = self.manager.summary(history)
+        return history_summaries[history.id]
+
     # remove this
     def serialize_state_ids(self, history, key, **context):
         """
@@ -276,10 +302,15 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
             state_ids[state] = []
 
         # TODO:?? collections and coll. states?
-        for hda in history.datasets:
+        hda_table = model.HistoryDatasetAssociation.table
+        rows = self.app.model.context.execute(
+            select([hda_table.c.id, func.coalesce(hda_table.c._state, model.Dataset.table.c.state)])
+            .select_from(hda_table.join(model.Dataset.table, hda_table.c.dataset_id == model.Dataset.table.c.id))
+            .where(hda_table.c.history_id == history.id)
+            .order_by(hda_table.c.hid))
+        for hda_id, state in rows:
             # TODO: do not encode ids at this layer
-            encoded_id = self.app.security.encode_id(hda.id)
-            state_ids[hda.state].append(encoded_id)
+            state_ids[state].append(self.app.security.encode_id(hda_id))
         return state_ids
 
     # remove this
@@ -293,6 +324,10 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
         for state in model.Dataset.states.values():
             state_counts[state] = 0
 
+        if exclude_deleted and not exclude_hidden:
+            state_counts.update(self._summary(history, **context).state_counts)
+            return state_counts
+
         # TODO:?? collections and coll. states?
         for hda in history.datasets:
             if exclude_deleted and hda.deleted:
@@ -349,7 +384,7 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
 
         Note: does not include deleted/hidden contents.
         """
-        return self.manager.contents_manager.state_counts(history)
+        return self._summary(history, **context).contents_states
 
     def serialize_contents_active(self, history, key, **context):
         """
@@ -359,7 +394,7 @@ class HistorySerializer(sharable.SharableModelSerializer, deletable.PurgableSeri
         Note: counts for deleted and hidden overlap; In other words, a dataset that's
         both deleted and hidden will be added to both totals.
         """
-        return self.manager.contents_manager.active_counts(history)
+        return self._summary(history, **context).contents_active
 
 
 class HistoryDeserializer(sharable.SharableModelDeserializer, deletable.PurgableDeserializerMixin):
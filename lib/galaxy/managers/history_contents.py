@@ -2,7 +2,12 @@
 Heterogenous lists/contents are difficult to query properly since unions are
 not easily made.
 """
+import calendar
 import logging
+from datetime import (
+    datetime,
+    timedelta
+)
 
 from sqlalchemy import (
     asc,
@@ -32,9 +37,17 @@ from galaxy.managers import (
     taggable,
     tools
 )
+from galaxy.model.orm.now import now
 
 log = logging.getLogger(__name__)
 
+#: 'kind' of the ids encoding the watermarks of since tokens
+SINCE_TOKEN_KIND = 'contents_since'
+#: watermarks lag behind the time tokens are issued by this much, so that contents
+#: updated by transactions committed after contents are listed or by hosts whose
+#: clocks are late are listed again rather than missed
+SINCE_TOKEN_OVERLAP = timedelta(seconds=5)
+
 
 # into its own class to have it's own filters, etc.
 # TODO: but can't inherit from model manager (which assumes only one model)
@@ -144,6 +157,35 @@ class HistoryContentsManager(containers.ContainerManagerMixin):
         raise glx_exceptions.RequestParameterInvalidException('Unknown order_by', order_by=order_by_string,
             available=['create_time', 'update_time', 'name', 'hid'])
 
+    # contents changed since a watermark, for clients syncing deltas
+    def since_token(self):
+        """
+        Return an opaque token to list the contents changed from now on (see
+        `parse_since_token`), to be issued before listing contents.
+        """
+        watermark = now() - SINCE_TOKEN_OVERLAP
+        microseconds = calendar.timegm(watermark.utctimetuple()) * 1000000 + watermark.microsecond
+        return self.app.security.encode_id(microseconds, kind=SINCE_TOKEN_KIND)
+
+    def parse_since_token(self, token):
+        """Return the watermark (a datetime) encoded by `token`, None if `token` is empty."""
+        if not token:
+            return None
+        try:
+            microseconds = self.app.security.decode_id(token, kind=SINCE_TOKEN_KIND)
+        except Exception:
+            raise glx_exceptions.RequestParameterInvalidException('Invalid since token', since=token)
+        return datetime.utcfromtimestamp(0) + timedelta(microseconds=microseconds)
+
+    def changed_since_filter(self, watermark):
+        """
+        Return a filter for the contents updated after `watermark`, on their own
+        `update_time` - bumped when their datasets or collections change state, see
+        `galaxy.model.history_summary` - and indexed with their `history_id`.
+        """
+        return base.ModelFilterParser.parsed_filter("orm_function",
+            lambda content_class: content_class.update_time > watermark)
+
     # history specific methods
     def state_counts(self, history):
         """
@@ -363,9 +405,9 @@ class HistoryContentsManager(containers.ContainerManagerMixin):
             # TODO: should be purgable? fix
             purged=literal(False),
             extension=literal(None),
-            # these are attached instead to the inner collection joined below
-            create_time=model.DatasetCollection.create_time,
-            update_time=model.DatasetCollection.update_time
+            # the create time is attached instead to the inner collection joined below, the HDCA's own
+            # update_time is used as it's bumped when the collection changes (see `changed_since_filter`)
+            create_time=model.DatasetCollection.create_time
         )
         subquery = self._session().query(*columns)
         # for the HDCA's we need to join the DatasetCollection since it has update/create times
@@ -9,6 +9,7 @@ import logging
 from sqlalchemy import sql
 
 from galaxy import model
+from galaxy.managers import base
 from galaxy.util import unicodify
 
 log = logging.getLogger(__name__)
@@ -30,6 +31,25 @@ def _tags_to_strings(item):
     return sorted(list(_tag_str_gen(item)))
 
 
+def _tag_strings_by_item_id(session, tag_assoc_class, item_id_key, item_ids):
+    """
+    Return a map of the ids of items to their tags as sorted lists of strings,
+    for all `item_ids` at once. `item_id_key` is the column of the
+    `tag_assoc_class` table referencing the items.
+    """
+    table = tag_assoc_class.table
+    item_id_column = table.c[item_id_key]
+    rows = session.execute(sql.select([item_id_column, table.c.user_tname, table.c.value, table.c.user_value])
+        .where(item_id_column.in_(item_ids))).fetchall()
+    tags = dict((item_id, []) for item_id in item_ids)
+    for item_id, user_tname, value, user_value in rows:
+        tag_str = user_tname
+        if value is not None:
+            tag_str += ":" + user_value
+        tags[item_id].append(tag_str)
+    return dict((item_id, sorted(item_tags)) for item_id, item_tags in tags.items())
+
+
 def _tags_from_strings(item, tag_handler, new_tags_list, user=None):
     # TODO: have to assume trans.user here...
     if not user:
@@ -77,6 +97,15 @@ class TaggableSerializerMixin(object):
         """
         return _tags_to_strings(item)
 
+    def row_serializer_for_tags(self, tag_assoc_class, item_id_key):
+        """
+        Return a `RowSerializer` of the tags of items (see
+        `base.BulkSerializerMixin`), fetching the tags of a batch at once.
+        """
+        def prefetch(batch, **context):
+            return _tag_strings_by_item_id(self.app.model.context, tag_assoc_class, item_id_key, list(batch.rows.keys()))
+        return base.RowSerializer([], lambda row, batch, **c: batch.prefetched['tags'][row.id], prefetch=prefetch)
+
 
 class TaggableDeserializerMixin(object):
 
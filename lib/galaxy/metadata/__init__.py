@@ -12,6 +12,7 @@ import six
 from six.moves import cPickle
 
 import galaxy.model
+from galaxy.metadata.cache import build_metadata_cache
 from galaxy.model.metadata import FileParameter, MetadataTempFile
 from galaxy.util import in_directory, safe_makedirs
 
@@ -22,16 +23,20 @@ SET_METADATA_SCRIPT = 'from galaxy_ext.metadata.set_metadata import set_metadata
 
 def get_metadata_compute_strategy(config, job_id):
     metadata_strategy = config.metadata_strategy
+    metadata_cache = build_metadata_cache(config)
     if metadata_strategy == "legacy":
-        return JobExternalOutputMetadataWrapper(job_id)
+        return JobExternalOutputMetadataWrapper(job_id, metadata_cache=metadata_cache)
     else:
-        return PortableDirectoryMetadataGenerator(job_id)
+        return PortableDirectoryMetadataGenerator(job_id, metadata_cache=metadata_cache)
 
 
 @six.add_metaclass(abc.ABCMeta)
 class MetadataCollectionStrategy(object):
     """Interface describing the abstract process of writing out and collecting output metadata.
     """
+    # galaxy.metadata.cache.MetadataCache of the metadata set on datasets, if
+    # enabled, only used when Galaxy sets metadata itself
+    metadata_cache = None
 
     def invalidate_external_metadata(self, datasets, sa_session):
         """Invalidate written files."""
@@ -98,8 +103,9 @@ class MetadataCollectionStrategy(object):
 class PortableDirectoryMetadataGenerator(MetadataCollectionStrategy):
     portable = True
 
-    def __init__(self, job_id):
+    def __init__(self, job_id, metadata_cache=None):
         self.job_id = job_id
+        self.metadata_cache = metadata_cache
 
     def setup_external_metadata(self, datasets_dict, sa_session, exec_dir=None,
                                 tmp_dir=None, dataset_files_path=None,
@@ -189,8 +195,9 @@ class JobExternalOutputMetadataWrapper(MetadataCollectionStrategy):
     """
     portable = False
 
-    def __init__(self, job_id):
+    def __init__(self, job_id, metadata_cache=None):
         self.job_id = job_id
+        self.metadata_cache = metadata_cache
 
     def _get_output_filenames_by_dataset(self, dataset, sa_session):
         if isinstance(dataset, galaxy.model.HistoryDatasetAssociation):
@@ -0,0 +1,257 @@
+"""
+Cache of the metadata set on datasets, keyed by their content.
+
+The same files (reference genomes, filtered BED files...) are uploaded and
+produced over and over, and set_meta() computes the same metadata for each
+of them. The cache keeps the metadata (and the peek and blurb) set on a
+dataset under a key made of the hash of its content, its datatype, the
+Galaxy version, the set_meta() keywords and the metadata it had before
+set_meta() was called, so that it is copied to identical datasets instead
+of being computed again.
+
+The cache is a directory shared by the Galaxy processes, used when they set
+metadata themselves: each entry is a JSON file, replaced at once when
+written, the least recently used entries are removed beyond ``max_entries``
+and the hits and misses of the lookups are counted for admins to check the
+hit rate. Jobs setting metadata externally do not use the cache, the
+metadata and peek it holds are copied to datasets of other users, so entries
+are signed with a secret of the Galaxy server and entries not signed with it
+(e.g. written by a tool) are ignored.
+"""
+import fcntl
+import hmac
+import json
+import logging
+import os
+import tempfile
+
+from galaxy.model.metadata import FileParameter
+from galaxy.util import (
+    safe_makedirs,
+    smart_str,
+)
+from galaxy.util.hash_util import hmac_new, memory_bound_hexdigest, new_secure_hash
+from galaxy.version import VERSION
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+DEFAULT_MAX_ENTRIES = 100000
+# Hash of the content of datasets, computed the way uploads validate theirs
+HASH_FUNCTION = "SHA-256"
+# Metadata elements describing the dataset rather than its content
+UNCACHED_ELEMENTS = ["dbkey"]
+# Fraction of max_entries left once the least recently used entries are removed
+EVICTION_RATIO = 0.9
+
+STATS_FILENAME = "stats.json"
+ENTRIES_DIRECTORY = "entries"
+
+
+def build_metadata_cache(config):
+    """Return the MetadataCache configured by ``config``, None if disabled."""
+    path = getattr(config, "metadata_cache_path", None)
+    if not path:
+        return None
+    secret = "metadata_cache:%s" % config.id_secret
+    return MetadataCache(path, secret, max_entries=getattr(config, "metadata_cache_max_entries", None) or DEFAULT_MAX_ENTRIES)
+
+
+class MetadataCache(object):
+
+    def __init__(self, path, secret, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self._secret = smart_str(secret)
+        self.max_entries = max_entries
+
+    def key(self, dataset_instance, set_meta_kwds=None):
+        """
+        Return the key of the metadata set_meta() would set on
+        ``dataset_instance`` with ``set_meta_kwds``, or None if it cannot be
+        cached: metadata of composite datasets depends on their extra files,
+        metadata files are not copied. The content is only hashed for
+        datatypes that can be cached.
+        """
+        datatype = dataset_instance.datatype
+        if getattr(datatype, "composite_type", None) or _has_metadata_file_elements(dataset_instance):
+            return None
+        try:
+            content_hash = memory_bound_hexdigest(hash_func_name=HASH_FUNCTION, path=dataset_instance.file_name)
+        except (IOError, OSError):
+            return None
+        metadata = _cached_metadata(dataset_instance)
+        key = [
+            CACHE_VERSION,
+            VERSION,
+            content_hash,
+            dataset_instance.extension,
+            "%s.%s" % (datatype.__class__.__module__, datatype.__class__.__name__),
+            set_meta_kwds or {},
+            metadata,
+        ]
+        return new_secure_hash(json.dumps(key, sort_keys=True))
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, ENTRIES_DIRECTORY, key[:2], "%s.json" % key)
+
+    def _signature(self, key, entry):
+        return hmac_new(self._secret, smart_str(json.dumps([key, entry], sort_keys=True)))
+
+    def _load(self, key, entry_path):
+        """Read the entry cached under ``key`` from ``entry_path``, None if missing or not signed by this server."""
+        with open(entry_path) as f:
+            signed_entry = json.load(f)
+        if not isinstance(signed_entry, dict) or not isinstance(signed_entry.get("entry"), dict):
+            return None
+        if not hmac.compare_digest(str(signed_entry.get("signature", "")), self._signature(key, signed_entry["entry"])):
+            log.warning("Ignoring metadata cache entry %s, it was not written by Galaxy", entry_path)
+            return None
+        return signed_entry["entry"]
+
+    def get(self, key, count_lookup=True):
+        """
+        Return the entry (a dictionary) cached under ``key``, None if missing.
+        The lookup is counted in the hits and misses unless ``count_lookup``
+        is False, e.g. when the key was already looked up for the dataset.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            entry = self._load(key, entry_path)
+            if entry is not None:
+                # Entries are removed by least recent use
+                os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            entry = None
+        if count_lookup:
+            self._update_stats(hits=int(entry is not None), misses=int(entry is None))
+        return entry
+
+    def update(self, key, **values):
+        """Add ``values`` to the entry cached under ``key``, failing silently (it is only a cache)."""
+        entry_path = self._entry_path(key)
+        try:
+            new_entries = int(not os.path.exists(entry_path))
+            try:
+                entry = self._load(key, entry_path) or {}
+            except (IOError, OSError, ValueError):
+                entry = {}
+            entry.update(values)
+            directory = os.path.dirname(entry_path)
+            safe_makedirs(directory)
+            with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+                json.dump({"entry": entry, "signature": self._signature(key, entry)}, f)
+            os.rename(f.name, entry_path)
+            if new_entries:
+                entries = self._update_stats(entries=new_entries)["entries"]
+                if entries > self.max_entries:
+                    self.evict()
+        except (IOError, OSError):
+            log.debug("Could not cache metadata under key %s", key, exc_info=True)
+
+    def evict(self):
+        """Remove the least recently used entries, down to EVICTION_RATIO of max_entries."""
+        entry_paths = []
+        entries_directory = os.path.join(self.path, ENTRIES_DIRECTORY)
+        for directory, _, filenames in os.walk(entries_directory):
+            for filename in filenames:
+                entry_path = os.path.join(directory, filename)
+                try:
+                    entry_paths.append((os.path.getmtime(entry_path), entry_path))
+                except OSError:
+                    pass
+        entry_paths.sort()
+        removed = 0
+        for _, entry_path in entry_paths[:max(len(entry_paths) - int(self.max_entries * EVICTION_RATIO), 0)]:
+            try:
+                os.remove(entry_path)
+                removed += 1
+            except OSError:
+                pass
+        self._update_stats(entries=len(entry_paths) - removed, reset_entries=True)
+
+    def _update_stats(self, hits=0, misses=0, entries=0, reset_entries=False):
+        stats = {"hits": 0, "misses": 0, "entries": 0}
+        try:
+            safe_makedirs(self.path)
+            with open(os.path.join(self.path, STATS_FILENAME), "a+") as f:
+                fcntl.lockf(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    stats.update(json.load(f))
+                except ValueError:
+                    pass
+                stats["hits"] += hits
+                stats["misses"] += misses
+                stats["entries"] = entries if reset_entries else stats["entries"] + entries
+                f.seek(0)
+                f.truncate()
+                json.dump(stats, f)
+        except (IOError, OSError):
+            log.debug("Could not update the statistics of the metadata cache", exc_info=True)
+        return stats
+
+    def stats(self):
+        """Return the number of entries, hits and misses of the cache and its hit rate."""
+        stats = self._update_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = float(stats["hits"]) / lookups if lookups else None
+        stats["max_entries"] = self.max_entries
+        return stats
+
+
+def set_meta(dataset_instance, metadata_cache=None, **set_meta_kwds):
+    """
+    Call set_meta() on ``dataset_instance``, or copy the metadata it would
+    set from ``metadata_cache``. Return the cache key of the dataset, None
+    if not cached.
+    """
+    key = metadata_cache and metadata_cache.key(dataset_instance, set_meta_kwds)
+    entry = key and metadata_cache.get(key)
+    if entry and "metadata" in entry:
+        metadata = _uncached_metadata(dataset_instance)
+        metadata.update(entry["metadata"])
+        dataset_instance.metadata.from_JSON_dict(json_dict=metadata)
+        return key
+    dataset_instance.datatype.set_meta(dataset_instance, **set_meta_kwds)
+    if key:
+        metadata_cache.update(key, metadata=_cached_metadata(dataset_instance))
+        return key
+    return None
+
+
+def set_peek(dataset_instance, metadata_cache=None, key=None, **set_peek_kwds):
+    """
+    Call set_peek() on ``dataset_instance``, or copy the peek and blurb from
+    ``metadata_cache`` if the dataset's metadata was cached under ``key``.
+    """
+    # set_meta() already counted the lookup of the dataset's key
+    entry = key and metadata_cache and metadata_cache.get(key, count_lookup=False)
+    if entry and "peek" in entry:
+        dataset_instance.peek = entry["peek"]
+        dataset_instance.blurb = entry["blurb"]
+        return
+    dataset_instance.set_peek(**set_peek_kwds)
+    if key and metadata_cache:
+        metadata_cache.update(key, peek=dataset_instance.peek, blurb=dataset_instance.blurb)
+
+
+def _has_metadata_file_elements(dataset_instance):
+    """Whether the metadata of the datatype of ``dataset_instance`` includes files (e.g. the index of BAM files)."""
+    return any(isinstance(spec.param, FileParameter) for spec in dataset_instance.metadata.spec.values())
+
+
+def _external_metadata(dataset_instance, names):
+    metadata = {}
+    for name, spec in dataset_instance.metadata.spec.items():
+        if name in names and name in dataset_instance._metadata:
+            metadata[name] = spec.param.to_external_value(dataset_instance._metadata[name])
+    return metadata
+
+
+def _cached_metadata(dataset_instance):
+    names = set(dataset_instance.metadata.spec.keys()) - set(UNCACHED_ELEMENTS)
+    return _external_metadata(dataset_instance, names)
+
+
+def _uncached_metadata(dataset_instance):
+    return _external_metadata(dataset_instance, UNCACHED_ELEMENTS)
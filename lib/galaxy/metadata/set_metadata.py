@@ -9,12 +9,21 @@ Galaxy should be importable on sys.path and output_filename_override should be
 set to the path of the dataset on which metadata is being set
 (output_filename_override could previously be left empty and the path would be
 constructed automatically).
+
+Outputs are processed in parallel by as many processes as the slots allocated
+to the job (GALAXY_SLOTS). The results of each output are written at once, so
+that running the script again only sets metadata on the outputs it has not
+been set on successfully yet.
 """
 import json
 import logging
+import multiprocessing
 import os
 import sys
+import tempfile
 import traceback
+from collections import namedtuple
+from concurrent.futures import process, ProcessPoolExecutor
 
 from six.moves import cPickle
 from sqlalchemy.orm import clear_mappers
@@ -30,6 +39,31 @@ from galaxy.util import (
 logging.basicConfig()
 log = logging.getLogger(__name__)
 
+# Raised when a worker process dies (e.g. killed when out of memory), the
+# Python 2 backport of concurrent.futures does not detect it
+BrokenProcessPool = getattr(process, "BrokenProcessPool", ())
+
+# An output on which set_meta() is called and the files used to do so
+MetadataOutput = namedtuple("MetadataOutput", [
+    "output_name",
+    "filename_in",
+    "filename_kwds",
+    "filename_out",
+    "filename_results_code",
+    "dataset_filename_override",
+    "override_metadata",
+    "validate",
+])
+
+# What setting metadata on each output needs, set once per process and
+# inherited by the worker processes
+_context = {}
+
+
+def _set_context(**context):
+    _context.clear()
+    _context.update(context)
+
 
 def set_validated_state(dataset_instance):
     from galaxy.datatypes.data import validate
@@ -103,44 +137,29 @@ def set_metadata_portable():
     datatypes_registry = validate_and_load_datatypes_config(datatypes_config)
     tool_provided_metadata = load_job_metadata(job_metadata)
 
-    def set_meta(new_dataset_instance, file_dict):
-        set_meta_with_tool_provided(new_dataset_instance, file_dict, set_meta_kwds, datatypes_registry, max_metadata_value_size)
-
+    metadata_outputs = []
     for output_name, output_dict in outputs.items():
-        filename_in = os.path.join("metadata/metadata_in_%s" % output_name)
-        filename_kwds = os.path.join("metadata/metadata_kwds_%s" % output_name)
-        filename_out = os.path.join("metadata/metadata_out_%s" % output_name)
-        filename_results_code = os.path.join("metadata/metadata_results_%s" % output_name)
-        override_metadata = os.path.join("metadata/metadata_override_%s" % output_name)
-        dataset_filename_override = output_dict["filename_override"]
-
-        # Same block as below...
-        set_meta_kwds = stringify_dictionary_keys(json.load(open(filename_kwds)))  # load kwds; need to ensure our keywords are not unicode
-        try:
-            dataset = cPickle.load(open(filename_in, 'rb'))  # load DatasetInstance
-            dataset.dataset.external_filename = dataset_filename_override
-            store_by = metadata_params.get("object_store_store_by", "id")
-            extra_files_dir_name = "dataset_%s_files" % getattr(dataset.dataset, store_by)
-            files_path = os.path.abspath(os.path.join(tool_job_working_directory, extra_files_dir_name))
-            dataset.dataset.external_extra_files_path = files_path
-            file_dict = tool_provided_metadata.get_dataset_meta(output_name, dataset.dataset.id)
-            if 'ext' in file_dict:
-                dataset.extension = file_dict['ext']
-            # Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
-            override_metadata = json.load(open(override_metadata))
-            for metadata_name, metadata_file_override in override_metadata:
-                if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value(metadata_file_override):
-                    metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON(metadata_file_override)
-                setattr(dataset.metadata, metadata_name, metadata_file_override)
-            if output_dict.get("validate", False):
-                set_validated_state(dataset)
-            set_meta(dataset, file_dict)
-            dataset.metadata.to_JSON_dict(filename_out)  # write out results of set_meta
-            json.dump((True, 'Metadata has been set successfully'), open(filename_results_code, 'wt+'))  # setting metadata has succeeded
-        except Exception:
-            json.dump((False, traceback.format_exc()), open(filename_results_code, 'wt+'))  # setting metadata has failed somehow
-
-    write_job_metadata(tool_job_working_directory, job_metadata, set_meta, tool_provided_metadata)
+        metadata_outputs.append(MetadataOutput(
+            output_name=output_name,
+            filename_in=os.path.join("metadata/metadata_in_%s" % output_name),
+            filename_kwds=os.path.join("metadata/metadata_kwds_%s" % output_name),
+            filename_out=os.path.join("metadata/metadata_out_%s" % output_name),
+            filename_results_code=os.path.join("metadata/metadata_results_%s" % output_name),
+            dataset_filename_override=output_dict["filename_override"],
+            override_metadata=os.path.join("metadata/metadata_override_%s" % output_name),
+            validate=output_dict.get("validate", False),
+        ))
+
+    _set_context(
+        tool_job_working_directory=tool_job_working_directory,
+        datatypes_registry=datatypes_registry,
+        tool_provided_metadata=tool_provided_metadata,
+        max_metadata_value_size=max_metadata_value_size,
+        store_by=metadata_params.get("object_store_store_by", "id"),
+        portable=True,
+    )
+    set_meta_kwds = set_metadata_on_outputs(metadata_outputs)
+    write_job_metadata(tool_job_working_directory, job_metadata, set_meta_kwds, tool_provided_metadata)
 
 
 def set_metadata_legacy():
@@ -164,39 +183,151 @@ def set_metadata_legacy():
     job_metadata = sys.argv.pop(1)
     tool_provided_metadata = load_job_metadata(job_metadata)
 
-    def set_meta(new_dataset_instance, file_dict):
-        set_meta_with_tool_provided(new_dataset_instance, file_dict, set_meta_kwds, datatypes_registry, max_metadata_value_size)
-
+    metadata_outputs = []
     for filenames in sys.argv[1:]:
         fields = filenames.split(',')
-        filename_in = fields.pop(0)
-        filename_kwds = fields.pop(0)
-        filename_out = fields.pop(0)
-        filename_results_code = fields.pop(0)
-        dataset_filename_override = fields.pop(0)
-        override_metadata = fields.pop(0)
-        set_meta_kwds = stringify_dictionary_keys(json.load(open(filename_kwds)))  # load kwds; need to ensure our keywords are not unicode
-        try:
-            dataset = cPickle.load(open(filename_in, 'rb'))  # load DatasetInstance
-            dataset.dataset.external_filename = dataset_filename_override
-            files_path = os.path.abspath(os.path.join(tool_job_working_directory, "dataset_%s_files" % (dataset.dataset.id)))
-            dataset.dataset.external_extra_files_path = files_path
-            file_dict = tool_provided_metadata.get_dataset_meta(None, dataset.dataset.id)
-            if 'ext' in file_dict:
-                dataset.extension = file_dict['ext']
-            # Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
-            override_metadata = json.load(open(override_metadata))
-            for metadata_name, metadata_file_override in override_metadata:
-                if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value(metadata_file_override):
-                    metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON(metadata_file_override)
-                setattr(dataset.metadata, metadata_name, metadata_file_override)
-            set_meta(dataset, file_dict)
-            dataset.metadata.to_JSON_dict(filename_out)  # write out results of set_meta
-            json.dump((True, 'Metadata has been set successfully'), open(filename_results_code, 'wt+'))  # setting metadata has succeeded
-        except Exception as e:
-            json.dump((False, unicodify(e)), open(filename_results_code, 'wt+'))  # setting metadata has failed somehow
-
-    write_job_metadata(tool_job_working_directory, job_metadata, set_meta, tool_provided_metadata)
+        metadata_outputs.append(MetadataOutput(
+            output_name=None,
+            filename_in=fields.pop(0),
+            filename_kwds=fields.pop(0),
+            filename_out=fields.pop(0),
+            filename_results_code=fields.pop(0),
+            dataset_filename_override=fields.pop(0),
+            override_metadata=fields.pop(0),
+            validate=False,
+        ))
+
+    _set_context(
+        tool_job_working_directory=tool_job_working_directory,
+        datatypes_registry=datatypes_registry,
+        tool_provided_metadata=tool_provided_metadata,
+        max_metadata_value_size=max_metadata_value_size,
+        store_by="id",
+        portable=False,
+    )
+    set_meta_kwds = set_metadata_on_outputs(metadata_outputs)
+    write_job_metadata(tool_job_working_directory, job_metadata, set_meta_kwds, tool_provided_metadata)
+
+
+def metadata_workers(outputs):
+    """
+    Number of processes to set metadata on ``outputs`` outputs with: the
+    slots allocated to the job (GALAXY_SLOTS), at most one per output.
+    """
+    try:
+        slots = int(os.environ.get("GALAXY_SLOTS", 1))
+    except ValueError:
+        slots = 1
+    return max(min(slots, outputs), 1)
+
+
+def _map(function, items):
+    """
+    Call ``function`` on ``items`` in a pool of metadata_workers() processes,
+    or in this process if there is a single worker. The processes are forked
+    to inherit the datatypes registry and the context of this one, and share
+    the slots of the job.
+
+    Raises ``BrokenProcessPool`` if a worker process dies instead of waiting
+    for its results forever.
+    """
+    workers = metadata_workers(len(items))
+    if workers == 1:
+        return [function(item) for item in items]
+    job_slots = os.environ["GALAXY_SLOTS"]
+    # Datatypes grooming or indexing with GALAXY_SLOTS threads (e.g. BAM) share the slots between workers
+    os.environ["GALAXY_SLOTS"] = str(max(int(job_slots) // workers, 1))
+    pool_kwds = {}
+    if sys.version_info >= (3, 7):
+        pool_kwds["mp_context"] = multiprocessing.get_context("fork")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, **pool_kwds) as pool:
+            return list(pool.map(function, items))
+    except BrokenProcessPool:
+        log.error("A process setting metadata terminated abruptly, e.g. killed for using too much memory")
+        raise
+    finally:
+        os.environ["GALAXY_SLOTS"] = job_slots
+
+
+def set_metadata_on_outputs(metadata_outputs):
+    """
+    Set metadata on ``metadata_outputs`` in parallel, skipping the outputs
+    whose metadata was set successfully by a previous run.
+
+    Returns the set_meta() keywords of the last output, also used for the
+    datasets the tool provided metadata for.
+    """
+    set_meta_kwds = {}
+    if metadata_outputs:
+        set_meta_kwds = stringify_dictionary_keys(json.load(open(metadata_outputs[-1].filename_kwds)))
+    pending_outputs = [metadata_output for metadata_output in metadata_outputs
+                       if not metadata_set_successfully(metadata_output.filename_results_code)]
+    if len(pending_outputs) < len(metadata_outputs):
+        log.info("Metadata already set on %d of %d outputs", len(metadata_outputs) - len(pending_outputs), len(metadata_outputs))
+    _map(set_metadata_on_output, pending_outputs)
+    return set_meta_kwds
+
+
+def metadata_set_successfully(filename_results_code):
+    """Whether the results written to ``filename_results_code`` tell that metadata has been set."""
+    try:
+        with open(filename_results_code, "r") as f:
+            rval, _ = json.load(f)
+    except (IOError, OSError, ValueError, TypeError):
+        return False
+    return rval is True
+
+
+def _dump_atomically(path, dump):
+    """
+    Write ``path`` with ``dump`` (called with a path) at once: the content of
+    path is either the previous or the complete new one, never part of it.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".%s." % os.path.basename(path))
+    os.close(fd)
+    try:
+        dump(tmp_path)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _dump_results_code(results_code, filename_results_code):
+    def dump(path):
+        with open(path, 'wt+') as f:
+            json.dump(results_code, f)
+    _dump_atomically(filename_results_code, dump)
+
+
+def set_metadata_on_output(metadata_output):
+    import galaxy.model
+    tool_job_working_directory = _context["tool_job_working_directory"]
+    set_meta_kwds = stringify_dictionary_keys(json.load(open(metadata_output.filename_kwds)))  # load kwds; need to ensure our keywords are not unicode
+    try:
+        dataset = cPickle.load(open(metadata_output.filename_in, 'rb'))  # load DatasetInstance
+        dataset.dataset.external_filename = metadata_output.dataset_filename_override
+        extra_files_dir_name = "dataset_%s_files" % getattr(dataset.dataset, _context["store_by"])
+        files_path = os.path.abspath(os.path.join(tool_job_working_directory, extra_files_dir_name))
+        dataset.dataset.external_extra_files_path = files_path
+        file_dict = _context["tool_provided_metadata"].get_dataset_meta(metadata_output.output_name, dataset.dataset.id)
+        if 'ext' in file_dict:
+            dataset.extension = file_dict['ext']
+        # Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
+        override_metadata = json.load(open(metadata_output.override_metadata))
+        for metadata_name, metadata_file_override in override_metadata:
+            if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value(metadata_file_override):
+                metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON(metadata_file_override)
+            setattr(dataset.metadata, metadata_name, metadata_file_override)
+        if metadata_output.validate:
+            set_validated_state(dataset)
+        set_meta_with_tool_provided(dataset, file_dict, set_meta_kwds, _context["datatypes_registry"], _context["max_metadata_value_size"])
+        _dump_atomically(metadata_output.filename_out, dataset.metadata.to_JSON_dict)  # write out results of set_meta
+        _dump_results_code((True, 'Metadata has been set successfully'), metadata_output.filename_results_code)  # setting metadata has succeeded
+    except Exception as e:
+        message = traceback.format_exc() if _context["portable"] else unicodify(e)
+        _dump_results_code((False, message), metadata_output.filename_results_code)  # setting metadata has failed somehow
 
 
 def validate_and_load_datatypes_config(datatypes_config):
@@ -220,18 +351,25 @@ def load_job_metadata(job_metadata):
     return parse_tool_provided_metadata(job_metadata)
 
 
-def write_job_metadata(tool_job_working_directory, job_metadata, set_meta, tool_provided_metadata):
-    for i, file_dict in enumerate(tool_provided_metadata.get_new_datasets_for_metadata_collection(), start=1):
-        filename = file_dict["filename"]
-        new_dataset_filename = os.path.join(tool_job_working_directory, "working", filename)
-        new_dataset = galaxy.model.Dataset(id=-i, external_filename=new_dataset_filename)
-        extra_files = file_dict.get('extra_files', None)
-        if extra_files is not None:
-            new_dataset._extra_files_path = os.path.join(tool_job_working_directory, "working", extra_files)
-        new_dataset.state = new_dataset.states.OK
-        new_dataset_instance = galaxy.model.HistoryDatasetAssociation(id=-i, dataset=new_dataset, extension=file_dict.get('ext', 'data'))
-        set_meta(new_dataset_instance, file_dict)
-        file_dict['metadata'] = json.loads(new_dataset_instance.metadata.to_JSON_dict())  # storing metadata in external form, need to turn back into dict, then later jsonify
+def write_job_metadata(tool_job_working_directory, job_metadata, set_meta_kwds, tool_provided_metadata):
+    new_datasets = [(i, file_dict, set_meta_kwds) for i, file_dict in enumerate(tool_provided_metadata.get_new_datasets_for_metadata_collection(), start=1)]
+    for (_, file_dict, _), metadata in zip(new_datasets, _map(_set_metadata_on_new_dataset, new_datasets)):
+        file_dict['metadata'] = metadata
 
     tool_provided_metadata.rewrite()
     clear_mappers()
+
+
+def _set_metadata_on_new_dataset(args):
+    i, file_dict, set_meta_kwds = args
+    tool_job_working_directory = _context["tool_job_working_directory"]
+    filename = file_dict["filename"]
+    new_dataset_filename = os.path.join(tool_job_working_directory, "working", filename)
+    new_dataset = galaxy.model.Dataset(id=-i, external_filename=new_dataset_filename)
+    extra_files = file_dict.get('extra_files', None)
+    if extra_files is not None:
+        new_dataset._extra_files_path = os.path.join(tool_job_working_directory, "working", extra_files)
+    new_dataset.state = new_dataset.states.OK
+    new_dataset_instance = galaxy.model.HistoryDatasetAssociation(id=-i, dataset=new_dataset, extension=file_dict.get('ext', 'data'))
+    set_meta_with_tool_provided(new_dataset_instance, file_dict, set_meta_kwds, _context["datatypes_registry"], _context["max_metadata_value_size"])
+    return json.loads(new_dataset_instance.metadata.to_JSON_dict())  # storing metadata in external form, need to turn back into dict, then later jsonify
@@ -512,7 +512,8 @@ class User(Dictifiable, RepresentById):
 
     def calculate_and_set_disk_usage(self):
         """
-        Calculates and sets user disk usage.
+        Calculates and sets user disk usage, rebuilding the references to
+        datasets it is kept current from (see :mod:`galaxy.model.user_disk_usage`).
         """
         self._calculate_or_set_disk_usage(dryrun=False)
 
@@ -521,6 +522,14 @@ class User(Dictifiable, RepresentById):
         Utility to calculate and return the disk usage.  If dryrun is False,
         the new value is set immediately.
         """
+        sa_session = object_session(self)
+        if not dryrun:
+            from galaxy.model import user_disk_usage
+            sa_session.flush()
+            with sa_session.begin(subtransactions=True):
+                user_disk_usage.reconcile(sa_session, [self.id])
+            sa_session.expire(self, ['disk_usage'])
+            return self.disk_usage
         sql_calc = """
             WITH per_user_histories AS
             (
@@ -541,12 +550,7 @@ class User(Dictifiable, RepresentById):
             WHERE dataset.id IN (SELECT dataset_id FROM per_hist_hdas)
                 AND library_dataset_dataset_association.id IS NULL
         """
-        sa_session = object_session(self)
-        usage = sa_session.scalar(sql_calc, {'id': self.id})
-        if not dryrun:
-            self.set_disk_usage(usage)
-            sa_session.flush()
-        return usage
+        return sa_session.scalar(sql_calc, {'id': self.id})
 
     @staticmethod
     def user_template_environment(user):
@@ -1626,6 +1630,8 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
             self.galaxy_sessions.append(association)
 
     def add_dataset(self, dataset, parent_id=None, genome_build=None, set_hid=True, quota=True):
+        # quota is unused, the disk usage of users is kept current on flush
+        # (see galaxy.model.user_disk_usage)
         if isinstance(dataset, Dataset):
             dataset = HistoryDatasetAssociation(dataset=dataset)
             object_session(self).add(dataset)
@@ -1644,8 +1650,6 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         else:
             if set_hid:
                 dataset.hid = self._next_hid()
-        if quota and self.user:
-            self.user.adjust_total_disk_usage(dataset.quota_amount(self.user))
         dataset.history = self
         if genome_build not in [None, '?']:
             self.genome_build = genome_build
@@ -1660,9 +1664,6 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         optimize = len(datasets) > 1 and parent_id is None and all_hdas and set_hid
         if optimize:
             self.__add_datasets_optimized(datasets, genome_build=genome_build)
-            if quota and self.user:
-                disk_usage = sum([d.get_total_size() for d in datasets])
-                self.user.adjust_total_disk_usage(disk_usage)
             sa_session.add_all(datasets)
             if flush:
                 sa_session.flush()
@@ -1705,7 +1706,6 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         non-deleted, deleted, and purged datasets.
         """
         name = name or self.name
-        applies_to_quota = target_user != self.user
 
         # Create new history.
         new_history = History(name=name, user=target_user)
@@ -1728,7 +1728,7 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         for hda in hdas:
             # Copy HDA.
             new_hda = hda.copy(force_flush=False)
-            new_history.add_dataset(new_hda, set_hid=False, quota=applies_to_quota)
+            new_history.add_dataset(new_hda, set_hid=False)
 
             if target_user:
                 new_hda.copy_item_annotation(db_session, self.user, hda, target_user, new_hda)
@@ -1951,6 +1951,9 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         visible = galaxy.util.string_as_bool_or_none(kwds.get('visible', None))
         if visible is not None:
             query = query.filter(content_class.visible == visible)
+        since = kwds.get('since', None)
+        if since is not None:
+            query = query.filter(content_class.table.c.update_time > since)
         if 'ids' in kwds:
             ids = kwds['ids']
             max_in_filter_length = kwds.get('max_in_filter_length', MAX_IN_FILTER_LENGTH)
@@ -1964,6 +1967,41 @@ class History(HasTags, Dictifiable, UsesAnnotations, HasName, RepresentById):
         return self.__filter_contents(HistoryDatasetCollectionAssociation, **kwds)
 
 
+class HistorySummary(RepresentById):
+    """
+    Counts of the contents of a history by state, visibility and deletion and
+    the size of its unique datasets, kept current by
+    :mod:`galaxy.model.history_summary`.
+    """
+
+    def __init__(self, history_id=None):
+        self.history_id = history_id
+        self.stale = False
+        self.state_counts = {}
+        self.contents_states = {}
+        self.active = 0
+        self.hidden = 0
+        self.deleted = 0
+        self.disk_size = None
+
+    @property
+    def contents_active(self):
+        return dict(active=self.active, hidden=self.hidden, deleted=self.deleted)
+
+
+class UserDatasetReference(RepresentById):
+    """
+    The count of the references of a user to a dataset: non-purged HDAs of
+    the dataset in their non-purged histories, kept current by
+    :mod:`galaxy.model.user_disk_usage`.
+    """
+
+    def __init__(self, user_id=None, dataset_id=None, reference_count=0):
+        self.user_id = user_id
+        self.dataset_id = dataset_id
+        self.reference_count = reference_count
+
+
 class HistoryUserShareAssociation(RepresentById):
     def __init__(self):
         self.history = None
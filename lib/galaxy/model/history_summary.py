@@ -0,0 +1,474 @@
+"""
+Maintain a summary of each history's contents: the counts of its contents by
+state, visibility and deletion and the size of its unique datasets.
+
+These are polled by the history panel and computing them from scratch costs
+several aggregate queries over every HDA and HDCA of the history. Instead,
+they are persisted in the ``history_summary`` table when first requested and
+kept current by session hooks: each flush applies the changes it makes to the
+state, visibility, deletion and purge of HDAs and HDCAs (and the state of
+their datasets and collections) to the summaries of their histories.
+
+A summary is rebuilt (reconciled) when it is next read if it was marked
+stale -- because a change could not be applied incrementally, e.g. the old
+value of an attribute was not known, or because counts went negative, i.e.
+the summary drifted (e.g. after bulk SQL updates) -- or if it was last
+reconciled more than ``reconcile_interval`` seconds ago.
+
+The same hooks bump the ``update_time`` of the HDAs and HDCAs whose datasets
+and collections changed in a flush, so that the contents of a history changed
+since a given time can be found by their own ``update_time``.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from boltons.iterutils import chunked
+from sqlalchemy import (
+    and_,
+    event,
+    false,
+    func,
+    inspect,
+    select
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import (
+    get_history,
+    PASSIVE_NO_INITIALIZE
+)
+
+from galaxy import model
+from galaxy.model.orm.now import now
+
+log = logging.getLogger(__name__)
+
+MAX_IN_CLAUSE_IDS = 1000
+
+# Attributes whose changes are applied to the summaries, their old values are
+# loaded when they are set
+HDA_ATTRIBUTES = ("_state", "deleted", "visible", "purged", "history_id", "dataset_id")
+HDCA_ATTRIBUTES = ("deleted", "visible", "history_id", "collection_id")
+DATASET_ATTRIBUTES = ("state", "purged", "total_size")
+DATASET_COLLECTION_ATTRIBUTES = ("populated_state",)
+
+_SESSION_INFO_KEY = "history_summary_deltas"
+_UNKNOWN = object()
+
+
+class SummaryDelta(object):
+    """Changes to apply to the summary of a history."""
+
+    def __init__(self):
+        self.state_counts = Counter()
+        self.contents_states = Counter()
+        self.contents_active = Counter()
+        self.disk_size = 0
+        # The counts must be reconciled
+        self.stale = False
+        # The size must be computed again
+        self.disk_size_stale = False
+
+    def add_hda(self, state, dataset_state, deleted, visible, sign=1):
+        if not deleted:
+            self.state_counts[state] += sign
+        self._add_content(dataset_state, deleted, visible, sign)
+
+    def add_hdca(self, populated_state, deleted, visible, sign=1):
+        self._add_content(populated_state, deleted, visible, sign)
+
+    def _add_content(self, state, deleted, visible, sign):
+        if deleted:
+            self.contents_active["deleted"] += sign
+        if not visible:
+            self.contents_active["hidden"] += sign
+        if not deleted and visible:
+            self.contents_active["active"] += sign
+            self.contents_states[state] += sign
+
+    def __bool__(self):
+        return bool(self.stale or self.disk_size_stale or self.disk_size or
+                    any(self.state_counts.values()) or any(self.contents_states.values()) or any(self.contents_active.values()))
+    __nonzero__ = __bool__
+
+
+def install(session):
+    """Keep history summaries current on flushes of ``session`` (a sessionmaker or scoped_session)."""
+    for model_class, attributes in ((model.HistoryDatasetAssociation, HDA_ATTRIBUTES),
+                                    (model.HistoryDatasetCollectionAssociation, HDCA_ATTRIBUTES),
+                                    (model.Dataset, DATASET_ATTRIBUTES),
+                                    (model.DatasetCollection, DATASET_COLLECTION_ATTRIBUTES)):
+        for attribute in attributes:
+            # Only so that the old values are loaded when the attributes are set
+            event.listen(getattr(model_class, attribute), "set", _on_set, active_history=True)
+    event.listen(session, "before_flush", _before_flush)
+    event.listen(session, "after_flush", _after_flush)
+
+
+def _on_set(target, value, oldvalue, initiator):
+    pass
+
+
+def _old_value(obj, key):
+    """The value of attribute ``key`` of persistent ``obj`` before the flush, _UNKNOWN if not loaded."""
+    history = get_history(obj, key, passive=PASSIVE_NO_INITIALIZE)
+    if history.deleted:
+        return history.deleted[0]
+    elif history.added:
+        return _UNKNOWN
+    return getattr(obj, key)
+
+
+def _changed(obj, keys):
+    return any(get_history(obj, key, passive=PASSIVE_NO_INITIALIZE).has_changes() for key in keys)
+
+
+def _moved(obj, relationship, column):
+    """
+    Whether ``relationship`` of persistent ``obj`` (or the corresponding
+    ``column``) was changed to another object in this flush, or may have been.
+    """
+    old_id = _old_value(obj, column)
+    if old_id is _UNKNOWN:
+        return True
+    history = get_history(obj, relationship, passive=PASSIVE_NO_INITIALIZE)
+    if history.added:
+        # Possibly set again to the same object
+        return history.added[0] is None or history.added[0].id != old_id
+    return getattr(obj, column) != old_id
+
+
+def _add_dataset_size_change(d, history_id, dataset, hda_purged, size_changed):
+    """Add the change of size of ``dataset`` to ``d``, once per history: the size of a history counts unique datasets."""
+    if hda_purged or (history_id, dataset.id) in size_changed:
+        return
+    size_changed.add((history_id, dataset.id))
+    old_purged, old_size = _old_value(dataset, "purged"), _old_value(dataset, "total_size")
+    if old_purged is _UNKNOWN or old_size is _UNKNOWN or bool(old_purged) != bool(dataset.purged):
+        d.disk_size_stale = True
+    elif not dataset.purged:
+        d.disk_size += (dataset.total_size or 0) - (old_size or 0)
+
+
+def _before_flush(session, flush_context, instances):
+    """
+    Compute the changes to the summaries from the objects about to be
+    flushed, while their old values are known. Deltas of objects new in the
+    flush are keyed by the objects, whose histories have no id yet.
+    """
+    deltas = {}
+
+    def delta(key):
+        if key not in deltas:
+            deltas[key] = SummaryDelta()
+        return deltas[key]
+
+    changed_datasets = {}
+    for obj in session.dirty:
+        if isinstance(obj, model.Dataset) and _changed(obj, DATASET_ATTRIBUTES):
+            changed_datasets[obj.id] = obj
+    changed_collections = {}
+    for obj in session.dirty:
+        if isinstance(obj, model.DatasetCollection) and _changed(obj, DATASET_COLLECTION_ATTRIBUTES):
+            changed_collections[obj.id] = obj
+
+    def old_dataset_state(hda):
+        dataset = changed_datasets.get(hda.dataset_id)
+        return _old_value(dataset, "state") if dataset is not None else hda.dataset.state
+
+    handled_hda_ids = set()
+    handled_hdca_ids = set()
+    # Sizes of datasets applied to the size of a history
+    size_changed = set()
+    # Counted after the flush, once their column defaults are set
+    new_contents = [obj for obj in session.new if isinstance(obj, (model.HistoryDatasetAssociation, model.HistoryDatasetCollectionAssociation))]
+    for obj in session.dirty:
+        if isinstance(obj, model.HistoryDatasetAssociation) and obj.id is not None:
+            dataset_changed = obj.dataset_id in changed_datasets
+            if not dataset_changed and not _changed(obj, HDA_ATTRIBUTES + ("history", "dataset")):
+                continue
+            handled_hda_ids.add(obj.id)
+            old_history_id = _old_value(obj, "history_id")
+            old = [_old_value(obj, "_state"), old_dataset_state(obj), _old_value(obj, "deleted"), _old_value(obj, "visible")]
+            if old_history_id is _UNKNOWN or _UNKNOWN in old or _moved(obj, "dataset", "dataset_id"):
+                for key in (old_history_id, obj):
+                    if key is not _UNKNOWN and key is not None:
+                        delta(key).stale = True
+                continue
+            # Moved from another history (or none, e.g. a copy) to this one
+            moved = _moved(obj, "history", "history_id")
+            if old_history_id is None and not moved:
+                continue
+            old_state, old_dataset_state_, old_deleted, old_visible = old
+            new_dataset_state = obj.dataset.state
+            if old_history_id is not None:
+                d = delta(old_history_id)
+                d.add_hda(old_state or old_dataset_state_, old_dataset_state_, old_deleted, old_visible, sign=-1)
+            d = delta(obj) if moved else delta(old_history_id)
+            d.add_hda(obj._state or new_dataset_state, new_dataset_state, obj.deleted, obj.visible)
+            if moved:
+                for key in (old_history_id, obj):
+                    if key is not None:
+                        delta(key).disk_size_stale = True
+            elif _changed(obj, ("purged",)):
+                d.disk_size_stale = True
+            elif dataset_changed:
+                _add_dataset_size_change(d, old_history_id, changed_datasets[obj.dataset_id], obj.purged, size_changed)
+        elif isinstance(obj, model.HistoryDatasetCollectionAssociation) and obj.id is not None:
+            collection_changed = obj.collection_id in changed_collections
+            if not collection_changed and not _changed(obj, HDCA_ATTRIBUTES + ("history", "collection")):
+                continue
+            handled_hdca_ids.add(obj.id)
+            old_history_id = _old_value(obj, "history_id")
+            collection = changed_collections.get(obj.collection_id)
+            old_state = _old_value(collection, "populated_state") if collection is not None else obj.collection.populated_state
+            old = [old_state, _old_value(obj, "deleted"), _old_value(obj, "visible")]
+            if old_history_id is _UNKNOWN or _UNKNOWN in old or _moved(obj, "collection", "collection_id"):
+                for key in (old_history_id, obj):
+                    if key is not _UNKNOWN and key is not None:
+                        delta(key).stale = True
+                continue
+            moved = _moved(obj, "history", "history_id")
+            if old_history_id is None and not moved:
+                continue
+            if old_history_id is not None:
+                delta(old_history_id).add_hdca(*old, sign=-1)
+            d = delta(obj) if moved else delta(old_history_id)
+            d.add_hdca(obj.collection.populated_state, obj.deleted, obj.visible)
+    for obj in session.deleted:
+        if isinstance(obj, (model.HistoryDatasetAssociation, model.HistoryDatasetCollectionAssociation)):
+            old_history_id = _old_value(obj, "history_id")
+            if old_history_id not in (None, _UNKNOWN):
+                delta(old_history_id).stale = True
+            if isinstance(obj, model.HistoryDatasetAssociation):
+                handled_hda_ids.add(obj.id)
+            else:
+                handled_hdca_ids.add(obj.id)
+
+    # Datasets and collections changed in this flush, their HDAs and HDCAs not
+    # (ids of all of these are kept to expire their touched update_time)
+    touched_hda_ids = set()
+    touched_hdca_ids = set()
+    hda_table = model.HistoryDatasetAssociation.table
+    for chunk in chunked(sorted(changed_datasets), MAX_IN_CLAUSE_IDS):
+        rows = session.execute(select([hda_table.c.id, hda_table.c.history_id, hda_table.c.dataset_id, hda_table.c._state,
+                                       hda_table.c.deleted, hda_table.c.visible, hda_table.c.purged])
+                               .where(hda_table.c.dataset_id.in_(chunk))).fetchall()
+        for hda_id, history_id, dataset_id, state, deleted, visible, purged in rows:
+            touched_hda_ids.add(hda_id)
+            if hda_id in handled_hda_ids or history_id is None:
+                continue
+            dataset = changed_datasets[dataset_id]
+            d = delta(history_id)
+            old_dataset_state = _old_value(dataset, "state")
+            if old_dataset_state is _UNKNOWN:
+                d.stale = True
+                continue
+            d.add_hda(state or old_dataset_state, old_dataset_state, deleted, visible, sign=-1)
+            d.add_hda(state or dataset.state, dataset.state, deleted, visible)
+            _add_dataset_size_change(d, history_id, dataset, purged, size_changed)
+    hdca_table = model.HistoryDatasetCollectionAssociation.table
+    for chunk in chunked(sorted(changed_collections), MAX_IN_CLAUSE_IDS):
+        rows = session.execute(select([hdca_table.c.id, hdca_table.c.history_id, hdca_table.c.collection_id,
+                                       hdca_table.c.deleted, hdca_table.c.visible])
+                               .where(hdca_table.c.collection_id.in_(chunk))).fetchall()
+        for hdca_id, history_id, collection_id, deleted, visible in rows:
+            touched_hdca_ids.add(hdca_id)
+            if hdca_id in handled_hdca_ids or history_id is None:
+                continue
+            collection = changed_collections[collection_id]
+            d = delta(history_id)
+            old_state = _old_value(collection, "populated_state")
+            if old_state is _UNKNOWN:
+                d.stale = True
+                continue
+            d.add_hdca(old_state, deleted, visible, sign=-1)
+            d.add_hdca(collection.populated_state, deleted, visible)
+    session.info[_SESSION_INFO_KEY] = (deltas, new_contents, list(changed_datasets), list(changed_collections),
+                                       touched_hda_ids, touched_hdca_ids)
+
+
+def _after_flush(session, flush_context):
+    """
+    Apply the changes computed before the flush and count the new contents,
+    now that they have a history id. Touch the contents whose datasets or
+    collections changed.
+    """
+    deltas, new_contents, dataset_ids, collection_ids, hda_ids, hdca_ids = session.info.pop(_SESSION_INFO_KEY, ({}, [], [], [], (), ()))
+    touch_contents(session, dataset_ids, collection_ids)
+    # The touched contents loaded in the session must not keep serving their old update_time
+    _expire_update_time(session, model.HistoryDatasetAssociation, hda_ids)
+    _expire_update_time(session, model.HistoryDatasetCollectionAssociation, hdca_ids)
+    for obj in new_contents:
+        d = deltas[obj] = SummaryDelta()
+        if isinstance(obj, model.HistoryDatasetAssociation):
+            dataset = obj.dataset
+            if dataset is None:
+                d.stale = True
+                continue
+            d.add_hda(obj._state or dataset.state, dataset.state, obj.deleted, obj.visible)
+            if dataset.total_size and not dataset.purged and not obj.purged:
+                # Unless the dataset is already in the history
+                d.disk_size_stale = True
+        else:
+            collection = obj.collection
+            if collection is None:
+                d.stale = True
+                continue
+            d.add_hdca(collection.populated_state, obj.deleted, obj.visible)
+    by_history_id = {}
+    for key, d in deltas.items():
+        # HDAs and HDCAs new in the flush or moved to another history
+        history_id = getattr(key, "history_id", key)
+        if history_id is None or not d:
+            continue
+        if history_id in by_history_id:
+            _merge(by_history_id[history_id], d)
+        else:
+            by_history_id[history_id] = d
+    apply_deltas(session, by_history_id)
+
+
+def _merge(d, other):
+    d.state_counts.update(other.state_counts)
+    d.contents_states.update(other.contents_states)
+    d.contents_active.update(other.contents_active)
+    d.disk_size += other.disk_size
+    d.stale = d.stale or other.stale
+    d.disk_size_stale = d.disk_size_stale or other.disk_size_stale
+
+
+def apply_deltas(session, deltas):
+    """Apply ``deltas``, a dictionary of SummaryDelta keyed by history id, to the summaries of these histories."""
+    table = model.HistorySummary.table
+    stale_ids = sorted(history_id for history_id, d in deltas.items() if d.stale)
+    mark_stale(session, stale_ids)
+    pending_ids = sorted(history_id for history_id, d in deltas.items() if not d.stale)
+    for chunk in chunked(pending_ids, MAX_IN_CLAUSE_IDS):
+        rows = session.execute(select([table]).where(and_(table.c.history_id.in_(chunk), table.c.stale == false()))
+                               .with_for_update()).fetchall()
+        for row in rows:
+            d = deltas[row.history_id]
+            values = dict(update_time=now())
+            state_counts = Counter(row.state_counts or {})
+            state_counts.update(d.state_counts)
+            contents_states = Counter(row.contents_states or {})
+            contents_states.update(d.contents_states)
+            contents_active = dict((key, row[key] + d.contents_active[key]) for key in ("active", "hidden", "deleted"))
+            if any(count < 0 for count in list(state_counts.values()) + list(contents_states.values()) + list(contents_active.values())):
+                # Drifted
+                log.debug("Summary of history %s drifted, it will be reconciled", row.history_id)
+                values["stale"] = True
+            else:
+                values.update(contents_active,
+                              state_counts=_nonzero(state_counts),
+                              contents_states=_nonzero(contents_states))
+                if d.disk_size_stale or row.disk_size is None:
+                    values["disk_size"] = None
+                elif d.disk_size:
+                    values["disk_size"] = int(row.disk_size) + d.disk_size
+            session.execute(table.update().where(table.c.id == row.id).values(**values))
+
+
+def _nonzero(counts):
+    return dict((state, count) for state, count in counts.items() if count)
+
+
+def touch_contents(session, dataset_ids=(), collection_ids=()):
+    """Set the ``update_time`` of the HDAs of ``dataset_ids`` and of the HDCAs of ``collection_ids`` to now."""
+    for table, column, ids in ((model.HistoryDatasetAssociation.table, "dataset_id", dataset_ids),
+                               (model.HistoryDatasetCollectionAssociation.table, "collection_id", collection_ids)):
+        for chunk in chunked(sorted(ids), MAX_IN_CLAUSE_IDS):
+            session.execute(table.update().where(table.c[column].in_(chunk)).values(update_time=now()))
+
+
+def _expire_update_time(session, model_class, ids):
+    """Expire the ``update_time`` of the instances of ``model_class`` with ``ids`` loaded in ``session``."""
+    mapper = inspect(model_class)
+    for obj_id in ids:
+        obj = session.identity_map.get(mapper.identity_key_from_primary_key([obj_id]))
+        if obj is not None:
+            session.expire(obj, ["update_time"])
+
+
+def mark_stale(session, history_ids):
+    """Mark the summaries of ``history_ids`` stale, they will be reconciled when next read."""
+    table = model.HistorySummary.table
+    for chunk in chunked(sorted(history_ids), MAX_IN_CLAUSE_IDS):
+        session.execute(table.update().where(table.c.history_id.in_(chunk)).values(stale=True))
+
+
+def mark_stale_for_datasets(session, dataset_ids):
+    """Mark stale the summaries of the histories containing ``dataset_ids``, e.g. after updating them in bulk."""
+    table = model.HistorySummary.table
+    hda_table = model.HistoryDatasetAssociation.table
+    for chunk in chunked(sorted(dataset_ids), MAX_IN_CLAUSE_IDS):
+        history_ids = select([hda_table.c.history_id]).where(hda_table.c.dataset_id.in_(chunk))
+        session.execute(table.update().where(table.c.history_id.in_(history_ids)).values(stale=True))
+
+
+def compute(session, history):
+    """Compute the summary of ``history`` from scratch, returns a (transient) HistorySummary."""
+    hda_table = model.HistoryDatasetAssociation.table
+    dataset_table = model.Dataset.table
+    hdca_table = model.HistoryDatasetCollectionAssociation.table
+    collection_table = model.DatasetCollection.table
+    d = SummaryDelta()
+    hda_groups = session.execute(
+        select([hda_table.c._state, dataset_table.c.state, hda_table.c.deleted, hda_table.c.visible, func.count()])
+        .select_from(hda_table.join(dataset_table, hda_table.c.dataset_id == dataset_table.c.id))
+        .where(hda_table.c.history_id == history.id)
+        .group_by(hda_table.c._state, dataset_table.c.state, hda_table.c.deleted, hda_table.c.visible)).fetchall()
+    for state, dataset_state, deleted, visible, count in hda_groups:
+        d.add_hda(state or dataset_state, dataset_state, deleted, visible, sign=count)
+    hdca_groups = session.execute(
+        select([collection_table.c.populated_state, hdca_table.c.deleted, hdca_table.c.visible, func.count()])
+        .select_from(hdca_table.join(collection_table, hdca_table.c.collection_id == collection_table.c.id))
+        .where(hdca_table.c.history_id == history.id)
+        .group_by(collection_table.c.populated_state, hdca_table.c.deleted, hdca_table.c.visible)).fetchall()
+    for populated_state, deleted, visible, count in hdca_groups:
+        d.add_hdca(populated_state, deleted, visible, sign=count)
+    summary = model.HistorySummary(history_id=history.id)
+    summary.state_counts = _nonzero(d.state_counts)
+    summary.contents_states = _nonzero(d.contents_states)
+    summary.active = d.contents_active["active"]
+    summary.hidden = d.contents_active["hidden"]
+    summary.deleted = d.contents_active["deleted"]
+    summary.disk_size = history.disk_size
+    summary.stale = False
+    summary.update_time = summary.reconcile_time = now()
+    return summary
+
+
+def get_summary(session, history, reconcile_interval=None):
+    """
+    Return the summary of ``history``, reconciled first if stale or last
+    reconciled more than ``reconcile_interval`` seconds ago. If
+    ``reconcile_interval`` is 0 the summary is computed and not persisted.
+    """
+    if not reconcile_interval:
+        return compute(session, history)
+    table = model.HistorySummary.table
+    row = session.execute(select([table]).where(table.c.history_id == history.id)).first()
+    if row is not None and not row.stale and row.reconcile_time > now() - timedelta(seconds=reconcile_interval):
+        summary = model.HistorySummary(history_id=history.id)
+        for column in table.c:
+            setattr(summary, column.key, row[column.key])
+        if summary.disk_size is None:
+            summary.disk_size = history.disk_size
+            # Unless the summary was reconciled or changed meanwhile
+            session.execute(table.update().where(and_(table.c.id == row.id, table.c.update_time == row.update_time,
+                                                      table.c.disk_size.is_(None)))
+                            .values(disk_size=summary.disk_size))
+        return summary
+    summary = compute(session, history)
+    values = dict((column.key, getattr(summary, column.key)) for column in table.c if column.key not in ("id", "history_id"))
+    if row is not None:
+        session.execute(table.update().where(table.c.id == row.id).values(**values))
+    else:
+        try:
+            session.execute(table.insert().values(history_id=history.id, **values))
+        except IntegrityError:
+            # Built concurrently
+            pass
+    return summary
@@ -37,6 +37,10 @@ from sqlalchemy.sql import exists
 from sqlalchemy.types import BigInteger
 
 from galaxy import model
+from galaxy.model import (
+    history_summary,
+    user_disk_usage
+)
 from galaxy.model.base import ModelMapping
 from galaxy.model.custom_types import JSONType, MetadataType, TrimmedString, UUIDType
 from galaxy.model.orm.engine_factory import build_engine
@@ -204,6 +208,28 @@ model.History.table = Table(
     Index('ix_history_slug', 'slug', mysql_length=200),
 )
 
+model.HistorySummary.table = Table(
+    "history_summary", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("history_id", Integer, ForeignKey("history.id"), index=True, unique=True),
+    Column("update_time", DateTime, default=now, onupdate=now),
+    Column("reconcile_time", DateTime, default=now),
+    Column("stale", Boolean, default=False),
+    Column("state_counts", JSONType),
+    Column("contents_states", JSONType),
+    Column("active", Integer, default=0),
+    Column("hidden", Integer, default=0),
+    Column("deleted", Integer, default=0),
+    Column("disk_size", Numeric(15, 0)))
+
+model.UserDatasetReference.table = Table(
+    "user_dataset_reference", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("galaxy_user.id")),
+    Column("dataset_id", Integer, ForeignKey("dataset.id"), index=True),
+    Column("reference_count", Integer, default=0),
+    UniqueConstraint("user_id", "dataset_id"))
+
 model.HistoryUserShareAssociation.table = Table(
     "history_user_share_association", metadata,
     Column("id", Integer, primary_key=True),
@@ -240,7 +266,8 @@ model.HistoryDatasetAssociation.table = Table(
     Column("validated_state", TrimmedString(64), default='unvalidated', nullable=False),
     Column("validated_state_message", TEXT),
     Column("hidden_beneath_collection_instance_id",
-           ForeignKey("history_dataset_collection_association.id"), nullable=True))
+           ForeignKey("history_dataset_collection_association.id"), nullable=True),
+    Index('ix_hda_history_id_update_time', 'history_id', 'update_time'))
 
 
 model.HistoryDatasetAssociationHistory.table = Table(
@@ -906,6 +933,8 @@ model.HistoryDatasetCollectionAssociation.table = Table(
     Column("implicit_output_name", Unicode(255), nullable=True),
     Column("job_id", ForeignKey("job.id"), index=True, nullable=True),
     Column("implicit_collection_jobs_id", ForeignKey("implicit_collection_jobs.id"), index=True, nullable=True),
+    Column("update_time", DateTime, default=now, onupdate=now),
+    Index('ix_hdca_history_id_update_time', 'history_id', 'update_time'),
 )
 
 model.LibraryDatasetCollectionAssociation.table = Table(
@@ -1641,6 +1670,13 @@ def simple_mapping(model, **kwds):
 
 simple_mapping(model.WorkerProcess)
 
+simple_mapping(model.HistorySummary,
+    history=relation(model.History))
+
+simple_mapping(model.UserDatasetReference,
+    user=relation(model.User),
+    dataset=relation(model.Dataset))
+
 mapper(model.FormValues, model.FormValues.table, properties=dict(
     form_definition=relation(model.FormDefinition,
         primaryjoin=(model.FormValues.table.c.form_definition_id == model.FormDefinition.table.c.id))
@@ -2850,6 +2886,8 @@ def init(file_path, url, engine_options=None, create_tables=False, map_install_m
         model_modules.append(tool_shed_install)
 
     result = ModelMapping(model_modules, engine=engine)
+    history_summary.install(result.context)
+    user_disk_usage.install(result.context)
 
     # Create tables if needed
     if create_tables:
@@ -0,0 +1,59 @@
+"""
+Add table for the summaries of the contents of histories
+"""
+from __future__ import print_function
+
+import logging
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    Numeric,
+    Table
+)
+
+from galaxy.model.custom_types import JSONType
+from galaxy.model.migrate.versions.util import (
+    create_table,
+    drop_table
+)
+from galaxy.model.orm.now import now
+
+log = logging.getLogger(__name__)
+metadata = MetaData()
+
+
+HistorySummary_table = Table(
+    "history_summary",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("history_id", Integer, ForeignKey("history.id"), index=True, unique=True),
+    Column("update_time", DateTime, default=now, onupdate=now),
+    Column("reconcile_time", DateTime, default=now),
+    Column("stale", Boolean, default=False),
+    Column("state_counts", JSONType),
+    Column("contents_states", JSONType),
+    Column("active", Integer, default=0),
+    Column("hidden", Integer, default=0),
+    Column("deleted", Integer, default=0),
+    Column("disk_size", Numeric(15, 0)),
+)
+
+
+def upgrade(migrate_engine):
+    print(__doc__)
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    create_table(HistorySummary_table)
+
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    drop_table(HistorySummary_table)
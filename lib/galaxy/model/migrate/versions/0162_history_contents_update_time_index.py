@@ -0,0 +1,60 @@
+"""
+Add an update_time column to history_dataset_collection_association and
+(history_id, update_time) indexes to the HDA and HDCA tables, to query the
+contents of a history changed since a given time.
+"""
+from __future__ import print_function
+
+import logging
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    Table
+)
+
+from galaxy.model.migrate.versions.util import (
+    add_column,
+    add_index,
+    drop_column,
+    drop_index
+)
+from galaxy.model.orm.now import now
+
+log = logging.getLogger(__name__)
+metadata = MetaData()
+
+INDEXES = (
+    ("ix_hda_history_id_update_time", "history_dataset_association"),
+    ("ix_hdca_history_id_update_time", "history_dataset_collection_association"),
+)
+
+
+def upgrade(migrate_engine):
+    print(__doc__)
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    hdca_table = Table("history_dataset_collection_association", metadata, autoload=True)
+    update_time_column = Column("update_time", DateTime, default=now, onupdate=now)
+    add_column(update_time_column, hdca_table, metadata)
+    try:
+        # Collection instances were last updated when their collections were
+        migrate_engine.execute("UPDATE history_dataset_collection_association SET update_time = "
+                               "(SELECT update_time FROM dataset_collection "
+                               "WHERE dataset_collection.id = history_dataset_collection_association.collection_id)")
+    except Exception:
+        log.exception("Setting the update_time of history_dataset_collection_association rows failed.")
+
+    for index_name, table_name in INDEXES:
+        add_index(index_name, table_name, ("history_id", "update_time"), metadata)
+
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    for index_name, table_name in INDEXES:
+        drop_index(index_name, table_name, ("history_id", "update_time"), metadata)
+    drop_column("update_time", "history_dataset_collection_association", metadata)
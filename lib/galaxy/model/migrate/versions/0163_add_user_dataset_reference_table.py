@@ -0,0 +1,79 @@
+"""
+Add table counting the references of users to datasets, which their disk
+usage is kept current from, and fill it and set disk usage from the
+non-purged HDAs of their non-purged histories.
+"""
+from __future__ import print_function
+
+import logging
+
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    MetaData,
+    Table,
+    UniqueConstraint
+)
+
+from galaxy.model.migrate.versions.util import (
+    create_table,
+    drop_table
+)
+
+log = logging.getLogger(__name__)
+metadata = MetaData()
+
+
+UserDatasetReference_table = Table(
+    "user_dataset_reference",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("galaxy_user.id")),
+    Column("dataset_id", Integer, ForeignKey("dataset.id"), index=True),
+    Column("reference_count", Integer, default=0),
+    UniqueConstraint("user_id", "dataset_id"),
+)
+
+FILL_REFERENCES = """
+    INSERT INTO user_dataset_reference (user_id, dataset_id, reference_count)
+    SELECT history.user_id, history_dataset_association.dataset_id, COUNT(*)
+    FROM history_dataset_association
+    JOIN history ON history.id = history_dataset_association.history_id
+    WHERE history.user_id IS NOT NULL
+        AND history_dataset_association.dataset_id IS NOT NULL
+        AND NOT history_dataset_association.purged
+        AND NOT history.purged
+    GROUP BY history.user_id, history_dataset_association.dataset_id
+"""
+
+SET_DISK_USAGE = """
+    UPDATE galaxy_user SET disk_usage = (
+        SELECT COALESCE(SUM(COALESCE(dataset.total_size, dataset.file_size, 0)), 0)
+        FROM user_dataset_reference
+        JOIN dataset ON dataset.id = user_dataset_reference.dataset_id
+        WHERE user_dataset_reference.user_id = galaxy_user.id
+            AND NOT EXISTS (SELECT id FROM library_dataset_dataset_association
+                            WHERE library_dataset_dataset_association.dataset_id = dataset.id)
+    )
+"""
+
+
+def upgrade(migrate_engine):
+    print(__doc__)
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    create_table(UserDatasetReference_table)
+    try:
+        migrate_engine.execute(FILL_REFERENCES)
+        migrate_engine.execute(SET_DISK_USAGE)
+    except Exception:
+        log.exception("Filling the user_dataset_reference table failed, recalculate the disk usage of users (scripts/set_user_disk_usage.py).")
+
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    metadata.reflect()
+
+    drop_table(UserDatasetReference_table)
@@ -132,6 +132,9 @@ def add_index(index_name, table, column_name, metadata=None, **kwds):
     :param table: Table to add the index to
     :type table: :class:`Table` or str
 
+    :param column_name: Column to index, or a tuple of columns for a composite index
+    :type column_name: str or tuple
+
     :param metadata: Needed only if ``table`` is a table name
     :type metadata: :class:`Metadata`
     """
@@ -140,11 +143,11 @@ def add_index(index_name, table, column_name, metadata=None, **kwds):
             assert metadata is not None
             table = Table(table, metadata, autoload=True)
         if index_name not in [ix.name for ix in table.indexes]:
-            column = table.c[column_name]
+            columns = _columns(table, column_name)
             # MySQL cannot index a TEXT/BLOB column without specifying mysql_length
-            if isinstance(column.type, (BLOB, MEDIUMBLOB, Text)):
+            if len(columns) == 1 and isinstance(columns[0].type, (BLOB, MEDIUMBLOB, Text)):
                 kwds.setdefault('mysql_length', 200)
-            index = Index(index_name, column, **kwds)
+            index = Index(index_name, *columns, **kwds)
             index.create()
         else:
             log.debug("Index '%s' on column '%s' in table '%s' already exists.", index_name, column_name, table)
@@ -169,10 +172,15 @@ def drop_index(index, table, column_name=None, metadata=None):
                 assert metadata is not None
                 table = Table(table, metadata, autoload=True)
             if index in [ix.name for ix in table.indexes]:
-                index = Index(index, table.c[column_name])
+                index = Index(index, *_columns(table, column_name))
             else:
                 log.debug("Index '%s' in table '%s' does not exist.", index, table)
                 return
         index.drop()
     except Exception:
         log.exception("Dropping index '%s' from table '%s' failed", index, table)
+
+
+def _columns(table, column_name):
+    column_names = column_name if isinstance(column_name, (list, tuple)) else [column_name]
+    return [table.c[name] for name in column_names]
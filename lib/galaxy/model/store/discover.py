@@ -221,6 +221,7 @@ class ModelPersistenceContext(object):
                 filename=filename,
                 metadata_source_name=metadata_source_name,
                 link_data=link_data,
+                dataset_attributes=_dataset_attributes(fields_match, dbkey),
                 tag_list=tag_list,
                 sources=sources,
                 hashes=hashes,
@@ -495,6 +496,7 @@ def persist_elements_to_folder(model_persistence_context, elements, library_fold
                 info=info,
                 library_folder=library_folder,
                 link_data=link_data,
+                dataset_attributes=_dataset_attributes(fields_match, dbkey),
                 sources=sources,
                 hashes=hashes,
                 created_from_basename=created_from_basename,
@@ -540,6 +542,7 @@ def persist_hdas(elements, model_persistence_context):
                     info=info,
                     link_data=link_data,
                     primary_data=primary_dataset,
+                    dataset_attributes=_dataset_attributes(fields_match, dbkey),
                     sources=sources,
                     hashes=hashes,
                     created_from_basename=created_from_basename,
@@ -607,6 +610,18 @@ def replace_request_syntax_sugar(obj):
             obj["hashes"].extend(new_hashes)
 
 
+def _dataset_attributes(fields_match, dbkey):
+    """
+    Attributes of the dataset matched by ``fields_match`` if its metadata was
+    counted while uploaded (by data fetch), None otherwise. Metadata provided
+    by tools is only set before set_meta() is called.
+    """
+    metadata = fields_match.counted_metadata
+    if not metadata:
+        return None
+    return {"dbkey": dbkey, "metadata": dict(metadata)}
+
+
 DiscoveredFile = namedtuple('DiscoveredFile', ['path', 'collector', 'match'])
 
 
@@ -719,6 +734,10 @@ class JsonCollectedDatasetMatch(object):
     def created_from_basename(self):
         return self.as_dict.get("created_from_basename")
 
+    @property
+    def counted_metadata(self):
+        return self.as_dict.get("counted_metadata")
+
 
 class RegexCollectedDatasetMatch(JsonCollectedDatasetMatch):
 
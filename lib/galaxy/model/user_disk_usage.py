@@ -0,0 +1,276 @@
+"""
+Keep the disk usage of users current incrementally.
+
+The disk usage of a user is the size of the unique datasets referenced by the
+non-purged HDAs of their non-purged histories, not counting datasets in a
+library (see ``User.calculate_disk_usage``). Computing it costs a query over
+every history and HDA of the user. Instead, the references of each user to
+each dataset are counted in the ``user_dataset_reference`` table and
+``galaxy_user.disk_usage`` is adjusted by session hooks: each flush compares
+the references of the HDAs (and histories) it changes before and after the
+flush, adds the size of a dataset to the usage of a user when it is first
+referenced, subtracts it when its last reference goes (purged HDA or history,
+HDA moved to another history, history given to another user, ...) and applies
+changes of the sizes of datasets to the users referencing them.
+
+Changes made by bulk SQL updates are not seen by the hooks. ``reconcile``
+rebuilds the references and disk usage of users from scratch -- it is the
+admin-triggered recalculation of disk usage (``User.calculate_and_set_disk_usage``)
+and runs automatically for users whose references drifted (counts went
+negative).
+"""
+import logging
+from collections import Counter, defaultdict
+
+from boltons.iterutils import chunked
+from sqlalchemy import (
+    and_,
+    event,
+    exists,
+    false,
+    func,
+    select
+)
+from sqlalchemy.orm.attributes import (
+    get_history,
+    PASSIVE_NO_INITIALIZE
+)
+from sqlalchemy.orm.util import identity_key
+
+from galaxy import model
+
+log = logging.getLogger(__name__)
+
+MAX_IN_CLAUSE_IDS = 1000
+
+# Attributes whose changes may change the references or the counted size of datasets
+HDA_ATTRIBUTES = ("purged", "history_id", "dataset_id", "history", "dataset")
+HISTORY_ATTRIBUTES = ("purged", "user_id", "user")
+DATASET_ATTRIBUTES = ("total_size", "file_size")
+LDDA_ATTRIBUTES = ("dataset_id", "dataset")
+
+_SESSION_INFO_KEY = "user_disk_usage_changes"
+
+
+class FlushChanges(object):
+    """What a flush may change and the references and sizes before the flush."""
+
+    def __init__(self):
+        self.hda_ids = set()
+        self.new_hdas = []
+        self.history_ids = set()
+        self.dataset_ids = set()
+        # HDA id -> (user id, dataset id) of HDAs referencing a dataset
+        self.references = {}
+        # dataset id -> size counted in disk usage
+        self.sizes = {}
+
+    def __bool__(self):
+        return bool(self.hda_ids or self.new_hdas or self.history_ids or self.dataset_ids)
+    __nonzero__ = __bool__
+
+
+def install(session):
+    """Keep the disk usage of users current on flushes of ``session`` (a sessionmaker or scoped_session)."""
+    event.listen(session, "before_flush", _before_flush)
+    event.listen(session, "after_flush_postexec", _after_flush_postexec)
+
+
+def _changed(obj, keys):
+    return any(get_history(obj, key, passive=PASSIVE_NO_INITIALIZE).has_changes() for key in keys)
+
+
+def _dataset_id(ldda):
+    if ldda.dataset_id is not None:
+        return ldda.dataset_id
+    return ldda.dataset.id if ldda.dataset is not None else None
+
+
+def _before_flush(session, flush_context, instances):
+    """Find the objects whose changes may change disk usage and record their references and sizes before the flush."""
+    # Left by a flush that failed
+    session.info.pop(_SESSION_INFO_KEY, None)
+    changes = FlushChanges()
+    ldda_ids = set()
+    for obj in session.new:
+        if isinstance(obj, model.HistoryDatasetAssociation):
+            changes.new_hdas.append(obj)
+        elif isinstance(obj, model.LibraryDatasetDatasetAssociation):
+            # A dataset new in the flush is not referenced yet
+            changes.dataset_ids.add(_dataset_id(obj))
+    for obj in session.dirty:
+        if isinstance(obj, model.HistoryDatasetAssociation):
+            if obj.id is not None and _changed(obj, HDA_ATTRIBUTES):
+                changes.hda_ids.add(obj.id)
+        elif isinstance(obj, model.History):
+            if obj.id is not None and _changed(obj, HISTORY_ATTRIBUTES):
+                changes.history_ids.add(obj.id)
+        elif isinstance(obj, model.Dataset):
+            if obj.id is not None and _changed(obj, DATASET_ATTRIBUTES):
+                changes.dataset_ids.add(obj.id)
+        elif isinstance(obj, model.LibraryDatasetDatasetAssociation):
+            if obj.id is not None and _changed(obj, LDDA_ATTRIBUTES):
+                ldda_ids.add(obj.id)
+                changes.dataset_ids.add(_dataset_id(obj))
+    for obj in session.deleted:
+        if isinstance(obj, model.HistoryDatasetAssociation):
+            changes.hda_ids.add(obj.id)
+        elif isinstance(obj, model.History):
+            changes.history_ids.add(obj.id)
+        elif isinstance(obj, model.LibraryDatasetDatasetAssociation):
+            ldda_ids.add(obj.id)
+    ldda_table = model.LibraryDatasetDatasetAssociation.table
+    for chunk in chunked(sorted(ldda_ids), MAX_IN_CLAUSE_IDS):
+        changes.dataset_ids.update(dataset_id for dataset_id, in session.execute(
+            select([ldda_table.c.dataset_id]).where(ldda_table.c.id.in_(chunk))))
+    changes.dataset_ids.discard(None)
+    if not changes:
+        return
+    changes.references = references(session, changes.hda_ids, changes.history_ids)
+    changes.sizes = sizes(session, changes.dataset_ids)
+    session.info[_SESSION_INFO_KEY] = changes
+
+
+def _after_flush_postexec(session, flush_context):
+    """Apply the changes of references and sizes made by the flush."""
+    changes = session.info.pop(_SESSION_INFO_KEY, None)
+    if not changes:
+        return
+    hda_ids = changes.hda_ids | set(hda.id for hda in changes.new_hdas if hda.id is not None)
+    new_references = references(session, hda_ids, changes.history_ids)
+    new_sizes = sizes(session, changes.dataset_ids)
+    reference_deltas = Counter()
+    for key in changes.references.values():
+        reference_deltas[key] -= 1
+    for key in new_references.values():
+        reference_deltas[key] += 1
+    size_deltas = dict((dataset_id, new_sizes.get(dataset_id, 0) - size) for dataset_id, size in changes.sizes.items())
+    usage_deltas = apply_changes(session,
+                                 dict((key, delta) for key, delta in reference_deltas.items() if delta),
+                                 dict((dataset_id, delta) for dataset_id, delta in size_deltas.items() if delta))
+    for user_id in usage_deltas:
+        user = session.identity_map.get(identity_key(model.User, user_id))
+        if user is not None:
+            session.expire(user, ["disk_usage"])
+
+
+def references(session, hda_ids=(), history_ids=()):
+    """
+    Return the references to datasets of the HDAs ``hda_ids`` and of the HDAs
+    of the histories ``history_ids``, a dictionary of (user id, dataset id)
+    keyed by HDA id -- HDAs not referencing a dataset are not in it.
+    """
+    hda_table = model.HistoryDatasetAssociation.table
+    history_table = model.History.table
+    query = (select([hda_table.c.id, history_table.c.user_id, hda_table.c.dataset_id])
+             .select_from(hda_table.join(history_table, hda_table.c.history_id == history_table.c.id)))
+    counted = and_(hda_table.c.purged == false(), history_table.c.purged == false(), history_table.c.user_id.isnot(None),
+                   hda_table.c.dataset_id.isnot(None))
+    returned = {}
+    for column, ids in ((hda_table.c.id, hda_ids), (hda_table.c.history_id, history_ids)):
+        for chunk in chunked(sorted(ids), MAX_IN_CLAUSE_IDS):
+            for hda_id, user_id, dataset_id in session.execute(query.where(and_(column.in_(chunk), counted))):
+                returned[hda_id] = (user_id, dataset_id)
+    return returned
+
+
+def sizes(session, dataset_ids):
+    """Return the sizes of datasets ``dataset_ids`` counted in disk usage by dataset id, 0 for datasets in a library."""
+    dataset_table = model.Dataset.table
+    ldda_table = model.LibraryDatasetDatasetAssociation.table
+    returned = {}
+    for chunk in chunked(sorted(dataset_ids), MAX_IN_CLAUSE_IDS):
+        in_library = set(dataset_id for dataset_id, in session.execute(
+            select([ldda_table.c.dataset_id]).where(ldda_table.c.dataset_id.in_(chunk)).distinct()))
+        for dataset_id, size in session.execute(
+                select([dataset_table.c.id, func.coalesce(dataset_table.c.total_size, dataset_table.c.file_size, 0)])
+                .where(dataset_table.c.id.in_(chunk))):
+            returned[dataset_id] = 0 if dataset_id in in_library else int(size)
+    return returned
+
+
+def apply_changes(session, reference_deltas, size_deltas):
+    """
+    Apply ``reference_deltas``, changes of the counts of references keyed by
+    (user id, dataset id), and ``size_deltas``, changes of the counted sizes
+    of datasets keyed by dataset id, to the references and disk usage of
+    users. Returns the changes of disk usage by user id, None for users
+    whose references drifted and were reconciled.
+    """
+    table = model.UserDatasetReference.table
+    user_table = model.User.table
+    usage_deltas = Counter()
+    # Changes of size apply to the users referencing the datasets before the changes of references
+    for chunk in chunked(sorted(size_deltas), MAX_IN_CLAUSE_IDS):
+        for user_id, dataset_id in session.execute(select([table.c.user_id, table.c.dataset_id])
+                                                   .where(and_(table.c.dataset_id.in_(chunk), table.c.reference_count > 0))):
+            usage_deltas[user_id] += size_deltas[dataset_id]
+    by_user_id = defaultdict(dict)
+    for (user_id, dataset_id), delta in reference_deltas.items():
+        by_user_id[user_id][dataset_id] = delta
+    # Serialize the changes of references of a user
+    for chunk in chunked(sorted(by_user_id), MAX_IN_CLAUSE_IDS):
+        session.execute(select([user_table.c.id]).where(user_table.c.id.in_(chunk)).with_for_update()).fetchall()
+    # Datasets now first referenced (+1) or no longer referenced (-1) by users
+    transitions = []
+    drifted = set()
+    for user_id, deltas in sorted(by_user_id.items()):
+        for chunk in chunked(sorted(deltas), MAX_IN_CLAUSE_IDS):
+            counts = dict(session.execute(select([table.c.dataset_id, table.c.reference_count])
+                                          .where(and_(table.c.user_id == user_id, table.c.dataset_id.in_(chunk)))).fetchall())
+            for dataset_id in chunk:
+                old_count = counts.get(dataset_id)
+                count = (old_count or 0) + deltas[dataset_id]
+                if count < 0:
+                    drifted.add(user_id)
+                    continue
+                if old_count is None:
+                    session.execute(table.insert().values(user_id=user_id, dataset_id=dataset_id, reference_count=count))
+                elif count == 0:
+                    session.execute(table.delete().where(and_(table.c.user_id == user_id, table.c.dataset_id == dataset_id)))
+                else:
+                    session.execute(table.update().where(and_(table.c.user_id == user_id, table.c.dataset_id == dataset_id))
+                                    .values(reference_count=count))
+                if not old_count and count:
+                    transitions.append((user_id, dataset_id, 1))
+                elif old_count and not count:
+                    transitions.append((user_id, dataset_id, -1))
+    dataset_sizes = sizes(session, set(dataset_id for _, dataset_id, _ in transitions))
+    for user_id, dataset_id, sign in transitions:
+        usage_deltas[user_id] += sign * dataset_sizes.get(dataset_id, 0)
+    for user_id, delta in sorted(usage_deltas.items()):
+        if delta and user_id not in drifted:
+            session.execute(user_table.update().where(user_table.c.id == user_id)
+                            .values(disk_usage=func.coalesce(user_table.c.disk_usage, 0) + delta))
+    if drifted:
+        log.debug("References of users %s drifted, reconciling their disk usage", sorted(drifted))
+        reconcile(session, sorted(drifted))
+    usage_deltas = dict(usage_deltas)
+    usage_deltas.update((user_id, None) for user_id in drifted)
+    return usage_deltas
+
+
+def reconcile(session, user_ids):
+    """Rebuild the references to datasets of users ``user_ids`` from their HDAs and set their disk usage from scratch."""
+    table = model.UserDatasetReference.table
+    user_table = model.User.table
+    hda_table = model.HistoryDatasetAssociation.table
+    history_table = model.History.table
+    dataset_table = model.Dataset.table
+    ldda_table = model.LibraryDatasetDatasetAssociation.table
+    for user_id in user_ids:
+        session.execute(select([user_table.c.id]).where(user_table.c.id == user_id).with_for_update()).fetchall()
+        session.execute(table.delete().where(table.c.user_id == user_id))
+        session.execute(table.insert().from_select(
+            ["user_id", "dataset_id", "reference_count"],
+            select([history_table.c.user_id, hda_table.c.dataset_id, func.count()])
+            .select_from(hda_table.join(history_table, hda_table.c.history_id == history_table.c.id))
+            .where(and_(history_table.c.user_id == user_id, hda_table.c.purged == false(), history_table.c.purged == false(),
+                        hda_table.c.dataset_id.isnot(None)))
+            .group_by(history_table.c.user_id, hda_table.c.dataset_id)))
+        usage = (select([func.coalesce(func.sum(func.coalesce(dataset_table.c.total_size, dataset_table.c.file_size, 0)), 0)])
+                 .select_from(dataset_table.join(table, table.c.dataset_id == dataset_table.c.id))
+                 .where(and_(table.c.user_id == user_id,
+                             ~exists().where(ldda_table.c.dataset_id == dataset_table.c.id)))
+                 .as_scalar())
+        session.execute(user_table.update().where(user_table.c.id == user_id).values(disk_usage=usage))
@@ -22,11 +22,13 @@ except ImportError:
 
 from galaxy.exceptions import ObjectInvalid, ObjectNotFound
 from galaxy.util import (
+    asbool,
     directory_hash_id,
     force_symlink,
     umask_fix_perms,
 )
 from galaxy.util.bunch import Bunch
+from galaxy.util.lru import LRUCache
 from galaxy.util.path import (
     safe_makedirs,
     safe_relpath,
@@ -34,6 +36,10 @@ from galaxy.util.path import (
 from galaxy.util.sleeper import Sleeper
 
 NO_SESSION_ERROR_MESSAGE = "Attempted to 'create' object store entity in configuration with no database session present."
+DEFAULT_FSMON_INTERVAL = 120  # seconds
+DEFAULT_STORE_ID_CACHE_SIZE = 100000
+# Backends that are fully busy keep this share of their weight
+MIN_IO_HEADROOM = 0.05
 
 log = logging.getLogger(__name__)
 
@@ -115,6 +121,20 @@ class ObjectStore(object):
         """Return True if the object identified by `obj` exists, False otherwise."""
         raise NotImplementedError()
 
+    def exists_many(self, objs, **kwargs):
+        """
+        Return a list of booleans telling whether each object in `objs`
+        exists, the keyword arguments are the ones of `exists`.
+        """
+        return [self.exists(obj, **kwargs) for obj in objs]
+
+    def locate_many(self, objs):
+        """
+        Prepare for accessing many objects at once, e.g. the inputs of a job
+        or the datasets of a listing. Stores that need to search for objects
+        (i.e. the distributed one) locate them here in a single pass.
+        """
+
     def file_ready(self, obj, base_dir=None, dir_only=False, extra_dir=None, extra_dir_at_root=False, alt_name=None, obj_dir=False):
         """
         Check if a file corresponding to a dataset is ready to be used.
@@ -394,6 +414,31 @@ class DiskObjectStore(ObjectStore):
                 return True
         return os.path.exists(self._construct_path(obj, **kwargs))
 
+    def exists_many(self, objs, **kwargs):
+        """
+        Check the existence of many objects, listing each directory holding
+        more than one of them once instead of checking every path.
+        """
+        if self.check_old_style:
+            return super(DiskObjectStore, self).exists_many(objs, **kwargs)
+        paths_by_dir = OrderedDict()
+        for index, obj in enumerate(objs):
+            dirname, basename = os.path.split(self._construct_path(obj, **kwargs))
+            paths_by_dir.setdefault(dirname, []).append((index, basename))
+        result = [False] * len(objs)
+        for dirname, entries in paths_by_dir.items():
+            if len(entries) == 1:
+                index, basename = entries[0]
+                result[index] = os.path.exists(os.path.join(dirname, basename))
+                continue
+            try:
+                listing = set(os.listdir(dirname))
+            except OSError:
+                continue
+            for index, basename in entries:
+                result[index] = basename in listing
+        return result
+
     def create(self, obj, **kwargs):
         """Override `ObjectStore`'s stub by creating any files and folders on disk."""
         if not self.exists(obj, **kwargs):
@@ -530,6 +575,23 @@ class NestedObjectStore(ObjectStore):
         """Determine if the `obj` exists in any of the backends."""
         return self._call_method('exists', obj, False, False, **kwargs)
 
+    def exists_many(self, objs, **kwargs):
+        """Determine which of `objs` exist in any of the backends, checking each backend once."""
+        result = [False] * len(objs)
+        remaining = list(range(len(objs)))
+        for store in self.backends.values():
+            if not remaining:
+                break
+            found = store.exists_many([objs[i] for i in remaining], **kwargs)
+            missing = []
+            for index, exists in zip(remaining, found):
+                if exists:
+                    result[index] = True
+                else:
+                    missing.append(index)
+            remaining = missing
+        return result
+
     def file_ready(self, obj, **kwargs):
         """Determine if the file for `obj` is ready to be used by any of the backends."""
         return self._call_method('file_ready', obj, False, False, **kwargs)
@@ -597,7 +659,12 @@ class DistributedObjectStore(NestedObjectStore):
 
     When getting objects the first store where the object exists is used.
     When creating objects they are created in a store selected randomly, but
-    with weighting.
+    with weighting. With dynamic weights the configured weight of each
+    backend is scaled by its free space and I/O headroom, as measured by the
+    file system monitor.
+
+    The backend found for objects without an ``object_store_id`` is
+    remembered, so they are only searched for once.
     """
     store_type = 'distributed'
 
@@ -619,10 +686,12 @@ class DistributedObjectStore(NestedObjectStore):
         super(DistributedObjectStore, self).__init__(config, config_dict)
 
         self.backends = {}
-        self.weighted_backend_ids = []
-        self.original_weighted_backend_ids = []
+        self.weights = OrderedDict()
         self.max_percent_full = {}
         self.global_max_percent_full = config_dict.get("global_max_percent_full", 0)
+        self.fsmon_interval = config_dict.get("fsmon_interval", DEFAULT_FSMON_INTERVAL)
+        self.dynamic_weights = asbool(config_dict.get("dynamic_weights", False))
+        self._store_id_cache = LRUCache(config_dict.get("store_id_cache_size", DEFAULT_STORE_ID_CACHE_SIZE))
         random.seed()
 
         backends_def = config_dict["backends"]
@@ -635,17 +704,14 @@ class DistributedObjectStore(NestedObjectStore):
             disk_config_dict = dict(files_dir=file_path, extra_dirs=extra_dirs)
             self.backends[backened_id] = DiskObjectStore(config, disk_config_dict)
             self.max_percent_full[backened_id] = maxpctfull
+            self.weights[backened_id] = weight
             log.debug("Loaded disk backend '%s' with weight %s and file_path: %s" % (backened_id, weight, file_path))
-
-            for i in range(0, weight):
-                # The simplest way to do weighting: add backend ids to a
-                # sequence the number of times equalling weight, then randomly
-                # choose a backend from that sequence at creation
-                self.weighted_backend_ids.append(backened_id)
-        self.original_weighted_backend_ids = self.weighted_backend_ids
+        # The (backend id, weight) pairs new objects are distributed over,
+        # updated by the file system monitor
+        self.backend_weights = [(id, weight) for id, weight in self.weights.items() if weight > 0]
 
         self.sleeper = None
-        if fsmon and (self.global_max_percent_full or [_ for _ in self.max_percent_full.values() if _ != 0.0]):
+        if fsmon and (self.global_max_percent_full or self.dynamic_weights or [_ for _ in self.max_percent_full.values() if _ != 0.0]):
             self.sleeper = Sleeper()
             self.filesystem_monitor_thread = threading.Thread(target=self.__filesystem_monitor)
             self.filesystem_monitor_thread.setDaemon(True)
@@ -662,6 +728,9 @@ class DistributedObjectStore(NestedObjectStore):
         backends = []
         config_dict = {
             'global_max_percent_full': float(backends_root.get('maxpctfull', 0)),
+            'fsmon_interval': float(backends_root.get('fsmon_interval', DEFAULT_FSMON_INTERVAL)),
+            'dynamic_weights': asbool(backends_root.get('dynamic_weights', False)),
+            'store_id_cache_size': int(backends_root.get('store_id_cache_size', DEFAULT_STORE_ID_CACHE_SIZE)),
             'backends': backends,
         }
 
@@ -715,12 +784,15 @@ class DistributedObjectStore(NestedObjectStore):
     def to_dict(self):
         as_dict = super(DistributedObjectStore, self).to_dict()
         as_dict["global_max_percent_full"] = self.global_max_percent_full
+        as_dict["fsmon_interval"] = self.fsmon_interval
+        as_dict["dynamic_weights"] = self.dynamic_weights
+        as_dict["store_id_cache_size"] = self._store_id_cache.maxsize
         backends = []
         for backend_id, backend in self.backends.items():
             backend_as_dict = backend.to_dict()
             backend_as_dict["id"] = backend_id
             backend_as_dict["max_percent_full"] = self.max_percent_full[backend_id]
-            backend_as_dict["weight"] = len([i for i in self.original_weighted_backend_ids if i == backend_id])
+            backend_as_dict["weight"] = self.weights[backend_id]
             backends.append(backend_as_dict)
         as_dict["backends"] = backends
         return as_dict
@@ -732,23 +804,50 @@ class DistributedObjectStore(NestedObjectStore):
             self.sleeper.wake()
 
     def __filesystem_monitor(self):
+        last_io_ticks = {}
+        last_check = None
         while self.running:
-            new_weighted_backend_ids = self.original_weighted_backend_ids
+            now = time.time()
+            backend_weights = []
             for id, backend in self.backends.items():
+                weight = self.weights[id]
                 maxpct = self.max_percent_full[id] or self.global_max_percent_full
                 pct = backend.get_store_usage_percent()
-                if pct > maxpct:
-                    new_weighted_backend_ids = [_ for _ in new_weighted_backend_ids if _ != id]
-            self.weighted_backend_ids = new_weighted_backend_ids
-            self.sleeper.sleep(120)  # Test free space every 2 minutes
+                if maxpct and pct > maxpct:
+                    continue
+                if self.dynamic_weights:
+                    # Scale by the share of the usable space that is still free
+                    limit = maxpct or 100.0
+                    weight *= max(limit - pct, 0.0) / limit
+                    io_ticks = _device_io_ticks(backend.file_path)
+                    if io_ticks is not None and last_io_ticks.get(id) is not None:
+                        # Scale by the share of the time the device was idle
+                        busy = float(io_ticks - last_io_ticks[id]) / ((now - last_check) * 1000)
+                        weight *= max(1.0 - busy, MIN_IO_HEADROOM)
+                    last_io_ticks[id] = io_ticks
+                if weight > 0:
+                    backend_weights.append((id, weight))
+            last_check = now
+            self.backend_weights = backend_weights
+            self.sleeper.sleep(self.fsmon_interval)
+
+    def _select_backend_id(self):
+        """Randomly select the backend of a new object according to the current weights."""
+        backend_weights = self.backend_weights
+        point = random.uniform(0, sum(weight for _, weight in backend_weights))
+        for id, weight in backend_weights:
+            point -= weight
+            if point <= 0:
+                return id
+        # Floating point rounding, or no backend has space left
+        return backend_weights[-1][0] if backend_weights else None
 
     def create(self, obj, **kwargs):
         """The only method in which obj.object_store_id may be None."""
         if obj.object_store_id is None or not self.exists(obj, **kwargs):
             if obj.object_store_id is None or obj.object_store_id not in self.backends:
-                try:
-                    obj.object_store_id = random.choice(self.weighted_backend_ids)
-                except IndexError:
+                obj.object_store_id = self._select_backend_id()
+                if obj.object_store_id is None:
                     raise ObjectInvalid('objectstore.create, could not generate '
                                         'obj.object_store_id: %s, kwargs: %s'
                                         % (str(obj), str(kwargs)))
@@ -760,6 +859,45 @@ class DistributedObjectStore(NestedObjectStore):
                           % (obj.object_store_id, obj.__class__.__name__, obj.id))
             self.backends[obj.object_store_id].create(obj, **kwargs)
 
+    def exists_many(self, objs, **kwargs):
+        """
+        Determine which of `objs` exist. Objects with a known backend are
+        checked in it, the other ones are searched for with one call per
+        backend.
+        """
+        result = [False] * len(objs)
+        indices_by_store_id = OrderedDict()
+        unknown = []
+        for index, obj in enumerate(objs):
+            object_store_id = self.__known_store_id_for(obj)
+            if object_store_id is None:
+                unknown.append(index)
+            else:
+                indices_by_store_id.setdefault(object_store_id, []).append(index)
+        for object_store_id, indices in indices_by_store_id.items():
+            found = self.backends[object_store_id].exists_many([objs[i] for i in indices], **kwargs)
+            for index, exists in zip(indices, found):
+                result[index] = exists
+        for id, store in self.backends.items():
+            if not unknown:
+                break
+            found = store.exists_many([objs[i] for i in unknown], **kwargs)
+            missing = []
+            for index, exists in zip(unknown, found):
+                if exists:
+                    result[index] = True
+                    self.__found_in(objs[index], id)
+                else:
+                    missing.append(index)
+            unknown = missing
+        return result
+
+    def locate_many(self, objs):
+        """Find the backends of the objects of `objs` not known yet with `exists_many`."""
+        unknown = [obj for obj in objs if self.__known_store_id_for(obj) is None]
+        if unknown:
+            self.exists_many(unknown)
+
     def _call_method(self, method, obj, default, default_is_exception, **kwargs):
         object_store_id = self.__get_store_id_for(obj, **kwargs)
         if object_store_id is not None:
@@ -770,22 +908,40 @@ class DistributedObjectStore(NestedObjectStore):
         else:
             return default
 
-    def __get_store_id_for(self, obj, **kwargs):
+    def __store_id_cache_key(self, obj):
+        return (obj.__class__.__name__, self._get_object_id(obj))
+
+    def __known_store_id_for(self, obj):
+        """Return the backend recorded on `obj` or where it was found before, None if unknown."""
         if obj.object_store_id is not None:
             if obj.object_store_id in self.backends:
                 return obj.object_store_id
             else:
                 log.warning('The backend object store ID (%s) for %s object with ID %s is invalid'
                             % (obj.object_store_id, obj.__class__.__name__, obj.id))
+        object_store_id = self._store_id_cache.get(self.__store_id_cache_key(obj))
+        if object_store_id in self.backends:
+            obj.object_store_id = object_store_id
+            return object_store_id
+        return None
+
+    def __found_in(self, obj, id):
+        log.warning('%s object with ID %s found in backend object store with ID %s'
+                    % (obj.__class__.__name__, obj.id, id))
+        self._store_id_cache[self.__store_id_cache_key(obj)] = id
+        obj.object_store_id = id
+        _create_object_in_session(obj)
+
+    def __get_store_id_for(self, obj, **kwargs):
+        object_store_id = self.__known_store_id_for(obj)
+        if object_store_id is not None:
+            return object_store_id
         # if this instance has been switched from a non-distributed to a
         # distributed object store, or if the object's store id is invalid,
         # try to locate the object
         for id, store in self.backends.items():
             if store.exists(obj, **kwargs):
-                log.warning('%s object with ID %s found in backend object store with ID %s'
-                            % (obj.__class__.__name__, obj.id, id))
-                obj.object_store_id = id
-                _create_object_in_session(obj)
+                self.__found_in(obj, id)
                 return id
         return None
 
@@ -947,6 +1103,24 @@ def local_extra_dirs(func):
     return wraps
 
 
+def _device_io_ticks(path):
+    """
+    Return the milliseconds the block device holding `path` spent doing I/O
+    since boot, or None if unknown (not on Linux, network file systems).
+    """
+    try:
+        st_dev = os.stat(path).st_dev
+        device = (os.major(st_dev), os.minor(st_dev))
+        with open("/proc/diskstats") as diskstats:
+            for line in diskstats:
+                fields = line.split()
+                if (int(fields[0]), int(fields[1])) == device:
+                    return int(fields[12])
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
 def convert_bytes(bytes):
     """A helper function used for pretty printing disk usage."""
     if bytes is None:
@@ -27,6 +27,12 @@ from galaxy.util import (
 )
 from galaxy.util.path import safe_relpath
 from galaxy.util.sleeper import Sleeper
+from .caching import CacheIndex
+from .ranged_download import (
+    DEFAULT_DOWNLOAD_PART_SIZE,
+    DEFAULT_DOWNLOAD_THREADS,
+    ranged_download,
+)
 from ..objectstore import (
     convert_bytes,
     ObjectStore
@@ -52,6 +58,8 @@ def parse_config_xml(config_xml):
         c_xml = config_xml.findall('cache')[0]
         cache_size = float(c_xml.get('size', -1))
         staging_path = c_xml.get('path', None)
+        download_threads = int(c_xml.get('download_threads', DEFAULT_DOWNLOAD_THREADS))
+        download_part_size = int(c_xml.get('download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
 
         tag, attrs = 'extra_dir', ('type', 'path')
         extra_dirs = config_xml.findall(tag)
@@ -72,6 +80,8 @@ def parse_config_xml(config_xml):
             'cache': {
                 'size': cache_size,
                 'path': staging_path,
+                'download_threads': download_threads,
+                'download_part_size': download_part_size,
             },
             'extra_dirs': extra_dirs,
         }
@@ -106,6 +116,8 @@ class AzureBlobObjectStore(ObjectStore):
 
         self.cache_size = cache_dict.get('size', -1)
         self.staging_path = cache_dict.get('path') or self.config.object_store_cache_path
+        self.download_threads = int(cache_dict.get('download_threads', DEFAULT_DOWNLOAD_THREADS))
+        self.download_part_size = int(cache_dict.get('download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
 
         self._initialize()
 
@@ -115,10 +127,12 @@ class AzureBlobObjectStore(ObjectStore):
 
         self._configure_connection()
 
+        self.cache_index = None
         # Clean cache only if value is set in galaxy.ini
         if self.cache_size != -1:
             # Convert GBs to bytes for comparison
             self.cache_size = self.cache_size * 1073741824
+            self.cache_index = CacheIndex(self.staging_path)
             # Helper for interruptable sleep
             self.sleeper = Sleeper()
             self.cache_monitor_thread = threading.Thread(target=self.__cache_monitor)
@@ -139,6 +153,8 @@ class AzureBlobObjectStore(ObjectStore):
             'cache': {
                 'size': self.cache_size,
                 'path': self.staging_path,
+                'download_threads': self.download_threads,
+                'download_part_size': self.download_part_size,
             }
         })
         return as_dict
@@ -249,6 +265,8 @@ class AzureBlobObjectStore(ObjectStore):
         # Now pull in the file
         file_ok = self._download(rel_path)
         self._fix_permissions(self._get_cache_path(rel_path_dir))
+        if file_ok and self.cache_index is not None:
+            self.cache_index.touch(rel_path)
         return file_ok
 
     def _transfer_cb(self, complete, total):
@@ -258,11 +276,22 @@ class AzureBlobObjectStore(ObjectStore):
         local_destination = self._get_cache_path(rel_path)
         try:
             log.debug("Pulling '%s' into cache to %s", rel_path, local_destination)
-            if self.cache_size > 0 and self._get_size_in_azure(rel_path) > self.cache_size:
+            properties = self.service.get_blob_properties(self.container_name, rel_path)
+            if type(properties) is Blob:
+                properties = properties.properties
+            size = properties.content_length
+            if self.cache_size > 0 and size > self.cache_size:
                 log.critical("File %s is larger (%s) than the cache size (%s). Cannot download.",
-                             rel_path, self._get_size_in_azure(rel_path), self.cache_size)
+                             rel_path, size, self.cache_size)
                 return False
             else:
+                part_size = self.download_part_size * 1024 * 1024
+                if self.download_threads > 1 and size > part_size:
+                    try:
+                        self._ranged_download(rel_path, size, properties.etag, part_size)
+                        return True
+                    except Exception:
+                        log.exception("Parallel download of '%s' failed, downloading it as a single stream", rel_path)
                 self.transfer_progress = 0  # Reset transfer progress counter
                 self.service.get_blob_to_path(self.container_name, rel_path, local_destination, progress_callback=self._transfer_cb)
                 return True
@@ -270,6 +299,16 @@ class AzureBlobObjectStore(ObjectStore):
             log.exception("Problem downloading '%s' from Azure", rel_path)
         return False
 
+    def _ranged_download(self, rel_path, size, etag, part_size):
+        def fetch_range(start, end):
+            # if_match makes sure all parts are from the same version of the blob
+            blob = self.service.get_blob_to_bytes(self.container_name, rel_path, start_range=start, end_range=end,
+                                                  if_match=etag, max_connections=1)
+            return blob.content
+
+        self.transfer_progress = 0
+        ranged_download(fetch_range, size, self._get_cache_path(rel_path), part_size=part_size, threads=self.download_threads)
+
     def _push_to_os(self, rel_path, source_file=None, from_string=None):
         """
         Push the file pointed to by ``rel_path`` to the object store naming the blob
@@ -391,6 +430,8 @@ class AzureBlobObjectStore(ObjectStore):
             if not dir_only:
                 rel_path = os.path.join(rel_path, alt_name if alt_name else "dataset_%s.dat" % obj.id)
                 open(os.path.join(self.staging_path, rel_path), 'w').close()
+                if self.cache_index is not None:
+                    self.cache_index.touch(rel_path, size=0)
                 self._push_to_os(rel_path, from_string='')
 
     def empty(self, obj, **kwargs):
@@ -429,6 +470,8 @@ class AzureBlobObjectStore(ObjectStore):
             # but requires iterating through each individual blob in Azure and deleing it.
             if entire_dir and extra_dir:
                 shutil.rmtree(self._get_cache_path(rel_path))
+                if self.cache_index is not None:
+                    self.cache_index.remove(rel_path)
                 blobs = self.service.list_blobs(self.container_name, prefix=rel_path)
                 for blob in blobs:
                     log.debug("Deleting from Azure: %s", blob)
@@ -437,6 +480,8 @@ class AzureBlobObjectStore(ObjectStore):
             else:
                 # Delete from cache first
                 os.unlink(self._get_cache_path(rel_path))
+                if self.cache_index is not None:
+                    self.cache_index.remove(rel_path)
                 # Delete from S3 as well
                 if self._in_azure(rel_path):
                     log.debug("Deleting from Azure: %s", rel_path)
@@ -453,6 +498,8 @@ class AzureBlobObjectStore(ObjectStore):
         # Check cache first and get file if not there
         if not self._in_cache(rel_path):
             self._pull_into_cache(rel_path)
+        elif self.cache_index is not None:
+            self.cache_index.access(rel_path)
         # Read the file content from cache
         data_file = open(self._get_cache_path(rel_path), 'r')
         data_file.seek(start)
@@ -481,6 +528,8 @@ class AzureBlobObjectStore(ObjectStore):
         #     return cache_path
         # Check if the file exists in the cache first
         if self._in_cache(rel_path):
+            if self.cache_index is not None and not dir_only:
+                self.cache_index.access(rel_path)
             return cache_path
         # Check if the file exists in persistent storage and, if it does, pull it into cache
         elif self.exists(obj, **kwargs):
@@ -515,6 +564,8 @@ class AzureBlobObjectStore(ObjectStore):
             else:
                 source_file = self._get_cache_path(rel_path)
 
+            if self.cache_index is not None:
+                self.cache_index.touch(rel_path)
             self._push_to_os(rel_path, source_file)
 
         else:
@@ -540,21 +591,11 @@ class AzureBlobObjectStore(ObjectStore):
     def __cache_monitor(self):
         time.sleep(2)  # Wait for things to load before starting the monitor
         while self.running:
-            total_size = 0
-            # Is this going to be too expensive of an operation to be done frequently?
-            file_list = []
-            for dirpath, _, filenames in os.walk(self.staging_path):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    file_size = os.path.getsize(filepath)
-                    total_size += file_size
-                    # Get the time given file was last accessed
-                    last_access_time = time.localtime(os.stat(filepath)[7])
-                    # Compose a tuple of the access time and the file path
-                    file_tuple = last_access_time, filepath, file_size
-                    file_list.append(file_tuple)
-            # Sort the file list (based on access time)
-            file_list.sort()
+            try:
+                self.cache_index.reconcile_if_due()
+            except Exception:
+                log.exception("Reconciling the cache index failed")
+            total_size = self.cache_index.total_size()
             # Initiate cleaning once within 10% of the defined cache size?
             cache_limit = self.cache_size * 0.9
             if total_size > cache_limit:
@@ -565,21 +606,6 @@ class AzureBlobObjectStore(ObjectStore):
                 # the limit - maybe delete additional #%?
                 # For now, delete enough to leave at least 10% of the total cache free
                 delete_this_much = total_size - cache_limit
-                # Keep deleting datasets from file_list until deleted_amount does not
-                # exceed delete_this_much; start deleting from the front of the file list,
-                # which assumes the oldest files come first on the list.
-                deleted_amount = 0
-                for entry in enumerate(file_list):
-                    if deleted_amount < delete_this_much:
-                        deleted_amount += entry[2]
-                        os.remove(entry[1])
-                        # Debugging code for printing deleted files' stats
-                        # folder, file_name = os.path.split(f[1])
-                        # file_date = time.strftime("%m/%d/%y %H:%M:%S", f[0])
-                        # log.debug("%s. %-25s %s, size %s (deleted %s/%s)" \
-                        #     % (i, file_name, convert_bytes(f[2]), file_date, \
-                        #     convert_bytes(deleted_amount), convert_bytes(delete_this_much)))
-                    else:
-                        log.debug("Cache cleaning done. Total space freed: %s", convert_bytes(deleted_amount))
-
+                deleted_amount = self.cache_index.clean(delete_this_much)
+                log.debug("Cache cleaning done. Total space freed: %s", convert_bytes(deleted_amount))
             self.sleeper.sleep(30)  # Test cache size every 30 seconds?
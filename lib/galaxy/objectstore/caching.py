@@ -0,0 +1,352 @@
+"""
+Index of the files in the local cache of the object stores keeping their
+data elsewhere (S3, Swift, Azure, cloud providers).
+
+The index records the size and the last access time of each cached file in
+an SQLite database shared by all Galaxy processes using the same cache
+directory, so the cache size can be checked and the least recently used
+files found without walking the cache. It also journals the files still to
+be uploaded by stores writing behind the cache, these are never evicted.
+
+Accesses to cached files (cache hits) are buffered in memory and written to
+the index at most every ``ACCESS_FLUSH_INTERVAL`` seconds, so reads do not
+take the (cross-process) write lock of the index; failing to take it is not
+fatal, the accesses are kept until the next flush. The index is reconciled
+with the content of the cache directory every ``reconcile_interval``
+seconds, accounting for files added or removed by other means.
+"""
+import errno
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+CACHE_INDEX_FILENAME = ".galaxy_cache_index.sqlite"
+# Seconds between writes of buffered accesses to the index
+ACCESS_FLUSH_INTERVAL = 60
+# Buffered accesses written at once regardless of the interval
+ACCESS_FLUSH_SIZE = 10000
+# Seconds between reconciliations of the index with the cache directory
+RECONCILE_INTERVAL = 3600
+
+# The total size of the indexed files is kept up to date by triggers, so it
+# does not depend on how many files are cached.
+CACHE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_file (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_file_last_access ON cache_file (last_access);
+CREATE TABLE IF NOT EXISTS cache_total (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_total (id, size) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_file_insert AFTER INSERT ON cache_file BEGIN
+    UPDATE cache_total SET size = size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_file_delete AFTER DELETE ON cache_file BEGIN
+    UPDATE cache_total SET size = size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_file_update AFTER UPDATE OF size ON cache_file BEGIN
+    UPDATE cache_total SET size = size - OLD.size + NEW.size WHERE id = 0;
+END;
+CREATE TABLE IF NOT EXISTS cache_reconcile (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    reconciled REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_upload (
+    path TEXT PRIMARY KEY,
+    queued REAL NOT NULL,
+    owner TEXT NOT NULL
+);
+"""
+
+
+def upload_owner():
+    """Identify this process as the owner of the uploads it queues."""
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def _owner_is_gone(owner):
+    """
+    Whether the process that queued an upload is no longer running. Owners on
+    other hosts are assumed to be alive, they resume their own uploads.
+    """
+    hostname, _, pid = owner.rpartition(":")
+    if hostname != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+    except ValueError:
+        return True
+    return False
+
+
+class CacheIndex(object):
+    """
+    Track the size and last access time of the files below ``cache_path``.
+
+    Paths may be given either absolute or relative to ``cache_path``.
+    """
+
+    def __init__(self, cache_path, index_path=None, reconcile_interval=RECONCILE_INTERVAL):
+        self.cache_path = os.path.abspath(cache_path)
+        self.index_path = index_path or os.path.join(self.cache_path, CACHE_INDEX_FILENAME)
+        self.reconcile_interval = reconcile_interval
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+        new_index = not os.path.exists(self.index_path)
+        self._lock = threading.Lock()
+        # path -> time of the accesses not written to the index yet
+        self._accesses = {}
+        self._accesses_lock = threading.Lock()
+        self._accesses_flushed = time.time()
+        self._connection = sqlite3.connect(self.index_path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.executescript(CACHE_INDEX_SCHEMA)
+        if new_index:
+            self.rebuild()
+
+    def _relpath(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.cache_path)
+        return os.path.normpath(path)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def touch(self, path, size=None):
+        """
+        Record an access to the cached file ``path``, (re)reading its size
+        from disk unless ``size`` is given. Missing files are dropped from
+        the index.
+        """
+        path = self._relpath(path)
+        if size is None:
+            try:
+                size = os.path.getsize(os.path.join(self.cache_path, path))
+            except OSError:
+                self.remove(path)
+                return
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.execute("UPDATE cache_file SET size = ?, last_access = ? WHERE path = ?", (size, now, path))
+            if cursor.rowcount == 0:
+                cursor.execute("INSERT INTO cache_file (path, size, last_access) VALUES (?, ?, ?)", (path, size, now))
+
+    def access(self, path):
+        """
+        Record an access to ``path`` without checking its size (e.g. on a
+        cache hit). The access is buffered, see ``flush_accesses``.
+        """
+        path = self._relpath(path)
+        now = time.time()
+        with self._accesses_lock:
+            self._accesses[path] = now
+            due = len(self._accesses) >= ACCESS_FLUSH_SIZE or now - self._accesses_flushed >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush_accesses()
+
+    def flush_accesses(self):
+        """
+        Write the buffered accesses to the index. Returns ``False`` if the
+        index could not be written (e.g. it is locked by another process), the
+        accesses are then kept for the next flush.
+        """
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, {}
+            self._accesses_flushed = time.time()
+        if not accesses:
+            return True
+        try:
+            with self._transaction() as cursor:
+                not_indexed = []
+                for path, last_access in accesses.items():
+                    cursor.execute("UPDATE cache_file SET last_access = MAX(last_access, ?) WHERE path = ?", (last_access, path))
+                    if cursor.rowcount == 0:
+                        not_indexed.append((path, last_access))
+                for path, last_access in not_indexed:
+                    # Not indexed yet, e.g. written directly into the cache
+                    try:
+                        size = os.path.getsize(os.path.join(self.cache_path, path))
+                    except OSError:
+                        continue
+                    cursor.execute("INSERT INTO cache_file (path, size, last_access) VALUES (?, ?, ?)", (path, size, last_access))
+        except sqlite3.Error as e:
+            log.warning("Could not record accesses to cached files in %s, will retry: %s", self.index_path, e)
+            with self._accesses_lock:
+                for path, last_access in accesses.items():
+                    if self._accesses.get(path, 0) < last_access:
+                        self._accesses[path] = last_access
+            return False
+        return True
+
+    def remove(self, path):
+        """Drop the file or directory ``path`` (and everything below it) from the index."""
+        path = self._relpath(path)
+        # Every path below ``path`` sorts between "path/" and "path0" ("0"
+        # follows "/"), so this uses the primary key index unlike LIKE would.
+        params = (path, path + os.sep, path + chr(ord(os.sep) + 1))
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM cache_file WHERE path = ? OR (path > ? AND path < ?)", params)
+            # Deleted files do not need to be uploaded anymore
+            cursor.execute("DELETE FROM pending_upload WHERE path = ? OR (path > ? AND path < ?)", params)
+
+    def total_size(self):
+        with self._lock:
+            return self._connection.execute("SELECT size FROM cache_total WHERE id = 0").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache_file").fetchone()[0]
+
+    def least_recently_used(self, limit=1000):
+        """Return up to ``limit`` ``(path, size)`` tuples of the least recently accessed files."""
+        self.flush_accesses()
+        with self._lock:
+            return self._connection.execute(
+                "SELECT path, size FROM cache_file WHERE path NOT IN (SELECT path FROM pending_upload) "
+                "ORDER BY last_access LIMIT ?", (limit,)).fetchall()
+
+    def clean(self, delete_this_much):
+        """
+        Delete the least recently used files from the cache until at least
+        ``delete_this_much`` bytes have been freed, returns the number of
+        bytes freed.
+        """
+        deleted_amount = 0
+        while deleted_amount < delete_this_much:
+            entries = self.least_recently_used()
+            if not entries:
+                break
+            for path, size in entries:
+                if deleted_amount >= delete_this_much:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_path, path))
+                    deleted_amount += size
+                except OSError as e:
+                    # Already gone, only drop the index entry
+                    log.debug("Could not remove cached file %s: %s", path, e)
+                with self._transaction() as cursor:
+                    cursor.execute("DELETE FROM cache_file WHERE path = ?", (path,))
+        return deleted_amount
+
+    def add_pending_upload(self, path, owner=None):
+        """
+        Journal that ``path`` must still be uploaded, returns the time it was
+        queued at which identifies this version of the file.
+        """
+        path = self._relpath(path)
+        queued = time.time()
+        with self._transaction() as cursor:
+            cursor.execute("INSERT OR REPLACE INTO pending_upload (path, queued, owner) VALUES (?, ?, ?)",
+                           (path, queued, owner or upload_owner()))
+        return queued
+
+    def finish_pending_upload(self, path, queued):
+        """
+        Drop ``path`` from the journal once it has been uploaded, unless it
+        was queued again (i.e. changed) in the meantime. Returns ``True`` if
+        the upload was done.
+        """
+        path = self._relpath(path)
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM pending_upload WHERE path = ? AND queued = ?", (path, queued))
+            return cursor.rowcount > 0
+
+    def is_pending_upload(self, path, queued=None):
+        path = self._relpath(path)
+        with self._lock:
+            row = self._connection.execute("SELECT queued FROM pending_upload WHERE path = ?", (path,)).fetchone()
+        return row is not None and (queued is None or row[0] == queued)
+
+    def claim_pending_uploads(self, owner=None):
+        """
+        Take over the uploads queued by processes that are no longer running
+        (e.g. before Galaxy was restarted), returns their ``(path, queued)``.
+        """
+        owner = owner or upload_owner()
+        with self._transaction() as cursor:
+            rows = cursor.execute("SELECT path, queued, owner FROM pending_upload").fetchall()
+            claimed = [(path, queued) for path, queued, row_owner in rows if row_owner != owner and _owner_is_gone(row_owner)]
+            cursor.executemany("UPDATE pending_upload SET owner = ? WHERE path = ?", [(owner, path) for path, _ in claimed])
+        return claimed
+
+    def _walk(self):
+        """Return a ``path -> (size, access time)`` map of the files of the cache directory."""
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.cache_path):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                if filepath.startswith(self.index_path):
+                    continue
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                entries[self._relpath(filepath)] = (stat.st_size, stat.st_atime)
+        return entries
+
+    def rebuild(self):
+        """Replace the index with the current content of the cache directory."""
+        log.info("Building cache index %s of %s", self.index_path, self.cache_path)
+        entries = self._walk()
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM cache_file")
+            cursor.executemany("INSERT INTO cache_file (path, size, last_access) VALUES (?, ?, ?)",
+                               [(path, size, atime) for path, (size, atime) in entries.items()])
+            cursor.execute("INSERT OR REPLACE INTO cache_reconcile (id, reconciled) VALUES (0, ?)", (time.time(),))
+
+    def reconcile(self):
+        """
+        Update the index with the content of the cache directory: index the
+        files missing from it, drop the entries of files no longer there and
+        update the sizes that changed, keeping the recorded access times.
+        """
+        self.flush_accesses()
+        entries = self._walk()
+        with self._transaction() as cursor:
+            indexed = dict(cursor.execute("SELECT path, size FROM cache_file").fetchall())
+            cursor.executemany("DELETE FROM cache_file WHERE path = ?", [(path,) for path in indexed if path not in entries])
+            cursor.executemany("INSERT INTO cache_file (path, size, last_access) VALUES (?, ?, ?)",
+                               [(path, size, atime) for path, (size, atime) in entries.items() if path not in indexed])
+            cursor.executemany("UPDATE cache_file SET size = ? WHERE path = ?",
+                               [(size, path) for path, (size, _) in entries.items() if path in indexed and indexed[path] != size])
+            cursor.execute("INSERT OR REPLACE INTO cache_reconcile (id, reconciled) VALUES (0, ?)", (time.time(),))
+
+    def reconcile_if_due(self):
+        """
+        Reconcile the index if no process using it did in the last
+        ``reconcile_interval`` seconds, returns whether it was reconciled.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT reconciled FROM cache_reconcile WHERE id = 0").fetchone()
+        if row is not None and time.time() - row[0] < self.reconcile_interval:
+            return False
+        log.debug("Reconciling cache index %s with %s", self.index_path, self.cache_path)
+        self.reconcile()
+        return True
+
+    def close(self):
+        self.flush_accesses()
+        with self._lock:
+            self._connection.close()
@@ -3,15 +3,15 @@ Object Store plugin for Cloud storage.
 """
 
 import logging
-import multiprocessing
 import os
 import os.path
 import shutil
-import subprocess
 import threading
 import time
 from datetime import datetime
 
+import requests
+
 from galaxy.exceptions import ObjectInvalid, ObjectNotFound
 from galaxy.util import (
     directory_hash_id,
@@ -19,6 +19,12 @@ from galaxy.util import (
     umask_fix_perms,
 )
 from galaxy.util.sleeper import Sleeper
+from .caching import CacheIndex
+from .ranged_download import (
+    DEFAULT_DOWNLOAD_PART_SIZE,
+    DEFAULT_DOWNLOAD_THREADS,
+    ranged_download,
+)
 from .s3 import parse_config_xml
 from ..objectstore import convert_bytes, ObjectStore
 try:
@@ -56,6 +62,8 @@ class CloudConfigMixin(object):
             "cache": {
                 "size": self.cache_size,
                 "path": self.staging_path,
+                "download_threads": self.download_threads,
+                "download_part_size": self.download_part_size,
             }
         }
 
@@ -90,6 +98,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
 
         self.cache_size = cache_dict.get('size', -1)
         self.staging_path = cache_dict.get('path') or self.config.object_store_cache_path
+        self.download_threads = int(cache_dict.get('download_threads', DEFAULT_DOWNLOAD_THREADS))
+        self.download_part_size = int(cache_dict.get('download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
 
         self._initialize()
 
@@ -99,21 +109,17 @@ class Cloud(ObjectStore, CloudConfigMixin):
 
         self.conn = self._get_connection(self.provider, self.credentials)
         self.bucket = self._get_bucket(self.bucket_name)
+        self.cache_index = None
         # Clean cache only if value is set in galaxy.ini
         if self.cache_size != -1:
             # Convert GBs to bytes for comparison
             self.cache_size = self.cache_size * 1073741824
+            self.cache_index = CacheIndex(self.staging_path)
             # Helper for interruptable sleep
             self.sleeper = Sleeper()
             self.cache_monitor_thread = threading.Thread(target=self.__cache_monitor)
             self.cache_monitor_thread.start()
             log.info("Cache cleaner manager started")
-        # Test if 'axel' is available for parallel download and pull the key into cache
-        try:
-            subprocess.call('axel')
-            self.use_axel = True
-        except OSError:
-            self.use_axel = False
 
     @staticmethod
     def _get_connection(provider, credentials):
@@ -246,21 +252,11 @@ class Cloud(ObjectStore, CloudConfigMixin):
     def __cache_monitor(self):
         time.sleep(2)  # Wait for things to load before starting the monitor
         while self.running:
-            total_size = 0
-            # Is this going to be too expensive of an operation to be done frequently?
-            file_list = []
-            for dirpath, _, filenames in os.walk(self.staging_path):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    file_size = os.path.getsize(filepath)
-                    total_size += file_size
-                    # Get the time given file was last accessed
-                    last_access_time = time.localtime(os.stat(filepath)[7])
-                    # Compose a tuple of the access time and the file path
-                    file_tuple = last_access_time, filepath, file_size
-                    file_list.append(file_tuple)
-            # Sort the file list (based on access time)
-            file_list.sort()
+            try:
+                self.cache_index.reconcile_if_due()
+            except Exception:
+                log.exception("Reconciling the cache index failed")
+            total_size = self.cache_index.total_size()
             # Initiate cleaning once within 10% of the defined cache size?
             cache_limit = self.cache_size * 0.9
             if total_size > cache_limit:
@@ -271,41 +267,9 @@ class Cloud(ObjectStore, CloudConfigMixin):
                 # the limit - maybe delete additional #%?
                 # For now, delete enough to leave at least 10% of the total cache free
                 delete_this_much = total_size - cache_limit
-                self.__clean_cache(file_list, delete_this_much)
-            self.sleeper.sleep(30)  # Test cache size every 30 seconds?
-
-    def __clean_cache(self, file_list, delete_this_much):
-        """ Keep deleting files from the file_list until the size of the deleted
-        files is greater than the value in delete_this_much parameter.
-
-        :type file_list: list
-        :param file_list: List of candidate files that can be deleted. This method
-            will start deleting files from the beginning of the list so the list
-            should be sorted accordingly. The list must contains 3-element tuples,
-            positioned as follows: position 0 holds file last accessed timestamp
-            (as time.struct_time), position 1 holds file path, and position 2 has
-            file size (e.g., (<access time>, /mnt/data/dataset_1.dat), 472394)
-
-        :type delete_this_much: int
-        :param delete_this_much: Total size of files, in bytes, that should be deleted.
-        """
-        # Keep deleting datasets from file_list until deleted_amount does not
-        # exceed delete_this_much; start deleting from the front of the file list,
-        # which assumes the oldest files come first on the list.
-        deleted_amount = 0
-        for entry in enumerate(file_list):
-            if deleted_amount < delete_this_much:
-                deleted_amount += entry[2]
-                os.remove(entry[1])
-                # Debugging code for printing deleted files' stats
-                # folder, file_name = os.path.split(f[1])
-                # file_date = time.strftime("%m/%d/%y %H:%M:%S", f[0])
-                # log.debug("%s. %-25s %s, size %s (deleted %s/%s)" \
-                #     % (i, file_name, convert_bytes(f[2]), file_date, \
-                #     convert_bytes(deleted_amount), convert_bytes(delete_this_much)))
-            else:
+                deleted_amount = self.cache_index.clean(delete_this_much)
                 log.debug("Cache cleaning done. Total space freed: %s", convert_bytes(deleted_amount))
-                return
+            self.sleeper.sleep(30)  # Test cache size every 30 seconds?
 
     def _get_bucket(self, bucket_name):
         try:
@@ -421,6 +385,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
         # Now pull in the file
         file_ok = self._download(rel_path)
         self._fix_permissions(self._get_cache_path(rel_path_dir))
+        if file_ok and self.cache_index is not None:
+            self.cache_index.touch(rel_path)
         return file_ok
 
     def _transfer_cb(self, complete, total):
@@ -435,23 +401,38 @@ class Cloud(ObjectStore, CloudConfigMixin):
                 log.critical("File %s is larger (%s) than the cache size (%s). Cannot download.",
                              rel_path, key.size, self.cache_size)
                 return False
-            if self.use_axel:
-                log.debug("Parallel pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
-                ncores = multiprocessing.cpu_count()
-                url = key.generate_url(7200)
-                ret_code = subprocess.call("axel -a -n %s '%s'" % (ncores, url))
-                if ret_code == 0:
+            part_size = self.download_part_size * 1024 * 1024
+            if self.download_threads > 1 and key.size > part_size:
+                try:
+                    self._ranged_download(key, part_size)
+                    log.debug("Parallel pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
                     return True
-            else:
-                log.debug("Pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
-                self.transfer_progress = 0  # Reset transfer progress counter
-                with open(self._get_cache_path(rel_path), "w+") as downloaded_file_handle:
-                    key.save_content(downloaded_file_handle)
-                return True
+                except Exception:
+                    log.exception("Parallel download of key '%s' failed, downloading it as a single stream", rel_path)
+            log.debug("Pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
+            self.transfer_progress = 0  # Reset transfer progress counter
+            with open(self._get_cache_path(rel_path), "w+") as downloaded_file_handle:
+                key.save_content(downloaded_file_handle)
+            return True
         except Exception:
             log.exception("Problem downloading key '%s' from S3 bucket '%s'", rel_path, self.bucket.name)
         return False
 
+    def _ranged_download(self, key, part_size):
+        # CloudBridge has no ranged reads, fetch the parts from a signed URL
+        # of the object instead (as supported by all providers).
+        url = key.generate_url(7200)
+
+        def fetch_range(start, end):
+            response = requests.get(url, headers={'Range': 'bytes=%d-%d' % (start, end)}, timeout=300)
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise Exception("Ranged request for '%s' returned status %s" % (key.name, response.status_code))
+            return response.content
+
+        self.transfer_progress = 0
+        ranged_download(fetch_range, key.size, self._get_cache_path(key.name), part_size=part_size, threads=self.download_threads)
+
     def _push_to_os(self, rel_path, source_file=None, from_string=None):
         """
         Push the file pointed to by ``rel_path`` to the object store naming the key
@@ -570,6 +551,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
             if not dir_only:
                 rel_path = os.path.join(rel_path, alt_name if alt_name else "dataset_%s.dat" % obj.id)
                 open(os.path.join(self.staging_path, rel_path), 'w').close()
+                if self.cache_index is not None:
+                    self.cache_index.touch(rel_path, size=0)
                 self._push_to_os(rel_path, from_string='')
 
     def empty(self, obj, **kwargs):
@@ -609,6 +592,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
             # but requires iterating through each individual key in S3 and deleing it.
             if entire_dir and extra_dir:
                 shutil.rmtree(self._get_cache_path(rel_path))
+                if self.cache_index is not None:
+                    self.cache_index.remove(rel_path)
                 results = self.bucket.objects.list(prefix=rel_path)
                 for key in results:
                     log.debug("Deleting key %s", key.name)
@@ -617,6 +602,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
             else:
                 # Delete from cache first
                 os.unlink(self._get_cache_path(rel_path))
+                if self.cache_index is not None:
+                    self.cache_index.remove(rel_path)
                 # Delete from S3 as well
                 if self._key_exists(rel_path):
                     key = self.bucket.objects.get(rel_path)
@@ -634,6 +621,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
         # Check cache first and get file if not there
         if not self._in_cache(rel_path):
             self._pull_into_cache(rel_path)
+        elif self.cache_index is not None:
+            self.cache_index.access(rel_path)
         # Read the file content from cache
         data_file = open(self._get_cache_path(rel_path), 'r')
         data_file.seek(start)
@@ -662,6 +651,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
         #     return cache_path
         # Check if the file exists in the cache first
         if self._in_cache(rel_path):
+            if self.cache_index is not None and not dir_only:
+                self.cache_index.access(rel_path)
             return cache_path
         # Check if the file exists in persistent storage and, if it does, pull it into cache
         elif self.exists(obj, **kwargs):
@@ -697,6 +688,8 @@ class Cloud(ObjectStore, CloudConfigMixin):
                     log.exception("Trouble copying source file '%s' to cache '%s'", source_file, cache_file)
             else:
                 source_file = self._get_cache_path(rel_path)
+            if self.cache_index is not None:
+                self.cache_index.touch(rel_path)
             # Update the file on cloud
             self._push_to_os(rel_path, source_file)
         else:
@@ -0,0 +1,93 @@
+"""
+Download large objects into the object store cache as byte ranges fetched
+in parallel.
+"""
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DOWNLOAD_THREADS = 8
+DEFAULT_DOWNLOAD_PART_SIZE = 16  # MB
+
+
+class RangedDownloadError(Exception):
+    pass
+
+
+def part_ranges(size, part_size):
+    """
+    Split ``size`` bytes into inclusive ``(start, end)`` byte ranges of at
+    most ``part_size`` bytes.
+
+    >>> part_ranges(10, 4)
+    [(0, 3), (4, 7), (8, 9)]
+    >>> part_ranges(8, 4)
+    [(0, 3), (4, 7)]
+    """
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        if size:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                # Not available (Python 2, some file systems), a sparse file
+                # of the right size will do
+                f.truncate(size)
+
+
+def ranged_download(fetch_range, size, destination, part_size=DEFAULT_DOWNLOAD_PART_SIZE * 1024 * 1024, threads=DEFAULT_DOWNLOAD_THREADS):
+    """
+    Download ``size`` bytes into ``destination`` with ``threads`` parallel
+    calls of ``fetch_range(start, end)``, which must return the bytes of the
+    inclusive range ``start``-``end`` of the object. Implementations should
+    make sure all ranges come from the same version of the object (e.g. with
+    an ``If-Match`` on the ETag of the object).
+
+    The parts are written at their offset in a temporary file allocated up
+    front next to ``destination``, which is renamed to ``destination`` once
+    all of them are downloaded, so readers never see an incomplete file.
+    Raises ``RangedDownloadError`` if a part or the resulting file does not
+    have the expected size, exceptions raised by ``fetch_range`` are passed
+    through. The temporary file is removed on failure.
+    """
+    ranges = part_ranges(size, part_size)
+    # Not tempfile.mkstemp, the file must get the same (umask) permissions as
+    # if it was written to the destination directly
+    temp_path = "%s.%s.part" % (destination, uuid.uuid4().hex)
+    os.close(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+
+    def fetch_part(part):
+        start, end = part
+        data = fetch_range(start, end)
+        if len(data) != end - start + 1:
+            raise RangedDownloadError("Got %d bytes for range %d-%d of %s" % (len(data), start, end, destination))
+        with open(temp_path, 'r+b') as f:
+            f.seek(start)
+            f.write(data)
+
+    try:
+        _preallocate(temp_path, size)
+        if ranges:
+            executor = ThreadPoolExecutor(max_workers=max(1, min(threads, len(ranges))))
+            try:
+                # Consume the results to raise the first exception encountered
+                for _ in executor.map(fetch_part, ranges):
+                    pass
+            finally:
+                executor.shutdown(wait=True)
+        downloaded_size = os.path.getsize(temp_path)
+        if downloaded_size != size:
+            raise RangedDownloadError("Downloaded %d bytes to %s, expected %d" % (downloaded_size, destination, size))
+        os.rename(temp_path, destination)
+    except Exception:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
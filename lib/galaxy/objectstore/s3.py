@@ -2,14 +2,17 @@
 Object Store plugin for the Amazon Simple Storage Service (S3)
 """
 import logging
-import multiprocessing
 import os
 import shutil
-import subprocess
 import threading
 import time
 from datetime import datetime
 
+from six.moves.queue import (
+    Empty,
+    Queue
+)
+
 try:
     # Imports are done this way to allow objectstore code to be used outside of Galaxy.
     import boto
@@ -24,13 +27,25 @@ from galaxy.util import (
     directory_hash_id,
     string_as_bool,
     umask_fix_perms,
-    which,
 )
 from galaxy.util.path import safe_relpath
 from galaxy.util.sleeper import Sleeper
+from .caching import (
+    CacheIndex,
+    upload_owner
+)
+from .ranged_download import (
+    DEFAULT_DOWNLOAD_PART_SIZE,
+    DEFAULT_DOWNLOAD_THREADS,
+    ranged_download,
+)
 from .s3_multipart_upload import multipart_upload
 from ..objectstore import convert_bytes, ObjectStore
 
+DEFAULT_UPLOAD_THREADS = 4
+# Seconds to wait before retrying a failed write-behind upload
+UPLOAD_RETRY_INTERVAL = 30
+
 NO_BOTO_ERROR_MESSAGE = ("S3/Swift object store configured, but no boto dependency available."
                          "Please install and properly configure boto or modify object store configuration.")
 
@@ -65,6 +80,10 @@ def parse_config_xml(config_xml):
         cache_size = float(c_xml.get('size', -1))
 
         staging_path = c_xml.get('path', None)
+        download_threads = int(c_xml.get('download_threads', DEFAULT_DOWNLOAD_THREADS))
+        download_part_size = int(c_xml.get('download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
+        write_behind = string_as_bool(c_xml.get('write_behind', 'False'))
+        upload_threads = int(c_xml.get('upload_threads', DEFAULT_UPLOAD_THREADS))
 
         tag, attrs = 'extra_dir', ('type', 'path')
         extra_dirs = config_xml.findall(tag)
@@ -94,6 +113,10 @@ def parse_config_xml(config_xml):
             'cache': {
                 'size': cache_size,
                 'path': staging_path,
+                'download_threads': download_threads,
+                'download_part_size': download_part_size,
+                'write_behind': write_behind,
+                'upload_threads': upload_threads,
             },
             'extra_dirs': extra_dirs,
         }
@@ -125,6 +148,10 @@ class CloudConfigMixin(object):
             'cache': {
                 'size': self.cache_size,
                 'path': self.staging_path,
+                'download_threads': self.download_threads,
+                'download_part_size': self.download_part_size,
+                'write_behind': self.write_behind,
+                'upload_threads': self.upload_threads,
             }
         }
 
@@ -162,6 +189,10 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
 
         self.cache_size = cache_dict.get('size', -1)
         self.staging_path = cache_dict.get('path') or self.config.object_store_cache_path
+        self.download_threads = int(cache_dict.get('download_threads', DEFAULT_DOWNLOAD_THREADS))
+        self.download_part_size = int(cache_dict.get('download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
+        self.write_behind = cache_dict.get('write_behind', False)
+        self.upload_threads = int(cache_dict.get('upload_threads', DEFAULT_UPLOAD_THREADS))
 
         extra_dirs = dict(
             (e['type'], e['path']) for e in config_dict.get('extra_dirs', []))
@@ -188,6 +219,10 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
 
         self._configure_connection()
         self.bucket = self._get_bucket(self.bucket)
+        self.cache_index = None
+        # The index also journals pending write-behind uploads
+        if self.cache_size != -1 or self.write_behind:
+            self.cache_index = CacheIndex(self.staging_path)
         # Clean cache only if value is set in galaxy.ini
         if self.cache_size != -1:
             # Convert GBs to bytes for comparison
@@ -197,11 +232,53 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
             self.cache_monitor_thread = threading.Thread(target=self.__cache_monitor)
             self.cache_monitor_thread.start()
             log.info("Cache cleaner manager started")
-        # Test if 'axel' is available for parallel download and pull the key into cache
-        if which('axel'):
-            self.use_axel = True
-        else:
-            self.use_axel = False
+        if self.write_behind:
+            self._init_upload_workers()
+
+    def _init_upload_workers(self):
+        self.upload_owner = upload_owner()
+        self.upload_queue = Queue()
+        self.upload_threads_list = []
+        for i in range(self.upload_threads):
+            worker = threading.Thread(name="S3ObjectStore.upload_thread-%d" % i, target=self.__upload_worker)
+            worker.daemon = True
+            worker.start()
+            self.upload_threads_list.append(worker)
+        # Resume the uploads a previous Galaxy process did not finish
+        pending = self.cache_index.claim_pending_uploads(self.upload_owner)
+        if pending:
+            log.info("Resuming %d pending uploads to S3", len(pending))
+        for rel_path, queued in pending:
+            self.upload_queue.put((rel_path, queued))
+        log.info("Write-behind upload workers started")
+
+    def __upload_worker(self):
+        while self.running:
+            try:
+                rel_path, queued = self.upload_queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
+                # Skip files deleted or changed (and queued again) since
+                if not self.cache_index.is_pending_upload(rel_path, queued):
+                    continue
+                if self._push_to_os(rel_path):
+                    if not self.cache_index.finish_pending_upload(rel_path, queued) and not self.cache_index.is_pending_upload(rel_path):
+                        # Deleted while it was uploaded, delete() didn't find the key yet
+                        log.debug("'%s' was deleted while uploaded, deleting key", rel_path)
+                        Key(self.bucket, rel_path).delete()
+                    continue
+            except Exception:
+                log.exception("Write-behind upload of '%s' failed", rel_path)
+            log.warning("Write-behind upload of '%s' failed, retrying in %s seconds", rel_path, UPLOAD_RETRY_INTERVAL)
+            retry = threading.Timer(UPLOAD_RETRY_INTERVAL, self.upload_queue.put, args=((rel_path, queued),))
+            retry.daemon = True
+            retry.start()
+
+    def _queue_upload(self, rel_path):
+        """Upload the cached file ``rel_path`` in the background, it is journaled until uploaded."""
+        queued = self.cache_index.add_pending_upload(rel_path, self.upload_owner)
+        self.upload_queue.put((rel_path, queued))
 
     def _configure_connection(self):
         log.debug("Configuring S3 Connection")
@@ -219,21 +296,11 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
     def __cache_monitor(self):
         time.sleep(2)  # Wait for things to load before starting the monitor
         while self.running:
-            total_size = 0
-            # Is this going to be too expensive of an operation to be done frequently?
-            file_list = []
-            for dirpath, _, filenames in os.walk(self.staging_path):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    file_size = os.path.getsize(filepath)
-                    total_size += file_size
-                    # Get the time given file was last accessed
-                    last_access_time = time.localtime(os.stat(filepath)[7])
-                    # Compose a tuple of the access time and the file path
-                    file_tuple = last_access_time, filepath, file_size
-                    file_list.append(file_tuple)
-            # Sort the file list (based on access time)
-            file_list.sort()
+            try:
+                self.cache_index.reconcile_if_due()
+            except Exception:
+                log.exception("Reconciling the cache index failed")
+            total_size = self.cache_index.total_size()
             # Initiate cleaning once within 10% of the defined cache size?
             cache_limit = self.cache_size * 0.9
             if total_size > cache_limit:
@@ -244,41 +311,9 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
                 # the limit - maybe delete additional #%?
                 # For now, delete enough to leave at least 10% of the total cache free
                 delete_this_much = total_size - cache_limit
-                self.__clean_cache(file_list, delete_this_much)
-            self.sleeper.sleep(30)  # Test cache size every 30 seconds?
-
-    def __clean_cache(self, file_list, delete_this_much):
-        """ Keep deleting files from the file_list until the size of the deleted
-        files is greater than the value in delete_this_much parameter.
-
-        :type file_list: list
-        :param file_list: List of candidate files that can be deleted. This method
-            will start deleting files from the beginning of the list so the list
-            should be sorted accordingly. The list must contains 3-element tuples,
-            positioned as follows: position 0 holds file last accessed timestamp
-            (as time.struct_time), position 1 holds file path, and position 2 has
-            file size (e.g., (<access time>, /mnt/data/dataset_1.dat), 472394)
-
-        :type delete_this_much: int
-        :param delete_this_much: Total size of files, in bytes, that should be deleted.
-        """
-        # Keep deleting datasets from file_list until deleted_amount does not
-        # exceed delete_this_much; start deleting from the front of the file list,
-        # which assumes the oldest files come first on the list.
-        deleted_amount = 0
-        for entry in file_list:
-            if deleted_amount < delete_this_much:
-                deleted_amount += entry[2]
-                os.remove(entry[1])
-                # Debugging code for printing deleted files' stats
-                # folder, file_name = os.path.split(f[1])
-                # file_date = time.strftime("%m/%d/%y %H:%M:%S", f[0])
-                # log.debug("%s. %-25s %s, size %s (deleted %s/%s)" \
-                #     % (i, file_name, convert_bytes(f[2]), file_date, \
-                #     convert_bytes(deleted_amount), convert_bytes(delete_this_much)))
-            else:
+                deleted_amount = self.cache_index.clean(delete_this_much)
                 log.debug("Cache cleaning done. Total space freed: %s", convert_bytes(deleted_amount))
-                return
+            self.sleeper.sleep(30)  # Test cache size every 30 seconds?
 
     def _get_bucket(self, bucket_name):
         """ Sometimes a handle to a bucket is not established right away so try
@@ -419,6 +454,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
         # Now pull in the file
         file_ok = self._download(rel_path)
         self._fix_permissions(self._get_cache_path(rel_path_dir))
+        if file_ok and self.cache_index is not None:
+            self.cache_index.touch(rel_path)
         return file_ok
 
     def _transfer_cb(self, complete, total):
@@ -433,22 +470,33 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
                 log.critical("File %s is larger (%s) than the cache size (%s). Cannot download.",
                              rel_path, key.size, self.cache_size)
                 return False
-            if self.use_axel:
-                log.debug("Parallel pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
-                ncores = multiprocessing.cpu_count()
-                url = key.generate_url(7200)
-                ret_code = subprocess.call(['axel', '-a', '-n', ncores, url])
-                if ret_code == 0:
+            part_size = self.download_part_size * 1024 * 1024
+            if self.download_threads > 1 and key.size > part_size:
+                try:
+                    self._ranged_download(key, part_size)
+                    log.debug("Parallel pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
                     return True
-            else:
-                log.debug("Pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
-                self.transfer_progress = 0  # Reset transfer progress counter
-                key.get_contents_to_filename(self._get_cache_path(rel_path), cb=self._transfer_cb, num_cb=10)
-                return True
+                except Exception:
+                    log.exception("Parallel download of key '%s' failed, downloading it as a single stream", rel_path)
+            log.debug("Pulled key '%s' into cache to %s", rel_path, self._get_cache_path(rel_path))
+            self.transfer_progress = 0  # Reset transfer progress counter
+            key.get_contents_to_filename(self._get_cache_path(rel_path), cb=self._transfer_cb, num_cb=10)
+            return True
         except S3ResponseError:
             log.exception("Problem downloading key '%s' from S3 bucket '%s'", rel_path, self.bucket.name)
         return False
 
+    def _ranged_download(self, key, part_size):
+        def fetch_range(start, end):
+            # A Key per part since boto keys are not thread safe, the If-Match
+            # makes sure all parts are from the same version of the object.
+            part_key = Key(self.bucket, key.name)
+            headers = {'Range': 'bytes=%d-%d' % (start, end), 'If-Match': key.etag}
+            return part_key.get_contents_as_string(headers=headers)
+
+        self.transfer_progress = 0
+        ranged_download(fetch_range, key.size, self._get_cache_path(key.name), part_size=part_size, threads=self.download_threads)
+
     def _push_to_os(self, rel_path, source_file=None, from_string=None):
         """
         Push the file pointed to by ``rel_path`` to the object store naming the key
@@ -498,6 +546,9 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
         rel_path = self._construct_path(obj, **kwargs)
         # Make sure the size in cache is available in its entirety
         if self._in_cache(rel_path):
+            # Until uploaded the cached copy is the only, complete, one
+            if self.write_behind and self.cache_index.is_pending_upload(rel_path):
+                return True
             if os.path.getsize(self._get_cache_path(rel_path)) == self._get_size_in_s3(rel_path):
                 return True
             log.debug("Waiting for dataset %s to transfer from OS: %s/%s", rel_path,
@@ -530,7 +581,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
 
         # TODO: Sync should probably not be done here. Add this to an async upload stack?
         if in_cache and not in_s3:
-            self._push_to_os(rel_path, source_file=self._get_cache_path(rel_path))
+            if not (self.write_behind and self.cache_index.is_pending_upload(rel_path)):
+                self._push_to_os(rel_path, source_file=self._get_cache_path(rel_path))
             return True
         elif in_s3:
             return True
@@ -570,6 +622,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
             if not dir_only:
                 rel_path = os.path.join(rel_path, alt_name if alt_name else "dataset_%s.dat" % obj.id)
                 open(os.path.join(self.staging_path, rel_path), 'w').close()
+                if self.cache_index is not None:
+                    self.cache_index.touch(rel_path, size=0)
                 self._push_to_os(rel_path, from_string='')
 
     def empty(self, obj, **kwargs):
@@ -609,6 +663,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
             # but requires iterating through each individual key in S3 and deleing it.
             if entire_dir and extra_dir:
                 shutil.rmtree(self._get_cache_path(rel_path))
+                if self.cache_index is not None:
+                    self.cache_index.remove(rel_path)
                 results = self.bucket.get_all_keys(prefix=rel_path)
                 for key in results:
                     log.debug("Deleting key %s", key.name)
@@ -617,12 +673,19 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
             else:
                 # Delete from cache first
                 os.unlink(self._get_cache_path(rel_path))
+                pending_upload = False
+                if self.cache_index is not None:
+                    pending_upload = self.write_behind and self.cache_index.is_pending_upload(rel_path)
+                    self.cache_index.remove(rel_path)
                 # Delete from S3 as well
                 if self._key_exists(rel_path):
                     key = Key(self.bucket, rel_path)
                     log.debug("Deleting key %s", key.name)
                     key.delete()
                     return True
+                elif pending_upload:
+                    # Never made it to S3, removing it from the journal was enough
+                    return True
         except S3ResponseError:
             log.exception("Could not delete key '%s' from S3", rel_path)
         except OSError:
@@ -634,6 +697,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
         # Check cache first and get file if not there
         if not self._in_cache(rel_path):
             self._pull_into_cache(rel_path)
+        elif self.cache_index is not None:
+            self.cache_index.access(rel_path)
         # Read the file content from cache
         data_file = open(self._get_cache_path(rel_path), 'r')
         data_file.seek(start)
@@ -662,6 +727,8 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
         #     return cache_path
         # Check if the file exists in the cache first
         if self._in_cache(rel_path):
+            if self.cache_index is not None and not dir_only:
+                self.cache_index.access(rel_path)
             return cache_path
         # Check if the file exists in persistent storage and, if it does, pull it into cache
         elif self.exists(obj, **kwargs):
@@ -693,12 +760,19 @@ class S3ObjectStore(ObjectStore, CloudConfigMixin):
                         # FIXME? Should this be a `move`?
                         shutil.copy2(source_file, cache_file)
                     self._fix_permissions(cache_file)
+                    source_file = cache_file
                 except OSError:
                     log.exception("Trouble copying source file '%s' to cache '%s'", source_file, cache_file)
             else:
                 source_file = self._get_cache_path(rel_path)
-            # Update the file on S3
-            self._push_to_os(rel_path, source_file)
+            if self.cache_index is not None:
+                self.cache_index.touch(rel_path)
+            # Update the file on S3, in the background from the cache if
+            # writing behind
+            if self.write_behind and source_file == self._get_cache_path(rel_path):
+                self._queue_upload(rel_path)
+            else:
+                self._push_to_os(rel_path, source_file)
         else:
             raise ObjectNotFound('objectstore.update_from_file, object does not exist: %s, kwargs: %s'
                                  % (str(obj), str(kwargs)))
@@ -1,3 +1,4 @@
+import binascii
 import codecs
 import collections
 import logging
@@ -10,12 +11,15 @@ from galaxy.util import (
     smart_str,
     unicodify
 )
+from galaxy.util.lru import LRUCache
 
 log = logging.getLogger(__name__)
 
 MAXIMUM_ID_SECRET_BITS = 448
 MAXIMUM_ID_SECRET_LENGTH = int(MAXIMUM_ID_SECRET_BITS / 8)
 KIND_TOO_LONG_MESSAGE = "Galaxy coding error, keep encryption 'kinds' smaller to utilize more bites of randomness from id_secret values."
+# Recently encoded ids remembered per kind
+ENCODED_ID_CACHE_SIZE = 10000
 
 
 class IdEncodingHelper(object):
@@ -27,17 +31,52 @@ class IdEncodingHelper(object):
 
         per_kind_id_secret_base = config.get('per_kind_id_secret_base', self.id_secret)
         self.id_ciphers_for_kind = _cipher_cache(per_kind_id_secret_base)
+        self.encoded_id_cache_size = config.get('encoded_id_cache_size', ENCODED_ID_CACHE_SIZE)
+        self._encoded_ids_for_kind = {}
 
     def encode_id(self, obj_id, kind=None):
         if obj_id is None:
             raise galaxy.exceptions.MalformedId("Attempted to encode None id")
-        id_cipher = self.__id_cipher(kind)
         # Convert to bytes
         s = smart_str(obj_id)
-        # Pad to a multiple of 8 with leading "!"
-        s = (b"!" * (8 - len(s) % 8)) + s
-        # Encrypt
-        return unicodify(codecs.encode(id_cipher.encrypt(s), 'hex'))
+        encoded_ids = self.__encoded_ids(kind)
+        encoded_id = encoded_ids.get(s)
+        if encoded_id is None:
+            # Pad to a multiple of 8 with leading "!" and encrypt
+            encoded_id = unicodify(codecs.encode(self.__id_cipher(kind).encrypt(_pad(s)), 'hex'))
+            encoded_ids[s] = encoded_id
+        return encoded_id
+
+    def encode_ids(self, obj_ids, kind=None):
+        """
+        Encode a list of ids, as `encode_id` does each of them, encrypting the
+        ids not encoded recently in a single cipher call.
+
+        >>> helper = IdEncodingHelper(id_secret='secret')
+        >>> helper.encode_ids([1, 42, 1]) == [helper.encode_id(1), helper.encode_id(42), helper.encode_id(1)]
+        True
+        >>> helper.decode_ids(helper.encode_ids([1, 42, 10 ** 20], kind='k'), kind='k')
+        [1, 42, 100000000000000000000]
+        """
+        if any(obj_id is None for obj_id in obj_ids):
+            raise galaxy.exceptions.MalformedId("Attempted to encode None id")
+        encoded_ids = self.__encoded_ids(kind)
+        strs = [smart_str(obj_id) for obj_id in obj_ids]
+        returned = [encoded_ids.get(s) for s in strs]
+        # ECB encrypts each block of 8 bytes independently, padded ids can be
+        # encrypted (and hex-encoded) at once and the result split
+        missing = list(collections.OrderedDict.fromkeys(s for s, encoded_id in zip(strs, returned) if encoded_id is None))
+        if missing:
+            padded = [_pad(s) for s in missing]
+            hex_ids = unicodify(binascii.hexlify(self.__id_cipher(kind).encrypt(b"".join(padded))))
+            encoded = {}
+            start = 0
+            for s, padded_s in zip(missing, padded):
+                end = start + 2 * len(padded_s)
+                encoded[s] = encoded_ids[s] = hex_ids[start:end]
+                start = end
+            returned = [encoded_id if encoded_id is not None else encoded[s] for s, encoded_id in zip(strs, returned)]
+        return returned
 
     def encode_dict_ids(self, a_dict, kind=None, skip_startswith=None):
         """
@@ -55,34 +94,65 @@ class IdEncodingHelper(object):
         Encodes all integer values in the dict rval whose keys are 'id' or end
         with '_id' excluding `tool_id` which are consumed and produced as is
         via the API.
+
+        The ids found are encoded at once by `encode_ids`.
         """
-        if not isinstance(rval, dict):
-            return rval
-        for k, v in rval.items():
-            if (k == 'id' or k.endswith('_id')) and v is not None and k not in ['tool_id', 'external_id']:
-                try:
-                    rval[k] = self.encode_id(v)
-                except Exception:
-                    pass  # probably already encoded
-            if (k.endswith("_ids") and isinstance(v, list)):
+        # (dict, key, ids, is a list of ids)
+        found = []
+        self.__find_all_ids(rval, recursive, found)
+        try:
+            encoded_ids = iter(self.encode_ids([i for _, _, ids, _ in found for i in ids]))
+        except Exception:
+            # encode ids one list at a time, leaving those failing as they are
+            for a_dict, key, ids, is_list in found:
                 try:
-                    o = []
-                    for i in v:
-                        o.append(self.encode_id(i))
-                    rval[k] = o
+                    encoded = [self.encode_id(i) for i in ids]
                 except Exception:
-                    pass
-            else:
-                if recursive and isinstance(v, dict):
-                    rval[k] = self.encode_all_ids(v, recursive)
-                elif recursive and isinstance(v, list):
-                    rval[k] = [self.encode_all_ids(el, True) for el in v]
+                    continue  # probably already encoded
+                a_dict[key] = encoded if is_list else encoded[0]
+            return rval
+        for a_dict, key, ids, is_list in found:
+            encoded = [next(encoded_ids) for _ in ids]
+            a_dict[key] = encoded if is_list else encoded[0]
         return rval
 
+    def __find_all_ids(self, rval, recursive, found):
+        if not isinstance(rval, dict):
+            return
+        for k, v in rval.items():
+            if k.endswith("_ids") and isinstance(v, list):
+                found.append((rval, k, v, True))
+            elif recursive and isinstance(v, dict):
+                self.__find_all_ids(v, recursive, found)
+            elif recursive and isinstance(v, list):
+                for el in v:
+                    self.__find_all_ids(el, recursive, found)
+            elif (k == 'id' or k.endswith('_id')) and v is not None and k not in ['tool_id', 'external_id']:
+                found.append((rval, k, [v], False))
+
     def decode_id(self, obj_id, kind=None):
         id_cipher = self.__id_cipher(kind)
         return int(unicodify(id_cipher.decrypt(codecs.decode(obj_id, 'hex'))).lstrip("!"))
 
+    def decode_ids(self, obj_ids, kind=None):
+        """
+        Decode a list of encoded ids, as `decode_id` does each of them,
+        decrypting them in a single cipher call. Raises a ValueError if any
+        of them is not a valid encoded id.
+        """
+        obj_ids = [unicodify(obj_id) for obj_id in obj_ids]
+        for obj_id in obj_ids:
+            if not obj_id or len(obj_id) % 16:
+                raise ValueError("Invalid encoded id %r" % obj_id)
+        decrypted = self.__id_cipher(kind).decrypt(codecs.decode("".join(obj_ids), 'hex'))
+        returned = []
+        start = 0
+        for obj_id in obj_ids:
+            end = start + len(obj_id) // 2
+            returned.append(int(unicodify(decrypted[start:end]).lstrip("!")))
+            start = end
+        return returned
+
     def encode_guid(self, session_key):
         # Session keys are strings
         # Pad to a multiple of 8 with leading "!"
@@ -107,6 +177,12 @@ class IdEncodingHelper(object):
             id_cipher = self.id_ciphers_for_kind[kind]
         return id_cipher
 
+    def __encoded_ids(self, kind):
+        encoded_ids = self._encoded_ids_for_kind.get(kind)
+        if encoded_ids is None:
+            encoded_ids = self._encoded_ids_for_kind.setdefault(kind, LRUCache(self.encoded_id_cache_size))
+        return encoded_ids
+
 
 class _cipher_cache(collections.defaultdict):
 
@@ -119,6 +195,11 @@ class _cipher_cache(collections.defaultdict):
         return Blowfish.new(_last_bits(secret), mode=Blowfish.MODE_ECB)
 
 
+def _pad(s):
+    """Pad bytes to a multiple of 8 with leading "!"."""
+    return (b"!" * (8 - len(s) % 8)) + s
+
+
 def _last_bits(secret):
     """We append the kind at the end, so just use the bits at the end.
     """
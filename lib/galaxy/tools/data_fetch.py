@@ -12,9 +12,11 @@ from six.moves import StringIO
 from galaxy.datatypes import sniff
 from galaxy.datatypes.registry import Registry
 from galaxy.datatypes.upload_util import (
+    counted_metadata,
     handle_upload,
     UploadProblemException,
 )
+from galaxy.datatypes.util import upload_pipeline
 from galaxy.util import in_directory
 from galaxy.util.compression_utils import CompressedFile
 from galaxy.util.hash_util import HASH_NAMES, memory_bound_hexdigest
@@ -100,10 +102,18 @@ def _fetch_target(upload_config, target):
         if url:
             sources.append({"source_uri": url})
         hashes = item.get("hashes", [])
+        in_place = item.get("in_place", False)
+        # Hashes are validated while the file is read to be converted or
+        # counted, unless it is modified in place before being read
+        digests = []
         for hash_dict in hashes:
             hash_function = hash_dict.get("hash_function")
-            hash_value = hash_dict.get("hash_value")
-            _handle_hash_validation(upload_config, hash_function, hash_value, path)
+            if in_place or not upload_config.validate_hashes:
+                _handle_hash_validation(upload_config, hash_function, hash_dict.get("hash_value"), path)
+            else:
+                digests.append(upload_pipeline.Digest(hash_function))
+        line_counts = upload_pipeline.LineCounts()
+        pipeline = upload_pipeline.UploadPipeline(digests + [line_counts])
 
         dbkey = item.get("dbkey", "?")
         requested_ext = item.get("ext", "auto")
@@ -118,7 +128,6 @@ def _fetch_target(upload_config, target):
         to_posix_lines = upload_config.get_option(item, "to_posix_lines")
         space_to_tab = upload_config.get_option(item, "space_to_tab")
         auto_decompress = upload_config.get_option(item, "auto_decompress")
-        in_place = item.get("in_place", False)
         purge_source = item.get("purge_source", True)
 
         registry = upload_config.registry
@@ -137,8 +146,16 @@ def _fetch_target(upload_config, target):
             auto_decompress=auto_decompress,
             convert_to_posix_lines=to_posix_lines,
             convert_spaces_to_tabs=space_to_tab,
+            pipeline=pipeline,
         )
 
+        for hash_dict, digest in zip(hashes, digests):
+            if pipeline.source:
+                _check_hash(digest.hash_function, hash_dict.get("hash_value"), digest.hexdigest())
+            else:
+                # The file was not read as uploaded, it is left as is when not converted in place
+                _handle_hash_validation(upload_config, digest.hash_function, hash_dict.get("hash_value"), path)
+
         if link_data_only:
             # Never alter a file that will not be copied to Galaxy's local file store.
             if datatype.dataset_content_needs_grooming(path):
@@ -152,11 +169,17 @@ def _fetch_target(upload_config, target):
         elif not link_data_only:
             path = upload_config.ensure_in_working_directory(path, purge_source, in_place)
 
+        metadata = None
         if not link_data_only and datatype and datatype.dataset_content_needs_grooming(path):
             # Groom the dataset content if necessary
             datatype.groom_dataset_content(path)
+        elif pipeline.path is not None and datatype:
+            # Metadata counted while the file was read, so that it isn't read again to set it
+            metadata = counted_metadata(datatype, line_counts, path)
 
         rval = {"name": name, "filename": path, "dbkey": dbkey, "ext": ext, "link_data_only": link_data_only, "sources": sources, "hashes": hashes}
+        if metadata is not None:
+            rval["counted_metadata"] = metadata
         if info is not None:
             rval["info"] = info
         if object_id is not None:
@@ -248,8 +271,12 @@ def _has_src_to_path(upload_config, item, is_dataset=False):
 def _handle_hash_validation(upload_config, hash_function, hash_value, path):
     if upload_config.validate_hashes:
         calculated_hash_value = memory_bound_hexdigest(hash_func_name=hash_function, path=path)
-        if calculated_hash_value != hash_value:
-            raise Exception("Failed to validate upload with [%s] - expected [%s] got [%s]" % (hash_function, hash_value, calculated_hash_value))
+        _check_hash(hash_function, hash_value, calculated_hash_value)
+
+
+def _check_hash(hash_function, hash_value, calculated_hash_value):
+    if calculated_hash_value != hash_value:
+        raise Exception("Failed to validate upload with [%s] - expected [%s] got [%s]" % (hash_function, hash_value, calculated_hash_value))
 
 
 def _arg_parser():
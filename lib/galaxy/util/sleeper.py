@@ -4,20 +4,21 @@ import threading
 class Sleeper(object):
     """
     Provides a 'sleep' method that sleeps for a number of seconds *unless*
-    the notify method is called (from a different thread).
+    the notify method is called (from a different thread). A wake up while
+    no thread is sleeping isn't lost, the next sleep returns immediately.
     """
 
     def __init__(self):
         self.condition = threading.Condition()
+        self.woken = False
 
     def sleep(self, seconds):
-        # Should this be in a try/finally block? -John
-        self.condition.acquire()
-        self.condition.wait(seconds)
-        self.condition.release()
+        with self.condition:
+            if not self.woken:
+                self.condition.wait(seconds)
+            self.woken = False
 
     def wake(self):
-        # Should this be in a try/finally block? -John
-        self.condition.acquire()
-        self.condition.notify()
-        self.condition.release()
+        with self.condition:
+            self.woken = True
+            self.condition.notify()
@@ -680,11 +680,8 @@ class GalaxyWebTransaction(base.DefaultWebTransaction,
             # belong to a different user.
             history = prev_galaxy_session.current_history
             if prev_galaxy_session.user is None:
-                # Increase the user's disk usage by the amount of the previous history's datasets if they didn't already
-                # own it.
-                for hda in history.datasets:
-                    user.adjust_total_disk_usage(hda.quota_amount(user))
                 # Only set default history permissions if the history is from the previous session and anonymous
+                # (its datasets are added to the user's disk usage when the history is given to the user)
                 set_permissions = True
         elif self.galaxy_session.current_history:
             history = self.galaxy_session.current_history
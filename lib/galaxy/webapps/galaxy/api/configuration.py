@@ -7,6 +7,7 @@ import logging
 import os
 
 from galaxy.managers import configuration, users
+from galaxy.metadata.cache import build_metadata_cache
 from galaxy.web import (
     expose_api,
     expose_api_anonymous_and_sessionless,
@@ -124,6 +125,20 @@ class ConfigurationController(BaseAPIController):
             rval.append(entry)
         return rval
 
+    @expose_api
+    @require_admin
+    def metadata_cache(self, trans):
+        """
+        GET /api/configuration/metadata_cache
+        Return the number of entries, hits and misses of the metadata cache and its hit rate.
+        """
+        metadata_cache = build_metadata_cache(self.app.config)
+        if metadata_cache is None:
+            return {"enabled": False}
+        stats = metadata_cache.stats()
+        stats["enabled"] = True
+        return stats
+
     @expose_api
     @require_admin
     def reload_toolbox(self, trans, **kwds):
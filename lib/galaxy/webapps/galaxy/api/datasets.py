@@ -393,6 +393,12 @@ class DatasetsController(BaseAPIController, UsesVisualizationMixin):
         """
         decoded_content_id = self.decode_id(history_content_id)
         raw = util.string_as_bool_or_none(raw)
+        # Ensure line is a line number before passing through to datatypes.
+        if kwd.get("line"):
+            if not str(kwd["line"]).isdigit():
+                trans.response.status = 400
+                return "Invalid line, must be a non-negative integer: %s" % kwd["line"]
+            kwd["line"] = int(kwd["line"])
 
         rval = ''
         try:
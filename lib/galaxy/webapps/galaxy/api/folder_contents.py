@@ -78,8 +78,13 @@ class FolderContentsController(BaseAPIController, UsesLibraryMixin, UsesLibraryM
         folder_contents = []
         update_time = ''
         create_time = ''
+        content_items = self._load_folder_contents(trans, folder, deleted)
+        # Datasets without a recorded size are measured in their object store
+        trans.app.object_store.locate_many([item.library_dataset_dataset_association.dataset for item in content_items
+                                            if item.api_type == 'file' and not item.library_dataset_dataset_association.dataset.file_size
+                                            and not item.library_dataset_dataset_association.dataset.external_filename])
         #  Go through every accessible item (folders, datasets) in the folder and include its metadata.
-        for content_item in self._load_folder_contents(trans, folder, deleted):
+        for content_item in content_items:
             return_item = {}
             encoded_id = trans.security.encode_id(content_item.id)
             create_time = content_item.create_time.strftime("%Y-%m-%d %I:%M %p")
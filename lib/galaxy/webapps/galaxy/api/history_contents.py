@@ -42,6 +42,9 @@ log = logging.getLogger(__name__)
 
 class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibraryMixinItems, UsesTagsMixin):
 
+    #: keys of the purged datasets listed when indexing contents changed since a token
+    TOMBSTONE_KEYS = ['id', 'type_id', 'hid', 'history_content_type', 'purged']
+
     def __init__(self, app):
         super(HistoryContentsController, self).__init__(app)
         self.hda_manager = hdas.HDAManager(app)
@@ -74,13 +77,34 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
         :param  types:      (optional) kinds of contents to index (currently just
                             dataset, but dataset_collection will be added shortly).
         :type   types:      str
+        :param  since:      (optional) a token returned by a previous call with
+                            ``since``, or an empty string for a first call: only
+                            the contents updated (or whose state changed) since
+                            that call are returned
+        :type   since:      str
 
         :rtype:     list
-        :returns:   dictionaries containing summary or detailed HDA information
+        :returns:   dictionaries containing summary or detailed HDA information,
+                    if ``since`` is given a dictionary with these as ``contents``,
+                    the purged datasets as ``tombstones`` and the token to pass
+                    to the next call as ``since``
         """
+        since = kwd.pop('since', None)
+        tombstones = None
+        if since is not None:
+            # Issued before listing the contents
+            next_since = self.history_contents_manager.since_token()
+            since = self.history_contents_manager.parse_since_token(since)
+            tombstones = []
         if v == 'dev':
-            return self.__index_v2(trans, history_id, **kwd)
+            rval = self.__index_v2(trans, history_id, since=since, tombstones=tombstones, **kwd)
+        else:
+            rval = self.__index_v1(trans, history_id, ids=ids, since=since, tombstones=tombstones, **kwd)
+        if tombstones is None:
+            return rval
+        return dict(contents=rval, tombstones=tombstones, since=next_since)
 
+    def __index_v1(self, trans, history_id, ids=None, since=None, tombstones=None, **kwd):
         rval = []
 
         history = self.history_manager.get_accessible(self.decode_id(history_id), trans.user, current_history=trans.history)
@@ -94,7 +118,7 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
         else:
             types = ['dataset', "dataset_collection"]
 
-        contents_kwds = {'types': types}
+        contents_kwds = {'types': types, 'since': since}
         if ids:
             ids = [self.decode_id(id) for id in ids.split(',')]
             contents_kwds['ids'] = ids
@@ -112,6 +136,8 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
                 details = util.listify(details)
 
         for content in history.contents_iter(**contents_kwds):
+            if self.__add_tombstone(trans, content, tombstones):
+                continue
             encoded_content_id = trans.security.encode_id(content.id)
             detailed = details == 'all' or (encoded_content_id in details)
 
@@ -127,6 +153,17 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
 
         return rval
 
+    def __add_tombstone(self, trans, content, tombstones):
+        """
+        Add ``content`` to ``tombstones`` if listing contents changed since a
+        token and it is a purged dataset, returns True if it was.
+        """
+        if tombstones is None or not isinstance(content, trans.app.model.HistoryDatasetAssociation) or not content.purged:
+            return False
+        tombstones.append(self.hda_serializer.serialize_to_view(content, user=trans.user, trans=trans,
+            keys=self.TOMBSTONE_KEYS))
+        return True
+
     def __collection_dict(self, trans, dataset_collection_instance, **kwds):
         return dictify_dataset_collection_instance(dataset_collection_instance,
             security=trans.security, parent=dataset_collection_instance.history, **kwds)
@@ -807,7 +844,7 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
     def __handle_unknown_contents_type(self, trans, contents_type):
         raise exceptions.UnknownContentsType('Unknown contents type: %s' % type)
 
-    def __index_v2(self, trans, history_id, **kwd):
+    def __index_v2(self, trans, history_id, since=None, tombstones=None, **kwd):
         """
         index( self, trans, history_id, **kwd )
         * GET /api/histories/{history_id}/contents
@@ -888,6 +925,8 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
 
         filter_params = self.parse_filter_params(kwd)
         filters = self.history_contents_filters.parse_filters(filter_params)
+        if since is not None:
+            filters.append(self.history_contents_manager.changed_since_filter(since))
         limit, offset = self.parse_limit_offset(kwd)
         order_by = self._parse_order_by(manager=self.history_contents_manager, order_by_string=kwd.get('order', 'hid-asc'))
         serialization_params = self._parse_serialization_params(kwd, 'summary')
@@ -902,9 +941,17 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
             details = util.listify(details)
         view = serialization_params.pop('view')
 
+        # function filters need the models, others let the contents be serialized in bulk
+        if not any(filter_.filter_type == 'function' for filter_ in filters):
+            rows = self.history_contents_manager.contents(history,
+                filters=filters, limit=limit, offset=offset, order_by=order_by, expand_models=False)
+            return self.__serialize_contents_in_bulk(trans, rows, view, details, serialization_params, tombstones)
+
         contents = self.history_contents_manager.contents(history,
             filters=filters, limit=limit, offset=offset, order_by=order_by)
         for content in contents:
+            if self.__add_tombstone(trans, content, tombstones):
+                continue
 
             # TODO: remove split
             if isinstance(content, trans.app.model.HistoryDatasetAssociation):
@@ -923,6 +970,46 @@ class HistoryContentsController(BaseAPIController, UsesLibraryMixin, UsesLibrary
 
         return rval
 
+    def __serialize_contents_in_bulk(self, trans, rows, view, details, serialization_params, tombstones):
+        """
+        Serialize the contents of the rows of the contents union query, as
+        `__index_v2` serializes them one by one, in bulk.
+        """
+        hda_ids_by_view = {}
+        tombstone_ids = []
+        hdca_ids = []
+        for row in rows:
+            if row.history_content_type == 'dataset':
+                if tombstones is not None and row.purged:
+                    tombstone_ids.append(row.id)
+                elif details == 'all' or trans.security.encode_id(row.id) in details:
+                    hda_ids_by_view.setdefault('detailed', []).append(row.id)
+                else:
+                    hda_ids_by_view.setdefault(view, []).append(row.id)
+            else:
+                hdca_ids.append(row.id)
+
+        serialized = {'dataset': {}, 'dataset_collection': {}}
+        serialized['dataset'].update(self.hda_serializer.serialize_many(tombstone_ids,
+            user=trans.user, trans=trans, keys=self.TOMBSTONE_KEYS))
+        for hda_view, hda_ids in hda_ids_by_view.items():
+            serialized['dataset'].update(self.hda_serializer.serialize_many(hda_ids,
+                user=trans.user, trans=trans, view=hda_view, **serialization_params))
+        serialized['dataset_collection'] = self.hdca_serializer.serialize_many(hdca_ids,
+            user=trans.user, trans=trans, view=view, **serialization_params)
+
+        rval = []
+        for row in rows:
+            content = serialized[row.history_content_type].get(row.id)
+            if content is None:
+                # removed since the contents were listed
+                continue
+            if tombstones is not None and row.history_content_type == 'dataset' and row.purged:
+                tombstones.append(content)
+            else:
+                rval.append(content)
+        return rval
+
     def encode_type_id(self, type_id):
         TYPE_ID_SEP = '-'
         split = type_id.split(TYPE_ID_SEP, 1)
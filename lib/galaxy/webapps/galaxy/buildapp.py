@@ -409,6 +409,12 @@ def populate_api_routes(webapp, app):
         controller="configuration",
         action="tool_lineages"
     )
+    webapp.mapper.connect(
+        'metadata_cache',
+        '/api/configuration/metadata_cache',
+        controller="configuration",
+        action="metadata_cache"
+    )
     webapp.mapper.connect(
         '/api/configuration/toolbox',
         controller="configuration",
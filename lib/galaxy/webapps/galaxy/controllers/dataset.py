@@ -248,6 +248,11 @@ class DatasetInterface(BaseUIController, UsesAnnotations, UsesItemRatings, UsesE
         # Ensure ck_size is an integer before passing through to datatypes.
         if ck_size:
             ck_size = int(ck_size)
+        # Ensure line is an integer before passing through to datatypes.
+        if kwd.get("line"):
+            kwd["line"] = int(kwd["line"])
+            if kwd["line"] < 0:
+                raise RequestParameterInvalidException("Invalid request parameter 'line', must not be negative.")
         return data.datatype.display_data(trans, data, preview, filename, to_ext, offset=offset, ck_size=ck_size, **kwd)
 
     @web.legacy_expose_api_anonymous
@@ -447,7 +452,7 @@ class DatasetInterface(BaseUIController, UsesAnnotations, UsesItemRatings, UsesE
                 else:
                     path = data.dataset.file_name
                     is_binary = check_binary(path)
-                    datatype = sniff.guess_ext(path, trans.app.datatypes_registry.sniff_order, is_binary=is_binary)
+                    datatype = sniff.guess_ext(path, trans.app.datatypes_registry.sniff_plan, is_binary=is_binary)
                     trans.app.datatypes_registry.change_datatype(data, datatype)
                     trans.sa_session.flush()
                     trans.app.datatypes_registry.set_external_metadata_tool.tool_action.execute(
@@ -961,10 +966,7 @@ class DatasetInterface(BaseUIController, UsesAnnotations, UsesItemRatings, UsesE
             # Ensure HDA is deleted
             hda.deleted = True
             # HDA is purgeable
-            # Decrease disk usage first
-            if user:
-                user.adjust_total_disk_usage(-hda.quota_amount(user))
-            # Mark purged
+            # Mark purged, disk usage is decreased on flush
             hda.purged = True
             trans.sa_session.add(hda)
             trans.log_event("HDA id %s has been purged" % hda.id)
@@ -467,15 +467,10 @@ def _purge_dataset(app, dataset, remove_from_disk, info_only=False):
                         # Remove associated extra files from disk if they exist
                         if dataset.extra_files_path and os.path.exists(dataset.extra_files_path):
                             shutil.rmtree(dataset.extra_files_path)  # we need to delete the directory and its contents; os.unlink would always fail on a directory
-                        usage_users = []
+                        # The disk usage of users is decreased on flush
                         for hda in dataset.history_associations:
                             if not hda.purged:
                                 hda.purged = True
-                                if hda.history.user is not None and hda.history.user not in usage_users:
-                                    usage_users.append(hda.history.user)
-                        for user in usage_users:
-                            user.adjust_total_disk_usage(-dataset.get_total_size())
-                            app.sa_session.add(user)
                     log.info("Purging dataset id %d", dataset.id)
                     dataset.purged = True
                     app.sa_session.add(dataset)
@@ -357,26 +357,41 @@ class RequiresDiskUsageRecalculation(object):
         copies at purge-time, simply maintain a list of users that have had
         HDAs purged, and update their usages once all updates are complete.
 
-        This could probably be done more efficiently.
+        The references of these users to datasets, which Galaxy keeps their
+        disk usage current from (see galaxy.model.user_disk_usage), are
+        rebuilt at the same time.
         """
         log.info('Recalculating disk usage for users whose data were purged')
         for user_id in sorted(self.__recalculate_disk_usage_user_ids):
             # TODO: h.purged = false should be unnecessary once all hdas in purged histories are purged.
             sql = """
+                     WITH referenced AS (
+                              SELECT hda.dataset_id, COUNT(*) AS reference_count
+                                FROM history_dataset_association hda
+                                     JOIN history h ON h.id = hda.history_id
+                               WHERE h.user_id = %(user_id)s
+                                     AND h.purged = false
+                                     AND hda.purged = false
+                                     AND hda.dataset_id IS NOT NULL
+                            GROUP BY hda.dataset_id),
+                          deleted_references AS (
+                              DELETE FROM user_dataset_reference
+                               WHERE user_id = %(user_id)s
+                                     AND dataset_id NOT IN (SELECT dataset_id FROM referenced)),
+                          updated_references AS (
+                              INSERT INTO user_dataset_reference (user_id, dataset_id, reference_count)
+                                   SELECT %(user_id)s, dataset_id, reference_count
+                                     FROM referenced
+                              ON CONFLICT (user_id, dataset_id)
+                                DO UPDATE SET reference_count = EXCLUDED.reference_count)
                    UPDATE galaxy_user
                       SET disk_usage = (
-                            SELECT COALESCE(SUM(total_size), 0)
-                              FROM (  SELECT d.total_size
-                                        FROM history_dataset_association hda
-                                             JOIN history h ON h.id = hda.history_id
-                                             JOIN dataset d ON hda.dataset_id = d.id
-                                       WHERE h.user_id = %(user_id)s
-                                             AND h.purged = false
-                                             AND hda.purged = false
-                                             AND d.purged = false
-                                             AND d.id NOT IN (SELECT dataset_id
-                                                                FROM library_dataset_dataset_association)
-                                    GROUP BY d.id) AS sizes)
+                            SELECT COALESCE(SUM(COALESCE(d.total_size, d.file_size, 0)), 0)
+                              FROM referenced r
+                                   JOIN dataset d ON r.dataset_id = d.id
+                             WHERE NOT EXISTS (SELECT 1
+                                                 FROM library_dataset_dataset_association ldda
+                                                WHERE ldda.dataset_id = d.id))
                     WHERE id = %(user_id)s
                 RETURNING disk_usage;
             """
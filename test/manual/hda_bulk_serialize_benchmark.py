@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Time serializing the contents of a large history to the summary view.
+
+Compares ``HDASerializer.serialize_many``, serializing items in bulk from
+the rows of a projection, with serializing each HDA from its (lazily
+loaded) attributes and relations, as the history contents API used to.
+
+% python test/manual/hda_bulk_serialize_benchmark.py --hdas 50000
+% python test/manual/hda_bulk_serialize_benchmark.py --hdas 50000 --database_connection postgresql:///galaxy_bench
+
+The database must be empty, its tables are created by the script.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+galaxy_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+sys.path.insert(1, os.path.join(galaxy_root, "lib"))
+sys.path.insert(1, os.path.join(galaxy_root, "test"))
+
+from unit.unittest_utils.galaxy_mock import MockApp
+
+from galaxy.managers import hdas
+
+DESCRIPTION = "Script to time serializing HDAs in bulk against serializing them one at a time."
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description=DESCRIPTION)
+    arg_parser.add_argument("--database_connection", default=None,
+                            help="SQLAlchemy URL of an empty database (default: a temporary SQLite database)")
+    arg_parser.add_argument("--hdas", type=int, default=50000, help="Number of HDAs in the history")
+    arg_parser.add_argument("--item_hdas", type=int, default=2000, help="Number of these HDAs to serialize one at a time")
+    arg_parser.add_argument("--view", default="summary", help="View to serialize")
+    args = arg_parser.parse_args(argv)
+
+    database_connection = args.database_connection
+    if database_connection is None:
+        database_connection = "sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "universe.sqlite")
+    app = MockApp(database_connection=database_connection)
+    app.config.is_admin_user = lambda user: False
+    hdas.HDASerializer.url_for = staticmethod(lambda *a, **k: "/mock/url")
+    serializer = hdas.HDASerializer(app)
+    user, hda_ids = _create_history(app, args.hdas)
+    sa_session = app.model.context
+
+    sa_session.expunge_all()
+    user = sa_session.query(app.model.User).get(user.id)
+    start = time.time()
+    serialized = serializer.serialize_many(hda_ids, view=args.view, user=user)
+    _report("bulk", len(serialized), time.time() - start)
+
+    sa_session.expunge_all()
+    user = sa_session.query(app.model.User).get(user.id)
+    start = time.time()
+    HDA = app.model.HistoryDatasetAssociation
+    for hda in sa_session.query(HDA).filter(HDA.id.in_(hda_ids[:args.item_hdas])).order_by(HDA.hid):
+        serializer.serialize_to_view(hda, view=args.view, user=user)
+    _report("item", min(args.item_hdas, len(hda_ids)), time.time() - start)
+
+
+def _create_history(app, count):
+    """Insert a history of ``count`` HDAs, one in ten tagged, using core inserts for speed."""
+    model = app.model
+    sa_session = model.context
+    user = model.User(email="bench@example.org", password="bench")
+    history = model.History(name="Serialization benchmark", user=user)
+    sa_session.add_all([user, history])
+    sa_session.flush()
+    hda_ids = []
+    for hid in range(1, count + 1):
+        dataset_id = sa_session.execute(model.Dataset.table.insert().values(state=model.Dataset.states.OK, file_size=hid)).inserted_primary_key[0]
+        hda_id = sa_session.execute(model.HistoryDatasetAssociation.table.insert().values(
+            history_id=history.id, dataset_id=dataset_id, hid=hid, name="dataset %d" % hid, extension="txt", visible=True)).inserted_primary_key[0]
+        if hid % 10 == 0:
+            sa_session.execute(model.HistoryDatasetAssociationTagAssociation.table.insert().values(
+                history_dataset_association_id=hda_id, user_id=user.id, user_tname="group", value="bench", user_value="bench"))
+        hda_ids.append(hda_id)
+    return user, hda_ids
+
+
+def _report(method, count, elapsed):
+    print("%s: serialized %d HDAs in %.3f seconds (%.1f HDAs/second)" % (method, count, elapsed, count / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
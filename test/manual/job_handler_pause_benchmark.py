@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Time pausing a large number of new jobs from the job handler.
+
+Compares the bulk ``UPDATE ... WHERE id IN (...)`` path used by the job
+handler queue with pausing each job through the ORM (as
+``JobWrapper.pause()`` does).
+
+% python test/manual/job_handler_pause_benchmark.py --jobs 50000
+% python test/manual/job_handler_pause_benchmark.py --jobs 50000 --database_connection postgresql:///galaxy_bench
+
+The database must be empty, its tables are created by the script.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+galaxy_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+sys.path.insert(1, os.path.join(galaxy_root, "lib"))
+
+import galaxy.datatypes.registry
+import galaxy.model
+import galaxy.model.mapping as mapping
+from galaxy.jobs.handler import pause_new_jobs
+
+DESCRIPTION = "Script to time pausing new jobs in bulk against pausing them one at a time."
+PAUSE_MESSAGE = "Execution of this dataset's job is paused because you were over your disk quota at the time it was ready to run"
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description=DESCRIPTION)
+    arg_parser.add_argument("--database_connection", default=None,
+                            help="SQLAlchemy URL of an empty database (default: a temporary SQLite database)")
+    arg_parser.add_argument("--jobs", type=int, default=50000, help="Number of new jobs to pause in bulk")
+    arg_parser.add_argument("--orm_jobs", type=int, default=2000, help="Number of new jobs to pause through the ORM")
+    args = arg_parser.parse_args(argv)
+
+    database_connection = args.database_connection
+    if database_connection is None:
+        database_connection = "sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "universe.sqlite")
+    datatypes_registry = galaxy.datatypes.registry.Registry()
+    datatypes_registry.load_datatypes()
+    galaxy.model.set_datatypes_registry(datatypes_registry)
+    model = mapping.init(tempfile.mkdtemp(), database_connection, create_tables=True)
+
+    bulk_job_ids = _create_new_jobs(model, args.jobs)
+    start = time.time()
+    paused = pause_new_jobs(model.context, dict((job_id, PAUSE_MESSAGE) for job_id in bulk_job_ids))
+    _report("bulk", len(paused), time.time() - start)
+
+    orm_job_ids = _create_new_jobs(model, args.orm_jobs)
+    sa_session = model.context
+    sa_session.expunge_all()
+    start = time.time()
+    for job_id in orm_job_ids:
+        job = sa_session.query(model.Job).get(job_id)
+        for dataset_assoc in job.output_datasets + job.output_library_datasets:
+            dataset_assoc.dataset.dataset.state = model.Dataset.states.PAUSED
+            dataset_assoc.dataset.info = PAUSE_MESSAGE
+            sa_session.add(dataset_assoc.dataset)
+        job.set_state(model.Job.states.PAUSED)
+        sa_session.add(job)
+        sa_session.flush()
+    _report("orm", len(orm_job_ids), time.time() - start)
+
+
+def _create_new_jobs(model, count):
+    """Insert ``count`` new jobs with one output dataset each, using core inserts for speed."""
+    sa_session = model.context
+    history = model.History(name="Job handler benchmark")
+    sa_session.add(history)
+    sa_session.flush()
+    job_ids = []
+    for _ in range(count):
+        dataset_id = sa_session.execute(model.Dataset.table.insert().values(state=model.Dataset.states.NEW)).inserted_primary_key[0]
+        hda_id = sa_session.execute(model.HistoryDatasetAssociation.table.insert().values(
+            history_id=history.id, dataset_id=dataset_id, name="output", extension="txt")).inserted_primary_key[0]
+        job_id = sa_session.execute(model.Job.table.insert().values(
+            state=model.Job.states.NEW, tool_id="cat1", handler="main")).inserted_primary_key[0]
+        sa_session.execute(model.JobToOutputDatasetAssociation.table.insert().values(
+            job_id=job_id, dataset_id=hda_id, name="out_file1"))
+        job_ids.append(job_id)
+    return job_ids
+
+
+def _report(method, count, elapsed):
+    print("%s: paused %d jobs in %.3f seconds (%.1f jobs/second)" % (method, count, elapsed, count / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Report how many bytes of each file are read to guess its datatype.
+
+For every file in the given directories (by default the sniffer test data
+and test-data), runs ``guess_ext`` with the sample datatypes registry and
+reports the bytes read through the shared ``FilePrefix`` of the file (the
+part of the file mapped and read at most once) and the bytes read by
+sniffers and libraries opening the file themselves (from /proc/self/io,
+Linux only).
+
+% python test/manual/sniff_bytes_read_benchmark.py
+% python test/manual/sniff_bytes_read_benchmark.py --verbose /path/to/uploads
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+galaxy_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+sys.path.insert(1, os.path.join(galaxy_root, "lib"))
+
+from galaxy.datatypes.registry import example_datatype_registry_for_sample
+from galaxy.datatypes.sniff import (
+    FilePrefix,
+    get_test_fname,
+    guess_ext,
+)
+
+DESCRIPTION = "Script to report the bytes read per guess_ext call."
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description=DESCRIPTION)
+    arg_parser.add_argument("directories", nargs="*", help="Directories of files to sniff")
+    arg_parser.add_argument("--verbose", action="store_true", help="Report every file")
+    args = arg_parser.parse_args(argv)
+    directories = args.directories or [os.path.dirname(get_test_fname("1.bed")), os.path.join(galaxy_root, "test-data")]
+
+    datatypes_registry = example_datatype_registry_for_sample()
+    sniff_plan = datatypes_registry.sniff_plan
+    totals = {"files": 0, "size": 0, "prefix": 0, "other": 0, "seconds": 0.0}
+    for path in _files(directories):
+        read_before = _bytes_read_by_process()
+        start = time.time()
+        file_prefix = FilePrefix(path)
+        ext = guess_ext(file_prefix, sniff_plan)
+        elapsed = time.time() - start
+        read_by_others = _bytes_read_by_process() - read_before if read_before is not None else 0
+        size = os.path.getsize(path)
+        totals["files"] += 1
+        totals["size"] += size
+        totals["prefix"] += file_prefix.bytes_read
+        totals["other"] += read_by_others
+        totals["seconds"] += elapsed
+        if args.verbose:
+            print("%s\t%s\tsize=%d\tprefix=%d\tother=%d\t%.4fs" % (path, ext, size, file_prefix.bytes_read, read_by_others, elapsed))
+
+    files = totals["files"] or 1
+    print("%d files, %d bytes" % (totals["files"], totals["size"]))
+    print("per guess_ext: %.0f bytes read through the file prefix, %.0f bytes read otherwise, %.2f ms"
+          % (totals["prefix"] / files, totals["other"] / files, totals["seconds"] * 1000 / files))
+
+
+def _files(directories):
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                yield path
+
+
+def _bytes_read_by_process():
+    """Bytes read by read() calls of this process so far, None if unknown."""
+    try:
+        with open("/proc/self/io") as io_stats:
+            for line in io_stats:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+if __name__ == "__main__":
+    main()
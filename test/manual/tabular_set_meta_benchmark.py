@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Time setting the metadata of large tabular datasets.
+
+Writes a wide file (a matrix with many columns) and a long file (a few
+columns, many lines) of about the requested size, mixing integers, floats,
+lists and strings, and reports how long ``Tabular.set_meta`` takes for
+each, reading them entirely (``max_data_lines=None``) and as by default.
+
+% python test/manual/tabular_set_meta_benchmark.py
+% python test/manual/tabular_set_meta_benchmark.py --size 100 --columns 10000
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+galaxy_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+sys.path.insert(1, os.path.join(galaxy_root, "lib"))
+
+from galaxy.datatypes.tabular import Tabular
+from galaxy.util.bunch import Bunch
+
+DESCRIPTION = "Script to time Tabular.set_meta on large wide and long files."
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser(description=DESCRIPTION)
+    arg_parser.add_argument("--size", type=int, default=1024, help="Size of each file in MB")
+    arg_parser.add_argument("--columns", type=int, default=10000, help="Columns of the wide file")
+    arg_parser.add_argument("--directory", default=None, help="Directory to write the files to, a temporary one by default")
+    args = arg_parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp()
+    try:
+        for name, columns in [("wide", args.columns), ("long", 8)]:
+            path = os.path.join(directory, "%s.tabular" % name)
+            _write_file(path, columns, args.size * 1024 * 1024)
+            for max_data_lines in [None, 100000]:
+                dataset = Bunch(file_name=path, has_data=lambda: True, get_size=lambda: os.path.getsize(path), metadata=Bunch())
+                start = time.time()
+                Tabular().set_meta(dataset, max_data_lines=max_data_lines)
+                elapsed = time.time() - start
+                metadata = dataset.metadata
+                print("%s\tmax_data_lines=%s\tcolumns=%d\tdata_lines=%s\t%.2fs\t%.1f MB/s" % (
+                    name, max_data_lines, metadata.columns, metadata.data_lines, elapsed,
+                    os.path.getsize(path) / 1024.0 / 1024 / elapsed))
+            os.remove(path)
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+
+
+def _write_file(path, columns, size):
+    rng = random.Random(1)
+    values = [
+        lambda: str(rng.randint(-1000, 1000000)),
+        lambda: "%.4f" % rng.uniform(-100, 100),
+        lambda: "%.3e" % rng.random(),
+        lambda: "NA",
+        lambda: "%d,%d" % (rng.randint(0, 99), rng.randint(0, 99)),
+        lambda: "gene%d" % rng.randint(0, 99999),
+    ]
+    # One kind of values per column, but some columns get a string now and then
+    column_values = [values[rng.randrange(len(values))] for _ in range(columns)]
+    rows = ["\t".join(column_values[c]() for c in range(columns)) + "\n" for _ in range(64)]
+    with open(path, "w") as fh:
+        fh.write("#" + "\t".join("column%d" % c for c in range(columns)) + "\n")
+        written = 0
+        while written < size:
+            row = rows[rng.randrange(len(rows))]
+            fh.write(row)
+            written += len(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Unit tests for the record indexes of dataset DataProviders.
+.. seealso:: galaxy.datatypes.dataproviders.dataset
+"""
+import json
+import os
+import random
+import shutil
+import time
+
+from galaxy.datatypes.dataproviders import dataset
+from galaxy.util.bunch import Bunch
+from ..util import get_tmp_path
+
+
+def _dataset(path, extra_files_path):
+    metadata = Bunch(columns=3, column_types=['str', 'int', 'int'], column_names=['chrom', 'start', 'end'],
+                     chromCol=1, startCol=2, endCol=3)
+    return Bunch(file_name=path, extra_files_path=extra_files_path, metadata=metadata, datatype=None)
+
+
+def _providers(hda, **kwargs):
+    return [
+        dataset.DatasetColumnarDataProvider(hda, **kwargs),
+        dataset.DatasetDictDataProvider(hda, **kwargs),
+        dataset.GenomicRegionDataProvider(hda, **kwargs),
+        dataset.DatasetColumnarDataProvider(hda, filters=['1-lt-1500'], **kwargs),
+        dataset.DatasetColumnarDataProvider(hda, regex_list=['chr2'], **kwargs),
+        dataset.DatasetColumnarDataProvider(hda, provide_blank=True, comment_char=None, **kwargs),
+    ]
+
+
+def _write_dataset(path, lines):
+    rng = random.Random(lines)
+    with open(path, 'w') as fh:
+        for i in range(lines):
+            line = rng.choice(['chr1\t%d\t%d\n', 'chr2\t%d\t%d\n', '# comment %d %d\n', ' \n'])
+            fh.write(line % (i, i + 1) if '%' in line else line)
+
+
+def test_offsets_match_a_full_scan(monkeypatch):
+    monkeypatch.setattr(dataset, 'RECORD_INDEX_INTERVAL', 7)
+    with get_tmp_path(suffix='.bed') as path, get_tmp_path() as extra_files_path:
+        _write_dataset(path, 2000)
+        hda = _dataset(path, extra_files_path)
+        expected = [list(provider) for provider in _providers(hda)]
+        assert os.path.exists(os.path.join(extra_files_path, dataset.RECORD_INDEX_FILENAME))
+        for offset in [0, 1, 6, 7, 8, 300, 301, 1000, 1500, 5000, 60, 3]:
+            for limit in [None, 1, 20]:
+                for data, provider in zip(expected, _providers(hda, offset=offset, limit=limit)):
+                    end = None if limit is None else offset + limit
+                    assert list(provider) == data[offset:end], (provider, offset, limit)
+        shutil.rmtree(extra_files_path)
+
+
+def test_index_built_lazily(monkeypatch):
+    monkeypatch.setattr(dataset, 'RECORD_INDEX_INTERVAL', 100)
+    with get_tmp_path(suffix='.bed') as path, get_tmp_path() as extra_files_path:
+        _write_dataset(path, 5000)
+        hda = _dataset(path, extra_files_path)
+        index_path = os.path.join(extra_files_path, dataset.RECORD_INDEX_FILENAME)
+
+        provider = dataset.DatasetColumnarDataProvider(hda, offset=1000, limit=2)
+        data = list(provider)
+        with open(index_path) as fh:
+            indexes = json.load(fh)['indexes']
+        # indexed as far as read
+        assert len(indexes) == 1 and len(indexes[0][2]) == 11
+
+        provider = dataset.DatasetColumnarDataProvider(hda, offset=1000, limit=2)
+        assert list(provider) == data
+        # read from the indexed line of the 1000th record
+        assert provider.num_data_read < 10
+
+        # a filter function cannot be described: not indexed
+        provider = dataset.DatasetColumnarDataProvider(hda, offset=1000, limit=2, filter_fn=lambda line: line)
+        assert list(provider) == data
+        assert provider.num_data_read > 1000
+        shutil.rmtree(extra_files_path)
+
+
+def test_index_dropped_when_dataset_changes(monkeypatch):
+    monkeypatch.setattr(dataset, 'RECORD_INDEX_INTERVAL', 10)
+    with get_tmp_path(suffix='.bed') as path, get_tmp_path() as extra_files_path:
+        _write_dataset(path, 500)
+        hda = _dataset(path, extra_files_path)
+        list(dataset.GenomicRegionDataProvider(hda))
+        mtime = os.path.getmtime(path)
+        with open(path, 'a') as fh:
+            fh.write('chr3\t1\t2\n')
+        with open(path, 'r+') as fh:
+            fh.write('chr9')
+        os.utime(path, (time.time(), mtime + 10))
+        provider = dataset.GenomicRegionDataProvider(hda, offset=30)
+        assert list(provider) == list(dataset.GenomicRegionDataProvider(hda, filter_fn=lambda line: line))[30:]
+        shutil.rmtree(extra_files_path)
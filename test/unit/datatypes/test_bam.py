@@ -1,5 +1,8 @@
+import os
+
 import pysam
 
+from galaxy.datatypes import binary
 from galaxy.datatypes.binary import Bam
 from .util import (
     get_dataset,
@@ -46,3 +49,53 @@ def test_set_meta_presorted():
         bam_file = pysam.AlignmentFile(dataset.file_name, mode='rb',
                                        index_filename=dataset.metadata.bam_index.file_name)
         assert bam_file.has_index() is True
+
+
+def test_dataset_content_needs_grooming_sampled_order():
+    b = Bam()
+    with get_input_files('1.bam', '2.shuffled.unsorted.bam', '1.qname_sorted.bam') as input_files:
+        sorted_bam, shuffled_bam, qname_sorted_bam = input_files
+        # Declared coordinate-sorted and sorted, no need to index
+        assert b._declared_and_sampled_coordinate_sorted(sorted_bam) is True
+        # Declared coordinate-sorted but shuffled
+        assert b._declared_and_sampled_coordinate_sorted(shuffled_bam) is False
+        assert b._declared_and_sampled_coordinate_sorted(qname_sorted_bam) is False
+        assert b.dataset_content_needs_grooming(qname_sorted_bam) is True
+
+
+def test_threads(monkeypatch):
+    b = Bam()
+    monkeypatch.setenv('GALAXY_SLOTS', '4')
+    assert b.threads() == 4
+    monkeypatch.setattr(Bam, '_max_threads', 2)
+    assert b.threads() == 2
+    assert Bam().max_threads == 2
+
+
+def test_pysam_index_args(monkeypatch):
+    monkeypatch.setattr(binary, 'PYSAM_INDEX_INPUT_FIRST', False)
+    assert binary._pysam_index_args('in.bam', 'in.bai', 4) == ['-@', '4', 'in.bam', 'in.bai']
+    monkeypatch.setattr(binary, 'PYSAM_INDEX_INPUT_FIRST', True)
+    assert binary._pysam_index_args('in.bam', 'in.bai', 4) == ['in.bam', 'in.bai', '-@', '4']
+
+
+def test_set_meta_keeps_valid_index(monkeypatch):
+    b = Bam()
+    monkeypatch.setenv('GALAXY_SLOTS', '2')
+    with get_dataset('1.bam') as dataset:
+        b.set_meta(dataset=dataset)
+        index_file_name = dataset.metadata.bam_index.file_name
+        assert b._valid_index(dataset.file_name, index_file_name) is True
+
+        def fail(*args):
+            raise AssertionError("valid index should be kept")
+
+        monkeypatch.setattr(pysam, 'index', fail)
+        b.set_meta(dataset=dataset)
+        monkeypatch.undo()
+
+        # An index older than the BAM file is indexed again
+        os.utime(index_file_name, (0, 0))
+        assert b._valid_index(dataset.file_name, index_file_name) is False
+        b.set_meta(dataset=dataset)
+        assert b._valid_index(dataset.file_name, index_file_name) is True
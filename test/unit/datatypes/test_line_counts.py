@@ -0,0 +1,115 @@
+import bz2
+import gzip
+import os
+import random
+
+import pysam
+import pytest
+
+from galaxy.datatypes.sniff import get_test_fname
+from galaxy.datatypes.util import line_counts
+from galaxy.util import galaxy_directory
+from galaxy.util.compression_utils import get_fileobj
+from .util import get_tmp_path
+
+TEST_DATA_DIRECTORIES = [
+    os.path.dirname(get_test_fname("1.bed")),
+    os.path.join(galaxy_directory(), "test-data"),
+]
+LINES = [
+    "", " ", "\t", "#", " # x", "@r1", " @r2", "ACGT", "+", "II@I", ">seq", "\t>seq", "\xa0>x", " #",
+    "\x1c@", "\x0b", "\x85", "\xe9t\xe9", "a\x00b", "@" * 50, "#" * 30,
+]
+
+
+def _count_line_by_line(path):
+    """Data lines, FASTA and FASTQ counts as the datatypes used to count them line by line."""
+    data_lines = 0
+    fasta = [0, 0]
+    fastq = [0, 0]
+    seq_counter = 0
+    with get_fileobj(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                data_lines += 1
+            if not line.startswith("#"):
+                fasta[0] += 1
+                if line.startswith(">"):
+                    fasta[1] += 1
+            if line.startswith("#") and not fastq[0]:
+                continue
+            seq_counter += 1
+            fastq[0] += 1
+            if line.startswith("@") and seq_counter >= 4:
+                fastq[1] += 1
+                seq_counter = 1
+    if seq_counter >= 4:
+        fastq[1] += 1
+    return data_lines, tuple(fasta), tuple(fastq)
+
+
+def _count_by_blocks(path, **kwd):
+    counters = [line_counts.DataLineCounter(), line_counts.FastaCounter(), line_counts.FastqCounter()]
+    for first_characters in line_counts.iter_first_characters(path, **kwd):
+        for counter in counters:
+            counter.update(first_characters)
+    data_lines, fasta, fastq = counters
+    return data_lines.data_lines, (fasta.data_lines, fasta.sequences), (fastq.data_lines, fastq.sequences)
+
+
+def _text_files():
+    for directory in TEST_DATA_DIRECTORIES:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                expected = _count_line_by_line(path)
+            except Exception:
+                # Not text
+                continue
+            yield path, expected
+
+
+def test_count_matches_line_by_line():
+    for path, expected in _text_files():
+        assert _count_by_blocks(path) == expected, path
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 64])
+def test_count_random_content(block_size):
+    rng = random.Random(block_size)
+    for _ in range(100):
+        lines = [rng.choice(LINES) for _ in range(rng.randint(0, 30))]
+        content = "".join(line + rng.choice(["\n", "\r\n", "\r"]) for line in lines)
+        if rng.random() < 0.5:
+            content += rng.choice(LINES)
+        compression = rng.choice([None, "gz", "bz2"])
+        with get_tmp_path() as path:
+            opener = {None: open, "gz": gzip.open, "bz2": bz2.BZ2File}[compression]
+            with opener(path, "wb") as fh:
+                fh.write(content.encode("utf-8"))
+            assert _count_by_blocks(path, block_size=block_size) == _count_line_by_line(path), repr(content)
+
+
+def test_count_not_utf8():
+    with get_tmp_path() as path:
+        with open(path, "wb") as fh:
+            fh.write(b"a\nb\xff\n")
+        with pytest.raises(UnicodeDecodeError):
+            _count_by_blocks(path)
+
+
+def test_count_bgzf_in_threads():
+    with get_tmp_path() as path, get_tmp_path(suffix=".gz") as bgzf_path:
+        with open(path, "w") as fh:
+            for i in range(20000):
+                fh.write("@read%d\nACGT\n+\nIIII\n" % i)
+        pysam.tabix_compress(path, bgzf_path)
+        counter = line_counts.count(bgzf_path, line_counts.FastqCounter(), threads=4)
+        assert (counter.data_lines, counter.sequences) == (80000, 20000)
+        blocks = list(line_counts.iter_blocks(bgzf_path, block_size=2 ** 14, threads=4))
+        assert len(blocks) > 1
+        with open(path, "rb") as fh:
+            assert b"".join(blocks) == fh.read()
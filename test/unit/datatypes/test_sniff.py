@@ -1,11 +1,16 @@
+import gzip
+import io
 import tempfile
 
 import pytest
 
+from galaxy.datatypes import sniff
 from galaxy.datatypes.sniff import (
     convert_newlines,
     convert_newlines_sep2tabs,
+    FilePrefix,
     get_test_fname,
+    open_for_sniffing,
 )
 
 
@@ -76,3 +81,64 @@ def test_convert_sep2tabs(source, expected):
         assert_converts_to_1234_convert_sep2tabs(source, expected=expected)
     else:
         assert_converts_to_1234_convert_sep2tabs(source)
+
+
+def test_file_prefix_shares_decompressed_contents():
+    contents = b"".join(b"line %d\n" % i for i in range(100000))
+    with tempfile.NamedTemporaryFile(suffix=".gz", delete=False) as tf:
+        with gzip.GzipFile(fileobj=tf, mode="wb") as gz:
+            gz.write(contents)
+    file_prefix = FilePrefix(tf.name)
+    assert file_prefix.compressed_format == "gzip"
+    assert file_prefix.contents_header_bytes == contents[:sniff.SNIFF_PREFIX_BYTES]
+    assert file_prefix.raw_file().read(2) == b"\x1f\x8b"
+    contents_file = file_prefix.contents_file()
+    contents_file.seek(10)
+    assert contents_file.read(6) == contents[10:16]
+    assert file_prefix.contents_file().read() == contents
+    assert file_prefix.bytes_read == file_prefix.file_size
+
+    # Sniffers get file objects over the prefix while its file is sniffed
+    with sniff._sniffing_file(file_prefix):
+        assert open_for_sniffing(tf.name, "gzip").read(4) == b"line"
+        assert open_for_sniffing(tf.name).read(2) == b"\x1f\x8b"
+        assert not isinstance(open_for_sniffing(get_test_fname("1.bed")), sniff._SharedBytesReader)
+    assert not isinstance(open_for_sniffing(tf.name, "gzip"), sniff._SharedBytesReader)
+
+
+def test_shared_bytes_keeps_limited_prefix():
+    contents = b"".join(b"line %d\n" % i for i in range(100000))
+
+    def reopen():
+        return io.BytesIO(contents)
+
+    shared = sniff._SharedBytes(source=reopen(), reopen=reopen, limit=1000)
+    reader = sniff._SharedBytesReader(shared)
+    # The size is known without keeping the data
+    assert reader.seek(-10, io.SEEK_END) == len(contents) - 10
+    assert reader.read() == contents[-10:]
+    assert len(shared.data) == 1000
+    assert reader.seek(500) == 500
+    assert reader.read(1000) == contents[500:1500]
+    reader.seek(200000)
+    assert reader.read(50) == contents[200000:200050]
+    assert sniff._SharedBytesReader(shared).read() == contents
+    assert len(shared.data) == 1000
+
+
+def test_file_prefix_close():
+    with FilePrefix(get_test_fname("1.bed")) as file_prefix:
+        contents_file = file_prefix.contents_file()
+        assert contents_file.read(3)
+    with pytest.raises(ValueError):
+        contents_file.read(3)
+
+
+def test_file_prefix_reads_lazily():
+    fname = get_test_fname("test.mz5")
+    file_prefix = FilePrefix(fname)
+    assert file_prefix.compressed_format is None
+    assert file_prefix.binary
+    assert file_prefix.bytes_read == min(file_prefix.file_size, sniff.SNIFF_PREFIX_BYTES)
+    with open(fname, "rb") as f:
+        assert file_prefix.raw_file().read(16) == f.read(16)
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from galaxy.datatypes.registry import example_datatype_registry_for_sample
+from galaxy.datatypes.sniff import (
+    FilePrefix,
+    get_test_fname,
+    run_sniffers_raw,
+    SniffPlan,
+)
+from galaxy.util import galaxy_directory
+
+TEST_DATA_DIRECTORIES = [
+    os.path.dirname(get_test_fname("1.bed")),
+    os.path.join(galaxy_directory(), "test-data"),
+]
+
+
+def _test_data_files():
+    for directory in TEST_DATA_DIRECTORIES:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                yield path
+
+
+def _run_sniffers_linear(file_prefix, sniff_order, is_binary=False):
+    """Run through the whole sniff order, as run_sniffers_raw did before sniff plans."""
+    fname = file_prefix.filename
+    for datatype in sniff_order:
+        try:
+            if hasattr(datatype, "sniff_prefix"):
+                datatype_compressed = getattr(datatype, "compressed", False)
+                if datatype_compressed and not file_prefix.compressed_format:
+                    continue
+                if not datatype_compressed and file_prefix.compressed_format:
+                    continue
+                if file_prefix.compressed_format and getattr(datatype, "compressed_format"):
+                    if file_prefix.compressed_format != datatype.compressed_format:
+                        continue
+                if datatype.sniff_prefix(file_prefix):
+                    return datatype.file_ext
+            elif is_binary and not datatype.is_binary:
+                continue
+            elif datatype.sniff(fname):
+                return datatype.file_ext
+        except Exception:
+            pass
+    return None
+
+
+@pytest.fixture(scope="module")
+def datatypes_registry():
+    return example_datatype_registry_for_sample()
+
+
+@pytest.mark.parametrize("is_binary", [False, True])
+def test_sniff_plan_matches_sniff_order(datatypes_registry, is_binary):
+    sniff_plan = datatypes_registry.sniff_plan
+    for path in _test_data_files():
+        file_prefix = FilePrefix(path)
+        expected = _run_sniffers_linear(file_prefix, datatypes_registry.sniff_order, is_binary=is_binary)
+        assert run_sniffers_raw(file_prefix, sniff_plan, is_binary=is_binary) == expected, path
+
+
+def test_sniff_plan_skips_magic_groups(datatypes_registry):
+    sniff_plan = datatypes_registry.sniff_plan
+    sqlite_candidates = [c for c in sniff_plan.candidates(None) if c[2] == (b'SQLite format 3\0',)]
+    assert len(sqlite_candidates) > 1
+
+    sniffed = []
+
+    class RecordingSniffer(object):
+        file_ext = "recorded"
+        is_binary = True
+        sniff_magic = (b"GALAXY",)
+
+        def sniff(self, filename):
+            sniffed.append(filename)
+            return True
+
+    plan = SniffPlan([RecordingSniffer()])
+    assert plan.magic_length == 6
+    assert run_sniffers_raw(get_test_fname("1.bed"), plan) is None
+    assert sniffed == []
+
+
+def test_sniff_plan_follows_registry_sniff_order(datatypes_registry):
+    sniff_plan = datatypes_registry.sniff_plan
+    assert datatypes_registry.sniff_plan is sniff_plan
+    datatypes_registry.sniff_order.append(datatypes_registry.get_datatype_by_extension("txt"))
+    try:
+        assert datatypes_registry.sniff_plan is not sniff_plan
+        assert len(datatypes_registry.sniff_plan) == len(sniff_plan) + 1
+    finally:
+        datatypes_registry.sniff_order.pop()
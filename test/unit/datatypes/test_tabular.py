@@ -0,0 +1,202 @@
+import gzip
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+from galaxy.datatypes import tabular
+from galaxy.datatypes.sniff import get_test_fname
+from galaxy.datatypes.tabular import Tabular
+from galaxy.util import galaxy_directory
+from galaxy.util.bunch import Bunch
+from galaxy.util.compression_utils import get_fileobj
+from .util import get_tmp_path
+
+TEST_DATA_DIRECTORIES = [
+    os.path.dirname(get_test_fname("1.bed")),
+    os.path.join(galaxy_directory(), "test-data"),
+]
+TRICKY_VALUES = [
+    "", "0", "-0", "12", "-12", "+3", " 4", "5 ", "1_000", "--1", "-", "1-", "٣",
+    "1.", ".5", "-.5", "-1.5", ".", "-.", "1.2.3", "1e5", "-1E-5", "inf", "nan", "NA", " na ",
+    "1e", "e5", "1e+", "+1e5", ".e5", "1.e-05", "1e5e5", "1e5.", "1E-0", "+", "+.", "Na", "nA",
+    "1,2", ",", "1,2.5", "a", "#", "\x00", "1\x00", "9" * 5000, "9." + "9" * 5000,
+]
+
+
+def _set_meta_line_by_line(dataset, skip=None, max_data_lines=100000, max_guess_type_data_lines=None):
+    """Tabular.set_meta as it typed values one by one, the reference of the block based implementation."""
+    order = ["int", "float", "list", "str"]
+
+    def guess(text):
+        for column_type, check in zip(order, [int, float]):
+            try:
+                check(text)
+                return column_type
+            except ValueError:
+                pass
+        if text.strip().lower() == "na":
+            return "float"
+        if "," in text:
+            return "list"
+        return "str" if text else None
+
+    def overrules(type1, type2):
+        return type1 is not None and (type2 is None or order.index(type1) > order.index(type2))
+
+    requested_skip = skip
+    skip = skip or 0
+    data_lines = comment_lines = 0
+    column_types = []
+    first_line_column_types = ["str"]
+    with get_fileobj(dataset.file_name) as dataset_fh:
+        i = 0
+        while True:
+            line = dataset_fh.readline()
+            if not line:
+                break
+            line = line.rstrip("\r\n")
+            if i < skip or not line or line.startswith("#"):
+                comment_lines += 1
+            else:
+                data_lines += 1
+                if max_guess_type_data_lines is None or data_lines <= max_guess_type_data_lines:
+                    for field_count, field in enumerate(line.split("\t")):
+                        if field_count >= len(column_types):
+                            column_types.append(None)
+                        column_type = guess(field)
+                        if overrules(column_type, column_types[field_count]):
+                            column_types[field_count] = column_type
+                if i == 0 and requested_skip is None:
+                    first_line_column_types = column_types
+                    column_types = [None for col in first_line_column_types]
+            if max_data_lines is not None and data_lines >= max_data_lines:
+                if dataset_fh.tell() != dataset.get_size():
+                    data_lines = comment_lines = None
+                break
+            i += 1
+    column_types.extend(first_line_column_types[len(column_types):])
+    for i in range(len(column_types)):
+        if column_types[i] is None:
+            if len(first_line_column_types) <= i or first_line_column_types[i] is None:
+                column_types[i] = "str"
+            else:
+                column_types[i] = first_line_column_types[i]
+    return data_lines, comment_lines, column_types, len(column_types)
+
+
+def _dataset(path):
+    return Bunch(file_name=path, has_data=lambda: True, get_size=lambda: os.path.getsize(path), metadata=Bunch())
+
+
+def _set_meta(path, **kwd):
+    dataset = _dataset(path)
+    Tabular().set_meta(dataset, **kwd)
+    metadata = dataset.metadata
+    return metadata.data_lines, metadata.comment_lines, metadata.column_types, metadata.columns
+
+
+def _tabular_files():
+    for directory in TEST_DATA_DIRECTORIES:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                with get_fileobj(path) as fh:
+                    fh.read()
+            except Exception:
+                # Not text
+                continue
+            yield path
+
+
+@pytest.mark.parametrize("kwd", [
+    {},
+    {"skip": 1},
+    {"max_data_lines": 5},
+    {"max_data_lines": None, "max_guess_type_data_lines": 3},
+])
+def test_set_meta_matches_line_by_line(kwd):
+    for path in _tabular_files():
+        assert _set_meta(path, **kwd) == _set_meta_line_by_line(_dataset(path), **kwd), path
+
+
+def test_set_meta_tricky_values(monkeypatch):
+    # Small blocks, so that lines and CRLF line endings are split between blocks
+    monkeypatch.setattr(tabular, "SET_META_BLOCK_SIZE", 7)
+    rng = random.Random(13)
+    for trial in range(30):
+        lines = []
+        for _ in range(rng.randint(0, 20)):
+            if rng.random() < 0.1:
+                lines.append(rng.choice(["", "#comment", "# a\tb"]))
+            else:
+                lines.append("\t".join(rng.choice(TRICKY_VALUES[:20] if trial % 2 else TRICKY_VALUES) for _ in range(rng.randint(1, 6))))
+        content = rng.choice(["\n", "\r\n", "\r"]).join(lines) + rng.choice(["", "\n", "\n\n"])
+        compress = rng.random() < 0.2
+        with get_tmp_path(suffix=".gz" if compress else ".tabular") as path:
+            with (gzip.open(path, "wb") if compress else open(path, "wb")) as fh:
+                fh.write(content.encode("utf-8"))
+            for kwd in [{}, {"skip": 2}, {"max_data_lines": 3}, {"max_data_lines": len(lines)}, {"max_guess_type_data_lines": 0}]:
+                assert _set_meta(path, **kwd) == _set_meta_line_by_line(_dataset(path), **kwd), (content, kwd)
+
+
+def test_set_meta_wide():
+    rng = random.Random(1)
+    with get_tmp_path(suffix=".tabular") as path:
+        with open(path, "w") as fh:
+            fh.write("\t".join("c%d" % i for i in range(2000)) + "\n")
+            for _ in range(50):
+                fh.write("\t".join([str(rng.randint(-9, 9)), "%.3f" % rng.random(), "1e-3", "x"] * 500) + "\n")
+        data_lines, comment_lines, column_types, columns = _set_meta(path)
+    assert (data_lines, comment_lines, columns) == (51, 0, 2000)
+    assert column_types == ["int", "float", "float", "str"] * 500
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_get_chunk(compress):
+    lines = ["%d\tvalue %d\r\n" % (i, i) for i in range(5000)]
+    with get_tmp_path(suffix=".gz" if compress else ".tabular") as path, get_tmp_path() as extra_files_path:
+        with (gzip.open(path, "wb") if compress else open(path, "wb")) as fh:
+            fh.write("".join(lines).encode("utf-8"))
+        dataset = Bunch(file_name=path, extra_files_path=extra_files_path, get_size=lambda: os.path.getsize(path))
+        trans = Bunch(app=Bunch(config=Bunch(display_chunk_size=1000)))
+        tabular_datatype = Tabular()
+
+        offset = 0
+        chunks = []
+        while True:
+            chunk = json.loads(tabular_datatype.get_chunk(trans, dataset, offset))
+            if not chunk["ck_data"]:
+                break
+            assert chunk["ck_data"].endswith("\n")
+            assert len(chunk["ck_data"]) <= 1000
+            chunks.append(chunk["ck_data"])
+            offset = chunk["offset"]
+        assert "".join(chunks) == "".join(lines).replace("\r\n", "\n")
+
+        chunk = json.loads(tabular_datatype.get_chunk(trans, dataset, line=4321))
+        assert chunk["ck_data"].startswith("4321\tvalue 4321\n")
+        assert chunk["line"] == 4321
+        assert os.path.exists(os.path.join(extra_files_path, tabular.LINE_INDEX_FILENAME))
+        chunk = json.loads(tabular_datatype.get_chunk(trans, dataset, line=12))
+        assert chunk["ck_data"].startswith("12\tvalue 12\n")
+        assert json.loads(tabular_datatype.get_chunk(trans, dataset, line=5000))["ck_data"] == ""
+        with pytest.raises(ValueError):
+            tabular_datatype.get_chunk(trans, dataset, line=-1)
+
+        # The index of a file rewritten with the same size is not used
+        lines[0] = "0\tvalue 0X\r\n"
+        lines[-1] = "4999\tvalue 499\r\n"
+        mtime = os.path.getmtime(path)
+        with (gzip.open(path, "wb") if compress else open(path, "wb")) as fh:
+            fh.write("".join(lines).encode("utf-8"))
+        os.utime(path, (mtime + 10, mtime + 10))
+        if not compress:
+            assert dataset.get_size() == len("".join(lines))
+        chunk = json.loads(tabular_datatype.get_chunk(trans, dataset, line=4321))
+        assert chunk["ck_data"].startswith("4321\tvalue 4321\n")
+        shutil.rmtree(extra_files_path)
@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+
+import pytest
+
+from galaxy.datatypes import sniff
+from galaxy.datatypes.registry import example_datatype_registry_for_sample
+from galaxy.datatypes.upload_util import counted_metadata, handle_upload
+from galaxy.datatypes.util import line_counts, upload_pipeline
+from galaxy.util.bunch import Bunch
+from .util import get_tmp_path
+
+LINES = ["", " ", "1 2", "a\t b", "  x  ", "@r", "+", "II", ">s", "AC GT", "#c", "\x0b", "é t"]
+
+
+def _random_content(rng):
+    lines = [rng.choice(LINES) for _ in range(rng.randint(0, 20))]
+    content = "".join(line + rng.choice(["\n", "\r\n", "\r"]) for line in lines)
+    if rng.random() < 0.5:
+        content += rng.choice(LINES)
+    return content.encode("utf-8")
+
+
+def _write(path, content):
+    with open(path, "wb") as fh:
+        fh.write(content)
+
+
+def _read(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 5, 64])
+def test_pipeline_converts_and_counts_as_separate_passes(block_size):
+    rng = random.Random(block_size)
+    for _ in range(50):
+        content = _random_content(rng)
+        spaces_to_tabs = rng.random() < 0.5
+        with get_tmp_path() as path, get_tmp_path() as expected_path:
+            _write(path, content)
+            _write(expected_path, content)
+            convert = sniff.convert_newlines_sep2tabs if spaces_to_tabs else sniff.convert_newlines
+            convert(expected_path, tmp_dir=tempfile.gettempdir())
+
+            digest, counts = upload_pipeline.Digest("SHA-256"), upload_pipeline.LineCounts()
+            pipeline = upload_pipeline.UploadPipeline([digest, counts], block_size=block_size)
+            transforms = [upload_pipeline.PosixLines()]
+            if spaces_to_tabs:
+                transforms.append(upload_pipeline.SpacesToTabs())
+            assert pipeline.run(path, transforms=transforms, tmp_dir=tempfile.gettempdir()) is None
+            assert _read(path) == _read(expected_path), content
+
+            assert digest.hexdigest() == hashlib.sha256(content).hexdigest()
+            expected_counts = [line_counts.count(expected_path, counter) for counter in (line_counts.DataLineCounter(), line_counts.FastaCounter(), line_counts.FastqCounter())]
+            assert counts.lines == _read(expected_path).count(b"\n")
+            assert counts.text.data_lines == expected_counts[0].data_lines
+            assert (counts.fasta.data_lines, counts.fasta.sequences) == (expected_counts[1].data_lines, expected_counts[1].sequences)
+            assert (counts.fastq.data_lines, counts.fastq.sequences) == (expected_counts[2].data_lines, expected_counts[2].sequences)
+
+
+def test_pipeline_not_in_place():
+    with get_tmp_path() as path:
+        _write(path, b"a b\r\nc")
+        pipeline = upload_pipeline.UploadPipeline()
+        converted_path = pipeline.run(path, transforms=[upload_pipeline.PosixLines()], in_place=False, tmp_dir=tempfile.gettempdir())
+        try:
+            assert _read(path) == b"a b\r\nc"
+            assert _read(converted_path) == b"a b\nc\n"
+        finally:
+            os.remove(converted_path)
+
+
+def test_pipeline_not_utf8():
+    with get_tmp_path() as path:
+        _write(path, b"a\nb\xff\n")
+        counts = upload_pipeline.LineCounts()
+        upload_pipeline.UploadPipeline([counts]).run(path)
+        assert isinstance(counts.error, UnicodeDecodeError)
+        assert counted_metadata(Bunch(set_meta=None), counts, path) is None
+
+
+@pytest.mark.parametrize("filename,compress,ext,to_posix_lines", [
+    ("1.fastqsanger", False, "fastqsanger", True),
+    ("sequence.fasta", False, "fasta", False),
+    ("1.bed", False, "bed", True),
+    ("test_space.txt", False, "txt", True),
+    ("test_space.txt", True, "txt", True),
+])
+def test_handle_upload_with_pipeline(filename, compress, ext, to_posix_lines):
+    registry = example_datatype_registry_for_sample()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, filename)
+        with open(sniff.get_test_fname(filename), "rb") as source, (gzip.open if compress else open)(path, "wb") as fh:
+            shutil.copyfileobj(source, fh)
+        digest, counts = upload_pipeline.Digest("MD5"), upload_pipeline.LineCounts()
+        pipeline = upload_pipeline.UploadPipeline([digest, counts])
+        _, sniffed_ext, datatype, _, converted_path = handle_upload(
+            registry=registry,
+            path=path,
+            requested_ext="auto",
+            name=filename,
+            tmp_prefix="gxtest",
+            tmp_dir=tmp_dir,
+            check_content=True,
+            link_data_only=False,
+            in_place=False,
+            auto_decompress=True,
+            convert_to_posix_lines=to_posix_lines,
+            convert_spaces_to_tabs=False,
+            pipeline=pipeline,
+        )
+        assert sniffed_ext == ext
+        final_path = converted_path or path
+        # The pipeline only validates the hash of the file as uploaded
+        assert pipeline.source == (not compress)
+        if pipeline.source:
+            assert digest.hexdigest() == hashlib.md5(_read(path)).hexdigest()
+
+        metadata = counted_metadata(datatype, counts, final_path)
+        dataset = Bunch(file_name=final_path, metadata=Bunch(), get_size=lambda: os.path.getsize(final_path), has_data=lambda: True)
+        datatype.set_meta(dataset)
+        if ext == "bed":
+            # Interval metadata is more than line counts
+            assert metadata is None
+        else:
+            assert metadata == dict((name, getattr(dataset.metadata, name)) for name in metadata)
+    finally:
+        shutil.rmtree(tmp_dir)
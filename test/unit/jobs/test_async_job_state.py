@@ -0,0 +1,71 @@
+import threading
+
+from six.moves.queue import Queue
+
+from galaxy.jobs.runners import (
+    AsynchronousJobRunner,
+    AsynchronousJobState,
+    STOP_SIGNAL,
+)
+from galaxy.util.sleeper import Sleeper
+
+
+def test_schedule_next_check_backs_off():
+    job_state = AsynchronousJobState()
+    assert job_state.check_due(0)
+    job_state.schedule_next_check(1, 10, 2, now=0)
+    assert job_state.next_check == 1
+    assert not job_state.check_due(0.5)
+    assert job_state.check_due(1)
+    for expected_interval in (2, 4, 8, 10, 10):
+        job_state.schedule_next_check(1, 10, 2, now=0)
+        assert job_state.check_interval == expected_interval
+    assert job_state.next_check == 10
+
+
+def test_schedule_next_check_resets_on_state_change():
+    job_state = AsynchronousJobState()
+    job_state.old_state = "queued"
+    for _ in range(5):
+        job_state.schedule_next_check(1, 10, 2, now=0)
+    assert job_state.check_interval == 10
+    job_state.running = True
+    job_state.schedule_next_check(1, 10, 2, now=0)
+    assert job_state.check_interval == 1
+    job_state.schedule_next_check(1, 10, 2, now=0)
+    assert job_state.check_interval == 2
+
+
+class CheckRecordingRunner(AsynchronousJobRunner):
+
+    def __init__(self, watched):
+        self.watched = watched
+        self.monitor_queue = Queue()
+        self.sleeper = Sleeper()
+        self.runner_params = dict(monitor_min_interval=1, monitor_max_interval=30, monitor_backoff=1.5)
+        self.checks = []
+
+    def check_watched_items(self, watched):
+        self.checks.append((list(watched), list(self.watched)))
+        self.monitor_queue.put(STOP_SIGNAL)
+        return watched
+
+
+def test_monitor_only_checks_due_jobs():
+    due, waiting = AsynchronousJobState(), AsynchronousJobState()
+    waiting.next_check = float("inf")
+    runner = CheckRecordingRunner([due, waiting])
+    runner.monitor()
+    # jobs that aren't due stay watched while the due ones are checked
+    assert runner.checks == [([due], [due, waiting])]
+    assert runner.watched == [waiting, due]
+    assert due.next_check is not None
+
+
+def test_sleeper_keeps_wake_up_before_sleep():
+    sleeper = Sleeper()
+    sleeper.wake()
+    thread = threading.Thread(target=sleeper.sleep, args=(60,))
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
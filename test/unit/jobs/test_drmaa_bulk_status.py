@@ -0,0 +1,34 @@
+from galaxy.jobs.runners.drmaa import parse_bulk_job_states
+from galaxy.util.bunch import Bunch
+
+JOB_STATES = Bunch(
+    QUEUED_ACTIVE='queued_active',
+    SYSTEM_ON_HOLD='system_on_hold',
+    USER_ON_HOLD='user_on_hold',
+    RUNNING='running',
+    SYSTEM_SUSPENDED='system_suspended',
+    USER_SUSPENDED='user_suspended',
+)
+
+
+def test_parse_squeue_output():
+    output = "1234 PD\n1235 R\n1236 CG\n1237 CD\n1238 F\n"
+    assert parse_bulk_job_states(output, JOB_STATES) == {
+        '1234': 'queued_active',
+        '1235': 'running',
+        '1236': 'running',
+    }
+
+
+def test_parse_qstat_output():
+    output = "42 r\n43 qw\n44 Eqw\n45 hqw\n"
+    assert parse_bulk_job_states(output, JOB_STATES) == {
+        '42': 'running',
+        '43': 'queued_active',
+        '45': 'user_on_hold',
+    }
+
+
+def test_parse_skips_headers():
+    output = "JOBID STATE\n1234 PD\n\n"
+    assert parse_bulk_job_states(output, JOB_STATES) == {'1234': 'queued_active'}
@@ -0,0 +1,40 @@
+import galaxy.datatypes.registry
+import galaxy.model
+import galaxy.model.mapping as mapping
+from galaxy.jobs.handler import pause_new_jobs
+
+datatypes_registry = galaxy.datatypes.registry.Registry()
+datatypes_registry.load_datatypes()
+galaxy.model.set_datatypes_registry(datatypes_registry)
+
+
+def test_pause_new_jobs():
+    model = mapping.init("/tmp", "sqlite:///:memory:", create_tables=True)
+    sa_session = model.context
+    history = model.History()
+    sa_session.add(history)
+    jobs = []
+    for state in (model.Job.states.NEW, model.Job.states.NEW, model.Job.states.QUEUED):
+        job = model.Job()
+        job.state = state
+        hda = model.HistoryDatasetAssociation(history=history, create_dataset=True, sa_session=sa_session)
+        job.add_output_dataset("out_file1", hda)
+        sa_session.add_all([job, hda])
+        jobs.append(job)
+    sa_session.flush()
+    job_ids = [j.id for j in jobs]
+
+    paused = pause_new_jobs(sa_session, {job_ids[0]: "over quota", job_ids[2]: "over quota"})
+    assert paused == [job_ids[0]]
+
+    sa_session.expunge_all()
+    paused_job, new_job, queued_job = [sa_session.query(model.Job).get(i) for i in job_ids]
+    assert paused_job.state == model.Job.states.PAUSED
+    assert paused_job.state_history[-1].state == model.Job.states.PAUSED
+    paused_output = paused_job.output_datasets[0].dataset
+    assert paused_output.dataset.state == model.Dataset.states.PAUSED
+    assert paused_output.info == "over quota"
+    assert new_job.state == model.Job.states.NEW
+    assert new_job.output_datasets[0].dataset.dataset.state == model.Dataset.states.NEW
+    assert queued_job.state == model.Job.states.QUEUED
+    assert queued_job.output_datasets[0].dataset.info is None
@@ -0,0 +1,44 @@
+from galaxy.jobs.handler import JobCounts
+from galaxy.model import Job
+
+
+def test_counts_follow_job_states():
+    counts = JobCounts()
+    counts.update(1, 7, "cluster", Job.states.QUEUED)
+    counts.update(2, 7, "local", Job.states.RUNNING)
+    counts.update(3, 8, "cluster", Job.states.RESUBMITTED)
+    assert counts.get_user_job_count(7) == 2
+    assert counts.get_user_job_count(8) == 1
+    assert counts.get_user_job_count_per_destination(7) == {"cluster": 1, "local": 1}
+    # Resubmitted jobs only count against the user's total
+    assert counts.get_user_job_count_per_destination(8) == {}
+    assert counts.get_total_job_count_per_destination() == {"cluster": 1, "local": 1}
+
+    counts.update(1, 7, "cluster", Job.states.RUNNING)
+    assert counts.get_user_job_count(7) == 2
+    assert counts.get_total_job_count_per_destination() == {"cluster": 1, "local": 1}
+
+    counts.update(1, 7, "cluster", Job.states.OK)
+    # Repeated terminal updates are ignored
+    counts.update(1, 7, "cluster", Job.states.OK)
+    assert counts.get_user_job_count(7) == 1
+    assert counts.get_user_job_count_per_destination(7) == {"local": 1}
+    assert counts.get_total_job_count_per_destination() == {"local": 1}
+    assert len(counts) == 2
+
+
+def test_anonymous_jobs_count_against_destinations():
+    counts = JobCounts()
+    counts.update(1, None, "cluster", Job.states.QUEUED)
+    assert counts.get_user_job_count(None) == 0
+    assert counts.get_total_job_count_per_destination() == {"cluster": 1}
+
+
+def test_reset():
+    counts = JobCounts()
+    counts.update(1, 7, "cluster", Job.states.QUEUED)
+    counts.reset([(2, 8, "local", Job.states.RUNNING), (3, 8, "local", Job.states.OK)])
+    assert counts.get_user_job_count(7) == 0
+    assert counts.get_user_job_count(8) == 1
+    assert counts.get_total_job_count_per_destination() == {"local": 1}
+    assert len(counts) == 1
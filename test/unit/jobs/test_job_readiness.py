@@ -0,0 +1,44 @@
+from galaxy.jobs.handler import JobReadinessTracker
+
+
+def test_track_without_dependencies_is_ready():
+    tracker = JobReadinessTracker()
+    tracker.track(1, [])
+    assert 1 in tracker
+    assert tracker.ready_job_ids == [1]
+    assert tracker.watched_dataset_ids == []
+
+
+def test_job_ready_once_all_inputs_ready():
+    tracker = JobReadinessTracker()
+    tracker.track(1, [10, 11])
+    tracker.track(2, [11])
+    assert tracker.ready_job_ids == []
+    assert sorted(tracker.watched_dataset_ids) == [10, 11]
+
+    assert tracker.datasets_ready([11]) == {2}
+    assert tracker.ready_job_ids == [2]
+    assert not tracker.is_watched(11)
+
+    assert tracker.datasets_ready([10]) == {1}
+    assert tracker.ready_job_ids == [1, 2]
+    assert tracker.watched_dataset_ids == []
+
+
+def test_sync_untracks_vanished_jobs():
+    tracker = JobReadinessTracker()
+    tracker.track(1, [10])
+    tracker.track(2, [])
+    assert tracker.sync([2, 3, 4]) == [3, 4]
+    assert 1 not in tracker
+    assert not tracker.is_watched(10)
+    assert tracker.ready_job_ids == [2]
+
+
+def test_clear():
+    tracker = JobReadinessTracker()
+    tracker.track(1, [10])
+    tracker.clear()
+    assert len(tracker) == 0
+    assert tracker.watched_dataset_ids == []
+    assert tracker.sync([1]) == [1]
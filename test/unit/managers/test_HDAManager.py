@@ -516,6 +516,33 @@ class HDASerializerTestCase(HDATestCase):
             keys=['file_path', 'visualizations'], user=non_owner)
         self.assertEqual(sorted(keys_in_inaccessible_view), sorted(serialized.keys()))
 
+    def test_serialize_many(self):
+        owner = self.user_manager.create(**user2_data)
+        non_owner = self.user_manager.create(**user3_data)
+        history1 = self.history_manager.create(name='history1', user=owner)
+        items = [self.hda_manager.create(history1, self.dataset_manager.create(), name='hda-%d' % i) for i in range(4)]
+        self.hda_manager.set_tags(items[0], ['name:one', 'two'], user=owner)
+        items[1].info = '  info  '
+        items[1].visible = False
+        items[2].deleted = True
+        items[3].state = model.Dataset.states.OK
+        self.dataset_manager.permissions.set_private_to_one_user(items[3].dataset, owner)
+        self.hda_manager.session().flush()
+        self.hda_serializer.url_for = lambda *a, **k: '(fake url): %s, %s' % (a, k)
+        ids = [item.id for item in items]
+
+        self.log('should serialize many items as each would be')
+        for user in (owner, non_owner, None):
+            for view, keys in (('summary', None), ('summary', ['misc_info', 'misc_blurb', 'uuid', 'peek']), (None, ['accessible', 'file_ext'])):
+                serialized = self.hda_serializer.serialize_many(ids, view=view, keys=keys, user=user)
+                for item in items:
+                    self.assertEqual(serialized[item.id], self.hda_serializer.serialize_to_view(item, view=view, keys=keys, user=user))
+        self.assertEqual(sorted(self.hda_serializer.serialize_many(ids, view='summary', user=non_owner)[items[3].id].keys()),
+                         sorted(self.hda_serializer._view_to_keys('inaccessible')))
+
+        self.log('should skip unknown ids')
+        self.assertEqual(list(self.hda_serializer.serialize_many([-1], view='summary').keys()), [])
+
     # TODO: test extra_files_path as well
 
 
@@ -110,6 +110,23 @@ class HDCASerializerTestCase(HDCATestCase):
         serialized = serializer.serialize_to_view(item, keys=only_keys)
         self.assertKeys(serialized, only_keys)
 
+    def test_serialize_many(self):
+        serializer = self.hdca_serializer
+        history = self._create_history()
+        items = [self._create_list_hdca([dict(name='hda-%d-%d' % (i, j)) for j in range(2)], history=history, name='collection-%d' % i)
+                 for i in range(3)]
+        self.hdca_manager.set_tags(items[0], ['name:one', 'two'], user=history.user)
+        items[1].visible = False
+        items[2].collection.populated_state = 'failed'
+        self.hdca_manager.session().flush()
+        ids = [item.id for item in items]
+
+        self.log('should serialize many items as each would be')
+        for view, keys in (('summary', None), ('detailed', None), (None, ['id', 'job_source_type', 'elements'])):
+            serialized = serializer.serialize_many(ids, view=view, keys=keys)
+            for item in items:
+                self.assertEqual(serialized[item.id], serializer.serialize_to_view(item, view=view, keys=keys))
+
 
 # =============================================================================
 if __name__ == '__main__':
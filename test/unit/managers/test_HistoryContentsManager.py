@@ -8,6 +8,7 @@ import unittest
 from sqlalchemy import column, desc, false, true
 from sqlalchemy.sql import text
 
+from galaxy import exceptions
 from galaxy.managers import base, collections, hdas, history_contents
 from galaxy.managers.histories import HistoryManager
 from .base import BaseTestCase
@@ -235,20 +236,46 @@ class HistoryAsContainerTestCase(HistoryAsContainerBaseTestCase):
         contents.append(self.add_list_collection_to_history(history, contents[4:6]))
 
         self.log("should allow filtering by update_time")
-        # in the case of collections we have to change the collection.collection (ugh) to change the update_time
+        # changing the collection of an HDCA bumps the HDCA's update_time
         contents[3].collection.populated_state = 'big ball of mud'
         self.app.model.context.flush()
-        update_time = contents[3].collection.update_time
-
-        def get_update_time(item):
-            update_time = getattr(item, 'update_time', None)
-            if not update_time:
-                update_time = item.collection.update_time
-            return update_time
+        update_time = contents[3].update_time
 
         results = self.contents_manager.contents(history, filters=[parsed_filter("orm", column('update_time') >= update_time)])
         self.assertEqual(results, [contents[3]])
 
+    def test_changed_since(self):
+        user2 = self.user_manager.create(**user2_data)
+        history = self.history_manager.create(name='history', user=user2)
+        contents = []
+        contents.extend([self.add_hda_to_history(history, name=('hda-' + str(x))) for x in range(3)])
+        contents.append(self.add_list_collection_to_history(history, contents[:3]))
+        contents.extend([self.add_hda_to_history(history, name=('hda-' + str(x))) for x in range(4, 6)])
+        self.app.model.context.flush()
+        watermark = max(content.update_time for content in history.contents_iter(types=['dataset', 'dataset_collection']))
+        changed_since = self.contents_manager.changed_since_filter(watermark)
+        self.assertEqual(self.contents_manager.contents(history, filters=[changed_since]), [])
+
+        self.log("should list the contents updated since a watermark, or whose datasets or collections changed")
+        self.assertTrue(all(content.update_time <= watermark for content in contents))
+        expected = [contents[0], contents[3], contents[4]]
+        # within a transaction the flush doesn't expire the loaded contents, they shouldn't keep their old update_time
+        with self.app.model.context.begin():
+            contents[0].dataset.state = 'ok'
+            contents[3].collection.populated_state = 'failed'
+            contents[4].visible = False
+            self.app.model.context.flush()
+            self.assertTrue(all(content.update_time > watermark for content in expected))
+        self.assertEqual(self.contents_manager.contents(history, filters=[changed_since]), expected)
+        self.assertEqual(list(history.contents_iter(types=['dataset', 'dataset_collection'], since=watermark)), expected)
+
+    def test_since_token(self):
+        before = datetime.datetime.utcnow()
+        watermark = self.contents_manager.parse_since_token(self.contents_manager.since_token())
+        self.assertTrue(before - history_contents.SINCE_TOKEN_OVERLAP <= watermark <= datetime.datetime.utcnow())
+        self.assertIsNone(self.contents_manager.parse_since_token(''))
+        self.assertRaises(exceptions.RequestParameterInvalidException, self.contents_manager.parse_since_token, 'bogus')
+
     def test_filtered_counting(self):
         user2 = self.user_manager.create(**user2_data)
         history = self.history_manager.create(name='history', user=user2)
@@ -22,6 +22,7 @@ from galaxy.managers.histories import (
     HistoryManager,
     HistorySerializer
 )
+from galaxy.model import history_summary
 from .base import BaseTestCase
 from ..unittest_utils import galaxy_mock
 
@@ -618,6 +619,113 @@ class HistorySerializerTestCase(BaseTestCase):
 
 
 # =============================================================================
+class HistorySummaryTestCase(BaseTestCase):
+
+    def set_up_managers(self):
+        super(HistorySummaryTestCase, self).set_up_managers()
+        self.history_manager = HistoryManager(self.app)
+        self.hda_manager = hdas.HDAManager(self.app)
+        self.history_serializer = HistorySerializer(self.app)
+
+    def assertSummaryCurrent(self, history, reconciled=False):
+        summary = self.history_manager.summary(history)
+        expected = history_summary.compute(self.trans.sa_session, history)
+        for key in ('state_counts', 'contents_states', 'contents_active'):
+            self.assertEqual(getattr(summary, key), getattr(expected, key), key)
+        self.assertEqual(int(summary.disk_size), int(expected.disk_size))
+        self.assertEqual(int(summary.disk_size), int(history.disk_size))
+        if not reconciled:
+            self.assertEqual(summary.reconcile_time, self.reconcile_time)
+        self.reconcile_time = summary.reconcile_time
+        return summary
+
+    def test_summary_kept_current(self):
+        user2 = self.user_manager.create(**user2_data)
+        history = self.history_manager.create(name='history', user=user2)
+        self.assertEqual(self.history_serializer.serialize(history, ['contents_active'])['contents_active'],
+                         dict(active=0, hidden=0, deleted=0))
+        self.reconcile_time = self.history_manager.summary(history).reconcile_time
+
+        self.log('adding, hiding and deleting contents should update the summary of a history')
+        hda1 = self.hda_manager.create(history=history)
+        hda2 = self.hda_manager.create(history=history)
+        hdca = model.HistoryDatasetCollectionAssociation(history=history, hid=3, visible=True, deleted=False,
+            collection=model.DatasetCollection(collection_type='list', populated=False))
+        self.trans.sa_session.add(hdca)
+        self.trans.sa_session.flush()
+        summary = self.assertSummaryCurrent(history)
+        self.assertEqual(summary.contents_active, dict(active=3, hidden=0, deleted=0))
+        self.assertEqual(summary.contents_states, dict(new=3))
+
+        self.hda_manager.update(hda1, dict(state='running'))
+        self.hda_manager.update(hda2, dict(visible=False))
+        summary = self.assertSummaryCurrent(history)
+        self.assertEqual(summary.state_counts, dict(running=1, new=1))
+        self.assertEqual(summary.contents_active, dict(active=2, hidden=1, deleted=0))
+
+        self.hda_manager.update(hda1, dict(state='ok', deleted=True))
+        hdca.collection.populated_state = 'ok'
+        self.trans.sa_session.flush()
+        summary = self.assertSummaryCurrent(history)
+        self.assertEqual(summary.contents_states, dict(ok=1))
+        self.assertEqual(self.history_serializer.serialize(history, ['state'])['state'], 'queued')
+
+        self.log('the size of a history should count unique datasets')
+        hda2.dataset.total_size = 10
+        self.hda_manager.copy(hda2, history=history)
+        self.trans.sa_session.flush()
+        summary = self.assertSummaryCurrent(history)
+        self.assertEqual(int(summary.disk_size), 10)
+        self.assertEqual(self.history_serializer.serialize(history, ['size'])['size'], 10)
+        self.hda_manager.purge(hda1)
+        self.assertSummaryCurrent(history)
+
+    def test_summary_read_once_per_serialization(self):
+        user2 = self.user_manager.create(**user2_data)
+        history = self.history_manager.create(name='history', user=user2)
+        self.hda_manager.create(history=history)
+        summaries = []
+        summary = self.history_serializer.manager.summary
+
+        def counted_summary(history):
+            summaries.append(history.id)
+            return summary(history)
+
+        self.history_serializer.manager.summary = counted_summary
+        keys = ['size', 'nice_size', 'state', 'state_details', 'contents_states', 'contents_active']
+        serialized = self.history_serializer.serialize(history, keys)
+        self.assertEqual(serialized['contents_active'], dict(active=1, hidden=0, deleted=0))
+        self.assertEqual(summaries, [history.id])
+        self.history_serializer.serialize(history, ['size', 'state'])
+        self.assertEqual(summaries, [history.id] * 2)
+
+    def test_summary_reconciled(self):
+        user2 = self.user_manager.create(**user2_data)
+        history = self.history_manager.create(name='history', user=user2)
+        hda = self.hda_manager.create(history=history)
+        self.reconcile_time = self.history_manager.summary(history).reconcile_time
+
+        self.log('a summary should be reconciled if marked stale, e.g. after bulk updates')
+        dataset_table = model.Dataset.table
+        self.trans.sa_session.execute(dataset_table.update().where(dataset_table.c.id == hda.dataset.id).values(state='paused'))
+        self.assertEqual(self.history_manager.summary(history).state_counts, dict(new=1))
+        history_summary.mark_stale_for_datasets(self.trans.sa_session, [hda.dataset.id])
+        summary = self.assertSummaryCurrent(history, reconciled=True)
+        self.assertEqual(summary.state_counts, dict(paused=1))
+
+        self.log('a summary should be reconciled if it drifted')
+        self.trans.sa_session.expire_all()
+        self.trans.sa_session.execute(dataset_table.update().where(dataset_table.c.id == hda.dataset.id).values(state='queued'))
+        # paused (in the summary) -> queued -> ok, queued went negative
+        self.hda_manager.update(hda, dict(state='ok'))
+        summary = self.assertSummaryCurrent(history, reconciled=True)
+        self.assertEqual(summary.state_counts, dict(ok=1))
+
+        self.log('a summary should not be persisted without a reconcile interval')
+        self.app.config.history_summary_reconcile_interval = 0
+        self.assertEqual(self.history_manager.summary(history).state_counts, dict(ok=1))
+
+
 class HistoryDeserializerTestCase(BaseTestCase):
 
     def set_up_managers(self):
@@ -13,7 +13,7 @@ from sqlalchemy import desc
 
 from galaxy import exceptions, model
 from galaxy.managers import base as base_manager
-from galaxy.managers import histories, users
+from galaxy.managers import hdas, histories, users
 from galaxy.security.passwords import check_password
 from galaxy.webapps.galaxy.controllers.user import User
 from .base import BaseTestCase
@@ -186,6 +186,105 @@ class UserManagerTestCase(BaseTestCase):
         self.assertEqual(response["message"], "Success.")
 
 
+# =============================================================================
+class UserDiskUsageTestCase(BaseTestCase):
+
+    def set_up_managers(self):
+        super(UserDiskUsageTestCase, self).set_up_managers()
+        self.history_manager = histories.HistoryManager(self.app)
+        self.hda_manager = hdas.HDAManager(self.app)
+
+    def assertUsage(self, user, expected):
+        self.trans.sa_session.flush()
+        self.assertEqual(int(user.get_disk_usage()), expected)
+        self.assertEqual(int(user.calculate_disk_usage() or 0), expected)
+
+    def create_hda(self, history, size):
+        hda = self.hda_manager.create(history=history)
+        hda.dataset.total_size = size
+        return hda
+
+    def references(self, user):
+        query = self.trans.sa_session.query(model.UserDatasetReference).filter_by(user_id=user.id)
+        return dict((reference.dataset_id, reference.reference_count) for reference in query)
+
+    def test_kept_current(self):
+        sa_session = self.trans.sa_session
+        user2 = self.user_manager.create(**user2_data)
+        history1 = self.history_manager.create(name='history1', user=user2)
+        history2 = self.history_manager.create(name='history2', user=user2)
+        self.assertUsage(user2, 0)
+
+        self.log("datasets should be counted once per user, whatever their number of HDAs")
+        hda1 = self.create_hda(history1, 10)
+        self.assertUsage(user2, 10)
+        copies = [self.hda_manager.copy(hda1, history=history1), self.hda_manager.copy(hda1, history=history2)]
+        self.assertUsage(user2, 10)
+        self.assertEqual(self.references(user2), {hda1.dataset.id: 3})
+
+        self.log("changes of the size of datasets should be counted")
+        hda2 = self.create_hda(history2, 5)
+        self.assertUsage(user2, 15)
+        hda2.dataset.total_size = 7
+        self.assertUsage(user2, 17)
+
+        self.log("datasets should be counted until their last HDA is purged")
+        for hda in [hda1] + copies:
+            hda.purged = True
+            self.assertUsage(user2, 17 if hda is not copies[-1] else 7)
+        self.assertEqual(self.references(user2), {hda2.dataset.id: 1})
+
+        self.log("purging a history should subtract its datasets")
+        history3 = self.history_manager.create(name='history3', user=user2)
+        self.create_hda(history3, 3)
+        self.assertUsage(user2, 10)
+        history3.purged = True
+        self.assertUsage(user2, 7)
+
+        self.log("the datasets of an anonymous history should be counted once it is given to a user")
+        history4 = self.history_manager.create(name='history4', user=None)
+        hda4 = self.create_hda(history4, 4)
+        self.assertUsage(user2, 7)
+        history4.user = user2
+        self.assertUsage(user2, 11)
+
+        self.log("datasets in a library should not be counted")
+        ldda = model.LibraryDatasetDatasetAssociation(dataset=hda2.dataset, sa_session=sa_session)
+        sa_session.add(ldda)
+        self.assertUsage(user2, 4)
+        sa_session.delete(ldda)
+        self.assertUsage(user2, 11)
+
+        self.log("moving an HDA to another user's history should move its dataset")
+        user3 = self.user_manager.create(**user3_data)
+        history5 = self.history_manager.create(name='history5', user=user3)
+        hda4.history = history5
+        self.assertUsage(user2, 7)
+        self.assertUsage(user3, 4)
+
+    def test_reconciled(self):
+        sa_session = self.trans.sa_session
+        user2 = self.user_manager.create(**user2_data)
+        history = self.history_manager.create(name='history', user=user2)
+        hda = self.create_hda(history, 10)
+        self.assertUsage(user2, 10)
+
+        self.log("the disk usage should be recalculated from scratch after bulk updates")
+        hda_table = model.HistoryDatasetAssociation.table
+        sa_session.execute(hda_table.update().where(hda_table.c.id == hda.id).values(purged=True))
+        self.assertEqual(int(user2.get_disk_usage()), 10)
+        user2.calculate_and_set_disk_usage()
+        self.assertUsage(user2, 0)
+        self.assertEqual(self.references(user2), {})
+
+        self.log("references that drifted should be reconciled")
+        sa_session.execute(hda_table.update().where(hda_table.c.id == hda.id).values(purged=False))
+        sa_session.expire_all()
+        hda.purged = True
+        self.assertUsage(user2, 0)
+        self.assertEqual(self.references(user2), {})
+
+
 # =============================================================================
 class UserSerializerTestCase(BaseTestCase):
 
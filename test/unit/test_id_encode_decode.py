@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from galaxy.exceptions import MalformedId
 from galaxy.security import idencoding
 
 
@@ -72,6 +73,44 @@ def test_encode_decode():
     assert 1 == test_helper_1.decode_id(test_helper_1.encode_id(1))
 
 
+def test_encode_decode_ids():
+    ids = [1, 2, 10 ** 9, 10 ** 20, 2, "7"]
+    for kind in (None, "k1"):
+        # Encoded as one at a time, uncached or not
+        helper = idencoding.IdEncodingHelper(id_secret="secu1")
+        encoded_ids = helper.encode_ids(ids, kind=kind)
+        assert encoded_ids == [test_helper_1.encode_id(i, kind=kind) for i in ids]
+        assert helper.encode_ids(ids, kind=kind) == encoded_ids
+        assert helper.decode_ids(encoded_ids, kind=kind) == [int(i) for i in ids]
+    assert test_helper_1.encode_ids([]) == []
+    assert test_helper_1.decode_ids([]) == []
+
+
+def test_encode_decode_ids_invalid():
+    for invalid_ids in ([1, None], [None]):
+        try:
+            test_helper_1.encode_ids(invalid_ids)
+        except MalformedId:
+            pass
+        else:
+            raise AssertionError("Encoding None should fail")
+    encoded_id = test_helper_1.encode_id(1)
+    for invalid_ids in ([encoded_id, encoded_id[:8]], [encoded_id + "zz" * 8], [""]):
+        try:
+            test_helper_1.decode_ids(invalid_ids)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Decoding %s should fail" % invalid_ids)
+
+
+def test_encoded_ids_cache_bounded():
+    helper = idencoding.IdEncodingHelper(id_secret="secu1", encoded_id_cache_size=10)
+    encoded_ids = helper.encode_ids(list(range(100)))
+    assert encoded_ids == [test_helper_1.encode_id(i) for i in range(100)]
+    assert helper.encode_id(1) == encoded_ids[1]
+
+
 def test_nested_encoding():
     # Does nothing if not a dict
     assert test_helper_1.encode_all_ids(1) == 1
@@ -91,6 +130,13 @@ def test_nested_encoding():
     assert test_helper_1.encode_all_ids(nested_dict, recursive=False)["objects"]["history_ids"] == [1, 2]
     assert test_helper_1.encode_all_ids(nested_dict, recursive=True)["objects"]["history_ids"] == expected_ids
 
+    # Including in lists of dicts, nested dicts are encoded in place
+    nested = dict(id=3, items=[dict(id=1, tool_id="cat1", job_id=None), dict(dataset_ids=[2, 1])])
+    encoded = test_helper_1.encode_all_ids(nested, recursive=True)
+    assert encoded["id"] == test_helper_1.encode_id(3)
+    assert encoded["items"][0] == dict(id=test_helper_1.encode_id(1), tool_id="cat1", job_id=None)
+    assert encoded["items"][1]["dataset_ids"] == [test_helper_1.encode_id(2), expected_ids[0]]
+
 
 def test_per_kind_encode_deocde():
     # Different ids are encoded differently
@@ -0,0 +1,160 @@
+"""Unit tests for the cache of the metadata set on datasets."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from tempfile import mkdtemp
+
+from galaxy import model
+from galaxy.job_execution.datasets import DatasetPath
+from galaxy.metadata import cache, PortableDirectoryMetadataGenerator
+from galaxy.util import galaxy_directory
+from galaxy.util.bunch import Bunch
+from .tools.test_history_imp_exp import _create_datasets, _mock_app
+
+SET_METADATA = "from galaxy.metadata.set_metadata import set_metadata; set_metadata()"
+
+
+def _datasets(app, n, filename="2.bed", extension="bed"):
+    sa_session = app.model.context
+    history = model.History(name="Test History")
+    datasets = _create_datasets(sa_session, history, n, extension=extension)
+    sa_session.add_all(datasets + [history])
+    sa_session.flush()
+    for dataset in datasets:
+        app.object_store.update_from_file(dataset, file_name=os.path.join(galaxy_directory(), "test-data", filename), create=True)
+    return datasets
+
+
+def test_build_metadata_cache():
+    assert cache.build_metadata_cache(Bunch(metadata_cache_path=None)) is None
+    metadata_cache = cache.build_metadata_cache(Bunch(metadata_cache_path="/tmp/cache", metadata_cache_max_entries=10, id_secret="changethis"))
+    assert (metadata_cache.path, metadata_cache.max_entries) == ("/tmp/cache", 10)
+
+
+def test_cache_entries_evicted_by_least_recent_use():
+    path = mkdtemp()
+    try:
+        metadata_cache = cache.MetadataCache(path, "secret", max_entries=4)
+        assert metadata_cache.get("a" * 64) is None
+        for i in range(4):
+            metadata_cache.update("%d" % i * 64, metadata={"i": i})
+        assert metadata_cache.stats()["entries"] == 4
+        # entry 0 is the least recently used, 0 and 1 are evicted down to 3 entries
+        os.utime(metadata_cache._entry_path("0" * 64), (0, 0))
+        metadata_cache.update("4" * 64, metadata={"i": 4})
+        metadata_cache.update("4" * 64, peek="peek")
+        assert metadata_cache.get("0" * 64) is None
+        assert metadata_cache.get("4" * 64) == {"metadata": {"i": 4}, "peek": "peek"}
+        stats = metadata_cache.stats()
+        assert (stats["entries"], stats["hits"], stats["misses"]) == (3, 1, 2)
+        assert stats["hit_rate"] == 1.0 / 3
+        assert stats["max_entries"] == 4
+    finally:
+        shutil.rmtree(path)
+
+
+def test_cache_ignores_entries_not_signed():
+    path = mkdtemp()
+    try:
+        metadata_cache = cache.MetadataCache(path, "secret")
+        metadata_cache.update("a" * 64, peek="peek")
+        assert metadata_cache.get("a" * 64) == {"peek": "peek"}
+        # Entries of another server, or written by a tool
+        assert cache.MetadataCache(path, "other secret").get("a" * 64) is None
+        entry_path = metadata_cache._entry_path("b" * 64)
+        os.makedirs(os.path.dirname(entry_path))
+        with open(entry_path, "w") as f:
+            json.dump({"entry": {"peek": "<script>"}, "signature": "0" * 40}, f)
+        assert metadata_cache.get("b" * 64) is None
+        metadata_cache.update("b" * 64, blurb="blurb")
+        assert metadata_cache.get("b" * 64) == {"blurb": "blurb"}
+    finally:
+        shutil.rmtree(path)
+
+
+def test_key_not_computed_for_metadata_files(monkeypatch):
+    app = _mock_app()
+    dataset, = _datasets(app, 1, filename="1.bam", extension="bam")
+
+    def fail(*args, **kwds):
+        raise AssertionError("content should not be hashed")
+
+    monkeypatch.setattr(cache, "memory_bound_hexdigest", fail)
+    assert cache.MetadataCache("/tmp/cache", "secret").key(dataset) is None
+
+
+def test_set_meta_copies_cached_metadata(monkeypatch):
+    app = _mock_app()
+    path = mkdtemp()
+    try:
+        metadata_cache = cache.MetadataCache(path, "secret")
+        first, second, other = _datasets(app, 2) + _datasets(app, 1, filename="1.bed")
+        second.metadata.dbkey = "hg19"
+
+        key = cache.set_meta(first, metadata_cache, overwrite=False)
+        assert key
+        cache.set_peek(first, metadata_cache, key)
+        assert first.metadata.data_lines == 68
+
+        def fail(*args, **kwds):
+            raise AssertionError("metadata should be copied from the cache")
+
+        monkeypatch.setattr(second.datatype.__class__, "set_meta", fail)
+        monkeypatch.setattr(second.datatype.__class__, "set_peek", fail)
+        assert cache.set_meta(second, metadata_cache, overwrite=False) == key
+        cache.set_peek(second, metadata_cache, key)
+        assert second.metadata.data_lines == 68
+        assert second.metadata.columns == first.metadata.columns
+        assert second.metadata.dbkey == "hg19"
+        assert (second.peek, second.blurb) == (first.peek, first.blurb)
+        # one lookup per dataset
+        stats = metadata_cache.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+        # other content, other key
+        assert cache.MetadataCache(path, "secret").key(other) not in (None, key)
+        # or other keywords
+        assert metadata_cache.key(first, {"overwrite": True}) != key
+    finally:
+        shutil.rmtree(path)
+
+
+def test_set_meta_without_cache():
+    app = _mock_app()
+    dataset, = _datasets(app, 1)
+    assert cache.set_meta(dataset, None, overwrite=False) is None
+    cache.set_peek(dataset, None, None)
+    assert dataset.metadata.data_lines == 68
+    assert dataset.peek
+
+
+def test_set_metadata_portable_without_cache():
+    app = _mock_app()
+    sa_session = app.model.context
+    dataset, = _datasets(app, 1)
+    cache_path = mkdtemp()
+    working_directory = mkdtemp()
+    try:
+        job_metadata = os.path.join(working_directory, "galaxy.json")
+        open(job_metadata, "w").close()
+        metadata_strategy = PortableDirectoryMetadataGenerator(1, metadata_cache=cache.MetadataCache(cache_path, "secret"))
+        metadata_strategy.setup_external_metadata(
+            {"out": dataset}, sa_session,
+            tmp_dir=working_directory,
+            output_fnames=[DatasetPath(dataset.dataset.id, dataset.file_name)],
+            datatypes_config=os.path.join(galaxy_directory(), "lib", "galaxy", "config", "sample", "datatypes_conf.xml.sample"),
+            job_metadata=job_metadata,
+        )
+        # Jobs neither read nor write the cache
+        with open(os.path.join(working_directory, "metadata", "params.json")) as f:
+            assert cache_path not in f.read()
+        env = dict(os.environ, PYTHONPATH=os.path.join(galaxy_directory(), "lib"))
+        subprocess.check_call([sys.executable, "-c", SET_METADATA], cwd=working_directory, env=env)
+        assert metadata_strategy.external_metadata_set_successfully(dataset, "out", sa_session, working_directory)
+        metadata_strategy.load_metadata(dataset, "out", sa_session, working_directory)
+        assert dataset.metadata.data_lines == 68
+        assert not os.path.exists(os.path.join(cache_path, cache.ENTRIES_DIRECTORY))
+    finally:
+        for directory in [cache_path, working_directory]:
+            shutil.rmtree(directory)
@@ -42,6 +42,43 @@ def test_model_create_context_persist_hdas():
         assert f.read().startswith("hello world\n")
 
 
+def test_persist_hdas_with_metadata():
+    # Metadata counted during the upload is not set again
+    work_directory = mkdtemp()
+    with open(os.path.join(work_directory, "file1.txt"), "w") as f:
+        f.write("hello world\nhello world line 2")
+    target = {
+        "destination": {
+            "type": "hdas",
+        },
+        "elements": [{
+            "filename": "file1.txt",
+            "ext": "txt",
+            "dbkey": "hg19",
+            "name": "my file",
+            "counted_metadata": {"data_lines": 42},
+        }, {
+            "filename": "file1.txt",
+            "ext": "txt",
+            "name": "my file with partial metadata",
+            "metadata": {"data_lines": 42},
+        }],
+    }
+    app = _mock_app(store_by="uuid")
+    temp_directory = mkdtemp()
+    with store.DirectoryModelExportStore(temp_directory, serialize_dataset_objects=True) as export_store:
+        persist_target_to_export_store(target, export_store, app.object_store, work_directory)
+
+    import_history = _import_directory_to_history(app, temp_directory, work_directory)
+
+    imported_hda = import_history.datasets[0]
+    assert imported_hda.metadata.data_lines == 42
+    assert imported_hda.dbkey == "hg19"
+    assert imported_hda.blurb == "42 lines"
+    # Metadata provided by a tool does not replace set_meta()
+    assert import_history.datasets[1].metadata.data_lines == 2
+
+
 def test_persist_target_library_dataset():
     work_directory = mkdtemp()
     with open(os.path.join(work_directory, "file1.txt"), "w") as f:
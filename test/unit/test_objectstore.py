@@ -1,4 +1,5 @@
 import os
+import socket
 from contextlib import contextmanager
 from shutil import rmtree
 from string import Template
@@ -12,8 +13,10 @@ from six import StringIO
 from galaxy import objectstore
 from galaxy.exceptions import ObjectInvalid
 from galaxy.objectstore.azure_blob import AzureBlobObjectStore
+from galaxy.objectstore.caching import CacheIndex
 from galaxy.objectstore.cloud import Cloud
 from galaxy.objectstore.pithos import PithosObjectStore
+from galaxy.objectstore.ranged_download import ranged_download, RangedDownloadError
 from galaxy.objectstore.s3 import S3ObjectStore
 from galaxy.util import directory_hash_id
 
@@ -337,6 +340,51 @@ def test_distributed_store():
             assert len(extra_dirs) == 2
 
 
+def test_distributed_store_exists_many():
+    for config_str in [DISTRIBUTED_TEST_CONFIG, DISTRIBUTED_TEST_CONFIG_YAML]:
+        with TestConfig(config_str) as (directory, object_store):
+            directory.write("", "files1/000/dataset_1.dat")
+            directory.write("", "files2/000/dataset_2.dat")
+            directory.write("", "files2/000/dataset_3.dat")
+            datasets = [MockDataset(i) for i in range(1, 5)]
+            with __stubbed_persistence() as persisted_ids:
+                assert object_store.exists_many(datasets) == [True, True, True, False]
+            assert persisted_ids == {1: "files1", 2: "files2", 3: "files2"}
+            assert datasets[3].object_store_id is None
+
+            # The backend found is remembered for other instances of the object
+            dataset = MockDataset(2)
+            assert object_store.exists(dataset)
+            assert dataset.object_store_id == "files2"
+            assert object_store.exists_many([MockDataset(3), dataset, MockDataset(5)]) == [True, True, False]
+
+
+def test_distributed_store_locate_many():
+    with TestConfig(DISTRIBUTED_TEST_CONFIG) as (directory, object_store):
+        directory.write("", "files1/000/dataset_1.dat")
+        directory.write("", "files2/000/dataset_2.dat")
+        datasets = [MockDataset(1), MockDataset(2), MockDataset(3)]
+        with __stubbed_persistence():
+            object_store.locate_many(datasets)
+        assert [dataset.object_store_id for dataset in datasets] == ["files1", "files2", None]
+
+
+def test_distributed_store_dynamic_weights():
+    config_str = DISTRIBUTED_TEST_CONFIG.replace('<backends>', '<backends dynamic_weights="true" fsmon_interval="30">')
+    with TestConfig(config_str) as (directory, object_store):
+        assert object_store.dynamic_weights
+        assert object_store.fsmon_interval == 30
+        as_dict = object_store.to_dict()
+        _assert_key_has_value(as_dict, "dynamic_weights", True)
+        assert [b["weight"] for b in as_dict["backends"]] == [2, 1]
+
+        object_store.backend_weights = [("files1", 0.5), ("files2", 0.0)]
+        for _ in range(10):
+            assert object_store._select_backend_id() == "files1"
+        object_store.backend_weights = []
+        assert object_store._select_backend_id() is None
+
+
 # Unit testing the cloud and advanced infrastructure object stores is difficult, but
 # we can at least stub out initializing and test the configuration of these things from
 # XML and dicts.
@@ -739,6 +787,154 @@ def test_config_parse_azure():
             assert len(extra_dirs) == 2
 
 
+def test_cache_index():
+    cache_path = mkdtemp()
+    try:
+        # Files already in the cache are indexed when the index is created
+        _write_cache_file(cache_path, "000/dataset_1.dat", 100)
+        cache_index = CacheIndex(cache_path)
+        assert len(cache_index) == 1
+        assert cache_index.total_size() == 100
+
+        _write_cache_file(cache_path, "000/dataset_2.dat", 200)
+        cache_index.touch("000/dataset_2.dat")
+        _write_cache_file(cache_path, "000/dataset_3_files/a.txt", 300)
+        cache_index.touch(os.path.join(cache_path, "000/dataset_3_files/a.txt"))
+        assert cache_index.total_size() == 600
+
+        # Growing a file is accounted for once touched again
+        _write_cache_file(cache_path, "000/dataset_2.dat", 250)
+        cache_index.touch("000/dataset_2.dat")
+        assert cache_index.total_size() == 650
+
+        cache_index.remove("000/dataset_3_files")
+        assert cache_index.total_size() == 350
+
+        # dataset_1 is now the most recently used file, dataset_2 gets evicted
+        cache_index.access("000/dataset_1.dat")
+        assert cache_index.clean(10) == 250
+        assert not os.path.exists(os.path.join(cache_path, "000/dataset_2.dat"))
+        assert os.path.exists(os.path.join(cache_path, "000/dataset_1.dat"))
+        assert cache_index.total_size() == 100
+        cache_index.close()
+
+        # The index is shared with other processes through the file
+        cache_index = CacheIndex(cache_path)
+        assert cache_index.least_recently_used() == [("000/dataset_1.dat", 100)]
+        cache_index.close()
+    finally:
+        rmtree(cache_path)
+
+
+def test_cache_index_reconcile():
+    cache_path = mkdtemp()
+    try:
+        for i in (1, 2):
+            _write_cache_file(cache_path, "000/dataset_%d.dat" % i, 100)
+        cache_index = CacheIndex(cache_path, reconcile_interval=3600)
+        # Just built, not due for reconciliation
+        assert not cache_index.reconcile_if_due()
+        cache_index.touch("000/dataset_2.dat")
+
+        # Accesses are buffered until flushed, newer ones are kept
+        cache_index.access("000/dataset_1.dat")
+        other_index = CacheIndex(cache_path)
+        assert other_index.least_recently_used()[0][0] == "000/dataset_1.dat"
+        assert cache_index.flush_accesses()
+        assert other_index.least_recently_used()[0][0] == "000/dataset_2.dat"
+        other_index.close()
+
+        # Files added and removed behind the back of the index
+        _write_cache_file(cache_path, "000/dataset_3.dat", 300)
+        _write_cache_file(cache_path, "000/dataset_2.dat", 200)
+        os.remove(os.path.join(cache_path, "000/dataset_1.dat"))
+        assert cache_index.total_size() == 200
+        cache_index.reconcile_interval = 0
+        assert cache_index.reconcile_if_due()
+        assert cache_index.total_size() == 500
+        assert len(cache_index) == 2
+        cache_index.close()
+    finally:
+        rmtree(cache_path)
+
+
+def test_cache_index_pending_uploads():
+    cache_path = mkdtemp()
+    try:
+        cache_index = CacheIndex(cache_path)
+        for i in (1, 2):
+            _write_cache_file(cache_path, "000/dataset_%d.dat" % i, 100)
+            cache_index.touch("000/dataset_%d.dat" % i)
+        queued = cache_index.add_pending_upload("000/dataset_1.dat")
+        assert cache_index.is_pending_upload("000/dataset_1.dat")
+        assert cache_index.is_pending_upload("000/dataset_1.dat", queued)
+
+        # Files not uploaded yet are never evicted
+        assert cache_index.clean(1000) == 100
+        assert os.path.exists(os.path.join(cache_path, "000/dataset_1.dat"))
+
+        # An upload of a file queued again since is not the last one
+        queued_again = cache_index.add_pending_upload("000/dataset_1.dat")
+        assert not cache_index.finish_pending_upload("000/dataset_1.dat", queued)
+        assert cache_index.finish_pending_upload("000/dataset_1.dat", queued_again)
+        assert not cache_index.is_pending_upload("000/dataset_1.dat")
+
+        # Deleting a file cancels its upload
+        cache_index.add_pending_upload("000/dataset_1.dat")
+        cache_index.remove("000")
+        assert not cache_index.is_pending_upload("000/dataset_1.dat")
+
+        # Uploads of processes no longer running are resumed by others
+        cache_index.add_pending_upload("000/dataset_3.dat", owner="%s:%d" % (socket.gethostname(), 2 ** 22 + 1))
+        cache_index.add_pending_upload("000/dataset_4.dat", owner="otherhost:1")
+        cache_index.add_pending_upload("000/dataset_5.dat")
+        assert [path for path, _ in cache_index.claim_pending_uploads("me:1")] == ["000/dataset_3.dat"]
+        assert cache_index.claim_pending_uploads("me:1") == []
+        cache_index.close()
+    finally:
+        rmtree(cache_path)
+
+
+def test_ranged_download():
+    content = os.urandom(1000)
+    fetched = []
+
+    def fetch_range(start, end):
+        fetched.append((start, end))
+        return content[start:end + 1]
+
+    directory = mkdtemp()
+    try:
+        destination = os.path.join(directory, "dataset_1.dat")
+        ranged_download(fetch_range, len(content), destination, part_size=64, threads=4)
+        with open(destination, "rb") as f:
+            assert f.read() == content
+        assert len(fetched) == 16
+        assert sorted(fetched)[-1] == (960, 999)
+
+        def short_fetch_range(start, end):
+            return content[start:end]
+
+        failed_destination = os.path.join(directory, "dataset_2.dat")
+        try:
+            ranged_download(short_fetch_range, len(content), failed_destination, part_size=64, threads=4)
+            raise AssertionError("Expected a RangedDownloadError")
+        except RangedDownloadError:
+            pass
+        # a failed download leaves neither the destination nor a partial file behind
+        assert os.listdir(directory) == ["dataset_1.dat"]
+    finally:
+        rmtree(directory)
+
+
+def _write_cache_file(cache_path, rel_path, size):
+    path = os.path.join(cache_path, rel_path)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write("x" * size)
+
+
 class TestConfig(object):
     def __init__(self, config_str=DISK_TEST_CONFIG, clazz=None, store_by="id"):
         self.temp_directory = mkdtemp()
@@ -49,3 +49,16 @@ class TestCliInterface(unittest.TestCase):
             self.shell = self.cli_interface.get_shell_plugin(self.shell_params)
             result = self.shell.execute(cmd='echo hello')
         assert result.stdout.strip() == 'hello'
+
+    def test_pooled_paramiko_shell_plugin(self):
+        with mockssh.Server(users={self.username: self.ssh_keys.private_key_file}) as server:
+            self.shell_params['port'] = server.port
+            self.shell_params['plugin'] = 'PooledParamikoShell'
+            self.shell = self.cli_interface.get_shell_plugin(self.shell_params)
+            results = [self.shell.execute(cmd='echo hello %d' % i) for i in range(3)]
+            stats = self.shell.stats()
+            self.shell.close()
+        assert [r.stdout.strip() for r in results] == ['hello 0', 'hello 1', 'hello 2']
+        assert stats['commands'] == 3
+        assert stats['connects'] == 1
+        assert stats['active_commands'] == 0
@@ -0,0 +1,104 @@
+"""Unit tests for setting the metadata of job outputs in external processes."""
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+from tempfile import mkdtemp
+
+import pytest
+
+from galaxy import model
+from galaxy.job_execution.datasets import DatasetPath
+from galaxy.metadata import PortableDirectoryMetadataGenerator
+from galaxy.metadata.set_metadata import _map, BrokenProcessPool, metadata_workers
+from galaxy.util import galaxy_directory
+from .tools.test_history_imp_exp import _create_datasets, _mock_app
+
+SET_METADATA = "from galaxy.metadata.set_metadata import set_metadata; set_metadata()"
+
+
+def test_metadata_workers(monkeypatch):
+    monkeypatch.setenv("GALAXY_SLOTS", "4")
+    assert metadata_workers(10) == 4
+    assert metadata_workers(2) == 2
+    assert metadata_workers(0) == 1
+    monkeypatch.setenv("GALAXY_SLOTS", "four")
+    assert metadata_workers(10) == 1
+
+
+def _slots(item):
+    return os.environ["GALAXY_SLOTS"]
+
+
+def test_map_shares_slots(monkeypatch):
+    monkeypatch.setenv("GALAXY_SLOTS", "5")
+    assert _map(_slots, [1, 2]) == ["2", "2"]
+    assert _map(_slots, [1]) == ["5"]
+    assert os.environ["GALAXY_SLOTS"] == "5"
+
+
+def _killed(item):
+    if item == 2:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return item
+
+
+@pytest.mark.skipif(sys.version_info < (3, 3), reason="Not detected by the concurrent.futures backport")
+def test_map_fails_on_dead_worker(monkeypatch):
+    monkeypatch.setenv("GALAXY_SLOTS", "2")
+    with pytest.raises(BrokenProcessPool):
+        _map(_killed, [1, 2, 3])
+    assert os.environ["GALAXY_SLOTS"] == "2"
+
+
+def test_set_metadata_portable_in_parallel():
+    app = _mock_app()
+    sa_session = app.model.context
+    history = model.History(name="Test History")
+    datasets = _create_datasets(sa_session, history, 6, extension="bed")
+    sa_session.add_all(datasets + [history])
+    sa_session.flush()
+    for dataset in datasets:
+        app.object_store.update_from_file(dataset, file_name=os.path.join(galaxy_directory(), "test-data", "2.bed"), create=True)
+    working_directory = mkdtemp()
+    job_metadata = os.path.join(working_directory, "galaxy.json")
+    open(job_metadata, "w").close()
+    metadata_strategy = PortableDirectoryMetadataGenerator(1)
+    metadata_strategy.setup_external_metadata(
+        dict(("out%d" % i, dataset) for i, dataset in enumerate(datasets)), sa_session,
+        tmp_dir=working_directory,
+        output_fnames=[DatasetPath(dataset.dataset.id, dataset.file_name) for dataset in datasets],
+        datatypes_config=os.path.join(galaxy_directory(), "lib", "galaxy", "config", "sample", "datatypes_conf.xml.sample"),
+        job_metadata=job_metadata,
+    )
+    # an output whose metadata cannot be set
+    with open(os.path.join(working_directory, "metadata", "metadata_override_out3"), "w") as f:
+        f.write("not json")
+
+    def set_metadata():
+        env = dict(os.environ, GALAXY_SLOTS="3", PYTHONPATH=os.path.join(galaxy_directory(), "lib"))
+        subprocess.check_call([sys.executable, "-c", SET_METADATA], cwd=working_directory, env=env)
+
+    def results(i):
+        with open(os.path.join(working_directory, "metadata", "metadata_results_out%d" % i)) as f:
+            return json.load(f)
+
+    set_metadata()
+    for i, dataset in enumerate(datasets):
+        assert metadata_strategy.external_metadata_set_successfully(dataset, "out%d" % i, sa_session, working_directory) == (i != 3)
+        if i != 3:
+            metadata_strategy.load_metadata(dataset, "out%d" % i, sa_session, working_directory)
+            assert dataset.metadata.data_lines == 68
+            assert dataset.metadata.columns == 6
+    assert "Traceback" in results(3)[1]
+
+    # running again only sets metadata on the datasets it failed on
+    first_results = [results(i) for i in range(len(datasets)) if i != 3]
+    os.remove(os.path.join(working_directory, "metadata", "metadata_in_out1"))
+    set_metadata()
+    assert [results(i) for i in range(len(datasets)) if i != 3] == first_results
+    assert not results(3)[0]
+    assert not [name for name in os.listdir(os.path.join(working_directory, "metadata")) if name.startswith(".")]
+    shutil.rmtree(working_directory)
@@ -0,0 +1,35 @@
+import hashlib
+
+import pytest
+
+from galaxy.datatypes.registry import example_datatype_registry_for_sample
+from galaxy.tools.data_fetch import _request_to_galaxy_json, UploadConfig
+
+CONTENT = "@r1\r\nACGT\r\n+\r\nIIII\r\n@r2\r\nACGT\r\n+\r\nIIII\r\n"
+
+
+def _fetch(monkeypatch, tmpdir, **item):
+    monkeypatch.chdir(str(tmpdir))
+    item.update(src="pasted", paste_content=CONTENT, ext="auto")
+    request = {
+        "targets": [{"destination": {"type": "hdas"}, "elements": [item]}],
+        "to_posix_lines": True,
+        "validate_hashes": True,
+    }
+    upload_config = UploadConfig(request, example_datatype_registry_for_sample())
+    return _request_to_galaxy_json(upload_config, request)["__unnamed_outputs"][0]["elements"][0]
+
+
+def test_fetch_validates_hashes_and_counts_metadata(monkeypatch, tmpdir):
+    md5 = hashlib.md5(CONTENT.encode("utf-8")).hexdigest()
+    element = _fetch(monkeypatch, tmpdir, hashes=[{"hash_function": "MD5", "hash_value": md5}])
+    assert element["ext"] == "fastqsanger"
+    assert element["counted_metadata"] == {"data_lines": 8, "sequences": 2}
+    with open(element["filename"]) as f:
+        assert f.read() == CONTENT.replace("\r\n", "\n")
+
+
+def test_fetch_invalid_hash(monkeypatch, tmpdir):
+    with pytest.raises(Exception) as exc_info:
+        _fetch(monkeypatch, tmpdir, hashes=[{"hash_function": "MD5", "hash_value": "0" * 32}])
+    assert "Failed to validate upload with [MD5]" in str(exc_info.value)
@@ -136,6 +136,7 @@ class MockAppConfig(Bunch):
 
         self.expose_dataset_path = True
         self.allow_user_dataset_purge = True
+        self.history_summary_reconcile_interval = 600
         self.enable_old_display_applications = True
         self.redact_username_in_logs = False
         self.auth_config_file = "config/auth_conf.xml.sample"